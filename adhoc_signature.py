@@ -0,0 +1,719 @@
+"""
+Pure-Python ad-hoc code signatures (`codesign --sign -` without codesign), for
+Mach-O files and .app bundles.
+"""
+
+import argparse
+import hashlib
+import logging
+import os
+import plistlib
+import struct
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import bundle_scanner
+import copy_store
+import macho
+import profiling
+
+PAGE_SHIFT = 12
+PAGE_SIZE = 1 << PAGE_SHIFT
+
+# Blob magics
+CSMAGIC_REQUIREMENTS = 0xfade0c01
+CSMAGIC_CODEDIRECTORY = 0xfade0c02
+CSMAGIC_EMBEDDED_SIGNATURE = 0xfade0cc0
+CSMAGIC_EMBEDDED_ENTITLEMENTS = 0xfade7171
+CSMAGIC_EMBEDDED_DER_ENTITLEMENTS = 0xfade7172
+CSMAGIC_BLOBWRAPPER = 0xfade0b01
+
+# SuperBlob slots; special slots are stored as negative hash indexes in the CodeDirectory
+CSSLOT_CODEDIRECTORY = 0
+CSSLOT_INFOSLOT = 1
+CSSLOT_REQUIREMENTS = 2
+CSSLOT_RESOURCEDIR = 3
+CSSLOT_ENTITLEMENTS = 5
+CSSLOT_DER_ENTITLEMENTS = 7
+CSSLOT_SIGNATURESLOT = 0x10000
+
+# CodeDirectory flags and fields
+CS_ADHOC = 0x2
+CS_RUNTIME = 0x10000
+CS_HASHTYPE_SHA256 = 2
+CS_HASH_SIZE = 32
+CODEDIRECTORY_VERSION = 0x20400  # with execSeg fields
+_CODEDIRECTORY_HEADER = ">IIIIIIIIIBBBBIIIIQQQQ"
+_CODEDIRECTORY_HEADER_SIZE = struct.calcsize(_CODEDIRECTORY_HEADER)
+
+# execSegFlags, and the entitlements that set them on a main executable
+CS_EXECSEG_MAIN_BINARY = 0x1
+EXECSEG_ENTITLEMENT_FLAGS = {
+    "get-task-allow": 0x10,
+    "run-unsigned-code": 0x10,
+    "com.apple.private.cs.debugger": 0x20,
+    "dynamic-codesigning": 0x40,
+    "com.apple.private.skip-library-validation": 0x80,
+    "com.apple.private.amfi.can-load-cdhash": 0x100,
+    "com.apple.private.amfi.can-execute-cdhash": 0x200,
+}
+
+# Pages hashed per thread-pool task
+_PAGES_PER_TASK = 256
+
+
+class SignatureError(Exception):
+    """
+    A file cannot be signed or its signature does not verify.
+    """
+
+
+def _align(value, alignment):
+    return value + (-value % alignment)
+
+
+def hash_pages(buf, limit, executor=None):
+    """
+    SHA-256 of every 4 KiB page of buf[:limit] (the last page may be shorter).
+
+    Args:
+        buf: bytes-like object
+        limit (int): codeLimit, the number of bytes covered
+        executor (Executor, optional): Hashes runs of pages concurrently
+
+    Returns:
+        bytes: The concatenated page hashes
+    """
+    task_bytes = PAGE_SIZE * _PAGES_PER_TASK
+    with memoryview(buf) as view:
+        def hash_run(start):
+            end = min(start + task_bytes, limit)
+            return b"".join(
+                hashlib.sha256(view[page:min(page + PAGE_SIZE, end)]).digest()
+                for page in range(start, end, PAGE_SIZE)
+            )
+
+        starts = range(0, limit, task_bytes)
+        if executor is None or limit <= task_bytes:
+            hashes = b"".join(map(hash_run, starts))
+        else:
+            hashes = b"".join(executor.map(hash_run, starts))
+    profiling.count("adhoc.pages", -(-limit // PAGE_SIZE))
+    return hashes
+
+
+def _der(tag, content):
+    length = len(content)
+    if length < 0x80:
+        return bytes([tag, length]) + content
+    raw = length.to_bytes((length.bit_length() + 7) // 8, "big")
+    return bytes([tag, 0x80 | len(raw)]) + raw + content
+
+
+def _der_value(value):
+    if isinstance(value, bool):
+        return _der(0x01, b"\xff" if value else b"\x00")
+    if isinstance(value, int):
+        return _der(0x02, value.to_bytes(value.bit_length() // 8 + 1, "big", signed=True))
+    if isinstance(value, str):
+        return _der(0x0c, value.encode())
+    if isinstance(value, (list, tuple)):
+        return _der(0x30, b"".join(_der_value(v) for v in value))
+    if isinstance(value, dict):
+        # Dictionaries are [CONTEXT 16] sets of (key, value) sequences, sorted by key
+        return _der(0xb0, b"".join(
+            _der(0x30, _der(0x0c, key.encode()) + _der_value(value[key])) for key in sorted(value)
+        ))
+    raise SignatureError(f"cannot encode {type(value).__name__} entitlement values as DER")
+
+
+def der_entitlements(entitlements):
+    """
+    DER form of an entitlements dictionary, as stored in the DER entitlements slot.
+    """
+    return _der(0x70, _der(0x02, b"\x01") + _der_value(entitlements))
+
+
+def _blob(magic, payload):
+    return struct.pack(">II", magic, 8 + len(payload)) + payload
+
+
+def _super_blob(blobs):
+    # blobs: (slot, blob) pairs, written in the given order
+    offset = 12 + 8 * len(blobs)
+    index = []
+    for slot, blob in blobs:
+        index.append(struct.pack(">II", slot, offset))
+        offset += len(blob)
+    return struct.pack(">III", CSMAGIC_EMBEDDED_SIGNATURE, offset, len(blobs)) + b"".join(index) + b"".join(b for _, b in blobs)
+
+
+def _code_directory(identifier, flags, code_limit, special_hashes, code_hashes, exec_seg):
+    # special_hashes: {slot: hash}; stored from the highest slot down to slot 1, right before slot 0
+    ident = identifier.encode() + b"\0"
+    n_special = max(special_hashes, default=0)
+    specials = b"".join(special_hashes.get(slot, b"\0" * CS_HASH_SIZE) for slot in range(n_special, 0, -1))
+    hash_offset = _CODEDIRECTORY_HEADER_SIZE + len(ident) + len(specials)
+    header = struct.pack(
+        _CODEDIRECTORY_HEADER,
+        CSMAGIC_CODEDIRECTORY, hash_offset + len(code_hashes), CODEDIRECTORY_VERSION, flags,
+        hash_offset, _CODEDIRECTORY_HEADER_SIZE, n_special, len(code_hashes) // CS_HASH_SIZE, code_limit,
+        CS_HASH_SIZE, CS_HASHTYPE_SHA256, 0, PAGE_SHIFT,
+        0, 0, 0, 0,  # spare2, scatterOffset, teamOffset, spare3
+        0, exec_seg[0], exec_seg[1], exec_seg[2],  # codeLimit64, execSeg base/limit/flags
+    )
+    return header + ident + specials + code_hashes
+
+
+def build_signature(code_hashes, code_limit, identifier, flags, exec_seg,
+                    entitlements=None, info_hash=None, resources_hash=None):
+    """
+    The embedded signature (SuperBlob) for one slice.
+
+    Args:
+        code_hashes (bytes): hash_pages() of the slice up to code_limit
+        code_limit (int): Offset of the signature in the slice
+        identifier (str): Signing identifier
+        flags (int): CodeDirectory flags (CS_ADHOC, CS_RUNTIME)
+        exec_seg (tuple): execSeg base, limit and flags
+        entitlements (bytes, optional): Entitlements plist (XML)
+        info_hash (bytes, optional): SHA-256 of the bundle's Info.plist
+        resources_hash (bytes, optional): SHA-256 of the bundle's CodeResources
+
+    Returns:
+        bytes
+    """
+    requirements = _blob(CSMAGIC_REQUIREMENTS, struct.pack(">I", 0))
+    blobs = [(CSSLOT_REQUIREMENTS, requirements)]
+    special_hashes = {CSSLOT_REQUIREMENTS: hashlib.sha256(requirements).digest()}
+    if info_hash:
+        special_hashes[CSSLOT_INFOSLOT] = info_hash
+    if resources_hash:
+        special_hashes[CSSLOT_RESOURCEDIR] = resources_hash
+    if entitlements:
+        xml_blob = _blob(CSMAGIC_EMBEDDED_ENTITLEMENTS, entitlements)
+        der_blob = _blob(CSMAGIC_EMBEDDED_DER_ENTITLEMENTS, der_entitlements(plistlib.loads(entitlements)))
+        blobs += [(CSSLOT_ENTITLEMENTS, xml_blob), (CSSLOT_DER_ENTITLEMENTS, der_blob)]
+        special_hashes[CSSLOT_ENTITLEMENTS] = hashlib.sha256(xml_blob).digest()
+        special_hashes[CSSLOT_DER_ENTITLEMENTS] = hashlib.sha256(der_blob).digest()
+    code_directory = _code_directory(identifier, flags, code_limit, special_hashes, code_hashes, exec_seg)
+    blobs.insert(0, (CSSLOT_CODEDIRECTORY, code_directory))
+    blobs.append((CSSLOT_SIGNATURESLOT, _blob(CSMAGIC_BLOBWRAPPER, b"")))
+    return _super_blob(blobs)
+
+
+def _segments(buf, slice_):
+    # Segment name -> (load command, fileoff, filesize) of one parsed slice
+    segments = {}
+    for lc in slice_.load_commands:
+        if lc.cmd == macho.LC_SEGMENT_64:
+            name = bytes(buf[lc.offset + 8:lc.offset + 24]).rstrip(b"\0").decode()
+            fileoff, filesize = struct.unpack_from(slice_.byteorder + "QQ", buf, lc.offset + 40)
+        elif lc.cmd == macho.LC_SEGMENT:
+            name = bytes(buf[lc.offset + 8:lc.offset + 24]).rstrip(b"\0").decode()
+            fileoff, filesize = struct.unpack_from(slice_.byteorder + "II", buf, lc.offset + 32)
+        else:
+            continue
+        segments[name] = (lc, fileoff, filesize)
+    return segments
+
+
+def _exec_seg(segments, filetype, entitlements):
+    text = segments.get("__TEXT")
+    base, limit = (text[1], text[2]) if text else (0, 0)
+    flags = 0
+    if filetype == macho.MH_EXECUTE:
+        flags = CS_EXECSEG_MAIN_BINARY
+        if entitlements:
+            values = plistlib.loads(entitlements)
+            for key, flag in EXECSEG_ENTITLEMENT_FLAGS.items():
+                if values.get(key) is True:
+                    flags |= flag
+    return base, limit, flags
+
+
+def sign_slice(data, identifier, flags, entitlements=None, info_hash=None, resources_hash=None, executor=None):
+    """
+    Sign one thin Mach-O image.
+
+    Args:
+        data (bytearray): The slice; resized and patched in place
+        (other arguments as for build_signature())
+
+    Raises:
+        SignatureError: If the slice has no room for LC_CODE_SIGNATURE or
+            __LINKEDIT is not the last segment
+    """
+    parsed = macho.parse_macho(data)
+    if parsed is None or parsed.is_fat:
+        raise SignatureError("not a thin Mach-O image")
+    slice_ = parsed.slices[0]
+    bo = slice_.byteorder
+    segments = _segments(data, slice_)
+    linkedit = segments.get("__LINKEDIT")
+    if linkedit is None:
+        raise SignatureError("no __LINKEDIT segment")
+    lc_linkedit, linkedit_off, linkedit_size = linkedit
+    if any(off + size > linkedit_off + linkedit_size for _, off, size in segments.values()):
+        raise SignatureError("__LINKEDIT is not the last segment")
+
+    signature_lc = slice_.code_signature
+    if signature_lc is not None:
+        lc_offset = signature_lc.offset
+        code_limit = struct.unpack_from(bo + "I", data, lc_offset + 8)[0]
+    else:
+        if slice_.header_padding < 16:
+            raise SignatureError("not enough header padding to add LC_CODE_SIGNATURE")
+        lc_offset = slice_.header_size + slice_.sizeofcmds
+        code_limit = _align(linkedit_off + linkedit_size, 16)
+        struct.pack_into(bo + "IIII", data, lc_offset, macho.LC_CODE_SIGNATURE, 16, code_limit, 0)
+        struct.pack_into(bo + "II", data, 16, slice_.ncmds + 1, slice_.sizeofcmds + 16)
+
+    exec_seg = _exec_seg(segments, slice_.filetype, entitlements)
+    n_pages = -(-code_limit // PAGE_SIZE)
+    size = len(build_signature(b"\0" * CS_HASH_SIZE * n_pages, code_limit, identifier, flags, exec_seg,
+                               entitlements, info_hash, resources_hash))
+    datasize = _align(size, 16)
+
+    # The header is covered by the page hashes, so patch it before hashing
+    struct.pack_into(bo + "II", data, lc_offset + 8, code_limit, datasize)
+    linkedit_size = code_limit + datasize - linkedit_off
+    segment_page = 0x4000 if slice_.cputype == macho.CPU_TYPE_ARM64 else 0x1000
+    if lc_linkedit.cmd == macho.LC_SEGMENT_64:
+        struct.pack_into(bo + "Q", data, lc_linkedit.offset + 32, _align(linkedit_size, segment_page))
+        struct.pack_into(bo + "Q", data, lc_linkedit.offset + 48, linkedit_size)
+    else:
+        struct.pack_into(bo + "I", data, lc_linkedit.offset + 28, _align(linkedit_size, segment_page))
+        struct.pack_into(bo + "I", data, lc_linkedit.offset + 36, linkedit_size)
+    if len(data) > code_limit:
+        del data[code_limit:]
+    else:
+        data.extend(b"\0" * (code_limit - len(data)))
+
+    code_hashes = hash_pages(data, code_limit, executor)
+    signature = build_signature(code_hashes, code_limit, identifier, flags, exec_seg,
+                                entitlements, info_hash, resources_hash)
+    data.extend(signature + b"\0" * (datasize - len(signature)))
+    return data
+
+
+def _fat_arches(data):
+    # (position in the header, cputype, cpusubtype, offset, size, align) per slice
+    is_64 = struct.unpack_from(">I", data, 0)[0] == macho.FAT_MAGIC_64
+    arches = []
+    for i in range(struct.unpack_from(">I", data, 4)[0]):
+        pos = 8 + i * (32 if is_64 else 20)
+        if is_64:
+            cputype, cpusubtype, offset, size, align = struct.unpack_from(">iiQQI", data, pos)
+        else:
+            cputype, cpusubtype, offset, size, align = struct.unpack_from(">iiIII", data, pos)
+        arches.append((pos, cputype, cpusubtype, offset, size, align))
+    return is_64, arches
+
+
+def _relayout_fat(data, signed_slices):
+    # Lay the re-signed slices out again, keeping each slice's alignment
+    is_64, arches = _fat_arches(data)
+    out = bytearray(data[:min(a[3] for a in arches)])
+    for (pos, cputype, cpusubtype, _, _, align), slice_data in sorted(zip(arches, signed_slices), key=lambda x: x[0][3]):
+        offset = _align(len(out), 1 << align)
+        out.extend(b"\0" * (offset - len(out)))
+        out.extend(slice_data)
+        if is_64:
+            struct.pack_into(">QQ", out, pos + 8, offset, len(slice_data))
+        else:
+            struct.pack_into(">II", out, pos + 8, offset, len(slice_data))
+    return out
+
+
+def default_identifier(path):
+    # codesign's default for code outside a bundle: the file name without its extension
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def sign_file(path, identifier=None, entitlements=None, runtime=True, info_hash=None, resources_hash=None,
+              executor=None):
+    """
+    Ad-hoc sign a Mach-O file in place, replacing any existing signature.
+
+    Args:
+        path (str): File to sign
+        identifier (str, optional): Defaults to default_identifier(path)
+        entitlements (bytes, optional): Entitlements plist to embed
+        runtime (bool): Set the hardened runtime flag (codesign --options=runtime)
+        info_hash, resources_hash (bytes, optional): Bundle hashes for the main executable
+        executor (Executor, optional): Pool for page hashing
+
+    Raises:
+        SignatureError: If the file is not a Mach-O file or cannot be signed
+    """
+    identifier = identifier or default_identifier(path)
+    flags = CS_ADHOC | (CS_RUNTIME if runtime else 0)
+    with open(path, "rb") as f:
+        data = bytearray(f.read())
+    parsed = macho.parse_macho(data, path)
+    if parsed is None:
+        raise SignatureError(f"{path} is not a Mach-O file")
+
+    try:
+        if parsed.is_fat:
+            _, arches = _fat_arches(data)
+            slices = [
+                sign_slice(bytearray(data[a[3]:a[3] + a[4]]), identifier, flags, entitlements,
+                           info_hash, resources_hash, executor)
+                for a in arches
+            ]
+            data = _relayout_fat(data, slices)
+        else:
+            sign_slice(data, identifier, flags, entitlements, info_hash, resources_hash, executor)
+    except SignatureError as e:
+        raise SignatureError(f"Cannot sign {path}: {e}") from None
+
+    # Rewrite in place rather than replacing the file, like relink.py
+    copy_store.unshare(path)
+    with open(path, "r+b") as f:
+        f.write(data)
+        f.truncate()
+    macho.invalidate(path)
+    profiling.count("adhoc.files")
+
+
+def _embedded_signature(buf, slice_):
+    # The SuperBlob of one slice, or None if it is unsigned
+    lc = slice_.code_signature
+    if lc is None:
+        return None, None
+    dataoff, datasize = struct.unpack_from(slice_.byteorder + "II", buf, lc.offset + 8)
+    start = slice_.offset + dataoff
+    magic, length = struct.unpack_from(">II", buf, start)
+    if magic != CSMAGIC_EMBEDDED_SIGNATURE or length > datasize:
+        raise SignatureError("bad embedded signature")
+    return dataoff, bytes(buf[start:start + length])
+
+
+def _blobs(signature):
+    # slot -> blob bytes of a SuperBlob
+    count = struct.unpack_from(">I", signature, 8)[0]
+    blobs = {}
+    for i in range(count):
+        slot, offset = struct.unpack_from(">II", signature, 12 + 8 * i)
+        length = struct.unpack_from(">I", signature, offset + 4)[0]
+        blobs[slot] = signature[offset:offset + length]
+    return blobs
+
+
+def _read_code_directory(code_directory):
+    fields = struct.unpack_from(">IIIIIIIII", code_directory, 0)
+    flags, hash_offset, ident_offset, n_special = fields[3], fields[4], fields[5], fields[6]
+    end = code_directory.index(b"\0", ident_offset)
+    special = {}
+    for slot in range(1, n_special + 1):
+        value = code_directory[hash_offset - slot * CS_HASH_SIZE:hash_offset - (slot - 1) * CS_HASH_SIZE]
+        if value != b"\0" * CS_HASH_SIZE:
+            special[slot] = value
+    return {
+        "version": fields[2],
+        "flags": flags,
+        "identifier": code_directory[ident_offset:end].decode(),
+        "special": special,
+    }
+
+
+def code_directory_hash(path):
+    """
+    cdhash (truncated SHA-256 of the CodeDirectory) of the first slice of a signed file.
+
+    Raises:
+        SignatureError: If the file is not signed
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    parsed = macho.parse_macho(data, path)
+    if parsed is None:
+        raise SignatureError(f"{path} is not a Mach-O file")
+    _, signature = _embedded_signature(data, parsed.slices[0])
+    if signature is None:
+        raise SignatureError(f"{path} is not signed")
+    return hashlib.sha256(_blobs(signature)[CSSLOT_CODEDIRECTORY]).digest()[:20]
+
+
+def verify_file(path, executor=None):
+    """
+    Rebuild every slice's signature from the file and compare it with the embedded one.
+
+    The identifier, flags, entitlements and bundle hashes are taken from the
+    embedded signature; everything else (page hashes, layout, requirements,
+    DER entitlements, execSeg) is computed, so the comparison is byte for byte.
+
+    Returns:
+        list: Problems found, empty if every slice verifies
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    parsed = macho.parse_macho(data, path)
+    if parsed is None:
+        return [f"{path}: not a Mach-O file"]
+
+    problems = []
+    for slice_ in parsed.slices:
+        try:
+            code_limit, embedded = _embedded_signature(data, slice_)
+        except (SignatureError, struct.error) as e:
+            problems.append(f"{path} ({slice_.arch}): {e}")
+            continue
+        if embedded is None:
+            problems.append(f"{path} ({slice_.arch}): not signed")
+            continue
+        blobs = _blobs(embedded)
+        code_directory = _read_code_directory(blobs[CSSLOT_CODEDIRECTORY])
+        if code_directory["version"] != CODEDIRECTORY_VERSION:
+            problems.append(f"{path} ({slice_.arch}): CodeDirectory version 0x{code_directory['version']:x} is not supported")
+            continue
+        entitlements = blobs.get(CSSLOT_ENTITLEMENTS, b"")[8:] or None
+        slice_data = memoryview(data)[slice_.offset:slice_.offset + code_limit]
+        expected = build_signature(
+            hash_pages(slice_data, code_limit, executor), code_limit, code_directory["identifier"],
+            code_directory["flags"], _exec_seg(_segments(data, slice_), slice_.filetype, entitlements),
+            entitlements, code_directory["special"].get(CSSLOT_INFOSLOT),
+            code_directory["special"].get(CSSLOT_RESOURCEDIR),
+        )
+        slice_data.release()
+        if expected != embedded:
+            problems.append(f"{path} ({slice_.arch}): signature does not match the file contents")
+    return problems
+
+
+# Resource rules codesign writes for an .app bundle
+_RESOURCE_RULES = {
+    "^Resources/": True,
+    "^Resources/.*\\.lproj/": {"optional": True, "weight": 1000.0},
+    "^Resources/.*\\.lproj/locversion.plist$": {"omit": True, "weight": 1100.0},
+    "^Resources/Base\\.lproj/": {"weight": 1010.0},
+    "^version.plist$": True,
+}
+_RESOURCE_RULES2 = {
+    ".*\\.dSYM($|/)": {"weight": 11.0},
+    "^(.*/)?\\.DS_Store$": {"omit": True, "weight": 2000.0},
+    "^(Frameworks|SharedFrameworks|PlugIns|Plug-ins|XPCServices|Helpers|MacOS|Library/(Automator|Spotlight|LoginItems))/": {"nested": True, "weight": 10.0},
+    "^.*": True,
+    "^Info\\.plist$": {"omit": True, "weight": 20.0},
+    "^PkgInfo$": {"omit": True, "weight": 20.0},
+    "^Resources/": {"weight": 20.0},
+    "^Resources/.*\\.lproj/": {"optional": True, "weight": 1000.0},
+    "^Resources/.*\\.lproj/locversion.plist$": {"omit": True, "weight": 1100.0},
+    "^Resources/Base\\.lproj/": {"weight": 1010.0},
+    "^[^/]+$": {"nested": True, "weight": 10.0},
+    "^embedded\\.provisionprofile$": {"weight": 20.0},
+    "^version\\.plist$": {"weight": 20.0},
+}
+_OMITTED = {"Info.plist", "PkgInfo"}
+
+
+def _read_info_plist(app_bundle_path):
+    info_path = os.path.join(app_bundle_path, "Contents", "Info.plist")
+    try:
+        with open(info_path, "rb") as f:
+            raw = f.read()
+        return raw, plistlib.loads(raw)
+    except (OSError, plistlib.InvalidFileException, ValueError) as e:
+        raise SignatureError(f"Cannot read {info_path}: {e}") from None
+
+
+def seal_resources(app_bundle_path, main_executable, executor=None):
+    """
+    Build the CodeResources plist of an .app bundle.
+
+    Files under Contents are recorded with their SHA-1 and SHA-256 hashes,
+    symlinks with their target, and signed Mach-O files outside
+    Contents/Resources (helpers, framework binaries) as nested code by
+    cdhash. Info.plist, PkgInfo, the main executable and _CodeSignature
+    are left out, as codesign does.
+
+    Returns:
+        bytes: The plist, as written to Contents/_CodeSignature/CodeResources
+    """
+    contents = os.path.join(app_bundle_path, "Contents")
+    records = []
+    for record in bundle_scanner.scan_bundle(contents):
+        rel_path = record.rel_path
+        if rel_path in _OMITTED or rel_path.startswith("_CodeSignature/") or os.path.basename(rel_path) == ".DS_Store":
+            continue
+        if os.path.realpath(record.path) == os.path.realpath(main_executable):
+            continue
+        records.append(record)
+
+    def describe(record):
+        if record.is_symlink:
+            return {"symlink": os.readlink(record.path)}
+        if record.is_macho and not record.rel_path.startswith("Resources/"):
+            cdhash = code_directory_hash(record.path)
+            return {"cdhash": cdhash, "requirement": f'cdhash H"{cdhash.hex()}"'}
+        sha1 = hashlib.sha1()
+        sha256 = hashlib.sha256()
+        with open(record.path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                sha1.update(chunk)
+                sha256.update(chunk)
+        entry = {"hash": sha1.digest(), "hash2": sha256.digest()}
+        if ".lproj/" in record.rel_path:
+            entry["optional"] = True
+        return entry
+
+    entries = list(executor.map(describe, records)) if executor else [describe(r) for r in records]
+    files = {}
+    files2 = {}
+    for record, entry in zip(records, entries):
+        files2[record.rel_path] = entry
+        if record.rel_path.startswith("Resources/") and "hash" in entry:
+            files[record.rel_path] = {"hash": entry["hash"], "optional": True} if entry.get("optional") else entry["hash"]
+    return plistlib.dumps(
+        {"files": files, "files2": files2, "rules": _RESOURCE_RULES, "rules2": _RESOURCE_RULES2},
+        fmt=plistlib.FMT_XML, sort_keys=True,
+    )
+
+
+def _main_executable(app_bundle_path, info):
+    name = info.get("CFBundleExecutable")
+    if not name:
+        raise SignatureError(f"{app_bundle_path}: Info.plist has no CFBundleExecutable")
+    path = os.path.join(app_bundle_path, "Contents", "MacOS", name)
+    if not macho.is_macho(path):
+        raise SignatureError(f"{app_bundle_path}: main executable {path} is not a Mach-O file")
+    return path
+
+
+def sign_bundle(app_bundle_path, entitlements=None, runtime=True, executor=None):
+    """
+    Seal an .app bundle's resources and sign its main executable.
+
+    Everything nested in the bundle must be signed first (sign_app_bundle()
+    in code_signing_1.py does that), since the seal records the cdhash of
+    nested code.
+    """
+    info_raw, info = _read_info_plist(app_bundle_path)
+    main_executable = _main_executable(app_bundle_path, info)
+    resources = seal_resources(app_bundle_path, main_executable, executor)
+    seal_dir = os.path.join(app_bundle_path, "Contents", "_CodeSignature")
+    os.makedirs(seal_dir, exist_ok=True)
+    copy_store.unshare(os.path.join(seal_dir, "CodeResources"))
+    with open(os.path.join(seal_dir, "CodeResources"), "wb") as f:
+        f.write(resources)
+    sign_file(
+        main_executable, info.get("CFBundleIdentifier") or default_identifier(main_executable), entitlements, runtime,
+        hashlib.sha256(info_raw).digest(), hashlib.sha256(resources).digest(), executor,
+    )
+
+
+def verify_bundle(app_bundle_path, executor=None):
+    """
+    Check the resource seal and every signed Mach-O file of an .app bundle.
+
+    Returns:
+        list: Problems found, empty if the bundle verifies
+    """
+    info_raw, info = _read_info_plist(app_bundle_path)
+    main_executable = _main_executable(app_bundle_path, info)
+    problems = []
+    seal_path = os.path.join(app_bundle_path, "Contents", "_CodeSignature", "CodeResources")
+    try:
+        with open(seal_path, "rb") as f:
+            sealed = f.read()
+    except OSError:
+        return [f"{app_bundle_path}: resources are not sealed"]
+    try:
+        if seal_resources(app_bundle_path, main_executable, executor) != sealed:
+            problems.append(f"{app_bundle_path}: resources were modified after signing")
+    except SignatureError as e:
+        problems.append(str(e))
+
+    with open(main_executable, "rb") as f:
+        data = f.read()
+    for slice_ in macho.parse_macho(data, main_executable).slices:
+        _, signature = _embedded_signature(data, slice_)
+        if signature is None:
+            continue
+        special = _read_code_directory(_blobs(signature)[CSSLOT_CODEDIRECTORY])["special"]
+        if special.get(CSSLOT_INFOSLOT) != hashlib.sha256(info_raw).digest():
+            problems.append(f"{main_executable} ({slice_.arch}): Info.plist was modified after signing")
+        if special.get(CSSLOT_RESOURCEDIR) != hashlib.sha256(sealed).digest():
+            problems.append(f"{main_executable} ({slice_.arch}): signature does not seal CodeResources")
+
+    for record in bundle_scanner.scan_bundle(app_bundle_path):
+        if record.is_macho:
+            problems.extend(verify_file(record.path, executor))
+    return problems
+
+
+class AdhocBackend:
+    """
+    In-process replacement for CodesignBackend when signing with `--identity -`.
+
+    Args:
+        jobs (int): Threads hashing pages and resource files
+        runtime (bool): Set the hardened runtime flag, like the
+            `--options=runtime` the codesign backend passes
+    """
+
+    def __init__(self, jobs=1, runtime=True):
+        self.jobs = max(1, jobs)
+        self.runtime = runtime
+        self._executor = ThreadPoolExecutor(max_workers=self.jobs) if self.jobs > 1 else None
+
+    def sign(self, paths, signing_identity, entitlements=None):
+        """
+        Raises:
+            SignatureError: If signing_identity is not "-" or a file cannot be signed
+        """
+        if signing_identity != "-":
+            raise SignatureError(f"the built-in signer only creates ad-hoc signatures, not {signing_identity!r}")
+        entitlements_data = None
+        if entitlements and os.path.exists(entitlements):
+            with open(entitlements, "rb") as f:
+                entitlements_data = f.read()
+        for path in paths:
+            if os.path.isdir(path):
+                sign_bundle(path, entitlements_data, self.runtime, self._executor)
+            else:
+                sign_file(path, None, entitlements_data, self.runtime, executor=self._executor)
+
+    def verify(self, app_bundle_path):
+        """
+        Raises:
+            SignatureError: Listing every problem found
+        """
+        problems = verify_bundle(app_bundle_path, self._executor)
+        for problem in problems:
+            logging.error(problem)
+        if problems:
+            raise SignatureError(f"{len(problems)} signature problems in {app_bundle_path}")
+        logging.info(f"Ad-hoc signature of {app_bundle_path} verified")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Ad-hoc sign or verify Mach-O files and .app bundles without codesign")
+    parser.add_argument("paths", nargs="+", help="Mach-O files or .app bundles")
+    parser.add_argument("--verify", action="store_true", help="Only verify the existing signatures")
+    parser.add_argument("--entitlements", help="Path to entitlements.plist")
+    parser.add_argument("--no-runtime", action="store_true", help="Do not set the hardened runtime flag")
+    parser.add_argument("--jobs", "-j", type=int, default=1, help="Threads hashing pages (default: 1)")
+    args = parser.parse_args()
+
+    backend = AdhocBackend(args.jobs, not args.no_runtime)
+    failed = False
+    for path in args.paths:
+        try:
+            if args.verify:
+                problems = verify_bundle(path, backend._executor) if os.path.isdir(path) else verify_file(path, backend._executor)
+                for problem in problems:
+                    logging.error(problem)
+                failed |= bool(problems)
+                if not problems:
+                    logging.info(f"{path}: signature verified")
+            else:
+                backend.sign([path], "-", args.entitlements)
+                logging.info(f"{path}: signed")
+        except (OSError, SignatureError) as e:
+            logging.error(f"{path}: {e}")
+            failed = True
+    sys.exit(1 if failed else 0)
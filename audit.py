@@ -0,0 +1,301 @@
+"""Static check that an app bundle is self-contained, without running any tool."""
+
+import argparse
+import json
+import logging
+import os
+import sys
+
+import bundle_scanner
+import launcher_cache
+import macho
+import parallel
+
+# References into the system are fine; missing weak references are skipped, as dyld does
+SYSTEM_PREFIXES = ("/usr/lib/", "/System/Library/")
+# dangling: a reference that does not resolve to a file
+# escapes: a reference that is absolute or resolves outside the bundle
+# rpath_escapes: an LC_RPATH that points outside the bundle
+# duplicate_id: two different files with the same install name
+# cycle: files that (indirectly) load each other
+# launcher: launch.cfg or loaders.cache no longer match the bundle (only checked if launch.cfg exists)
+ISSUE_KINDS = ("dangling", "escapes", "rpath_escapes", "duplicate_id", "cycle", "launcher")
+
+
+class AuditIssue:
+    """
+    One problem found in the bundle.
+
+    Attributes:
+        kind (str): One of ISSUE_KINDS
+        path (str): Bundle-relative path of the file the problem is in
+        detail (str): The offending reference, rpath, install name or cycle
+    """
+
+    __slots__ = ("kind", "path", "detail")
+
+    def __init__(self, kind, path, detail):
+        self.kind = kind
+        self.path = path
+        self.detail = detail
+
+    def to_dict(self):
+        return {"kind": self.kind, "path": self.path, "detail": self.detail}
+
+    def __repr__(self):
+        return f"AuditIssue({self.kind}, {self.path!r}, {self.detail!r})"
+
+
+class AuditReport:
+    """
+    Result of audit_bundle().
+
+    Attributes:
+        issues (list): AuditIssue records, sorted
+        files_checked (int): Number of Mach-O files parsed
+        references_checked (int): Number of load commands resolved
+    """
+
+    def __init__(self, issues, files_checked, references_checked):
+        self.issues = sorted(issues, key=lambda i: (ISSUE_KINDS.index(i.kind), i.path, i.detail))
+        self.files_checked = files_checked
+        self.references_checked = references_checked
+
+    @property
+    def ok(self):
+        return not self.issues
+
+    def by_kind(self):
+        groups = {}
+        for issue in self.issues:
+            groups.setdefault(issue.kind, []).append(issue)
+        return groups
+
+    def to_dict(self):
+        return {
+            "ok": self.ok,
+            "files_checked": self.files_checked,
+            "references_checked": self.references_checked,
+            "counts": {kind: len(issues) for kind, issues in self.by_kind().items()},
+            "issues": [i.to_dict() for i in self.issues],
+        }
+
+    def log(self):
+        for kind, issues in self.by_kind().items():
+            logging.error(f"{len(issues)} {kind} issue{'s' if len(issues) != 1 else ''}:")
+            for issue in issues:
+                logging.error(f"  {issue.path}: {issue.detail}")
+        status = "passed" if self.ok else f"failed with {len(self.issues)} issues"
+        logging.info(f"Audit {status}: {self.files_checked} files, {self.references_checked} references checked")
+
+
+def _inside(path, bundle_root):
+    return path == bundle_root or path.startswith(bundle_root + os.sep)
+
+
+def _audit_file(path, rel_path, bundle_root, executable_path, main_rpaths):
+    # Resolve the load commands of one file; returns (install name, bundle files it loads, issues, references)
+    binary = macho.read_macho(path)
+    if binary is None:
+        return None, [], [], 0
+
+    issues = []
+    weak = {lc.string for s in binary.slices for lc in s.load_commands if lc.cmd == macho.LC_LOAD_WEAK_DYLIB}
+
+    rpaths = []
+    for rpath in binary.rpaths:
+        expanded = macho.expand_load_path(rpath, path, executable_path)
+        if expanded is None:
+            issues.append(AuditIssue("rpath_escapes", rel_path, f"{rpath} (cannot be expanded)"))
+            continue
+        if not _inside(os.path.realpath(expanded), bundle_root):
+            issues.append(AuditIssue("rpath_escapes", rel_path, rpath))
+        rpaths.append(rpath)
+
+    edges = []
+    references = binary.dependencies
+    for reference in references:
+        if reference.startswith(SYSTEM_PREFIXES):
+            continue
+        if not reference.startswith("@"):
+            issues.append(AuditIssue("escapes", rel_path, reference))
+            continue
+        if reference.startswith("@rpath/"):
+            # dyld tries the loader's rpaths, then those of the images that loaded it, ending with the executable
+            candidates = rpaths + [r for r in main_rpaths if r not in rpaths]
+            target = None
+            for rpath in candidates:
+                base = macho.expand_load_path(rpath, path if rpath in rpaths else executable_path, executable_path)
+                if base and os.path.exists(os.path.join(base, reference[len("@rpath/"):])):
+                    target = os.path.realpath(os.path.join(base, reference[len("@rpath/"):]))
+                    break
+        else:
+            target = macho.resolve_load_path(reference, path, executable_path, [])
+        if target is None:
+            if reference not in weak:
+                issues.append(AuditIssue("dangling", rel_path, reference))
+        elif not _inside(target, bundle_root):
+            issues.append(AuditIssue("escapes", rel_path, f"{reference} -> {target}"))
+        elif target != os.path.realpath(path):
+            edges.append(target)
+    return binary.install_name, edges, issues, len(references)
+
+
+def _find_cycles(edges):
+    # Strongly connected components with more than one file (iterative Tarjan)
+    index = {}
+    low = {}
+    on_stack = set()
+    stack = []
+    components = []
+    counter = 0
+    for start in sorted(edges):
+        if start in index:
+            continue
+        work = [(start, iter(sorted(edges.get(start, ()))))]
+        index[start] = low[start] = counter
+        counter += 1
+        stack.append(start)
+        on_stack.add(start)
+        while work:
+            node, children = work[-1]
+            advanced = False
+            for child in children:
+                if child not in index:
+                    index[child] = low[child] = counter
+                    counter += 1
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(sorted(edges.get(child, ())))))
+                    advanced = True
+                    break
+                if child in on_stack:
+                    low[node] = min(low[node], index[child])
+            if advanced:
+                continue
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[node])
+            if low[node] == index[node]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    component.append(member)
+                    if member == node:
+                        break
+                if len(component) > 1:
+                    components.append(sorted(component))
+    return sorted(components)
+
+
+def _resolve_bundle(app_bundle_path, jobs, files):
+    # Resolve the references of every Mach-O file once: (bundle root, [(real path, rel path)], _audit_file results)
+    bundle_root = os.path.realpath(app_bundle_path)
+    if files is None:
+        files = bundle_scanner.scan_bundle(app_bundle_path)
+    binaries = []
+    seen = set()
+    for f in files:
+        if f.is_macho:
+            real_path = os.path.realpath(f.path)
+            if real_path not in seen:
+                seen.add(real_path)
+                binaries.append((real_path, os.path.relpath(real_path, bundle_root)))
+
+    executable_path = os.path.join(bundle_root, "Contents", "MacOS", "")
+    main_rpaths = []
+    for real_path, _ in binaries:
+        binary = macho.read_macho(real_path)
+        if binary is not None and binary.is_executable and os.path.dirname(real_path) == executable_path.rstrip(os.sep):
+            main_rpaths = binary.rpaths
+            executable_path = real_path
+            break
+
+    results = parallel.map_in_order(
+        lambda item: _audit_file(item[0], item[1], bundle_root, executable_path, main_rpaths),
+        binaries,
+        jobs,
+    )
+    return bundle_root, binaries, results
+
+
+def load_graph(app_bundle_path, jobs=1, files=None):
+    """
+    Which bundle files each Mach-O file of the bundle loads.
+
+    Args:
+        app_bundle_path (str): Path to the .app bundle
+        jobs (int): Number of files parsed at the same time
+        files (list, optional): bundle_scanner.BundleFile records of an earlier scan
+
+    Returns:
+        dict: Real path of every Mach-O file -> set of real paths it loads
+    """
+    _, binaries, results = _resolve_bundle(app_bundle_path, jobs, files)
+    return {real_path: set(result[1]) for (real_path, _), result in zip(binaries, results)}
+
+
+def audit_bundle(app_bundle_path, jobs=1, files=None):
+    """
+    Check that every Mach-O file in the bundle only loads files inside it.
+
+    Args:
+        app_bundle_path (str): Path to the .app bundle
+        jobs (int): Number of files parsed at the same time
+        files (list, optional): bundle_scanner.BundleFile records of an
+            earlier scan, instead of walking the bundle again
+
+    Returns:
+        AuditReport
+    """
+    bundle_root, binaries, results = _resolve_bundle(app_bundle_path, jobs, files)
+
+    issues = []
+    edges = {}
+    install_names = {}
+    references = 0
+    for (real_path, rel_path), (install_name, targets, file_issues, count) in zip(binaries, results):
+        issues.extend(file_issues)
+        edges[real_path] = set(targets)
+        references += count
+        if install_name:
+            install_names.setdefault(install_name, []).append(rel_path)
+
+    for install_name, paths in install_names.items():
+        if len(paths) > 1:
+            for rel_path in paths:
+                issues.append(AuditIssue("duplicate_id", rel_path, f"{install_name} (also {', '.join(p for p in paths if p != rel_path)})"))
+
+    for component in _find_cycles(edges):
+        members = [os.path.relpath(p, bundle_root) for p in component]
+        issues.append(AuditIssue("cycle", members[0], " -> ".join(members)))
+
+    if os.path.exists(os.path.join(launcher_cache.resources_dir(app_bundle_path), launcher_cache.LAUNCH_CONFIG)):
+        for problem in launcher_cache.check_launch_files(app_bundle_path):
+            issues.append(AuditIssue("launcher", "Contents/Resources", problem))
+
+    return AuditReport(issues, len(binaries), references)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Check that an app bundle only loads libraries from inside itself")
+    parser.add_argument("--app", required=True, help="Path to the .app bundle")
+    parser.add_argument("--jobs", "-j", type=int, default=1, help="Number of files parsed in parallel (default: 1)")
+    parser.add_argument("--json", metavar="FILE", help="Also write the report as JSON")
+    parser.add_argument("--ignore", action="append", choices=ISSUE_KINDS, default=[], help="Do not fail on this kind of issue (repeatable)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.app):
+        logging.error(f"App bundle not found at {args.app}")
+        sys.exit(2)
+
+    report = audit_bundle(args.app, args.jobs)
+    report.issues = [i for i in report.issues if i.kind not in args.ignore]
+    report.log()
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report.to_dict(), f, indent=1)
+    sys.exit(0 if report.ok else 1)
@@ -0,0 +1,182 @@
+"""
+Collect several app bundles in one session, sharing lookups, input hashes and
+relinked libraries between them.
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import dependency_collection_4
+import library_index
+import manifest
+import profiling
+import relocation_cache
+import rpath_cache
+import thinning
+
+
+class BatchSession:
+    """
+    Lookups and relinked libraries shared by the bundles of a batch.
+
+    The session keeps the library index, the @rpath cache, the SHA-256 of
+    every input (manifest.DigestCache) and a relocation cache, so a library
+    relinked the same way for an earlier bundle is copied instead of
+    relinked; parsed Mach-O files are cached by macho.py for the whole
+    process. Each bundle keeps its own copy store and manifest.
+
+    Args:
+        arch (str, optional): Thin universal binaries to this architecture
+        cache_dir (str, optional): Relocation cache to use; a temporary one is
+            created (and removed by close()) if None
+        cache_size (int): Size in bytes a given relocation cache is trimmed to
+    """
+
+    def __init__(self, arch=None, cache_dir=None, cache_size=relocation_cache.DEFAULT_MAX_BYTES):
+        self.arch = arch
+        self.library_index = library_index.LibraryIndex()
+        self.rpath_cache = rpath_cache.RpathCache()
+        self.digests = manifest.DigestCache()
+        self._tmp_dir = None
+        if cache_dir is None:
+            self._tmp_dir = tempfile.mkdtemp(prefix="synfig-batch-")
+            cache_dir = self._tmp_dir
+        self.relocation_cache = relocation_cache.RelocationCache(cache_dir, cache_size)
+        self._inputs = set()
+        self.results = []
+
+    def activate(self):
+        # Called by dependency_collection_4.process_app_bundle in place of its per-run resets
+        dependency_collection_4.reset_library_index(self.library_index)
+        dependency_collection_4.reset_rpath_cache(self.rpath_cache)
+        dependency_collection_4.reset_digest_cache(self.digests)
+        dependency_collection_4.reset_relocation_cache(self.relocation_cache)
+
+    def process(self, app_bundle_path, jobs=1, manifest_path=None, force=False):
+        """
+        Collect one bundle with the session's caches.
+
+        Returns:
+            dict: Work done and work taken from earlier bundles of the batch
+        """
+        self.rpath_cache.checkpoint()
+        self.digests.checkpoint()
+        relinks_before = self.relocation_cache.reused
+        start = time.perf_counter()
+        result = {"app": app_bundle_path}
+        try:
+            with profiling.phase("bundle", app=os.path.basename(app_bundle_path)):
+                graph = dependency_collection_4.process_app_bundle(
+                    app_bundle_path, jobs, manifest_path, force, arch=self.arch, session=self,
+                )
+        except Exception as e:
+            logging.error(f"Collecting {app_bundle_path} failed: {e}")
+            result["error"] = str(e)
+            graph = []
+
+        # Inputs are the files outside the bundle; their load commands were parsed once per session
+        inputs = {node.path for node in graph if not node.in_bundle}
+        result.update({
+            "seconds": round(time.perf_counter() - start, 3),
+            "files": len(graph),
+            "inputs": len(inputs),
+            "inputs_reused": len(inputs & self._inputs),
+            "rpath_lookups_reused": self.rpath_cache.reused,
+            "hashes_reused": self.digests.reused,
+            "bytes_hash_reused": self.digests.bytes_reused,
+            "relinks_reused": self.relocation_cache.reused - relinks_before,
+        })
+        self._inputs |= inputs
+        self.results.append(result)
+        logging.info(
+            f"{os.path.basename(app_bundle_path)}: {result['inputs_reused']}/{result['inputs']} inputs already parsed, "
+            f"{result['rpath_lookups_reused']} @rpath lookups, {result['hashes_reused']} hashes and "
+            f"{result['relinks_reused']} relinks taken from earlier bundles ({result['seconds']:.2f}s)"
+        )
+        return result
+
+    def report(self):
+        totals = {
+            key: sum(result.get(key, 0) for result in self.results)
+            for key in ("inputs", "inputs_reused", "rpath_lookups_reused", "hashes_reused", "bytes_hash_reused", "relinks_reused")
+        }
+        failed = [result["app"] for result in self.results if "error" in result]
+        logging.info(
+            f"Batch of {len(self.results)} bundles: {totals['inputs_reused']} of {totals['inputs']} input parses, "
+            f"{totals['rpath_lookups_reused']} @rpath lookups, {totals['hashes_reused']} hashes "
+            f"({totals['bytes_hash_reused'] / (1024 * 1024):.1f} MiB) and {totals['relinks_reused']} relinks "
+            f"saved compared with separate runs" + (f", {len(failed)} failed" if failed else "")
+        )
+        for key, value in totals.items():
+            profiling.count(f"batch.{key}", value)
+        return {"bundles": self.results, "saved": totals, "failed": failed}
+
+    def close(self):
+        # Trim a kept relocation cache, remove a temporary one
+        if self._tmp_dir is None:
+            self.relocation_cache.evict()
+            self.relocation_cache.report()
+        else:
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
+        dependency_collection_4.reset_digest_cache()
+        dependency_collection_4.reset_relocation_cache()
+
+
+def process_app_bundles(app_bundle_paths, jobs=1, arch=None, force=False,
+                        cache_dir=None, cache_size=relocation_cache.DEFAULT_MAX_BYTES):
+    """
+    Collect several bundles in one session (see BatchSession), one after
+    another, each on the `jobs` worker pool. A bundle that fails does not
+    stop the others.
+
+    Returns:
+        dict: Per-bundle results, the work saved in total and the bundles that failed
+    """
+    session = BatchSession(arch, cache_dir, cache_size)
+    try:
+        for app_bundle_path in app_bundle_paths:
+            session.process(app_bundle_path, jobs, force=force)
+    finally:
+        session.close()
+    return session.report()
+
+
+if __name__ == "__main__":
+    dependency_collection_4.setup_logging()
+    parser = argparse.ArgumentParser(description="Collect the dependencies of several app bundles in one session")
+    parser.add_argument("--app", action="append", required=True, help="Path to an .app bundle (repeatable)")
+    parser.add_argument("--jobs", "-j", type=int, default=1, help="Number of parallel workers per bundle (default: 1, serial)")
+    parser.add_argument("--force", action="store_true", help="Ignore the manifests and process every file")
+    parser.add_argument("--arch", choices=thinning.ARCHS, help="Keep only this architecture of universal binaries (default: keep all)")
+    parser.add_argument("--cache", default=relocation_cache.default_cache_dir(), metavar="DIR",
+                        help="Relocation cache to share with other runs (default: $SYNFIG_BUNDLE_CACHE, else a temporary one)")
+    parser.add_argument("--cache-size", type=int, default=relocation_cache.DEFAULT_MAX_BYTES // (1024 * 1024), metavar="MIB",
+                        help="Evict least recently used cache entries beyond this size (default: 2048)")
+    parser.add_argument("--report", metavar="FILE", help="Also write the batch report as JSON")
+    parser.add_argument("--profile", nargs="?", const="batch.profile", metavar="PREFIX",
+                        help="Time phases and tool calls, write PREFIX.json and PREFIX.trace.json (default prefix: batch.profile)")
+    args = parser.parse_args()
+    if args.profile:
+        profiling.enable()
+
+    missing = [app for app in args.app if not os.path.exists(app)]
+    if missing:
+        logging.error(f"App bundle not found at {', '.join(missing)}")
+        sys.exit(1)
+
+    try:
+        report = process_app_bundles(args.app, args.jobs, args.arch, args.force,
+                                     args.cache, args.cache_size * 1024 * 1024)
+        if args.report:
+            with open(args.report, "w") as f:
+                json.dump(report, f, indent=2)
+        sys.exit(1 if report["failed"] else 0)
+    finally:
+        if args.profile:
+            profiling.report(args.profile)
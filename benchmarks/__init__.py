@@ -0,0 +1,8 @@
+'''
+Benchmarks for the collection and signing scripts.
+
+Everything here runs on Linux: synthetic_bundle.py generates .app trees with
+small but valid Mach-O files, tools/ holds stand-ins for install_name_tool,
+codesign and spctl, and run.py times the phases and compares the results
+against a JSON baseline.
+'''
@@ -0,0 +1,119 @@
+"""
+Minimal Mach-O writer for synthetic bundles. The files do not run, but
+macho.py, relink.py and the real otool/install_name_tool accept them.
+"""
+
+import hashlib
+import struct
+
+import macho
+
+HEADER_SPACE = 0x1000  # minimum space for header + load commands + padding
+PAGE_SIZE = 0x4000
+LINKEDIT_SIZE = 0x1000
+
+
+def _pad8(data):
+    return data + b"\0" * (-len(data) % 8)
+
+
+def _dylib_command(cmd, name):
+    name = _pad8(name.encode() + b"\0")
+    # struct dylib_command: cmd, cmdsize, name offset, timestamp, current and compatibility version
+    return struct.pack("<IIIIII", cmd, 24 + len(name), 24, 2, 0x10000, 0x10000) + name
+
+
+def _rpath_command(path):
+    path = _pad8(path.encode() + b"\0")
+    return struct.pack("<III", macho.LC_RPATH, 12 + len(path), 12) + path
+
+
+def _segment(name, vmaddr, vmsize, fileoff, filesize, prot, sections=b"", nsects=0):
+    return struct.pack(
+        "<II16sQQQQiiII", macho.LC_SEGMENT_64, 72 + len(sections), name,
+        vmaddr, vmsize, fileoff, filesize, prot, prot, nsects, 0,
+    ) + sections
+
+
+def _payload(seed, size):
+    # Distinct, deterministic contents per file so the copy store does not deduplicate them
+    block = hashlib.sha256(seed.encode()).digest()
+    return (block * (size // len(block) + 1))[:size]
+
+
+def build_macho(filetype=macho.MH_DYLIB, install_name=None, dependencies=(), rpaths=(),
+                cputype=macho.CPU_TYPE_ARM64, text_size=0x4000, seed=None):
+    """
+    Build a thin 64-bit little-endian Mach-O file.
+
+    Args:
+        filetype (int): macho.MH_DYLIB, MH_EXECUTE or MH_BUNDLE
+        install_name (str, optional): LC_ID_DYLIB
+        dependencies (list): LC_LOAD_DYLIB references
+        rpaths (list): LC_RPATH entries
+        cputype (int): CPU type of the slice
+        text_size (int): Bytes of (meaningless) code after the header
+        seed (str, optional): Makes the code bytes unique, defaults to the install name
+
+    Returns:
+        bytes: The file contents
+    """
+    text_size = max(text_size, 16)
+    commands = []
+    if install_name:
+        commands.append(_dylib_command(macho.LC_ID_DYLIB, install_name))
+    commands.extend(_dylib_command(macho.LC_LOAD_DYLIB, d) for d in dependencies)
+    commands.extend(_rpath_command(r) for r in rpaths)
+    segments_size = 2 * 72 + 80
+
+    # Leave as much padding as the commands take, so relinking to longer
+    # @executable_path references still fits in place
+    used = 32 + segments_size + sum(len(c) for c in commands)
+    header_space = max(HEADER_SPACE, 2 * used + (-2 * used % 0x1000))
+    text_end = header_space + text_size
+    text_filesize = text_end + (-text_end % PAGE_SIZE)
+    file_size = text_filesize + LINKEDIT_SIZE
+
+    section = struct.pack(
+        "<16s16sQQIIIIIIII", b"__text", b"__TEXT", header_space, text_size,
+        header_space, 2, 0, 0, 0x80000400, 0, 0, 0,
+    )
+    commands[:0] = [
+        _segment(b"__TEXT", 0, text_filesize, 0, text_filesize, 5, section, 1),
+        _segment(b"__LINKEDIT", text_filesize, LINKEDIT_SIZE, text_filesize, LINKEDIT_SIZE, 1),
+    ]
+
+    body = b"".join(commands)
+    header = struct.pack(
+        "<IiIIIIII", macho.MH_MAGIC_64, cputype, 0, filetype,
+        len(commands), len(body), 0x00200085, 0,
+    )
+
+    data = bytearray(file_size)
+    data[:len(header) + len(body)] = header + body
+    data[header_space:text_end] = _payload(seed or install_name or "", text_size)
+    return bytes(data)
+
+
+def build_fat(slices):
+    """
+    Wrap thin Mach-O files in a fat (universal) header.
+
+    Args:
+        slices (list): Thin files as returned by build_macho
+
+    Returns:
+        bytes: The universal file
+    """
+    align = 14  # 2^14, as lipo does for arm64
+    offset = PAGE_SIZE
+    arches = []
+    blobs = []
+    for data in slices:
+        cputype, cpusubtype = struct.unpack_from("<ii", data, 4)
+        arches.append(struct.pack(">iiIII", cputype, cpusubtype, offset, len(data), align))
+        padded = data + b"\0" * (-len(data) % PAGE_SIZE)
+        blobs.append(padded)
+        offset += len(padded)
+    header = struct.pack(">II", macho.FAT_MAGIC, len(slices)) + b"".join(arches)
+    return header + b"\0" * (PAGE_SIZE - len(header)) + b"".join(blobs)
@@ -0,0 +1,263 @@
+"""
+Time dependency collection and signing on synthetic bundles, optionally against
+a baseline result.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+if __package__ in (None, ""):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import synthetic_bundle
+
+TOOLS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tools")
+DEFAULT_SIZES = [50, 500]
+DEFAULT_JOBS = [1, 8]
+# Slowdowns below this many seconds are noise, whatever the ratio
+MIN_TIME_DELTA = 0.1
+
+
+def _peak_rss_kib():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak  # bytes on macOS, KiB on Linux
+
+
+def _count_tool_calls(log_path):
+    counts = {}
+    try:
+        with open(log_path) as f:
+            for line in f:
+                tool = line.split(" ", 1)[0]
+                counts[tool] = counts.get(tool, 0) + 1
+    except FileNotFoundError:
+        pass
+    return counts
+
+
+class _Phase:
+    # Time one phase and attribute the stand-in calls made during it
+    def __init__(self, results, name, tool_log):
+        self.results = results
+        self.name = name
+        self.tool_log = tool_log
+
+    def __enter__(self):
+        self.before = _count_tool_calls(self.tool_log)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        after = _count_tool_calls(self.tool_log)
+        calls = {tool: n - self.before.get(tool, 0) for tool, n in after.items() if n != self.before.get(tool, 0)}
+        self.results[self.name] = {"seconds": round(elapsed, 4), "subprocesses": sum(calls.values()), "tools": calls}
+        return False
+
+
+def run_scenario(libraries, jobs, workdir, fanout=4):
+    """
+    Generate a bundle and run every phase on it in this process:
+
+        scan       find_bundle_binaries() on the fresh bundle
+        collect    process_app_bundle() from scratch
+        recollect  process_app_bundle() again, with the manifest (nothing to do)
+        sign       sign_app_bundle() with the stand-in codesign
+        verify     verify_signature() with the stand-in codesign/spctl
+
+    install_name_tool, codesign and spctl resolve to the stand-ins in tools/,
+    which log their calls, so the subprocess counts are exact.
+
+    Returns:
+        dict: Scenario result, with the time, subprocess count and tool calls
+            of every phase
+    """
+    # Imported here so the parent process does not pay for them
+    import code_signing_1
+    import dependency_collection_4
+
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)  # the scripts write their log files to the working directory
+    tool_log = os.path.join(workdir, "tools.log")
+    os.environ["BENCH_TOOL_LOG"] = tool_log
+    os.environ["PATH"] = TOOLS_DIR + os.pathsep + os.environ.get("PATH", "")
+
+    start = time.perf_counter()
+    info = synthetic_bundle.generate_bundle(os.path.join(workdir, "bundle"), libraries, fanout)
+    generate_seconds = time.perf_counter() - start
+    app = info["app"]
+
+    phases = {}
+    with _Phase(phases, "scan", tool_log):
+        binaries = dependency_collection_4.find_bundle_binaries(app)
+    with _Phase(phases, "collect", tool_log):
+        graph = dependency_collection_4.process_app_bundle(app, jobs)
+    store = dependency_collection_4.get_copy_store()
+    phases["collect"]["bytes_copied"] = store.bytes_copied
+    phases["collect"]["files_copied"] = store.files_copied
+    with _Phase(phases, "recollect", tool_log):
+        dependency_collection_4.process_app_bundle(app, jobs)
+    phases["recollect"]["bytes_copied"] = dependency_collection_4.get_copy_store().bytes_copied
+
+    backend = code_signing_1.CodesignBackend(
+        codesign=os.path.join(TOOLS_DIR, "codesign"), spctl=os.path.join(TOOLS_DIR, "spctl"),
+    )
+    with _Phase(phases, "sign", tool_log):
+        code_signing_1.sign_app_bundle(app, "-", jobs=jobs, backend=backend)
+    # sign_app_bundle() verifies at the end as well; time verification on its own
+    with _Phase(phases, "verify", tool_log):
+        code_signing_1.verify_signature(app, backend)
+
+    return {
+        "name": f"{libraries}libs-{jobs}jobs",
+        "libraries": libraries,
+        "jobs": jobs,
+        "fanout": fanout,
+        "roots": len(binaries),
+        "graph_nodes": len(graph),
+        "generate_seconds": round(generate_seconds, 4),
+        "phases": phases,
+        "peak_rss_kib": _peak_rss_kib(),
+    }
+
+
+def _best_of(runs):
+    # Fastest time per phase; counts are deterministic and taken from the first run
+    best = runs[0]
+    for run in runs[1:]:
+        for phase, values in run["phases"].items():
+            best["phases"][phase]["seconds"] = min(best["phases"][phase]["seconds"], values["seconds"])
+        best["peak_rss_kib"] = min(best["peak_rss_kib"], run["peak_rss_kib"])
+    best["repeat"] = len(runs)
+    return best
+
+
+def run_all(sizes, jobs_list, fanout=4, workdir=None, keep=False, repeat=3):
+    # One child process per scenario run, so peak RSS is per scenario; the fastest of `repeat` runs is kept
+    base = workdir or tempfile.mkdtemp(prefix="bundle-bench-")
+    results = []
+    try:
+        for libraries in sizes:
+            for jobs in jobs_list:
+                scenario_dir = os.path.join(base, f"{libraries}-{jobs}")
+                cmd = [sys.executable, "-m", "benchmarks.run", "--scenario", str(libraries), str(jobs),
+                       "--fanout", str(fanout), "--workdir", scenario_dir]
+                runs = []
+                for _ in range(max(1, repeat)):
+                    output = subprocess.run(
+                        cmd, check=True, stdout=subprocess.PIPE, text=True,
+                        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                    ).stdout
+                    runs.append(json.loads(output))
+                result = _best_of(runs)
+                logging.info(
+                    f"{result['name']}: " + ", ".join(f"{p} {v['seconds']:.2f}s" for p, v in result["phases"].items())
+                    + f", peak RSS {result['peak_rss_kib'] // 1024} MiB"
+                )
+                results.append(result)
+    finally:
+        if not keep:
+            shutil.rmtree(base, ignore_errors=True)
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+
+
+def compare(current, baseline, tolerance):
+    """
+    List regressions of `current` against `baseline`: phases that got slower
+    than `tolerance` allows, or started running more subprocesses or copying
+    more bytes.
+
+    Returns:
+        list: One message per regression
+    """
+    previous = {r["name"]: r for r in baseline.get("results", [])}
+    regressions = []
+    for result in current["results"]:
+        old = previous.get(result["name"])
+        if old is None:
+            continue
+        for phase, values in result["phases"].items():
+            old_values = old["phases"].get(phase)
+            if old_values is None:
+                continue
+            seconds, old_seconds = values["seconds"], old_values["seconds"]
+            if seconds > old_seconds * (1 + tolerance) and seconds - old_seconds > MIN_TIME_DELTA:
+                regressions.append(f"{result['name']} {phase}: {old_seconds:.3f}s -> {seconds:.3f}s")
+            if values["subprocesses"] > old_values["subprocesses"]:
+                regressions.append(
+                    f"{result['name']} {phase}: {old_values['subprocesses']} -> {values['subprocesses']} subprocesses"
+                )
+            if values.get("bytes_copied", 0) > old_values.get("bytes_copied", 0):
+                regressions.append(
+                    f"{result['name']} {phase}: {old_values.get('bytes_copied', 0)} -> {values['bytes_copied']} bytes copied"
+                )
+        if result["peak_rss_kib"] > old["peak_rss_kib"] * (1 + tolerance):
+            regressions.append(f"{result['name']}: peak RSS {old['peak_rss_kib']} -> {result['peak_rss_kib']} KiB")
+    return regressions
+
+
+def print_table(report):
+    phases = ["scan", "collect", "recollect", "sign", "verify"]
+    print(f"{'scenario':<18}" + "".join(f"{p:>11}" for p in phases) + f"{'procs':>8}{'MiB copied':>12}{'RSS MiB':>9}")
+    for r in report["results"]:
+        procs = sum(r["phases"][p]["subprocesses"] for p in phases)
+        copied = r["phases"]["collect"].get("bytes_copied", 0) / (1024 * 1024)
+        print(f"{r['name']:<18}" + "".join(f"{r['phases'][p]['seconds']:>10.3f}s" for p in phases)
+              + f"{procs:>8}{copied:>12.1f}{r['peak_rss_kib'] / 1024:>9.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark dependency collection and signing on synthetic bundles")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Library counts (default: 50 500)")
+    parser.add_argument("--jobs", type=int, nargs="+", default=DEFAULT_JOBS, help="Worker counts (default: 1 8)")
+    parser.add_argument("--fanout", type=int, default=4, help="Dependencies per library (default: 4)")
+    parser.add_argument("--workdir", help="Where to generate bundles (default: a temporary directory)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per scenario, the fastest counts (default: 3)")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated bundles")
+    parser.add_argument("--output", "-o", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare against this JSON result file, exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="Allowed slowdown ratio (default: 0.5)")
+    parser.add_argument("--scenario", type=int, nargs=2, metavar=("LIBRARIES", "JOBS"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scenario:
+        # Child process: only the JSON result goes to stdout
+        logging.basicConfig(level=logging.WARNING, stream=sys.stderr)
+        result = run_scenario(args.scenario[0], args.scenario[1], os.path.abspath(args.workdir), args.fanout)
+        json.dump(result, sys.stdout)
+        sys.exit(0)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    report = run_all(args.sizes, args.jobs, args.fanout, args.workdir and os.path.abspath(args.workdir),
+                     args.keep, args.repeat)
+    print_table(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=1, sort_keys=True)
+            f.write("\n")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        for message in regressions:
+            logging.error(f"Regression: {message}")
+        sys.exit(1 if regressions else 0)
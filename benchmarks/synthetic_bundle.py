@@ -0,0 +1,169 @@
+"""Generate a synthetic app bundle and the Homebrew-like prefix it links against."""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+
+if __package__ in (None, ""):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import macho
+from benchmarks import machogen
+
+
+def _library_names(index, versioned):
+    # (real file name, name used in references and as install name, alias names)
+    if versioned:
+        return f"libsyn{index}.1.2.dylib", f"libsyn{index}.1.dylib", [f"libsyn{index}.1.dylib", f"libsyn{index}.dylib"]
+    return f"libsyn{index}.dylib", f"libsyn{index}.dylib", []
+
+
+def _write(path, data, mode=0o644):
+    with open(path, "wb") as f:
+        f.write(data)
+    os.chmod(path, mode)
+
+
+def generate_bundle(root, libraries=200, fanout=4, frameworks=4, data_files=100,
+                    versioned_every=5, rpath_every=7, loader_path_every=6, fat_every=0,
+                    text_size=0x4000, seed=0):
+    """
+    Create a synthetic prefix and app bundle under `root` (replaced if present):
+
+        prefix/lib/                 libsynN.dylib, or libsynN.1.2.dylib with
+                                    libsynN.1.dylib and libsynN.dylib symlinks
+        prefix/Frameworks/          SynFwK.framework with Versions/A, Versions/Current
+                                    and the usual top-level symlinks
+        Synth.app/Contents/MacOS/   main executable and a helper tool
+        Synth.app/Contents/Resources/share/
+                                    plain data files
+
+    Libraries only depend on libraries with a higher index, so the graph is
+    a DAG. References are mostly absolute, with a share of @rpath and
+    @loader_path ones as in Homebrew bottles. The main executable references
+    every library nothing else references, so the whole prefix is reachable.
+
+    Args:
+        root (str): Output directory
+        libraries (int): Number of dylibs in prefix/lib
+        fanout (int): Dependencies per library
+        frameworks (int): Number of frameworks in prefix/Frameworks
+        data_files (int): Non-binary files in Contents/Resources/share
+        versioned_every (int): Every n-th library gets a versioned name and aliases (0 = none)
+        rpath_every (int): Every n-th library is referenced through @rpath (0 = none)
+        loader_path_every (int): Every n-th library is referenced through @loader_path (0 = none)
+        fat_every (int): Every n-th library is a universal x86_64 + arm64 file (0 = none)
+        text_size (int): Code bytes per slice
+        seed (int): Random seed for the dependency graph
+
+    Returns:
+        dict: {"app", "prefix", "libraries", "frameworks", "bytes"}
+    """
+    rnd = random.Random(seed)
+    shutil.rmtree(root, ignore_errors=True)
+    lib_dir = os.path.join(root, "prefix", "lib")
+    fw_dir = os.path.join(root, "prefix", "Frameworks")
+    app = os.path.join(root, "Synth.app")
+    for d in (lib_dir, fw_dir, os.path.join(app, "Contents", "MacOS"), os.path.join(app, "Contents", "Resources", "share")):
+        os.makedirs(d)
+
+    def every(n, i):
+        return n > 0 and i % n == n - 1
+
+    names = [_library_names(i, every(versioned_every, i)) for i in range(libraries)]
+
+    def reference(child, loader_rpaths):
+        # How a library refers to library `child`
+        _, ref_name, _ = names[child]
+        if every(rpath_every, child):
+            loader_rpaths.add("@loader_path")
+            return f"@rpath/{ref_name}"
+        if every(loader_path_every, child):
+            return f"@loader_path/{ref_name}"
+        return os.path.join(lib_dir, ref_name)
+
+    total_bytes = 0
+    referenced = set()
+    for i, (file_name, ref_name, aliases) in enumerate(names):
+        children = sorted(rnd.sample(range(i + 1, libraries), min(fanout, libraries - i - 1)))
+        referenced.update(children)
+        rpaths = set()
+        deps = [reference(c, rpaths) for c in children] + ["/usr/lib/libSystem.B.dylib"]
+        install_name = os.path.join(lib_dir, ref_name)
+        kwargs = dict(install_name=install_name, dependencies=deps, rpaths=sorted(rpaths), text_size=text_size)
+        if every(fat_every, i):
+            data = machogen.build_fat([
+                machogen.build_macho(cputype=macho.CPU_TYPE_X86_64, seed=install_name + "x86_64", **kwargs),
+                machogen.build_macho(cputype=macho.CPU_TYPE_ARM64, **kwargs),
+            ])
+        else:
+            data = machogen.build_macho(**kwargs)
+        _write(os.path.join(lib_dir, file_name), data)
+        total_bytes += len(data)
+        for alias in aliases:
+            if alias != file_name:
+                os.symlink(file_name, os.path.join(lib_dir, alias))
+
+    framework_binaries = []
+    for k in range(frameworks):
+        name = f"SynFw{k}"
+        fw = os.path.join(fw_dir, f"{name}.framework")
+        version_dir = os.path.join(fw, "Versions", "A")
+        os.makedirs(os.path.join(version_dir, "Resources"))
+        binary = os.path.join(version_dir, name)
+        deps = [os.path.join(lib_dir, names[c][1]) for c in sorted(rnd.sample(range(libraries), min(2, libraries)))]
+        data = machogen.build_macho(install_name=binary, dependencies=deps + ["/usr/lib/libSystem.B.dylib"], text_size=text_size)
+        _write(binary, data)
+        total_bytes += len(data)
+        with open(os.path.join(version_dir, "Resources", "Info.plist"), "w") as f:
+            f.write(f"<plist><dict><key>CFBundleExecutable</key><string>{name}</string></dict></plist>\n")
+        os.symlink("A", os.path.join(fw, "Versions", "Current"))
+        os.symlink(f"Versions/Current/{name}", os.path.join(fw, name))
+        os.symlink("Versions/Current/Resources", os.path.join(fw, "Resources"))
+        framework_binaries.append(binary)
+
+    # The main executable pulls in everything nothing else references
+    roots = [i for i in range(libraries) if i not in referenced]
+    main_deps = [f"@rpath/{names[i][1]}" for i in roots] + framework_binaries + ["/usr/lib/libSystem.B.dylib"]
+    executable = machogen.build_macho(
+        filetype=macho.MH_EXECUTE, dependencies=main_deps, rpaths=[lib_dir], text_size=text_size, seed="Synth",
+    )
+    _write(os.path.join(app, "Contents", "MacOS", "Synth"), executable, 0o755)
+    helper_deps = [os.path.join(lib_dir, names[i][1]) for i in range(min(3, libraries))]
+    helper = machogen.build_macho(
+        filetype=macho.MH_EXECUTE, dependencies=helper_deps + ["/usr/lib/libSystem.B.dylib"], text_size=text_size, seed="synth-helper",
+    )
+    _write(os.path.join(app, "Contents", "MacOS", "synth-helper"), helper, 0o755)
+    total_bytes += len(executable) + len(helper)
+
+    with open(os.path.join(app, "Contents", "Info.plist"), "w") as f:
+        f.write("<plist><dict><key>CFBundleExecutable</key><string>Synth</string></dict></plist>\n")
+    share = os.path.join(app, "Contents", "Resources", "share")
+    for n in range(data_files):
+        with open(os.path.join(share, f"data{n}.txt"), "w") as f:
+            f.write(f"synthetic data file {n}\n" * 8)
+
+    return {
+        "app": app,
+        "prefix": os.path.join(root, "prefix"),
+        "libraries": libraries,
+        "frameworks": frameworks,
+        "bytes": total_bytes,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic app bundle for benchmarks")
+    parser.add_argument("root", help="Output directory (replaced if it exists)")
+    parser.add_argument("--libraries", "-n", type=int, default=200, help="Number of libraries (default: 200)")
+    parser.add_argument("--fanout", type=int, default=4, help="Dependencies per library (default: 4)")
+    parser.add_argument("--frameworks", type=int, default=4, help="Number of frameworks (default: 4)")
+    parser.add_argument("--fat-every", type=int, default=0, help="Make every n-th library universal (default: none)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+    args = parser.parse_args()
+
+    info = generate_bundle(args.root, args.libraries, args.fanout, args.frameworks,
+                           fat_every=args.fat_every, seed=args.seed)
+    print(f"Generated {info['app']}: {info['libraries']} libraries, {info['frameworks']} frameworks, {info['bytes']} bytes")
@@ -0,0 +1,478 @@
+"""One entry point for the whole pipeline: collect, audit, sign, verify and package."""
+
+import argparse
+import json
+import logging
+import os
+import sys
+
+import audit
+import batch
+import bundle_scanner
+import code_signing_1
+import dependency_collection_4
+import launcher_cache
+import package
+import profiling
+import prune
+import python_payload
+import relocation_cache
+import staging
+import thinning
+import tool_runner
+import watch
+
+
+class Bundle:
+    """
+    Scan results and dependency graph of one app bundle, shared by the stages.
+
+    The bundle is scanned once: collect adds the files it writes to the scan
+    instead of walking the bundle again, and sign takes its file list from
+    the scan and its signing order from the graph.
+
+    Args:
+        app_bundle_path (str): Path to the .app bundle
+        jobs (int): Worker threads for collecting and codesign calls
+        manifest_path (str, optional): Collector manifest, see dependency_collection_4
+        arch (str, optional): Thin universal binaries to this architecture while collecting
+        cache_dir (str, optional): Relocation cache shared with other runs, see relocation_cache.py
+        cache_size (int): Size in bytes the relocation cache is trimmed to
+    """
+
+    def __init__(self, app_bundle_path, jobs=1, manifest_path=None, arch=None,
+                 cache_dir=None, cache_size=relocation_cache.DEFAULT_MAX_BYTES):
+        self.path = app_bundle_path
+        self.jobs = jobs
+        self.manifest_path = manifest_path
+        self.arch = arch
+        self.cache_dir = cache_dir
+        self.cache_size = cache_size
+        self.graph = None
+        self.scans = 0
+        self._files = None
+
+    def scan(self):
+        """
+        All files of the bundle, walked on first use.
+
+        Returns:
+            list: bundle_scanner.BundleFile records
+        """
+        if self._files is None:
+            with profiling.phase("scan"):
+                self._files = list(bundle_scanner.scan_bundle(self.path))
+            self.scans += 1
+        return self._files
+
+    def rescan(self):
+        # Forget the scan, e.g. after the bundle was changed by something else
+        self._files = None
+        return self.scan()
+
+    def roots(self):
+        # Executable Mach-O files: where dependency collection starts
+        return [
+            f.path for f in self.scan()
+            if f.is_executable and f.is_macho and not dependency_collection_4.is_skipped_binary(f.path)
+        ]
+
+    def signable_files(self, rules=bundle_scanner.SIGN_RULES):
+        # Mach-O files the signer would find, taken from the existing scan
+        return [f.path for f in self.scan() if f.is_macho and not rules.excludes(f.rel_path)]
+
+    def collect(self, force=False):
+        """
+        Copy and relink the dependencies of every executable into the bundle,
+        then write the launcher's loaders.cache and launch.cfg (see launcher_cache.py).
+
+        Returns:
+            DependencyGraph: The graph of this run
+        """
+        roots = self.roots()
+        self.graph = dependency_collection_4.process_app_bundle(
+            self.path, self.jobs, self.manifest_path, force, binaries=roots, arch=self.arch,
+            cache_dir=self.cache_dir, cache_size=self.cache_size,
+        )
+        if self.arch:
+            # The roots were thinned in place, refresh their records
+            thinned = set(roots)
+            self._files = [
+                bundle_scanner.scan_file(f.path, self.path) if f.path in thinned else f for f in self._files
+            ]
+        self._add_collected_files()
+        with profiling.phase("launcher"):
+            written = launcher_cache.write_launch_files(self.path)
+        known = {f.path for f in self._files}
+        for record in (bundle_scanner.scan_file(p, self.path) for p in written):
+            if record is not None and record.path not in known:
+                self._files.append(record)
+        return self.graph
+
+    def _add_collected_files(self, graph=None):
+        # Bring the scan up to date with what collect wrote, without walking the whole bundle
+        known = {os.path.realpath(f.path) for f in self._files}
+        root = os.path.realpath(self.path)
+        added = []
+        frameworks = set()
+        directories = set()
+        for node in graph or self.graph:
+            if not node.dest or os.path.realpath(node.dest) in known:
+                continue
+            if ".framework/" in node.dest:
+                # Frameworks are copied whole (symlinks, Versions), scan the copied directory
+                frameworks.add(node.dest.split(".framework/", 1)[0] + ".framework")
+            else:
+                record = bundle_scanner.scan_file(node.dest, self.path)
+                if record is not None:
+                    added.append(record)
+                directories.add(os.path.dirname(node.dest))
+        for directory in sorted(directories):
+            # Aliases of the copied libraries
+            added.extend(self._symlinks(directory))
+        for framework in sorted(frameworks):
+            rel_root = os.path.relpath(os.path.realpath(framework), root).replace(os.sep, "/")
+            added.extend(bundle_scanner.scan_bundle(framework, rel_root=rel_root))
+        for record in added:
+            real_path = os.path.realpath(record.path) if not record.is_symlink else record.path
+            if real_path not in known:
+                known.add(real_path)
+                self._files.append(record)
+
+    def _symlinks(self, directory):
+        try:
+            with os.scandir(directory) as it:
+                links = sorted(entry.path for entry in it if entry.is_symlink())
+        except OSError:
+            return []
+        return [r for r in (bundle_scanner.scan_file(link, self.path) for link in links) if r is not None]
+
+    def python_payload(self, keep_tests=False, compile=True):
+        """
+        Clean up, relocate and precompile the embedded Python, see python_payload.py.
+
+        Returns:
+            list: One report per embedded Python version
+        """
+        self.scan()
+        reports = []
+        for payload in python_payload.find_payloads(self.path):
+            with profiling.phase("python"):
+                reports.extend(python_payload.process_python_payload(
+                    self.path, self.jobs, self.arch, keep_tests, compile, payloads=[payload],
+                ))
+            # The payload changed wholesale (tests and caches removed, .pyc files added), scan it again
+            rel_root = os.path.relpath(os.path.realpath(payload.framework), os.path.realpath(self.path))
+            self._files = [f for f in self._files if not f.rel_path.startswith(rel_root + "/")]
+            self._files.extend(bundle_scanner.scan_bundle(payload.framework, rel_root=rel_root))
+            self._add_collected_files(reports[-1]["graph"])
+        return reports
+
+    def prune(self, extra_roots=(), dry_run=False):
+        """
+        Remove libraries, frameworks and framework content nothing loads.
+
+        Returns:
+            prune.PruneReport
+        """
+        with profiling.phase("prune"):
+            report = prune.prune_bundle(
+                self.path, self.jobs, self.scan(), extra_roots, dry_run, self.manifest_path, self.arch,
+            )
+        if report.removed and not dry_run:
+            removed = tuple(report.removed)
+            self._files = [
+                f for f in self._files
+                if not any(f.rel_path == r or f.rel_path.startswith(r + "/") for r in removed)
+            ]
+        return report
+
+    def audit(self, ignore=()):
+        """
+        Check that the bundle only loads files from inside itself.
+
+        Args:
+            ignore (iterable): Issue kinds left out of the report
+
+        Returns:
+            audit.AuditReport
+        """
+        with profiling.phase("audit"):
+            report = audit.audit_bundle(self.path, self.jobs, self.scan())
+        report.issues = [i for i in report.issues if i.kind not in ignore]
+        return report
+
+    def sign(self, signing_identity, entitlements=None, backend=None):
+        """
+        Sign every Mach-O file and then the bundle, in dependency order.
+        """
+        code_signing_1.sign_app_bundle(
+            self.path, signing_identity, entitlements, self.jobs, backend,
+            signable_files=self.signable_files(), graph=self.graph, verify=False, manifest_path=self.manifest_path,
+        )
+
+    def verify(self, backend=None):
+        with profiling.phase("verify"):
+            code_signing_1.verify_signature(self.path, backend)
+
+    def package(self, fmt="zip", output=None, level=None):
+        """
+        Pack the bundle into a distribution archive, see package.py.
+
+        Returns:
+            dict: The archive's contents manifest
+        """
+        return package.package_bundle(self.path, output, fmt, level, self.jobs)
+
+
+def setup_logging(log_file=None):
+    # Console only; a log file only when asked for, never in the working directory by default
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        handlers.append(logging.FileHandler(log_file))
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=handlers,
+    )
+
+
+def run_batch(args):
+    missing = [app for app in args.app if not os.path.exists(app)]
+    if missing:
+        logging.error(f"App bundle not found at {', '.join(missing)}")
+        return 1
+    try:
+        report = batch.process_app_bundles(args.app, args.jobs, args.arch, args.force,
+                                           args.cache, args.cache_size * 1024 * 1024)
+        if args.report:
+            with open(args.report, "w") as f:
+                json.dump(report, f, indent=2)
+        if report["failed"]:
+            logging.error(f"bundle batch failed for {', '.join(report['failed'])}")
+            return 1
+        logging.info(f"bundle batch completed ({len(args.app)} bundles)")
+        return 0
+    finally:
+        if args.profile:
+            profiling.report(args.profile)
+
+
+# Arguments that do not change the staged bundle, left out of the staging journal
+_UNSTAGED_ARGS = {"jobs", "profile", "log_file", "timeout", "audit_json", "prune_report", "output", "format", "level", "stage", "stage_dir"}
+
+
+def open_stage(args):
+    """
+    Clone the bundle into its staging directory, or resume the staged work, see staging.py.
+
+    Returns:
+        staging.Stage: The opened stage
+    """
+    output = args.publish or args.app
+    manifest_path = args.manifest if os.path.abspath(output) == os.path.abspath(args.app) else None
+    stage = staging.Stage(
+        args.app, output, {key: value for key, value in vars(args).items() if key not in _UNSTAGED_ARGS},
+        args.stage_dir, manifest_path, args.manifest,
+    )
+    stage.open(args.jobs)
+    return stage
+
+
+def run_stages(args, bundle, backend, stage=None):
+    """
+    Run the stages of `args.command` on `bundle`, skipping those the staging journal has as done.
+
+    Returns:
+        bool: False if the audit stopped the run
+    """
+    def run(name, func, rerunnable=True):
+        return stage.run(name, func, rerunnable) if stage is not None else func()
+
+    if args.command in ("collect", "all"):
+        run("collect", lambda: bundle.collect(args.force), rerunnable=False)
+    if args.command == "python" or (args.command in ("collect", "all") and not args.skip_python):
+        run("python", lambda: bundle.python_payload(args.keep_tests, not args.no_compile), rerunnable=False)
+    if args.command == "prune" or getattr(args, "prune", False):
+        def prune_bundle():
+            report = bundle.prune(args.root, getattr(args, "dry_run", False))
+            logging.info("Size by root:\n" + report.format_table())
+            if args.prune_report:
+                with open(args.prune_report, "w") as f:
+                    json.dump(report.to_dict(), f, indent=1)
+        run("prune", prune_bundle)
+    if args.command in ("audit", "all") and not (stage is not None and stage.done("audit")):
+        report = bundle.audit(args.ignore)
+        report.log()
+        if args.audit_json:
+            with open(args.audit_json, "w") as f:
+                json.dump(report.to_dict(), f, indent=1)
+        if not report.ok and not getattr(args, "skip_audit", False):
+            logging.error(f"bundle {args.command} stopped: the bundle is not self-contained")
+            return False
+        if stage is not None:
+            stage.complete("audit")
+    if args.command in ("sign", "all"):
+        run("sign", lambda: bundle.sign(args.identity, args.entitlements, backend))
+    if args.command in ("verify", "all"):
+        run("verify", lambda: bundle.verify(backend))
+    return True
+
+
+def main(argv=None):
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--app", required=True, help="Path to the .app bundle")
+    common.add_argument("--jobs", "-j", type=int, default=1, help="Number of parallel workers (default: 1, serial)")
+    common.add_argument("--profile", nargs="?", const="bundle.profile", metavar="PREFIX",
+                        help="Time phases and tool calls, write PREFIX.json and PREFIX.trace.json (default prefix: bundle.profile)")
+    common.add_argument("--log-file", metavar="FILE", help="Also write the log to FILE (default: console only)")
+
+    collect_options = argparse.ArgumentParser(add_help=False)
+    collect_options.add_argument("--manifest", help="Manifest file (default: .<app name>.manifest.json next to the bundle)")
+    collect_options.add_argument("--arch", choices=thinning.ARCHS, help="Keep only this architecture of universal binaries (default: keep all)")
+    collect_options.add_argument("--force", action="store_true", help="Ignore the manifest and process every file")
+    collect_options.add_argument("--cache", default=relocation_cache.default_cache_dir(), metavar="DIR",
+                                 help="Reuse relinked libraries from this directory across runs (default: $SYNFIG_BUNDLE_CACHE, no cache if unset)")
+    collect_options.add_argument("--cache-size", type=int, default=relocation_cache.DEFAULT_MAX_BYTES // (1024 * 1024), metavar="MIB",
+                                 help="Evict least recently used cache entries beyond this size (default: 2048)")
+
+    tool_options = argparse.ArgumentParser(add_help=False)
+    tool_options.add_argument("--codesign", default=os.environ.get("CODESIGN", "codesign"), help="codesign tool to use (default: $CODESIGN or codesign)")
+    tool_options.add_argument("--spctl", default=os.environ.get("SPCTL", "spctl"), help="spctl tool to use (default: $SPCTL or spctl)")
+    tool_options.add_argument("--backend", choices=["auto", "codesign", "python"], default="auto",
+                              help="Signer: codesign, or the built-in ad-hoc signer (python); auto uses python for --identity - (default: auto)")
+    tool_options.add_argument("--timeout", type=float, help="Seconds before a codesign/spctl call is killed (default: no limit)")
+
+    prune_options = argparse.ArgumentParser(add_help=False)
+    prune_options.add_argument("--root", action="append", default=[], help="Bundle-relative file or directory that is also loaded at run time (repeatable)")
+    prune_options.add_argument("--prune-report", metavar="FILE", help="Also write the prune and size report as JSON")
+
+    audit_options = argparse.ArgumentParser(add_help=False)
+    audit_options.add_argument("--ignore", action="append", choices=audit.ISSUE_KINDS, default=[], help="Do not fail on this kind of audit issue (repeatable)")
+    audit_options.add_argument("--audit-json", metavar="FILE", help="Also write the audit report as JSON")
+
+    package_options = argparse.ArgumentParser(add_help=False)
+    package_options.add_argument("--output", "-o", help="Archive path (default: <App>.<format> next to the bundle)")
+    package_options.add_argument("--level", type=int, help="Compression level (default: zip 6, tar.xz 6, tar.zst 10)")
+
+    stage_options = argparse.ArgumentParser(add_help=False)
+    stage_options.add_argument("--stage", action="store_true",
+                               help="Work on a copy-on-write clone of the bundle and replace the bundle with it atomically at the end; "
+                                    "rerunning an interrupted command resumes it")
+    stage_options.add_argument("--stage-dir", metavar="DIR",
+                               help="Staging directory, on the same file system as the published bundle (default: .<app name>.staging next to it)")
+    stage_options.add_argument("--publish", metavar="APP", help="Publish the staged bundle here instead of replacing --app (implies --stage)")
+
+    sign_options = argparse.ArgumentParser(add_help=False)
+    sign_options.add_argument("--identity", required=True, help="Signing identity (e.g., 'Developer ID Application: Name (ID)')")
+    sign_options.add_argument("--entitlements", help="Path to entitlements.plist")
+
+    parser = argparse.ArgumentParser(description="Collect, sign and verify a macOS app bundle")
+    commands = parser.add_subparsers(dest="command", required=True)
+    python_options = argparse.ArgumentParser(add_help=False)
+    python_options.add_argument("--keep-tests", action="store_true", help="Keep the embedded Python's test packages")
+    python_options.add_argument("--no-compile", action="store_true", help="Do not precompile the embedded Python to .pyc files")
+
+    collect_parser = commands.add_parser("collect", parents=[common, collect_options, python_options, stage_options], help="Copy and relink dependencies into the bundle")
+    collect_parser.add_argument("--skip-python", action="store_true", help="Leave the embedded Python.framework as it is")
+    python_parser = commands.add_parser("python", parents=[common, python_options],
+                                        help="Relocate, clean up and precompile the embedded Python.framework")
+    python_parser.add_argument("--arch", choices=thinning.ARCHS, help="Keep only this architecture of universal binaries (default: keep all)")
+    prune_parser = commands.add_parser("prune", parents=[common, prune_options], help="Remove what nothing loads, report size by root")
+    prune_parser.add_argument("--dry-run", action="store_true", help="Only report what would be removed")
+    prune_parser.add_argument("--manifest", help="Collector manifest to update (default: .<app name>.manifest.json next to the bundle)")
+    prune_parser.add_argument("--arch", choices=thinning.ARCHS, help="Architecture the bundle was collected for (selects the manifest)")
+    commands.add_parser("audit", parents=[common, audit_options], help="Check that the bundle is self-contained, exit 1 if not")
+    commands.add_parser("sign", parents=[common, tool_options, sign_options], help="Sign the bundle")
+    commands.add_parser("verify", parents=[common, tool_options], help="Verify the bundle's signature")
+    package_parser = commands.add_parser("package", parents=[common, package_options], help="Pack the bundle into a zip, tar.xz or tar.zst archive")
+    package_parser.add_argument("--format", choices=package.FORMATS, default="zip", help="Archive format (default: zip)")
+    all_parser = commands.add_parser("all", parents=[common, collect_options, python_options, prune_options, audit_options, tool_options, sign_options, package_options, stage_options],
+                                     help="collect, (prune,) audit, sign, verify (and package)")
+    all_parser.add_argument("--prune", action="store_true", help="Prune the bundle after collecting")
+    all_parser.add_argument("--skip-python", action="store_true", help="Leave the embedded Python.framework as it is")
+    all_parser.add_argument("--package", dest="format", choices=package.FORMATS, help="Pack the verified bundle into an archive of this format")
+    watch_parser = commands.add_parser("watch", parents=[common, collect_options, tool_options],
+                                       help="Rebundle (and re-sign) only what changes in the bundle's inputs, until interrupted")
+    watch_parser.add_argument("--watch", action="append", default=[], metavar="DIR",
+                              help="Build output directory whose libraries replace the bundled ones of the same name (repeatable)")
+    watch_parser.add_argument("--interval", type=float, default=watch.DEFAULT_INTERVAL, help="Seconds between polls (default: 0.5)")
+    watch_parser.add_argument("--identity", help="Sign changed files and the bundle with this identity (default: do not sign)")
+    watch_parser.add_argument("--entitlements", help="Path to entitlements.plist")
+    all_parser.add_argument("--skip-audit", action="store_true", help="Sign even if the audit finds issues")
+    batch_parser = commands.add_parser("batch", help="Collect several bundles in one session that shares lookups and relinked libraries")
+    batch_parser.add_argument("--app", action="append", required=True, help="Path to an .app bundle (repeatable)")
+    batch_parser.add_argument("--jobs", "-j", type=int, default=1, help="Number of parallel workers per bundle (default: 1, serial)")
+    batch_parser.add_argument("--arch", choices=thinning.ARCHS, help="Keep only this architecture of universal binaries (default: keep all)")
+    batch_parser.add_argument("--force", action="store_true", help="Ignore the manifests and process every file")
+    batch_parser.add_argument("--cache", default=relocation_cache.default_cache_dir(), metavar="DIR",
+                              help="Relocation cache to share with other runs (default: $SYNFIG_BUNDLE_CACHE, else a temporary one)")
+    batch_parser.add_argument("--cache-size", type=int, default=relocation_cache.DEFAULT_MAX_BYTES // (1024 * 1024), metavar="MIB",
+                              help="Evict least recently used cache entries beyond this size (default: 2048)")
+    batch_parser.add_argument("--report", metavar="FILE", help="Also write the batch report as JSON")
+    batch_parser.add_argument("--profile", nargs="?", const="bundle.profile", metavar="PREFIX",
+                              help="Time phases and tool calls, write PREFIX.json and PREFIX.trace.json (default prefix: bundle.profile)")
+    batch_parser.add_argument("--log-file", metavar="FILE", help="Also write the log to FILE (default: console only)")
+    args = parser.parse_args(argv)
+
+    setup_logging(args.log_file)
+    if args.profile:
+        profiling.enable()
+    if args.command == "batch":
+        return run_batch(args)
+    if not os.path.exists(args.app):
+        logging.error(f"App bundle not found at {args.app}")
+        return 1
+
+    stage = None
+    if getattr(args, "stage", False) or getattr(args, "publish", None):
+        try:
+            stage = open_stage(args)
+        except (OSError, RuntimeError) as e:
+            logging.error(f"bundle {args.command} failed: cannot stage {args.app}: {e}")
+            return 1
+
+    bundle = Bundle(
+        stage.path if stage else args.app, args.jobs,
+        stage.manifest_path if stage else getattr(args, "manifest", None), getattr(args, "arch", None),
+        getattr(args, "cache", None), getattr(args, "cache_size", 0) * 1024 * 1024,
+    )
+    backend = None
+    if args.command not in ("collect", "python", "prune", "audit", "package"):
+        tool_runner.set_runner(tool_runner.ToolRunner(max(1, args.jobs), args.timeout))
+        backend = code_signing_1.make_backend(
+            args.backend, getattr(args, "identity", None), args.codesign, args.spctl, args.jobs,
+        )
+
+    try:
+        if args.command == "watch":
+            try:
+                watch.watch(args.app, args.watch, args.jobs, args.manifest, args.arch, args.interval,
+                            args.identity, args.entitlements, backend if args.identity else None, args.cache)
+            except KeyboardInterrupt:
+                pass
+            return 0
+        if not run_stages(args, bundle, backend, stage):
+            if stage is not None:
+                logging.error(f"Staged work kept in {stage.work_dir}, remove it to start over")
+            return 1
+        if stage is not None:
+            stage.publish()
+        if args.command == "package" or getattr(args, "format", None):
+            (Bundle(stage.output, args.jobs) if stage else bundle).package(args.format, args.output, args.level)
+        logging.info(f"bundle {args.command} completed ({bundle.scans} scan{'s' if bundle.scans != 1 else ''} of the bundle)")
+        return 0
+    except Exception as e:
+        logging.error(f"bundle {args.command} failed: {e}")
+        if stage is not None:
+            logging.error(f"Staged work kept in {stage.work_dir}, run the same command again to resume it")
+        return 1
+    finally:
+        if stage is not None:
+            stage.close()
+        if args.profile:
+            profiling.report(args.profile)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,173 @@
+"""Single-pass scanner for app bundles, shared by the collector and the signer."""
+
+import fnmatch
+import os
+import stat
+
+import macho
+
+
+class PruneRules:
+    """
+    Decide which directories the scanner does not descend into.
+
+    Args:
+        names (iterable): Directory names pruned wherever they appear
+        paths (iterable): fnmatch patterns matched against the bundle-relative path
+        keep (iterable): Bundle-relative paths that are never pruned, even
+            if their name is listed in `names`
+    """
+
+    def __init__(self, names=(), paths=(), keep=()):
+        self.names = set(names)
+        self.paths = list(paths)
+        self.keep = set(keep)
+
+    def prunes(self, rel_path, name):
+        if rel_path in self.keep:
+            return False
+        if name in self.names:
+            return True
+        return any(fnmatch.fnmatchcase(rel_path, pattern) for pattern in self.paths)
+
+    def excludes(self, rel_path):
+        """
+        True if a scan with these rules would not reach the file at `rel_path`,
+        i.e. if one of its parent directories is pruned. Lets a scan made with
+        other rules be filtered afterwards instead of walking again.
+        """
+        parts = rel_path.split("/")[:-1]
+        for i in range(len(parts)):
+            if self.prunes("/".join(parts[:i + 1]), parts[i]):
+                return True
+        return False
+
+
+# Collector: look everywhere
+COLLECT_RULES = PruneRules()
+
+# Signer: skip headers and data. Contents/Resources itself is kept because the collector puts libraries in
+# Resources/lib and Resources/bin, and the embedded Python.framework (see python_payload.py) in Resources/Frameworks.
+SIGN_RULES = PruneRules(
+    names={"Headers", "Resources"},
+    paths={"Contents/Resources/share"},
+    keep={"Contents/Resources"},
+)
+
+
+class BundleFile:
+    """
+    One file found by the scanner.
+
+    Attributes:
+        path (str): Full path of the file
+        rel_path (str): Path relative to the scanned root
+        kind (str): "macho", "fat", "script", "data" or "symlink"
+        size (int): Size in bytes (of the link itself for symlinks)
+        mode (int): st_mode of the file (of the link itself for symlinks)
+    """
+
+    __slots__ = ("path", "rel_path", "kind", "size", "mode")
+
+    def __init__(self, path, rel_path, kind, size, mode):
+        self.path = path
+        self.rel_path = rel_path
+        self.kind = kind
+        self.size = size
+        self.mode = mode
+
+    @property
+    def is_macho(self):
+        return self.kind in ("macho", "fat")
+
+    @property
+    def is_symlink(self):
+        return self.kind == "symlink"
+
+    @property
+    def is_executable(self):
+        # Same test as os.access(path, os.X_OK) for the owner, without a syscall
+        return bool(self.mode & (stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH))
+
+    def __repr__(self):
+        return f"BundleFile({self.rel_path!r}, {self.kind})"
+
+
+def classify(path, size):
+    # Read just enough bytes to tell the file types apart
+    if size < 4:
+        return "data"
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return "data"
+    try:
+        head = os.read(fd, 8)
+    finally:
+        os.close(fd)
+    return macho.classify_header(head)
+
+
+def scan_file(path, root):
+    """
+    BundleFile for a single path below `root` (e.g. a file written after the scan).
+
+    Returns:
+        BundleFile: The record, or None if the path does not exist or is a directory
+    """
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return None
+    rel_path = os.path.relpath(path, root).replace(os.sep, "/")
+    if stat.S_ISLNK(st.st_mode):
+        return BundleFile(path, rel_path, "symlink", st.st_size, st.st_mode)
+    if not stat.S_ISREG(st.st_mode):
+        return None
+    return BundleFile(path, rel_path, classify(path, st.st_size), st.st_size, st.st_mode)
+
+
+def scan_bundle(root, rules=COLLECT_RULES, rel_root=""):
+    """
+    Walk a bundle once and yield a BundleFile for every file in it.
+
+    Symlinks are reported with kind "symlink" and never followed, so
+    framework Versions/Current links and library aliases are not scanned
+    twice. Entries are yielded in sorted order, so results are stable.
+
+    Args:
+        root (str): Directory to scan (usually the .app bundle)
+        rules (PruneRules): Directories to skip
+        rel_root (str): Relative path of `root` itself, when scanning a
+            subdirectory of a bundle so rel_path stays bundle-relative
+
+    Yields:
+        BundleFile
+    """
+    stack = [(root, rel_root)]
+    while stack:
+        directory, rel_dir = stack.pop()
+        try:
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError:
+            continue
+
+        subdirs = []
+        for entry in entries:
+            rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+            try:
+                if entry.is_symlink():
+                    st = entry.stat(follow_symlinks=False)
+                    yield BundleFile(entry.path, rel_path, "symlink", st.st_size, st.st_mode)
+                elif entry.is_dir(follow_symlinks=False):
+                    if not rules.prunes(rel_path, entry.name):
+                        subdirs.append((entry.path, rel_path))
+                elif entry.is_file(follow_symlinks=False):
+                    st = entry.stat(follow_symlinks=False)
+                    yield BundleFile(entry.path, rel_path, classify(entry.path, st.st_size), st.st_size, st.st_mode)
+            except OSError:
+                continue
+
+        # Depth-first, in name order
+        stack.extend(reversed(subdirs))
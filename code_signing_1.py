@@ -4,6 +4,15 @@ import subprocess
 from pathlib import Path
 import sys
 
+import adhoc_signature
+import bundle_scanner
+import copy_store
+import macho
+import manifest
+import parallel
+import profiling
+import tool_runner
+
 # Sets up logging configuration to output to both file and console
 def setup_logging():
     """
@@ -21,7 +30,10 @@ def setup_logging():
     
 def is_binary_file(file_path):
     """
-    Check if a file is a Mach-O binary or dynamic library by running the 'file' command.
+    Check if a file is a Mach-O binary or dynamic library.
+    
+    Reads the file's magic bytes in-process (thin or fat/universal Mach-O)
+    instead of forking the 'file' command for every file in the bundle.
     
     Args:
         file_path (str): Path to the file to check
@@ -29,66 +41,123 @@ def is_binary_file(file_path):
     Returns:
         bool: True if the file is a Mach-O binary, False otherwise
     """
-    try:
-        # Use the Unix 'file' command to determine file type
-        result = subprocess.run(
-            ["file", "-b", file_path],  # '-b' flag produces brief output without the filename
-            capture_output=True, 
-            text=True, 
-            check=True
-        )
-        # Check if the output contains "Mach-O" which indicates a macOS binary
-        return "Mach-O" in result.stdout
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Failed to check if {file_path} is a binary: {e}")
-        return False
+    return macho.is_macho(file_path)
 
 
-def find_signable_files(app_bundle_path):
+def find_signable_files(app_bundle_path, rules=None):
     """
     Find all files within an app bundle that need code signing.
     
-    This includes:
-    - Executable binaries
-    - Dynamic libraries (.dylib)
-    - Shared objects (.so)
-    - Framework bundles (.framework)
-    - Nested app bundles (.app)
+    This includes every Mach-O file (executables, .dylib and .so files,
+    framework binaries) found by a single scan of the bundle. Symlinks are
+    skipped: framework Versions/Current links and library aliases point at
+    files that are signed under their real path.
     
     Args:
         app_bundle_path (str): Path to the .app bundle
+        rules (bundle_scanner.PruneRules, optional): Directories to skip,
+            defaults to bundle_scanner.SIGN_RULES
         
     Returns:
         list: Paths to all files that need signing
     """
-    signable_files = []
+    if rules is None:
+        rules = bundle_scanner.SIGN_RULES
+    return [f.path for f in bundle_scanner.scan_bundle(app_bundle_path, rules) if f.is_macho]
+
+def _signed_in_place(path):
+    """
+    Files that signing `path` rewrites: the file itself, or for a bundle
+    directory its executables and its seal.
+    """
+    if not os.path.isdir(path):
+        return [path]
+    written = []
+    for sub_dir in ("MacOS", "_CodeSignature"):
+        directory = os.path.join(path, "Contents", sub_dir)
+        if os.path.isdir(directory):
+            written.extend(os.path.join(directory, name) for name in sorted(os.listdir(directory)))
+    return written
+
+class CodesignBackend:
+    """
+    Signs and verifies files by running Apple's `codesign` and `spctl`.
     
-    # Define file extensions and directories to target
-    extensions = {".dylib", ".so", ".framework", ".app", ""}  # Empty string for executables without extensions
-    skip_dirs = {"Headers", "Resources", "Python.framework"}  # Skip directories that don't need signing
+    The tool paths can be replaced by stand-in scripts with the same
+    command-line interface, which lets the signing scheduler run on Linux.
     
-    # Walk through the entire bundle directory tree
-    for root, dirs, files in os.walk(app_bundle_path):
-        # Filter out directories we want to skip
-        dirs[:] = [d for d in dirs if d not in skip_dirs]
+    Args:
+        codesign (str): Path or name of the codesign tool
+        spctl (str): Path or name of the spctl tool
+        runner (tool_runner.ToolRunner, optional): Runs the tools, defaults to tool_runner.get_runner()
+    """
+    
+    def __init__(self, codesign="codesign", spctl="spctl", runner=None):
+        self.codesign = codesign
+        self.spctl = spctl
+        self.runner = runner
+    
+    def _run(self, cmd):
+        result = (self.runner or tool_runner.get_runner()).run(cmd)
+        for line in (result.stdout + result.stderr).splitlines():
+            logging.info(f"{os.path.basename(cmd[0])}: {line}")
+        return result.check()
+    
+    def sign(self, paths, signing_identity, entitlements=None):
+        """
+        Sign one or more paths with a single codesign invocation.
+        
+        Raises:
+            subprocess.CalledProcessError: If codesign fails
+        """
+        cmd = [
+            self.codesign,
+            "--force",         # Replace any existing signature
+            "--timestamp",     # Add a secure timestamp for long-term validity
+            "--options=runtime",  # Enable hardened runtime (required for notarization)
+            "-s", signing_identity  # Specify the signing identity
+        ]
         
-        for file in files:
-            file_path = os.path.join(root, file)
-            
-            # Check if it's a Mach-O binary
-            if is_binary_file(file_path):
-                signable_files.append(file_path)
-            
-            # Special handling for framework bundles - add the framework binary directly
-            if file_path.endswith(".framework"):
-                # The framework binary typically has the same name as the framework without the extension
-                framework_binary = os.path.join(file_path, os.path.splitext(file)[0])
-                if os.path.exists(framework_binary):
-                    signable_files.append(framework_binary)
-    
-    return signable_files
+        # Add entitlements if specified and the file exists
+        if entitlements and os.path.exists(entitlements):
+            cmd.extend(["--entitlements", entitlements])
+        
+        # codesign writes the files (and a bundle's main executable and seal) in place
+        for path in paths:
+            for written in _signed_in_place(path):
+                copy_store.unshare(written)
+        
+        # Add the files to sign at the end of the command
+        cmd.extend(paths)
+        self._run(cmd)  # raises an exception if the command fails
+    
+    def verify(self, app_bundle_path):
+        """
+        Raises:
+            subprocess.CalledProcessError: If either check fails
+        """
+        # Verify code signature details with strict checking
+        self._run([self.codesign, "-dv", "--strict=all", app_bundle_path])
+        # Verify the app passes Gatekeeper assessment
+        self._run([self.spctl, "-a", "-vv", app_bundle_path])
 
-def sign_file(file_path, signing_identity, entitlements=None):
+def make_backend(kind="auto", signing_identity=None, codesign="codesign", spctl="spctl", jobs=1):
+    """
+    Create the signer backend selected on the command line.
+    
+    Args:
+        kind (str): "codesign", "python" (adhoc_signature.AdhocBackend) or
+            "auto", which uses the built-in signer for ad-hoc signing
+            (identity "-") and codesign otherwise
+        jobs (int): Threads the built-in signer hashes pages with
+    """
+    if kind == "auto":
+        kind = "python" if signing_identity == "-" else "codesign"
+    if kind == "python":
+        return adhoc_signature.AdhocBackend(jobs)
+    return CodesignBackend(codesign, spctl)
+
+def sign_file(file_path, signing_identity, entitlements=None, backend=None):
     """
     Sign a single file with the specified code signing identity.
     
@@ -96,62 +165,161 @@ def sign_file(file_path, signing_identity, entitlements=None):
         file_path (str): Path to the file to sign
         signing_identity (str): Code signing identity (e.g., 'Developer ID Application: Name (ID)')
         entitlements (str, optional): Path to entitlements plist file
+        backend (CodesignBackend, optional): Signer to use, defaults to the system codesign
+    """
+    sign_files([file_path], signing_identity, entitlements, backend)
+
+def sign_files(file_paths, signing_identity, entitlements=None, backend=None):
     """
-    cmd = [
-        "codesign",
-        "--force",         # Replace any existing signature
-        "--timestamp",     # Add a secure timestamp for long-term validity
-        "--options=runtime",  # Enable hardened runtime (required for notarization)
-        "-s", signing_identity  # Specify the signing identity
-    ]
+    Sign several independent files with one call to the signer backend.
+    """
+    backend = backend or CodesignBackend()
+    try:
+        for file_path in file_paths:
+            logging.info(f"Signing {file_path}")
+        backend.sign(file_paths, signing_identity, entitlements)
+    except (subprocess.CalledProcessError, adhoc_signature.SignatureError) as e:
+        logging.error(f"Failed to sign {', '.join(file_paths)}: {e}")
+        raise  # Re-raise the exception to be handled by the caller
+
+def find_main_executable(app_bundle_path):
+    """
+    Return the path of the bundle's main executable (used for @executable_path),
+    or None if Contents/MacOS holds no Mach-O file.
+    """
+    macos_dir = os.path.join(app_bundle_path, "Contents", "MacOS")
+    if not os.path.isdir(macos_dir):
+        return None
+    for name in sorted(os.listdir(macos_dir)):
+        candidate = os.path.join(macos_dir, name)
+        if os.path.isfile(candidate) and macho.get_file_type(candidate) == macho.MH_EXECUTE:
+            return candidate
+    return None
+
+def compute_signing_waves(signable_files, app_bundle_path, graph=None):
+    """
+    Group files into waves that can each be signed in one go.
     
-    # Add entitlements if specified and the file exists
-    if entitlements and os.path.exists(entitlements):
-        cmd.extend(["--entitlements", entitlements])
+    A file depends on every other signable file it loads (resolved from its
+    load commands against the bundle). Each wave only contains files
+    whose dependencies were all signed in earlier waves, so files without
+    dependencies come first. Dependency cycles (rare, but legal for dylibs)
+    are broken by signing the remaining files together in a final wave.
     
-    # Add the file to sign at the end of the command
-    cmd.append(file_path)
+    Args:
+        signable_files (list): Paths returned by find_signable_files()
+        app_bundle_path (str): Path to the .app bundle
+        graph (DependencyGraph, optional): Graph from the collector; its edges
+            are used instead of resolving the load commands again
+        
+    Returns:
+        list: Waves, each a sorted list of paths
+    """
+    executable_path = find_main_executable(app_bundle_path)
+    by_real_path = {}
+    for file_path in signable_files:
+        by_real_path.setdefault(os.path.realpath(file_path), file_path)
     
-    try:
-        logging.info(f"Signing {file_path}")
-        subprocess.run(cmd, check=True)  # check=True raises an exception if the command fails
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Failed to sign {file_path}: {e}")
-        raise  # Re-raise the exception to be handled by the caller
+    # Bundle file -> bundle files it loads, for the nodes whose references the collector listed and resolved
+    graph_edges = {}
+    if graph is not None:
+        for node in graph:
+            if node.dest and node.children and None not in node.children.values():
+                graph_edges[os.path.realpath(node.dest)] = {
+                    os.path.realpath(child.dest) for child in graph.child_nodes(node) if child.dest
+                }
+    
+    dependencies = {}
+    for real_path, file_path in by_real_path.items():
+        deps = set()
+        if real_path in graph_edges:
+            deps.update(t for t in graph_edges[real_path] if t in by_real_path and t != real_path)
+        else:
+            for reference in macho.get_dependencies(file_path):
+                target = macho.resolve_load_path(reference, file_path, executable_path)
+                if target in by_real_path and target != real_path:
+                    deps.add(target)
+        dependencies[real_path] = deps
+    
+    waves = []
+    signed = set()
+    remaining = set(dependencies)
+    while remaining:
+        wave = sorted(p for p in remaining if dependencies[p] <= signed)
+        if not wave:
+            logging.warning(f"Dependency cycle between {len(remaining)} files, signing them together")
+            wave = sorted(remaining)
+        waves.append([by_real_path[p] for p in wave])
+        signed.update(wave)
+        remaining.difference_update(wave)
+    return waves
 
-def sign_app_bundle(app_bundle_path, signing_identity, entitlements=None):
+def sign_wave(wave, signing_identity, entitlements=None, backend=None, jobs=1, batch_size=32):
+    """
+    Sign all files of one wave concurrently.
+    
+    The wave is split into at most `jobs` batches of up to `batch_size`
+    files; each batch is a single multi-path codesign call.
+    """
+    per_batch = max(1, min(batch_size, -(-len(wave) // max(1, jobs))))
+    batches = [wave[i:i + per_batch] for i in range(0, len(wave), per_batch)]
+    parallel.map_in_order(
+        lambda batch: sign_files(batch, signing_identity, entitlements, backend),
+        batches,
+        jobs,
+    )
+
+def sign_app_bundle(app_bundle_path, signing_identity, entitlements=None, jobs=1, backend=None,
+                    signable_files=None, graph=None, verify=True, manifest_path=None):
     """
     Sign an entire macOS application bundle, including all contained binaries.
     
     The signing follows Apple's recommended order:
-    1. Sign embedded components first (reverse-order approach)
+    1. Sign embedded components first, leaves of the dependency graph first
     2. Sign the main bundle at the end
     
+    Args:
+        jobs (int): Number of codesign calls running at the same time
+        backend (CodesignBackend, optional): Signer to use, defaults to the system codesign
+        signable_files (list, optional): Files to sign, if the bundle was already scanned
+        graph (DependencyGraph, optional): Collector graph to derive the signing order from
+        verify (bool): Verify the signature at the end
+        manifest_path (str, optional): Collector manifest to update, defaults to the one next to the bundle
     """
-    setup_logging()
+    backend = backend or CodesignBackend()
     
     # Step 1: Find all binary files that need signing
-    signable_files = find_signable_files(app_bundle_path)
-    
-    # Step 2: Sort files to sign in the correct order.
-    # - Sort by path depth (deeper paths first)
-    # - Sort by type (.app bundle last)
-    signable_files.sort(
-        key=lambda x: (os.path.dirname(x).count("/"), x.endswith(".app")),
-        reverse=True  # Deepest files first
-    )
-    # Step 3: Sign each individual file (except for .app bundle)
-    for file in signable_files:
-        if not file.endswith(".app"):  # .app bundle will be signed separately
-            sign_file(file, signing_identity, entitlements)
+    if signable_files is None:
+        with profiling.phase("scan"):
+            signable_files = find_signable_files(app_bundle_path)
+    signable_files = [f for f in signable_files if not f.endswith(".app")]
     
-    # Step 4: Sign the main app bundle
-    sign_file(app_bundle_path, signing_identity, entitlements)
+    # Step 2: Compute the signing waves from load commands and bundle nesting
+    with profiling.phase("plan"):
+        waves = compute_signing_waves(signable_files, app_bundle_path, graph)
+    logging.info(f"Signing {len(signable_files)} files in {len(waves)} waves")
+    
+    # Step 3: Sign each wave, files within a wave in parallel
+    with profiling.phase("sign"):
+        for i, wave in enumerate(waves):
+            with profiling.phase("wave", index=i, files=len(wave)):
+                sign_wave(wave, signing_identity, entitlements, backend, jobs)
+        
+        # Step 4: Sign the main app bundle
+        sign_file(app_bundle_path, signing_identity, entitlements, backend)
+    
+    # Record the re-signed files (signing the bundle rewrites the main executable too),
+    # so the next collect does not take them for modified
+    main_executable = find_main_executable(app_bundle_path)
+    manifest.refresh_manifest(app_bundle_path, signable_files + ([main_executable] if main_executable else []),
+                              manifest_path)
     
     # Step 5: Verify that everything was signed correctly
-    verify_signature(app_bundle_path)
+    if verify:
+        with profiling.phase("verify"):
+            verify_signature(app_bundle_path, backend)
 
-def verify_signature(app_bundle_path):
+def verify_signature(app_bundle_path, backend=None):
     """
     Verify the code signatures in the app bundle using Apple's tools.
     
@@ -159,19 +327,11 @@ def verify_signature(app_bundle_path):
     1. codesign verification - checks the signature validity
     2. spctl assessment - checks if the app meets the requirements to run
     """
+    backend = backend or CodesignBackend()
     try:
-        # Verify code signature details with strict checking
-        subprocess.run(
-            ["codesign", "-dv", "--strict=all", app_bundle_path],
-            check=True
-        )
-        # Verify the app passes Gatekeeper assessment
-        subprocess.run(
-            ["spctl", "-a", "-vv", app_bundle_path],
-            check=True
-        )
+        backend.verify(app_bundle_path)
         logging.info("Code signing verification passed!")
-    except subprocess.CalledProcessError as e:
+    except (subprocess.CalledProcessError, adhoc_signature.SignatureError) as e:
         logging.error(f"Code signing verification failed: {e}")
         raise  
 
@@ -184,8 +344,20 @@ if __name__ == "__main__":
     parser.add_argument("--app", required=True, help="Path to .app bundle")
     parser.add_argument("--identity", required=True, help="Signing identity (e.g., 'Developer ID Application: Name (ID)')")
     parser.add_argument("--entitlements", help="Path to entitlements.plist")
+    parser.add_argument("--jobs", "-j", type=int, default=1, help="Number of parallel codesign calls per wave (default: 1)")
+    parser.add_argument("--codesign", default=os.environ.get("CODESIGN", "codesign"), help="codesign tool to use (default: $CODESIGN or codesign)")
+    parser.add_argument("--spctl", default=os.environ.get("SPCTL", "spctl"), help="spctl tool to use (default: $SPCTL or spctl)")
+    parser.add_argument("--backend", choices=["auto", "codesign", "python"], default="auto",
+                        help="Signer: codesign, or the built-in ad-hoc signer (python); auto uses python for --identity - (default: auto)")
+    parser.add_argument("--manifest", help="Collector manifest to update (default: .<app name>.manifest.json next to the bundle)")
+    parser.add_argument("--timeout", type=float, help="Seconds before a codesign/spctl call is killed (default: no limit)")
+    parser.add_argument("--profile", nargs="?", const="code_signing.profile", metavar="PREFIX",
+                        help="Time phases and tool calls, write PREFIX.json and PREFIX.trace.json (default prefix: code_signing.profile)")
     
     args = parser.parse_args()
+    setup_logging()
+    if args.profile:
+        profiling.enable()
     
     # Verify the app bundle exists
     if not os.path.exists(args.app):
@@ -194,8 +366,13 @@ if __name__ == "__main__":
     
     try:
         # Perform the signing process
-        sign_app_bundle(args.app, args.identity, args.entitlements)
+        tool_runner.set_runner(tool_runner.ToolRunner(max(1, args.jobs), args.timeout))
+        backend = make_backend(args.backend, args.identity, args.codesign, args.spctl, args.jobs)
+        sign_app_bundle(args.app, args.identity, args.entitlements, args.jobs, backend, manifest_path=args.manifest)
     except Exception as e:
         # Handle any exceptions that occurred during signing
         logging.error(f"Signing failed: {e}")
-        sys.exit(1)  # Exit with error code
\ No newline at end of file
+        sys.exit(1)  # Exit with error code
+    finally:
+        if args.profile:
+            profiling.report(args.profile)
\ No newline at end of file
@@ -0,0 +1,170 @@
+"""
+Content-addressed placement of copied libraries: one canonical file per unique
+content, symlinks for its other names.
+"""
+
+import logging
+import os
+import shutil
+import threading
+
+import thinning
+
+
+def fast_copy(src, dst):
+    """
+    Copy a file's contents and metadata like shutil.copy2.
+
+    Uses os.copy_file_range where available, which lets the kernel copy
+    without a round trip through user space and reflinks on copy-on-write
+    file systems (Btrfs, XFS). Falls back to shutil.copy2, which itself
+    uses fcopyfile()/sendfile() on macOS/Linux.
+    """
+    if hasattr(os, "copy_file_range"):
+        try:
+            with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+                remaining = os.fstat(fsrc.fileno()).st_size
+                while remaining > 0:
+                    copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                    if copied == 0:
+                        break
+                    remaining -= copied
+            if remaining == 0:
+                shutil.copystat(src, dst)
+                return
+        except OSError:
+            pass  # e.g. EXDEV or unsupported file system, use the portable path
+    shutil.copy2(src, dst)
+
+
+def unshare(path):
+    """
+    Give `path` an inode of its own before it is written in place.
+
+    A staging clone (see staging.py) may hardlink its files to the bundle it
+    was cloned from; writing through such a link would change both. Files
+    with a single link are left alone, so this costs one stat per write.
+
+    Returns:
+        bool: True if the file was copied
+    """
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        return False
+    if st.st_nlink <= 1 or not os.path.isfile(path) or os.path.islink(path):
+        return False
+    tmp_path = f"{path}.unshare.{os.getpid()}.{threading.get_ident()}"
+    try:
+        fast_copy(path, tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return True
+
+
+class CopyStore:
+    """
+    Canonical bundle files keyed by content hash.
+
+    claim() decides where an input goes (in call order, so callers control
+    determinism), copy() writes canonical files and add_alias() creates the
+    symlinks. All methods are thread-safe.
+
+    Args:
+        arch (str, optional): Only copy this slice of fat files, e.g. "arm64"
+    """
+
+    def __init__(self, arch=None):
+        self.arch = arch
+        self._by_digest = {}
+        self._by_dest = {}
+        self._lock = threading.Lock()
+        self.files_copied = 0
+        self.bytes_copied = 0
+        self.duplicates = 0
+        self.bytes_saved = 0
+        self.aliases = 0
+        self.bytes_thinned = 0
+
+    def claim(self, source, digest, dest_dir):
+        """
+        Assign the canonical bundle path for `source`.
+
+        The first input with a given content is placed under its own
+        basename. Later inputs with the same content reuse that file.
+
+        Returns:
+            tuple: (dest_path, is_new) where `is_new` is True if `source`
+                has to be copied to `dest_path`
+        """
+        with self._lock:
+            existing = self._by_digest.get(digest)
+            if existing is not None:
+                self.duplicates += 1
+                self.bytes_saved += os.path.getsize(source)
+                return existing, False
+
+            dest_path = os.path.join(dest_dir, os.path.basename(source))
+            other = self._by_dest.get(dest_path)
+            if other is not None:
+                # Same name, different content: keep the first one, as before
+                logging.warning(f"{source} has the same name as a different library, keeping {other}")
+                return dest_path, False
+
+            self._by_digest[digest] = dest_path
+            self._by_dest[dest_path] = source
+            return dest_path, not os.path.exists(dest_path)
+
+    def write(self, source, dest_path):
+        # Copy one file, thinned to self.arch when set; also used as copytree()'s copy_function
+        if self.arch is None:
+            fast_copy(source, dest_path)
+            return
+        removed = thinning.thin_copy(source, dest_path, self.arch, fast_copy)
+        if removed:
+            with self._lock:
+                self.bytes_thinned += removed
+
+    def copy(self, source, dest_path):
+        self.write(source, dest_path)
+        with self._lock:
+            self.files_copied += 1
+            self.bytes_copied += os.path.getsize(dest_path)
+
+    def add_alias(self, dest_path, alias_name):
+        """
+        Make `alias_name` (in the directory of `dest_path`) a relative symlink to it.
+
+        Existing regular files are never replaced.
+        """
+        alias_path = os.path.join(os.path.dirname(dest_path), alias_name)
+        if alias_path == dest_path:
+            return
+        with self._lock:
+            if os.path.islink(alias_path):
+                if os.readlink(alias_path) == os.path.basename(dest_path):
+                    return
+                os.unlink(alias_path)
+            elif os.path.exists(alias_path):
+                logging.warning(f"Not replacing {alias_path} with an alias of {os.path.basename(dest_path)}")
+                return
+            os.symlink(os.path.basename(dest_path), alias_path)
+            self.aliases += 1
+
+    def report(self):
+        logging.info(
+            f"Copy store: {self.files_copied} files copied ({self.bytes_copied} bytes), "
+            f"{self.duplicates} duplicates deduplicated ({self.bytes_saved} bytes saved), "
+            f"{self.aliases} aliases"
+            + (f", {self.bytes_thinned} bytes of other architectures left out" if self.arch else "")
+        )
+        return {
+            "files_copied": self.files_copied,
+            "bytes_copied": self.bytes_copied,
+            "duplicates": self.duplicates,
+            "bytes_saved": self.bytes_saved,
+            "aliases": self.aliases,
+            "bytes_thinned": self.bytes_thinned,
+        }
@@ -2,6 +2,8 @@ import subprocess
 import sys
 import os
 
+import tool_runner
+
 def get_dependencies(binary_path):
     
     #Runs otol -L on the binary and extracts the list of dependencies
@@ -10,7 +12,9 @@ def get_dependencies(binary_path):
     except subprocess.CalledProcessError as e:
         print("Error running otool: {e}")
         return []
-    
+    return parse_otool_output(output)
+
+def parse_otool_output(output):
     lines = output.split("\n")[1:] #skipping the first line
     dependencies = []
     
@@ -29,6 +33,19 @@ def filter_non_system_libs(binary_path):
     dependencies= get_dependencies(binary_path)
     return [lib for lib in dependencies if not is_system_library(lib)]
 
+def get_all_dependencies(binaries, runner=None):
+    #Runs otool -L on all binaries concurrently, returns {binary: dependencies}
+    runner = runner or tool_runner.get_runner()
+    results = runner.run_many([["otool", "-L", binary] for binary in binaries])
+    dependencies = {}
+    for binary, result in zip(binaries, results):
+        if not result.ok:
+            # Not a Mach-O file (scripts are executable too) or otool failed
+            dependencies[binary] = []
+            continue
+        dependencies[binary] = parse_otool_output(result.stdout)
+    return dependencies
+
 def find_binaries(app_folder):
     #Finds all executable binaries within the .app folder
     binaries = []
@@ -51,9 +68,8 @@ if __name__ == "__main__":
     binaries = find_binaries(app_folder)
     all_libs_to_bundle = set()
     
-    for binary in binaries:
-        libs_to_bundle = filter_non_system_libs(binary)
-        all_libs_to_bundle.update(libs_to_bundle)
+    for binary, dependencies in get_all_dependencies(binaries).items():
+        all_libs_to_bundle.update(lib for lib in dependencies if not is_system_library(lib))
         
     print("Libraries to bundle:")
     for lib in sorted(all_libs_to_bundle):
@@ -1,10 +1,89 @@
 import logging
 import os
-import subprocess
 import shutil
 import sys
 import argparse
-import re
+import threading
+
+import bundle_scanner
+import copy_store
+import dependency_graph
+import library_index
+import macho
+import manifest
+import parallel
+import profiling
+import relink
+import relocation_cache
+import rpath_cache
+import thinning
+
+SYSTEM_LIBRARY_PREFIXES = ("/usr/lib", "/System/Library")
+
+# Serializes writes to the same destination when running with --jobs
+_dest_locks = parallel.PathLocks()
+
+# Library location index, built once per run on first use
+_library_index = None
+_library_index_lock = threading.Lock()
+
+def get_library_index():
+    global _library_index
+    with _library_index_lock:
+        if _library_index is None:
+            _library_index = library_index.LibraryIndex()
+        return _library_index
+
+# Start from a fresh index (e.g. when libraries were installed since the last run)
+def reset_library_index(index=None):
+    global _library_index
+    with _library_index_lock:
+        _library_index = index
+
+# @rpath lists and lookups, one cache per run
+_rpath_cache = rpath_cache.RpathCache()
+
+def get_rpath_cache():
+    return _rpath_cache
+
+def reset_rpath_cache(cache=None):
+    global _rpath_cache
+    _rpath_cache = cache or rpath_cache.RpathCache()
+
+# Content-addressed store deciding which copied file is canonical, one per run
+_copy_store = copy_store.CopyStore()
+
+def get_copy_store():
+    return _copy_store
+
+def reset_copy_store(store=None):
+    global _copy_store
+    _copy_store = store or copy_store.CopyStore()
+
+# Relinked libraries shared across runs (see relocation_cache.py), None when no cache directory is set
+_relocation_cache = None
+
+def get_relocation_cache():
+    return _relocation_cache
+
+def reset_relocation_cache(cache=None):
+    global _relocation_cache
+    _relocation_cache = cache
+
+# SHA-256 of input files shared by the bundles of a batch (see batch.py), None to hash every time
+_digest_cache = None
+
+def get_digest_cache():
+    return _digest_cache
+
+def reset_digest_cache(cache=None):
+    global _digest_cache
+    _digest_cache = cache
+
+# Content hash of an input file, from the batch's digest cache when there is one
+def source_digest(path):
+    cache = get_digest_cache()
+    return cache.digest(path) if cache is not None else manifest.hash_file(path)
 
 # Logging to console output as well as a file
 def setup_logging():
@@ -19,109 +98,81 @@ def setup_logging():
 
 # Recursively find all executable files in the app bundle.
 def find_binaries(app_folder):
-    binaries = []
-    for root, _, files in os.walk(app_folder):
-        for file in files:
-            file_path = os.path.join(root, file)
-            if os.access(file_path, os.X_OK) and not os.path.isdir(file_path):
-                binaries.append(file_path)
-    return binaries
+    return [f.path for f in bundle_scanner.scan_bundle(app_folder) if f.is_executable and not f.is_symlink]
 
+# Check the Mach-O magic in-process instead of forking `file -b`
 def is_binary_file(file_path):
-    try:
-        result = subprocess.run(
-            ["file", "-b", file_path], 
-            capture_output=True, 
-            text=True, 
-            check=True
-        )
-        return any(x in result.stdout for x in ["Mach-O", "shared library"])
-    except:
-        return False
+    return macho.is_macho(file_path)
 
-# List dependencies of a binary using otool -L
+# List dependencies of a binary from its LC_LOAD_DYLIB-style load commands (what otool -L prints, minus the LC_ID_DYLIB line)
 def get_dependencies(binary_path):
-    try:
-        output = subprocess.check_output(["otool", "-L", binary_path], text=True)
-        deps = []
-        for line in output.strip().split('\n')[1:]:  # Skip first line because it contains the binary itself.
-            match = re.match(r'^\s*(@?[^\s]+)', line) # Extract only the path from the output, ignoring version details and leading whitespaces.
-            if match:
-                deps.append(match.group(1))
-        return deps
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Error running otool: {e}")
-        return []
-
-# Function for @rpath references in libraries
+    return macho.get_dependencies(binary_path)
+
+# Homebrew locations of the synfig and mlt libraries, searched after the binary's own rpaths
+RPATH_SPECIAL_PATHS = [
+    "/opt/homebrew/opt/synfig/lib",
+    "/usr/local/opt/synfig/lib",
+    "/opt/homebrew/opt/mlt/lib",
+    "/usr/local/opt/mlt/lib",
+]
+
+# Where libsynfig*/libmlt* are looked for when none of the rpaths has them
+RPATH_BROADER_SEARCH_PATHS = [
+    "/opt/homebrew/lib",
+    "/usr/local/lib",
+    "/opt/local/lib",
+    os.path.expanduser("~/lib"),
+]
+
+# Every directory an @rpath reference of the binary is looked up in, in order
+def expand_rpaths(binary_path):
+    executable_path = bundle_executable_path(binary_path)
+    rpaths = []
+    for rpath in macho.get_rpaths(binary_path):
+        # @loader_path is the binary's directory, @executable_path the bundle's Contents/MacOS
+        expanded = macho.expand_load_path(rpath, binary_path, executable_path)
+        if expanded:
+            rpaths.append(expanded)
+    rpaths.extend(RPATH_SPECIAL_PATHS)
+    if executable_path:
+        # Add the app's own lib directory
+        rpaths.append(os.path.normpath(os.path.join(executable_path, "..", "Resources", "lib")))
+    return rpaths
+
+# Look a library up in an expanded rpath list, then in the broader locations for synfig/mlt
+def search_rpaths(rpaths, rpath_lib):
+    for rpath in rpaths:
+        possible_path = os.path.join(rpath, rpath_lib)
+        if os.path.exists(possible_path):
+            return os.path.realpath(possible_path)
+
+    # Try a broader search for these specific libraries
+    if any(lib in rpath_lib for lib in ["libsynfig", "libsynfigapp", "libmlt"]):
+        logging.info(f"Performing broader search for {rpath_lib}")
+        index = get_library_index()
+        for path in RPATH_BROADER_SEARCH_PATHS:
+            found = index.find_in_dir(path, rpath_lib)
+            if found:
+                return found
+
+    logging.warning(f"Could not resolve @rpath reference: {rpath_lib}")
+    return None
+
+# Resolve an @rpath reference; rpath lists and lookups are cached for the whole run
 def resolve_rpath(binary_path, rpath_lib):
     try:
-        # Extracting load commands (including LC_RPATH entries).
-        output = subprocess.check_output(["otool", "-l", binary_path], text=True)
-        rpaths = []
-        binary_dir = os.path.dirname(binary_path)
-        
-    
-        for i, line in enumerate(output.splitlines()):
-            if "cmd LC_RPATH" in line:
-                # Look ahead a few lines for the path (because in the output of the otool -l the path information appears 1-3 lines after the cmd LC_RPATH line )
-                for j in range(1, 5):
-                    # Safety checks to ensure we don't go beyond the end of output and that we've found the line containing the actual path
-                    if i+j < len(output.splitlines()) and "path" in output.splitlines()[i+j]:
-                        path_line = output.splitlines()[i+j]
-                        rpath = path_line.strip().split("path ")[1].strip() # Extract everything after "path"
-                        
-                        # Expand @loader_path and @executable_path
-                        expanded = rpath
-                        if "@loader_path" in rpath:
-                            expanded = os.path.normpath(rpath.replace("@loader_path", binary_dir))
-                        elif "@executable_path" in rpath:
-                            expanded = os.path.normpath(rpath.replace("@executable_path", 
-                                os.path.dirname(os.path.dirname(binary_dir))))
-                        
-                        rpaths.append(expanded)
-                        break
-        
-        # For synfig and mlt libraries specifically (hardcoded for now)
-        special_paths = [
-            "/opt/homebrew/opt/synfig/lib",
-            "/usr/local/opt/synfig/lib",
-            "/opt/homebrew/opt/mlt/lib",
-            "/usr/local/opt/mlt/lib",
-            # Add the app's own lib directory
-            os.path.join(os.path.dirname(os.path.dirname(binary_dir)), "Resources", "lib")
-        ]
-        rpaths.extend(special_paths)
-        
-        # Search in all resolved paths
-        for rpath in rpaths:
-            possible_path = os.path.join(rpath, rpath_lib)
-            if os.path.exists(possible_path):
-                return os.path.realpath(possible_path)
-        
-        # Try a broader search for these specific libraries
-        if any(lib in rpath_lib for lib in ["libsynfig", "libsynfigapp", "libmlt"]):
-            logging.info(f"Performing broader search for {rpath_lib}")
-            broader_search_paths = [
-                "/opt/homebrew/lib",
-                "/usr/local/lib",
-                "/opt/local/lib",
-                os.path.expanduser("~/lib"),
-                # Add any additional directories where these libraries might be
-            ]
-            
-            for path in broader_search_paths:
-                if os.path.exists(path) and os.path.isdir(path):
-                    for file in os.listdir(path):
-                        if rpath_lib in file:
-                            return os.path.realpath(os.path.join(path, file))
-        
-        logging.warning(f"Could not resolve @rpath reference: {rpath_lib}")
-        return None
+        cache = get_rpath_cache()
+        return cache.resolve(cache.rpaths(binary_path, expand_rpaths), rpath_lib, search_rpaths)
     except Exception as e:
         logging.error(f"Error resolving @rpath: {e}")
         return None
 
+# @executable_path of a file inside an app bundle is the bundle's Contents/MacOS directory
+def bundle_executable_path(binary_path):
+    if ".app/Contents/" not in binary_path:
+        return None
+    return os.path.join(binary_path.split(".app/Contents/", 1)[0] + ".app", "Contents", "MacOS", "")
+
 # Function for resolving library paths
 def resolve_library_path(lib_path, binary_path=None):
     try:
@@ -132,39 +183,27 @@ def resolve_library_path(lib_path, binary_path=None):
             if resolved:
                 return resolved
 
+        # Handle @executable_path / @loader_path references of already relocated binaries
+        if lib_path.startswith(("@executable_path", "@loader_path")) and binary_path:
+            resolved = macho.resolve_load_path(lib_path, binary_path, bundle_executable_path(binary_path), [])
+            if resolved:
+                return resolved
+
         # Handle direct paths
         if os.path.exists(lib_path):
             return os.path.realpath(lib_path)
 
-        # Search common locations with version flexibility
-        lib_name_base = os.path.basename(lib_path).split('.dylib', 1)[0] # # Gets base name without extension
-        search_paths = [
-            "/opt/homebrew/lib",  # Core Homebrew libraries
-            "/opt/homebrew/opt/*/lib",  # to cover all Homebrew formulae
-            "/usr/local/opt/*/lib",  # Intel Homebrew formula libraries
-            "/usr/local/opt/sqlite/lib", # Intel Homebrew SQLite
-            "/opt/homebrew/opt/sqlite/lib", # ARM Homebrew SQLite
-            "/usr/local/lib", # legacy homebrew installation directory
-            "/opt/local/lib", # MacPorts installation directory
-            "/usr/lib", # System libraries
-            "/Library/Frameworks", # System-wide frameworks
-            os.path.join(os.path.dirname(binary_path), "..", "lib") if binary_path else None
-        ]
-        
-        # Regex pattern for versioned libraries
-        version_pattern = re.compile(rf'^{re.escape(lib_name_base)}(\.\d+)*\.dylib$')
-        
-        for path in filter(None, search_paths):
-            # Check for exact match first
-            candidate = os.path.join(path, lib_name_base + ".dylib")
-            if os.path.exists(candidate):
-                return os.path.realpath(candidate)
-            
-            # Check for versioned matches
-            if os.path.exists(path):
-                for f in os.listdir(path):
-                    if version_pattern.match(f):
-                        return os.path.realpath(os.path.join(path, f))
+        # Search common locations with version flexibility (see library_index.DEFAULT_SEARCH_ROOTS)
+        index = get_library_index()
+        found = index.find(lib_path)
+        if found:
+            return found
+
+        # Finally the lib directory next to the referencing binary
+        if binary_path:
+            found = index.find_in_dir(os.path.join(os.path.dirname(binary_path), "..", "lib"), lib_path)
+            if found:
+                return found
 
         logging.warning(f"Could not resolve library path: {lib_path}")
         return lib_path  # Return original path to avoid None
@@ -180,105 +219,131 @@ def handle_framework(actual_path, app_bundle_path):
         framework_name = os.path.basename(framework_dir)
         dest_dir = os.path.join(app_bundle_path, "Contents", "Frameworks", framework_name)
         
-        if not os.path.exists(dest_dir):
-            logging.info(f"Copying framework: {framework_name}")
-            # Copy entire framework, resolving symlinks
-            shutil.copytree(framework_dir, dest_dir, copy_function=shutil.copy2)
-            
-            # Fix symlinks within framework
-            for root, dirs, files in os.walk(dest_dir):
-                for name in files + dirs:
-                    path = os.path.join(root, name) # Get full absolute path of the current item
-                    if os.path.islink(path):
-                        link_target = os.path.realpath(path) # gets the destination of the symlink
-                        if link_target.startswith(framework_dir):
-                            # Calculate new relative path from link location to target
-                            # Example: Turns "very/long/path/A.framework/Versions/5" to "5" when it is present in Versions/ 
-                            relative = os.path.relpath(link_target, os.path.dirname(path))
-                            os.unlink(path)
-                            # Create new relative symlink in the copied framework
-                            # This ensures portability when the app bundle is moved
-                            os.symlink(relative, path)
+        with _dest_locks.get(dest_dir):
+            if not os.path.exists(dest_dir):
+                logging.info(f"Copying framework: {framework_name}")
+                # Copy entire framework, keeping its symlinks (Versions/Current, top-level links) as symlinks
+                shutil.copytree(framework_dir, dest_dir, symlinks=True, copy_function=get_copy_store().write)
+                
+                # Fix symlinks within framework
+                for root, dirs, files in os.walk(dest_dir):
+                    for name in files + dirs:
+                        path = os.path.join(root, name) # Get full absolute path of the current item
+                        if os.path.islink(path):
+                            link_target = os.path.realpath(path) # gets the destination of the symlink
+                            if link_target.startswith(framework_dir + os.sep):
+                                # Calculate new relative path from link location to the same item in the copy
+                                # Example: Turns "very/long/path/A.framework/Versions/5" to "5" when it is present in Versions/ 
+                                copied_target = os.path.join(dest_dir, os.path.relpath(link_target, framework_dir))
+                                relative = os.path.relpath(copied_target, os.path.dirname(path))
+                                os.unlink(path)
+                                # Create new relative symlink in the copied framework
+                                # This ensures portability when the app bundle is moved
+                                os.symlink(relative, path)
         
         return os.path.join(dest_dir, resolved_path.split(".framework/", 1)[1])
     except Exception as e:
         logging.error(f"Error handling framework: {e}")
         return None    
     
+# Find the real path of the file a load-command reference points to, or None if it cannot be found
+def find_dependency(lib_path, binary_path=None):
+    actual_path = resolve_library_path(lib_path, binary_path)
+
+    if not actual_path or not os.path.exists(actual_path):
+        # Try finding versioned library in valid directories
+        actual_path = get_library_index().find_in_dir(os.path.dirname(lib_path), lib_path)
+
+        if not actual_path or not os.path.exists(actual_path):
+            logging.warning(f"Dependency not found: {lib_path}")
+            return None
+
+    return os.path.realpath(actual_path)
+
 ''' Function to copy the dependencies to appropriate locations in the app bundle.
     Executables: Contents/Resources/bin
     Libraries: Contents/Resources/lib
     Frameworks: Contents/Frameworks
 '''
 def copy_dependency(lib_path, app_bundle_path, binary_path=None):
-    try:
-        actual_path = resolve_library_path(lib_path, binary_path)
-        
-        if not actual_path or not os.path.exists(actual_path):
-            # Try finding versioned library in valid directories
-            lib_dir = os.path.dirname(lib_path)
-            lib_base = os.path.basename(lib_path).split('.dylib', 1)[0] # obtaining base name without extension
-            version_pattern = re.compile(rf'^{re.escape(lib_base)}(\.\d+)*\.dylib$') # Regex pattern for versioned libraries
-            
-            if os.path.isdir(lib_dir):
-                for f in os.listdir(lib_dir):
-                    if version_pattern.match(f):
-                        actual_path = os.path.join(lib_dir, f)
-                        break
+    actual_path = find_dependency(lib_path, binary_path)
+    if not actual_path:
+        return None
+    return copy_library(actual_path, app_bundle_path)
+
+# Directory a (non-framework) file is copied to, or None for unhandled file types
+def library_destination_dir(actual_path, app_bundle_path):
+    file_type = macho.get_file_type(actual_path)
+    if file_type == macho.MH_EXECUTE:
+        return os.path.join(app_bundle_path, "Contents", "Resources", "bin")
+    elif file_type == macho.MH_DYLIB or ".dylib" in actual_path or ".so" in actual_path:
+        return os.path.join(app_bundle_path, "Contents", "Resources", "lib")
+    logging.warning(f"Unhandled file type: {actual_path}")
+    return None
+
+# Decide the canonical bundle path of a resolved file: (dest_path, needs_copy), or (None, False)
+def claim_library(actual_path, app_bundle_path, digest=None):
+    dest_dir = library_destination_dir(actual_path, app_bundle_path)
+    if dest_dir is None:
+        return None, False
+    # Resolve symlinks before copying
+    actual_path = os.path.realpath(actual_path)
+    digest = digest or source_digest(actual_path)
+    return get_copy_store().claim(actual_path, digest, dest_dir)
+
+# Write a claimed file into the bundle
+def write_library(actual_path, dest_path):
+    actual_path = os.path.realpath(actual_path)
+    with _dest_locks.get(dest_path):
+        if not os.path.exists(dest_path):
+            logging.info(f"Copying {os.path.basename(actual_path)} to {os.path.dirname(dest_path)}")
+            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+            get_copy_store().copy(actual_path, dest_path)
             
-            if not actual_path or not os.path.exists(actual_path):
-                logging.warning(f"Dependency not found: {lib_path}")
-                return None
+            # Set appropriate permissions
+            os.chmod(dest_path, 0o755 if macho.get_file_type(actual_path) == macho.MH_EXECUTE else 0o644)
 
+# Copy an already resolved file into the bundle and return its new (canonical) path
+def copy_library(actual_path, app_bundle_path):
+    try:
         # Handle frameworks with symlinks
         if ".framework" in actual_path:
             return handle_framework(actual_path, app_bundle_path)
         
-        file_type = subprocess.run(
-            ["file", "-b", actual_path],
-            capture_output=True, text=True
-        ).stdout.lower()
-
-        # Determine destination
-        if "mach-o executable" in file_type:
-            dest_dir = os.path.join(app_bundle_path, "Contents", "Resources", "bin")
-        elif "shared library" in file_type or ".dylib" in actual_path or ".so" in actual_path:
-            dest_dir = os.path.join(app_bundle_path, "Contents", "Resources", "lib")
-        else:
-            logging.warning(f"Unhandled file type: {actual_path}")
-            return None
-        
-        # Copy the file
-        os.makedirs(dest_dir, exist_ok=True)
-        dest_path = os.path.join(dest_dir, os.path.basename(actual_path))
-        
-        if not os.path.exists(dest_path):
-            logging.info(f"Copying {os.path.basename(actual_path)} to {dest_dir}")
-            # Resolve symlinks before copying
-            if os.path.islink(actual_path):
-                link_target = os.path.realpath(actual_path)
-                if os.path.exists(link_target):
-                    shutil.copy2(link_target, dest_path)
-            else:
-                shutil.copy2(actual_path, dest_path)
-            
-            # Set appropriate permissions
-            os.chmod(dest_path, 0o755 if "executable" in file_type else 0o644)
-        
+        dest_path, needs_copy = claim_library(actual_path, app_bundle_path)
+        if needs_copy:
+            write_library(actual_path, dest_path)
         return dest_path
     except Exception as e:
         logging.error(f"Error copying dependency: {e}")
         return None
 
-def update_library_paths(binary_path, dependencies, app_bundle_path):
+# Bundle-relative reference to a file inside the bundle, e.g. @executable_path/../Resources/lib/libfoo.1.2.dylib
+def bundle_reference(dest_path, app_bundle_path):
+    contents = os.path.realpath(os.path.join(app_bundle_path, "Contents"))
+    return "@executable_path/../" + os.path.relpath(os.path.realpath(dest_path), contents)
+
+# `resolved` optionally maps each reference to the real path it was resolved to during discovery,
+# `targets` to the canonical file in the bundle it must point at.
+# The edits are added to `plan` when given, otherwise they are applied right away in one pass.
+def update_library_paths(binary_path, dependencies, app_bundle_path, resolved=None, plan=None, targets=None):
+    apply_now = plan is None
+    if apply_now:
+        plan = relink.RelinkPlan(binary_path)
+
     for original_path in dependencies:
-        if original_path.startswith(("/usr/lib", "/System/Library")):
+        if original_path.startswith(SYSTEM_LIBRARY_PREFIXES):
             continue  # Skip system libraries
         
         lib_name = os.path.basename(original_path)
-        actual_path = resolve_library_path(original_path, binary_path)
+        if resolved is not None and original_path in resolved:
+            actual_path = resolved[original_path] or original_path
+        else:
+            actual_path = resolve_library_path(original_path, binary_path)
 
-        if ".framework" in original_path:
+        if targets and targets.get(original_path):
+            new_path = bundle_reference(targets[original_path], app_bundle_path)
+        elif ".framework" in original_path:
             framework_parts = original_path.split(".framework/")
             framework_name = os.path.basename(framework_parts[0] + ".framework")
             new_path = f"@executable_path/../Frameworks/{framework_name}/{framework_parts[1] if len(framework_parts) > 1 else framework_name}"
@@ -286,31 +351,30 @@ def update_library_paths(binary_path, dependencies, app_bundle_path):
                 /Library/Frameworks/QtCore.framework/Versions/5/QtCore
                 Converts to: @executable_path/../Frameworks/QtCore.framework/QtCore'''
         else:
-            file_type = subprocess.run(
-                ["file", "-b", actual_path],
-                capture_output=True, text=True
-            ).stdout.lower()
-
             # Place executables in Resources/bin, libraries in Resources/lib
-            if "mach-o executable" in file_type:
+            if macho.get_file_type(actual_path) == macho.MH_EXECUTE:
                 new_path = f"@executable_path/../Resources/bin/{lib_name}"
             else:
                 new_path = f"@executable_path/../Resources/lib/{lib_name}"
 
         logging.info(f"Updating reference in {binary_path}: {original_path} -> {new_path}")
-        try:
-            subprocess.run([
-                "install_name_tool", 
-                "-change", 
-                original_path, 
-                new_path, 
-                binary_path
-            ], check=True)
-        except subprocess.CalledProcessError as e:
-            logging.error(f"Error updating reference: {e}")
-
-def update_library_id(lib_path):
-    if not os.path.exists(lib_path):
+        plan.change(original_path, new_path)
+
+    if apply_now:
+        relink.apply_plan(plan)
+
+# Absolute LC_RPATH entries pointing outside the bundle are stale once every reference is relinked.
+# `inspect_path` is read instead of `binary_path` when the bundle copy is not written yet.
+def update_rpaths(binary_path, app_bundle_path, plan, inspect_path=None):
+    bundle_root = os.path.realpath(app_bundle_path) + os.sep
+    for rpath in macho.get_rpaths(inspect_path or binary_path):
+        if rpath.startswith("/") and not os.path.realpath(rpath).startswith(bundle_root):
+            logging.info(f"Removing rpath from {binary_path}: {rpath}")
+            plan.delete_rpath(rpath)
+
+def update_library_id(lib_path, plan=None, inspect_path=None):
+    inspect_path = inspect_path or lib_path
+    if not os.path.exists(inspect_path):
         return
 
     if "Contents/Frameworks" in lib_path:
@@ -326,110 +390,330 @@ def update_library_id(lib_path):
     else:
         return
 
+    if macho.get_install_name(inspect_path) == new_id:
+        return
+
     logging.info(f"Updating ID of {lib_path} to {new_id}")
+    if plan is None:
+        plan = relink.RelinkPlan(lib_path)
+        plan.set_id(new_id)
+        relink.apply_plan(plan)
+    else:
+        plan.set_id(new_id)
+
+# The embedded Python.framework (interpreter, C extensions) is left to the Python payload stage (python_payload.py)
+def is_skipped_binary(binary_path):
+    return "Python.framework/" in binary_path
+
+# Non-system dependencies of a binary, i.e. the references that have to be bundled
+def get_bundled_dependencies(binary_path):
+    return [dep for dep in get_dependencies(binary_path) if not dep.startswith(SYSTEM_LIBRARY_PREFIXES)]
+
+# Phase 1: discover the full dependency closure of the given binaries once, one node per real path.
+# `known` maps files that are already relocated (see manifest.py) to their bundle path; discovery stops there.
+def discover_dependencies(binaries, app_bundle_path, jobs=1, known=None):
+    known = known or {}
+    bundle_root = os.path.realpath(app_bundle_path) + os.sep
+    roots = []
+    for binary in binaries:
+        if is_skipped_binary(binary):
+            logging.info(f"Skipping Python framework binary: {binary}")
+        elif not is_binary_file(binary):
+            logging.info(f"Skipping non-binary file: {binary}")
+        else:
+            roots.append(os.path.realpath(binary))
+
+    with profiling.phase("resolve"):
+        return dependency_graph.build_dependency_graph(
+            roots,
+            list_references=lambda path: [] if path in known else get_bundled_dependencies(path),
+            resolve_reference=find_dependency,
+            in_bundle=lambda path: path.startswith(bundle_root),
+            jobs=jobs,
+        )
+
+# Binaries of the same framework share a group and are copied in graph order
+def copy_group(path):
+    return os.path.basename(path.split(".framework/")[0])
+
+def hash_source(path):
     try:
-        subprocess.run([
-            "install_name_tool", 
-            "-id", 
-            new_id, 
-            lib_path
-        ], check=True)
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Error updating library ID: {e}")
-        
-# The main processor function        
+        return source_digest(path)
+    except OSError as e:
+        logging.error(f"Error reading dependency {path}: {e}")
+        return None
+
+# Phase 2: copy every node that is not in the bundle yet, one canonical file per unique content.
+# Returns the relocation cache lookups by node path (see write_relocated).
+def copy_pass(graph, app_bundle_path, jobs=1, known=None):
+    with profiling.phase("copy"):
+        return _copy_pass(graph, app_bundle_path, jobs, known)
+
+def _copy_pass(graph, app_bundle_path, jobs, known):
+    known = known or {}
+    frameworks = {}
+    libraries = []
+    for node in graph:
+        if node.path in known:
+            node.dest = known[node.path]
+        elif node.dest is None:
+            if ".framework" in node.path:
+                frameworks.setdefault(copy_group(node.path), []).append(node)
+            else:
+                libraries.append(node)
+
+    # Frameworks are copied whole, one framework directory per task
+    def copy_frameworks(nodes):
+        for node in nodes:
+            node.dest = handle_framework(node.path, app_bundle_path)
+
+    with profiling.phase("copy frameworks"):
+        parallel.map_in_order(copy_frameworks, frameworks.values(), jobs)
+
+    # Hash in parallel, pick canonical files in graph order, then copy the new ones in parallel
+    with profiling.phase("hash"):
+        digests = parallel.map_in_order(lambda node: hash_source(node.path), libraries, jobs)
+    new_files = []
+    for node, digest in zip(libraries, digests):
+        if digest:
+            node.dest, needs_copy = claim_library(node.path, app_bundle_path, digest)
+            if needs_copy:
+                new_files.append((node, digest))
+    # Every destination is claimed now, so relink plans can be made before anything is written
+    with profiling.phase("write", files=len(new_files)):
+        lookups = parallel.map_in_order(
+            lambda item: write_relocated(item[0], item[1], app_bundle_path, graph), new_files, jobs,
+        )
+
+    create_aliases(graph)
+    report = get_copy_store().report()
+    profiling.count("copy.files", report["files_copied"])
+    profiling.count("copy.bytes", report["bytes_copied"])
+    profiling.count("copy.bytes_thinned", report["bytes_thinned"])
+    return {node.path: lookup for (node, _), lookup in zip(new_files, lookups) if lookup is not None}
+
+# Result of looking a library up in the relocation cache
+class RelocationLookup:
+    def __init__(self, key, plan, hit):
+        self.key = key
+        self.plan = plan
+        self.hit = hit
+
+# Write a claimed library, taking the relinked copy from the relocation cache when it has one.
+# Returns a RelocationLookup, or None when there is no cache or the file is not relinked.
+def write_relocated(node, digest, app_bundle_path, graph):
+    cache = get_relocation_cache()
+    if cache is None or is_skipped_binary(node.dest) or not is_binary_file(node.path):
+        write_library(node.path, node.dest)
+        return None
+    plan = plan_relink(node, app_bundle_path, graph, inspect_path=node.path)
+    key = cache.key(digest, plan, get_copy_store().arch)
+    if cache.fetch(key, lambda cached: write_library(cached, node.dest)):
+        logging.info(f"Relocation cache hit for {os.path.basename(node.path)}")
+        return RelocationLookup(key, plan, True)
+    write_library(node.path, node.dest)
+    return RelocationLookup(key, plan, False)
+
+# Symlink the other names a copied library is known by (versioned references, deduplicated inputs) to its canonical file
+def create_aliases(graph):
+    store = get_copy_store()
+    for node in graph:
+        if node.dest and not node.in_bundle and ".framework" not in node.dest:
+            store.add_alias(node.dest, os.path.basename(node.path))
+        for reference, key in node.children.items():
+            child = graph.get(key) if key else None
+            if child is None or not child.dest or ".framework" in child.dest:
+                continue
+            alias_name = os.path.basename(reference)
+            if alias_name.endswith((".dylib", ".so")):
+                store.add_alias(child.dest, alias_name)
+
+# Relink plan of one bundled binary: reference changes, stale rpaths and (for libraries) the new ID.
+# With `inspect_path` (the input file) the plan can be made before the bundle copy exists.
+def plan_relink(node, app_bundle_path, graph=None, inspect_path=None):
+    plan = relink.RelinkPlan(node.dest)
+    if node.references:
+        targets = {}
+        if graph is not None:
+            for reference, key in node.children.items():
+                child = graph.get(key) if key else None
+                if child is not None and child.dest:
+                    targets[reference] = child.dest
+        update_library_paths(node.dest, node.references, app_bundle_path, node.children, plan, targets)
+    update_rpaths(node.dest, app_bundle_path, plan, inspect_path)
+    if macho.get_file_type(inspect_path or node.dest) == macho.MH_DYLIB:
+        if "Contents/Frameworks" in node.dest or "Contents/Resources" in node.dest:
+            update_library_id(node.dest, plan, inspect_path)
+    return plan
+
+# Phase 3: rewrite the load commands of every bundled binary, one pass per file, dependencies first.
+# Files taken from the relocation cache are already relinked; the others are added to it.
+# Returns the applied plans keyed by node path.
+def relink_pass(graph, app_bundle_path, jobs=1, known=None, lookups=None):
+    known = known or {}
+    lookups = lookups or {}
+    plans = {}
+
+    def relink_node(node):
+        if node.path in known:
+            return
+        lookup = lookups.get(node.path)
+        if lookup is not None and lookup.hit:
+            plans[node.path] = lookup.plan
+            return
+        if node.dest and not is_skipped_binary(node.dest) and is_binary_file(node.dest):
+            with _dest_locks.get(node.dest):
+                plan = plan_relink(node, app_bundle_path, graph)
+                applied = relink.apply_plan(plan)
+                plans[node.path] = plan
+                if applied and lookup is not None and plan.to_dict() == lookup.plan.to_dict():
+                    get_relocation_cache().store(lookup.key, node.dest)
+
+    with profiling.phase("relink"):
+        parallel.run_in_dependency_order(graph, relink_node, jobs)
+    return plans
+
+def process_graph(graph, app_bundle_path, jobs=1, known=None):
+    lookups = copy_pass(graph, app_bundle_path, jobs, known)
+    return relink_pass(graph, app_bundle_path, jobs, known, lookups)
+
+# Process a single binary and everything it depends on
 def process_binary(binary_path, app_bundle_path):
     try:
         logging.info(f"Processing {binary_path}")
-        
-        # Skip Python extensions inside framework
-        if "Python.framework" in binary_path and binary_path.endswith(".so"):
-            logging.info(f"Skipping Python framework C extension: {binary_path}")
-            return
-        
-        if not is_binary_file(binary_path):
-            logging.info(f"Skipping non-binary file: {binary_path}")
-            return
-        
-        # Discovering dependencies
-        dependencies = get_dependencies(binary_path)
-        dependencies = [dep for dep in dependencies if not dep.startswith(("/usr/lib", "/System/Library"))]
-        
-        if not dependencies:
-            logging.info(f"No non-system dependencies found for {binary_path}")
-            return
-        
-        # Dependency processing loop
-        for lib_path in dependencies:
-            copied_path = copy_dependency(lib_path, app_bundle_path, binary_path)
-            if copied_path and copied_path != binary_path:
-                process_binary(copied_path, app_bundle_path)
-        
-        # update path
-        update_library_paths(binary_path, dependencies, app_bundle_path)
-        
-        # update library ID
-        if "Contents/Frameworks" in binary_path or "Contents/Resources" in binary_path:
-            update_library_id(binary_path)
-            
+        graph = discover_dependencies([binary_path], app_bundle_path)
+        process_graph(graph, app_bundle_path)
         logging.info(f"Successfully processed {binary_path}")
-        
     except Exception as e:
         logging.error(f"Error processing {binary_path}: {str(e)}")
         raise
 
-def process_app_bundle(app_bundle_path):
+# Mach-O files among the executables of the bundle, i.e. the roots of the dependency graph
+def find_bundle_binaries(app_bundle_path):
+    # One scan; the file type comes from the magic bytes read during the walk
+    return [
+        f.path for f in bundle_scanner.scan_bundle(app_bundle_path)
+        if f.is_executable and f.is_macho and not is_skipped_binary(f.path)
+    ]
+
+# Report which files a run would redo, without touching the bundle
+def check_app_bundle(app_bundle_path, manifest_path=None, arch=None):
+    bundle_manifest = manifest.BundleManifest(app_bundle_path, manifest_path, arch)
+    if not bundle_manifest.load():
+        logging.info(f"No manifest at {bundle_manifest.path}, everything is stale")
+    stale, dirty, _ = bundle_manifest.find_stale(find_bundle_binaries(app_bundle_path))
+    for rel_path in stale:
+        logging.info(f"Stale: {rel_path}")
+    for rel_path in sorted(set(dirty) - set(stale)):
+        logging.info(f"Stale dependent: {rel_path}")
+    return stale, dirty
+
+# `jobs` > 1 runs discovery, copying and relinking on a worker pool; the result is identical to the serial run.
+# Unless `force` is set, files recorded as unchanged and relocated in the manifest are skipped.
+# `binaries` (the graph roots) can be passed in by a caller that has already scanned the bundle.
+# With `cache_dir`, relinked libraries are reused from and added to a relocation cache of at most `cache_size` bytes.
+# A batch `session` (see batch.py) supplies the lookup caches and the relocation cache instead; the copy store
+# and the manifest always belong to this bundle alone.
+def process_app_bundle(app_bundle_path, jobs=1, manifest_path=None, force=False, binaries=None, arch=None,
+                       cache_dir=None, cache_size=relocation_cache.DEFAULT_MAX_BYTES, session=None):
     logging.info(f"Starting to process app bundle: {app_bundle_path}")
+    if session is None:
+        reset_library_index()
+        reset_rpath_cache()
+        reset_digest_cache()
+        reset_relocation_cache(relocation_cache.RelocationCache(cache_dir, cache_size) if cache_dir else None)
+    else:
+        session.activate()
+    reset_copy_store(copy_store.CopyStore(arch))
     
     # Create required directories
     for d in ["Frameworks", "Resources/bin", "Resources/lib"]:
         os.makedirs(os.path.join(app_bundle_path, "Contents", d), exist_ok=True)
     
-    binaries = find_binaries(app_bundle_path)
+    if binaries is None:
+        with profiling.phase("scan"):
+            binaries = find_bundle_binaries(app_bundle_path)
     logging.info(f"Found {len(binaries)} binaries to process")
     
-    for binary in binaries:
-        process_binary(binary, app_bundle_path)
+    bundle_manifest = manifest.BundleManifest(app_bundle_path, manifest_path, arch)
+    with profiling.phase("manifest check"):
+        if not force:
+            bundle_manifest.load()
+        stale, dirty, outdated = bundle_manifest.find_stale(binaries)
+    
+    # Bundle copies whose source changed are copied again from scratch
+    for rel_path in outdated:
+        logging.info(f"Source of {rel_path} changed, copying it again")
+        os.remove(bundle_manifest.abs(rel_path))
+        copy_library(bundle_manifest.files[rel_path]["source"], app_bundle_path)
+    
+    roots = [bundle_manifest.abs(r) for r in dirty if os.path.exists(bundle_manifest.abs(r))]
+    known = bundle_manifest.known_files(dirty)
+    if arch:
+        # The bundle's own binaries are not copied, thin them where they are
+        with profiling.phase("thin"):
+            removed = sum(parallel.map_in_order(lambda path: thinning.thin_in_place(path, arch), roots, jobs))
+        get_copy_store().bytes_thinned += removed
+    logging.info(f"{len(stale)} changed files, {len(roots)} files to process, {len(known)} known files skipped")
+    
+    graph = discover_dependencies(roots, app_bundle_path, jobs, known)
+    get_rpath_cache().report()
+    plans = process_graph(graph, app_bundle_path, jobs, known)
+    
+    # Record what was done for the next run
+    with profiling.phase("manifest save"):
+        for node in graph:
+            if node.path not in known:
+                bundle_manifest.record(node, graph, plans.get(node.path))
+        bundle_manifest.forget_missing()
+        bundle_manifest.save()
+    
+    cache = get_relocation_cache()
+    if cache is not None and session is None:
+        with profiling.phase("cache evict"):
+            cache.evict()
+        report = cache.report()
+        profiling.count("relocation_cache.hits", report["hits"])
+        profiling.count("relocation_cache.misses", report["misses"])
     
     logging.info(f"Finished processing app bundle: {app_bundle_path}")
-    return True
-
-# Recursively find all executable files in the app bundle.
-def find_binaries(app_folder):
-    binaries = []
-    for root, _, files in os.walk(app_folder):
-        for file in files:
-            file_path = os.path.join(root, file)
-            if os.access(file_path, os.X_OK) and not os.path.isdir(file_path):
-                binaries.append(file_path)
-    return binaries
-
-def is_binary_file(file_path):
-    try:
-        result = subprocess.run(
-            ["file", "-b", file_path], 
-            capture_output=True, 
-            text=True, 
-            check=True
-        )
-        return any(x in result.stdout for x in ["Mach-O", "shared library"])
-    except:
-        return False
+    return graph
 
 if __name__ == "__main__":
     setup_logging()
     parser = argparse.ArgumentParser(description="Process dependencies for macOS app bundle")
     parser.add_argument("--app", required=True, help="Path to the .app bundle")
+    parser.add_argument("--jobs", "-j", type=int, default=1, help="Number of parallel workers (default: 1, serial)")
+    parser.add_argument("--manifest", help="Manifest file (default: .<app name>.manifest.json next to the bundle)")
+    parser.add_argument("--force", action="store_true", help="Ignore the manifest and process every file")
+    parser.add_argument("--check", action="store_true", help="Only report which files are stale, exit 1 if any")
+    parser.add_argument("--arch", choices=thinning.ARCHS, help="Keep only this architecture of universal binaries (default: keep all)")
+    parser.add_argument("--cache", default=relocation_cache.default_cache_dir(), metavar="DIR",
+                        help="Reuse relinked libraries from this directory across runs (default: $SYNFIG_BUNDLE_CACHE, no cache if unset)")
+    parser.add_argument("--cache-size", type=int, default=relocation_cache.DEFAULT_MAX_BYTES // (1024 * 1024), metavar="MIB",
+                        help="Evict least recently used cache entries beyond this size (default: 2048)")
+    parser.add_argument("--profile", nargs="?", const="dependency_collection.profile", metavar="PREFIX",
+                        help="Time phases and tool calls, write PREFIX.json and PREFIX.trace.json (default prefix: dependency_collection.profile)")
     args = parser.parse_args()
+    if args.profile:
+        profiling.enable()
     
     if not os.path.exists(args.app):
         logging.error(f"App bundle not found at {args.app}")
         sys.exit(1)
     
+    if args.check:
+        stale, _ = check_app_bundle(args.app, args.manifest, args.arch)
+        sys.exit(1 if stale else 0)
+    
     try:
-        process_app_bundle(args.app)
+        process_app_bundle(args.app, args.jobs, args.manifest, args.force, arch=args.arch,
+                           cache_dir=args.cache, cache_size=args.cache_size * 1024 * 1024)
         logging.info("Dependency collection completed successfully")
         sys.exit(0)
     except Exception as e:
         logging.error(f"Fatal error: {str(e)}")
-        sys.exit(1)
\ No newline at end of file
+        sys.exit(1)
+    finally:
+        if args.profile:
+            profiling.report(args.profile)
\ No newline at end of file
@@ -0,0 +1,161 @@
+"""
+Dependency graph of the binaries that end up in an app bundle, one node per
+real path.
+"""
+
+import logging
+
+import parallel
+
+
+class DependencyNode:
+    """
+    One unique file in the dependency closure.
+
+    Attributes:
+        path (str): Real path of the source file (the node key)
+        in_bundle (bool): True if the file already lives inside the app bundle
+        dest (str): Path of the file inside the bundle, once known
+        references (list): Non-system load-command strings, in file order
+        children (dict): Reference string -> key of the node it resolves to,
+            or None if it could not be resolved
+    """
+
+    def __init__(self, path, in_bundle=False):
+        self.path = path
+        self.in_bundle = in_bundle
+        self.dest = path if in_bundle else None
+        self.references = []
+        self.children = {}
+
+    def __repr__(self):
+        return f"DependencyNode({self.path!r}, dest={self.dest!r})"
+
+
+class DependencyGraph:
+    """
+    Nodes in discovery order plus the edges between them.
+    """
+
+    def __init__(self):
+        self.nodes = {}
+        self.roots = []
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __iter__(self):
+        return iter(self.nodes.values())
+
+    def __contains__(self, key):
+        return key in self.nodes
+
+    def get(self, key):
+        return self.nodes.get(key)
+
+    def add_node(self, key, in_bundle=False):
+        node = self.nodes.get(key)
+        if node is None:
+            node = DependencyNode(key, in_bundle)
+            self.nodes[key] = node
+        return node
+
+    def child_nodes(self, node):
+        # Distinct resolved children of `node`, in reference order
+        seen = set()
+        children = []
+        for key in node.children.values():
+            if key is not None and key not in seen and key != node.path:
+                seen.add(key)
+                children.append(self.nodes[key])
+        return children
+
+    def dependents(self):
+        """
+        Build the reverse edges of the graph.
+
+        Returns:
+            dict: Node key -> list of keys of the nodes that reference it
+        """
+        reverse = {key: [] for key in self.nodes}
+        for node in self:
+            for child in self.child_nodes(node):
+                reverse[child.path].append(node.path)
+        return reverse
+
+    def post_order(self):
+        """
+        Return all nodes leaves-first (every node after its dependencies).
+
+        Cycles are broken at the first back edge found. Iterative, so the
+        depth of the graph is not limited by the interpreter's stack.
+        """
+        order = []
+        done = set()
+        for start in list(self.roots) + list(self.nodes):
+            if start in done:
+                continue
+            done.add(start)
+            stack = [(self.nodes[start], iter(self.child_nodes(self.nodes[start])))]
+            while stack:
+                node, children = stack[-1]
+                for child in children:
+                    if child.path not in done:
+                        done.add(child.path)
+                        stack.append((child, iter(self.child_nodes(child))))
+                        break
+                else:
+                    stack.pop()
+                    order.append(node)
+        return order
+
+
+def build_dependency_graph(roots, list_references, resolve_reference, in_bundle=lambda path: False, jobs=1):
+    """
+    Discover the full dependency closure of `roots`.
+
+    Args:
+        roots (list): Real paths of the binaries to start from
+        list_references (callable): path -> list of load-command strings to follow
+        resolve_reference (callable): (reference, referencing path) -> real path
+            of the referenced file, or None if it cannot be found
+        in_bundle (callable): path -> True if the file is already in the bundle
+        jobs (int): Number of files scanned and resolved concurrently
+
+    The closure is walked one breadth-first level at a time. Within a level
+    the files are scanned in parallel, but results are merged in level
+    order, so the graph is identical for any value of `jobs`.
+
+    Returns:
+        DependencyGraph: One node per unique real path
+    """
+    graph = DependencyGraph()
+    level = []
+
+    for root in roots:
+        if root not in graph:
+            graph.add_node(root, in_bundle(root))
+            graph.roots.append(root)
+            level.append(root)
+
+    def scan(path):
+        resolved = {}
+        for reference in list_references(path):
+            if reference not in resolved:
+                resolved[reference] = resolve_reference(reference, path)
+        return resolved
+
+    while level:
+        next_level = []
+        for path, resolved in zip(level, parallel.map_in_order(scan, level, jobs)):
+            node = graph.nodes[path]
+            node.references = list(resolved)
+            node.children = resolved
+            for key in resolved.values():
+                if key is not None and key not in graph:
+                    graph.add_node(key, in_bundle(key))
+                    next_level.append(key)
+        level = next_level
+
+    logging.info(f"Dependency graph: {len(graph.roots)} roots, {len(graph)} unique files")
+    return graph
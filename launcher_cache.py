@@ -0,0 +1,285 @@
+"""
+Launch-time lookups of the launcher (main.cpp), done once at bundle time and
+written to loaders.cache and launch.cfg.
+"""
+
+import argparse
+import logging
+import os
+import sys
+
+import copy_store
+import tool_runner
+
+LAUNCH_CONFIG = "launch.cfg"
+RESOURCES_PLACEHOLDER = "@SYNFIG_RESOURCES@"
+LOADERS_DIR = "lib/gdk-pixbuf-2.0/2.10.0/loaders"
+LOADERS_CACHE = "lib/gdk-pixbuf-2.0/2.10.0/loaders.cache"
+PYTHON_VERSIONS_DIR = "Frameworks/Python.framework/Versions"
+MLT_REPOSITORY = "lib/mlt"
+
+# Loader caches of the Homebrew gdk-pixbuf the loaders were copied from
+SOURCE_LOADER_CACHES = [
+    "/opt/homebrew/lib/gdk-pixbuf-2.0/2.10.0/loaders.cache",
+    "/usr/local/lib/gdk-pixbuf-2.0/2.10.0/loaders.cache",
+]
+
+
+def resources_dir(app_bundle_path):
+    return os.path.join(app_bundle_path, "Contents", "Resources")
+
+
+def _subdirectories(path):
+    try:
+        return sorted(e.name for e in os.scandir(path) if e.is_dir(follow_symlinks=False) and not e.name.startswith("."))
+    except OSError:
+        return []
+
+
+def find_python_version(resources):
+    # Version directory Versions/Current points at, else the only (or first) real version directory
+    versions = os.path.join(resources, PYTHON_VERSIONS_DIR)
+    current = os.path.join(versions, "Current")
+    if os.path.islink(current) and os.path.isdir(current):
+        return os.path.basename(os.path.realpath(current))
+    candidates = _subdirectories(versions)
+    return candidates[0] if candidates else None
+
+
+def find_imagemagick_dirs(resources):
+    """
+    ImageMagick's config-* and modules-* directories, relative to Resources.
+
+    Returns:
+        tuple: (config dir, modules dir), None for any that is missing
+    """
+    for name in _subdirectories(os.path.join(resources, "lib")):
+        if name.startswith("ImageMagick"):
+            magick = os.path.join("lib", name)
+            entries = _subdirectories(os.path.join(resources, magick))
+            config = next((os.path.join(magick, e) for e in entries if e.startswith("config-")), None)
+            modules = next((os.path.join(magick, e) for e in entries if e.startswith("modules-")), None)
+            return config, modules
+    return None, None
+
+
+def _loader_modules(resources):
+    loaders = os.path.join(resources, LOADERS_DIR)
+    try:
+        return sorted(e.name for e in os.scandir(loaders) if e.name.endswith((".so", ".dylib")))
+    except OSError:
+        return []
+
+
+def _split_entries(cache):
+    # Comment header and the blank-line separated module entries of a loaders.cache
+    header = []
+    entries = []
+    current = []
+    for line in cache.splitlines():
+        if not entries and not current and (line.startswith("#") or not line.strip()):
+            header.append(line)
+        elif line.strip():
+            current.append(line)
+        elif current:
+            entries.append(current)
+            current = []
+    if current:
+        entries.append(current)
+    return header, entries
+
+
+def relocate_loaders_cache(cache, modules, placeholder_dir):
+    """
+    Point the module paths of a loaders.cache at the bundle.
+
+    Entries whose module is not among `modules` are dropped.
+
+    Args:
+        cache (str): Output of gdk-pixbuf-query-loaders
+        modules (list): Loader file names present in the bundle
+        placeholder_dir (str): Directory the module paths get, e.g.
+            "@SYNFIG_RESOURCES@/lib/gdk-pixbuf-2.0/2.10.0/loaders"
+
+    Returns:
+        str: The relocated cache
+    """
+    header, entries = _split_entries(cache)
+    lines = [line for line in header if line.strip() not in ("", "#") and not line.startswith("# LoaderDir")]
+    lines += ["#", f"# LoaderDir = {placeholder_dir}", "#"]
+    kept = set()
+    for entry in entries:
+        module = entry[0].strip().strip('"')
+        name = os.path.basename(module)
+        if name not in modules or name in kept:
+            continue
+        kept.add(name)
+        lines.append(f'"{placeholder_dir}/{name}"')
+        lines.extend(entry[1:])
+        lines.append("")
+    return "\n".join(lines) + "\n"
+
+
+def query_loaders(resources, runner=None):
+    """
+    Run the bundle's gdk-pixbuf-query-loaders on its own loaders directory.
+
+    Returns:
+        str: The cache, or None if the tool cannot run here (e.g. not on macOS)
+    """
+    tool = os.path.join(resources, "bin", "gdk-pixbuf-query-loaders")
+    loaders = os.path.join(resources, LOADERS_DIR)
+    if not os.access(tool, os.X_OK):
+        return None
+    modules = [os.path.join(loaders, m) for m in _loader_modules(resources)]
+    result = (runner or tool_runner.get_runner()).run([tool] + modules)
+    if not result.ok or not result.stdout.strip():
+        logging.info(f"Could not run {tool} ({result.error or result.stderr.strip() or result.returncode})")
+        return None
+    return result.stdout
+
+
+def read_source_cache(source_caches=None):
+    for path in source_caches if source_caches is not None else SOURCE_LOADER_CACHES:
+        try:
+            with open(path) as f:
+                return f.read()
+        except OSError:
+            continue
+    return None
+
+
+def launch_config(app_bundle_path, loaders_cache=None):
+    """
+    The launch.cfg entries for the bundle as it is now.
+
+    Returns:
+        dict: Key -> value, only for what the bundle contains
+    """
+    resources = resources_dir(app_bundle_path)
+    config = {}
+    python_version = find_python_version(resources)
+    if python_version:
+        # The launcher sets PYTHONHOME from it
+        config["PYTHON_VERSION"] = python_version
+    magick_config, magick_modules = find_imagemagick_dirs(resources)
+    if magick_config and magick_modules:
+        config["MAGICK_CONFIGURE_PATH"] = magick_config
+        config["MAGICK_MODULES_DIR"] = magick_modules
+    if os.path.isdir(os.path.join(resources, MLT_REPOSITORY)):
+        config["MLT_REPOSITORY"] = MLT_REPOSITORY
+    if loaders_cache:
+        config["GDK_PIXBUF_LOADERS_CACHE"] = loaders_cache
+    return config
+
+
+def read_launch_config(app_bundle_path):
+    config = {}
+    with open(os.path.join(resources_dir(app_bundle_path), LAUNCH_CONFIG)) as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if line and not line.startswith("#") and "=" in line:
+                key, value = line.split("=", 1)
+                config[key] = value
+    return config
+
+
+def write_launch_files(app_bundle_path, runner=None, source_caches=None):
+    """
+    Generate loaders.cache and launch.cfg in the bundle's Resources.
+
+    The loader cache comes from the bundle's own gdk-pixbuf-query-loaders
+    when it can run here, otherwise from the Homebrew cache the loaders
+    were copied from; without either only launch.cfg is written and the
+    launcher keeps querying the loaders at start.
+
+    Returns:
+        list: Paths of the files written
+    """
+    resources = resources_dir(app_bundle_path)
+    written = []
+    modules = _loader_modules(resources)
+    cache_rel = None
+    if modules:
+        cache = query_loaders(resources, runner)
+        if cache is None:
+            cache = read_source_cache(source_caches)
+        if cache is not None:
+            relocated = relocate_loaders_cache(cache, modules, f"{RESOURCES_PLACEHOLDER}/{LOADERS_DIR}")
+            path = os.path.join(resources, LOADERS_CACHE)
+            copy_store.unshare(path)
+            with open(path, "w") as f:
+                f.write(relocated)
+            written.append(path)
+            cache_rel = LOADERS_CACHE
+        else:
+            logging.warning("No gdk-pixbuf loader cache available, the launcher will query the loaders at start")
+
+    config = launch_config(app_bundle_path, cache_rel)
+    path = os.path.join(resources, LAUNCH_CONFIG)
+    copy_store.unshare(path)
+    with open(path, "w") as f:
+        f.write("# Written by launcher_cache.py at bundle time, read by the launcher (main.cpp)\n")
+        f.write("# Paths are relative to Contents/Resources\n")
+        for key, value in config.items():
+            f.write(f"{key}={value}\n")
+    written.append(path)
+    logging.info(f"Launch files written: {', '.join(os.path.relpath(p, resources) for p in written)}")
+    return written
+
+
+def check_launch_files(app_bundle_path):
+    """
+    Compare launch.cfg and loaders.cache with the bundle's contents.
+
+    Returns:
+        list: Problems found, empty if the launch files are up to date
+    """
+    resources = resources_dir(app_bundle_path)
+    try:
+        recorded = read_launch_config(app_bundle_path)
+    except OSError:
+        return [f"{LAUNCH_CONFIG} is missing"]
+
+    problems = []
+    expected = launch_config(app_bundle_path, recorded.get("GDK_PIXBUF_LOADERS_CACHE"))
+    for key in sorted(set(recorded) | set(expected)):
+        if recorded.get(key) != expected.get(key):
+            problems.append(f"{LAUNCH_CONFIG}: {key} is {recorded.get(key)!r}, the bundle has {expected.get(key)!r}")
+        elif key != "PYTHON_VERSION" and not os.path.exists(os.path.join(resources, recorded[key])):
+            problems.append(f"{LAUNCH_CONFIG}: {key} points at missing {recorded[key]}")
+
+    modules = _loader_modules(resources)
+    cache_rel = recorded.get("GDK_PIXBUF_LOADERS_CACHE")
+    if cache_rel and os.path.exists(os.path.join(resources, cache_rel)):
+        with open(os.path.join(resources, cache_rel)) as f:
+            _, entries = _split_entries(f.read())
+        cached = {os.path.basename(entry[0].strip().strip('"')) for entry in entries}
+        for name in sorted(cached - set(modules)):
+            problems.append(f"{cache_rel}: lists {name}, which is not in {LOADERS_DIR}")
+        for name in sorted(set(modules) - cached):
+            problems.append(f"{cache_rel}: does not list {LOADERS_DIR}/{name}")
+    elif modules and cache_rel is None:
+        problems.append(f"{LOADERS_DIR} has loaders but {LAUNCH_CONFIG} has no loader cache")
+    return problems
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Write (or check) the launcher's loaders.cache and launch.cfg")
+    parser.add_argument("--app", required=True, help="Path to the .app bundle")
+    parser.add_argument("--check", action="store_true", help="Only check that the files match the bundle, exit 1 if not")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.app):
+        logging.error(f"App bundle not found at {args.app}")
+        sys.exit(1)
+
+    if args.check:
+        problems = check_launch_files(args.app)
+        for problem in problems:
+            logging.error(problem)
+        if not problems:
+            logging.info("Launch files match the bundle")
+        sys.exit(1 if problems else 0)
+    write_launch_files(args.app)
@@ -0,0 +1,139 @@
+"""Index of the libraries available in the usual install locations."""
+
+import glob
+import logging
+import os
+import re
+import threading
+
+# Search roots in priority order, same as the collector has always used
+DEFAULT_SEARCH_ROOTS = [
+    "/opt/homebrew/lib",  # Core Homebrew libraries
+    "/opt/homebrew/opt/*/lib",  # to cover all Homebrew formulae
+    "/usr/local/opt/*/lib",  # Intel Homebrew formula libraries
+    "/usr/local/opt/sqlite/lib", # Intel Homebrew SQLite
+    "/opt/homebrew/opt/sqlite/lib", # ARM Homebrew SQLite
+    "/usr/local/lib", # legacy homebrew installation directory
+    "/opt/local/lib", # MacPorts installation directory
+    "/usr/lib", # System libraries
+    "/Library/Frameworks", # System-wide frameworks
+]
+
+_VERSION_SUFFIX = re.compile(r'(\.\d+)+$')
+
+
+def library_stem(name):
+    """
+    Name of a library without its `.dylib` extension.
+
+    Example: libfoo.1.2.dylib -> libfoo.1.2
+    """
+    return os.path.basename(name).split('.dylib', 1)[0]
+
+
+def versioned_stems(name):
+    """
+    Every stem a versioned library answers to, most specific first.
+
+    Example: libfoo.1.2.dylib -> [libfoo.1.2, libfoo.1, libfoo]
+
+    Only names of the form <base>(.<digits>)*.dylib are versioned; anything
+    else only answers to its own stem.
+    """
+    if not name.endswith(".dylib"):
+        return []
+    stem = name[:-len(".dylib")]
+    stems = [stem]
+    while _VERSION_SUFFIX.search(stem):
+        stem = stem.rsplit(".", 1)[0]
+        stems.append(stem)
+    return stems
+
+
+class LibraryIndex:
+    """
+    Map library stems to real paths across a list of search roots.
+
+    Lookups follow the old search order exactly: roots in priority order,
+    and within a root an exact <stem>.dylib beats a versioned
+    <stem>.<digits>...dylib.
+
+    Args:
+        search_roots (list): Directories to index, glob patterns allowed
+    """
+
+    def __init__(self, search_roots=None):
+        self.search_roots = list(DEFAULT_SEARCH_ROOTS if search_roots is None else search_roots)
+        self._stems = {}
+        self._names = {}
+        self._dirs = {}
+        self._lock = threading.Lock()
+        self._build()
+
+    def _build(self):
+        directories = []
+        for root in self.search_roots:
+            matches = sorted(glob.glob(root)) if glob.has_magic(root) else [root]
+            directories.extend(d for d in matches if os.path.isdir(d))
+
+        for rank, directory in enumerate(directories):
+            entries = self._scan(directory)
+            for stem, (priority, path) in entries["stems"].items():
+                current = self._stems.get(stem)
+                if current is None or (rank, priority) < current[0]:
+                    self._stems[stem] = ((rank, priority), path)
+            for name, path in entries["names"].items():
+                self._names.setdefault(name, path)
+        logging.info(f"Library index: {len(directories)} directories, {len(self._names)} files")
+
+    def _scan(self, directory):
+        # List a directory once; cached so per-binary directories are also scanned once
+        with self._lock:
+            cached = self._dirs.get(directory)
+        if cached is not None:
+            return cached
+
+        stems = {}
+        names = {}
+        try:
+            with os.scandir(directory) as it:
+                names_in_dir = sorted(entry.name for entry in it)
+        except OSError:
+            names_in_dir = []
+
+        for name in names_in_dir:
+            path = os.path.join(directory, name)
+            names[name] = path
+            for i, stem in enumerate(versioned_stems(name)):
+                priority = 0 if i == 0 else 1
+                if stem not in stems or priority < stems[stem][0]:
+                    stems[stem] = (priority, path)
+
+        result = {"stems": stems, "names": names}
+        with self._lock:
+            self._dirs[directory] = result
+        return result
+
+    def find(self, lib_name):
+        """
+        Look up a library by name (path, basename or stem).
+
+        Returns:
+            str: Real path of the best match, or None
+        """
+        found = self._stems.get(library_stem(lib_name))
+        return os.path.realpath(found[1]) if found else None
+
+    def find_name(self, file_name):
+        # Exact file-name lookup (no version flexibility)
+        path = self._names.get(os.path.basename(file_name))
+        return os.path.realpath(path) if path else None
+
+    def find_in_dir(self, directory, lib_name):
+        """
+        Look up a library in a single directory that need not be a search root.
+        """
+        if not directory or not os.path.isdir(directory):
+            return None
+        found = self._scan(os.path.normpath(directory))["stems"].get(library_stem(lib_name))
+        return os.path.realpath(found[1]) if found else None
@@ -0,0 +1,533 @@
+"""Pure-Python Mach-O reader, replacing `file`, `otool -L` and `otool -l`."""
+
+import logging
+import mmap
+import os
+import struct
+import threading
+
+import profiling
+
+# Header magics (as read in the file's own byte order)
+MH_MAGIC = 0xfeedface
+MH_CIGAM = 0xcefaedfe
+MH_MAGIC_64 = 0xfeedfacf
+MH_CIGAM_64 = 0xcffaedfe
+FAT_MAGIC = 0xcafebabe
+FAT_MAGIC_64 = 0xcafebabf
+
+# File types (mach_header.filetype)
+MH_OBJECT = 0x1
+MH_EXECUTE = 0x2
+MH_DYLINKER = 0x7
+MH_DYLIB = 0x6
+MH_BUNDLE = 0x8
+MH_DYLIB_STUB = 0x9
+MH_DSYM = 0xa
+
+FILE_TYPE_NAMES = {
+    MH_OBJECT: "object",
+    MH_EXECUTE: "executable",
+    MH_DYLIB: "shared library",
+    MH_DYLINKER: "dynamic linker",
+    MH_BUNDLE: "bundle",
+    MH_DYLIB_STUB: "shared library stub",
+    MH_DSYM: "dSYM companion file",
+}
+
+# Load commands
+LC_REQ_DYLD = 0x80000000
+LC_SEGMENT = 0x1
+LC_LOAD_DYLIB = 0xc
+LC_ID_DYLIB = 0xd
+LC_SEGMENT_64 = 0x19
+LC_LOAD_WEAK_DYLIB = 0x18 | LC_REQ_DYLD
+LC_RPATH = 0x1c | LC_REQ_DYLD
+LC_CODE_SIGNATURE = 0x1d
+LC_REEXPORT_DYLIB = 0x1f | LC_REQ_DYLD
+LC_LAZY_LOAD_DYLIB = 0x20
+LC_LOAD_UPWARD_DYLIB = 0x23 | LC_REQ_DYLD
+
+# Every load command that makes dyld load another image
+DYLIB_LOAD_COMMANDS = {
+    LC_LOAD_DYLIB,
+    LC_LOAD_WEAK_DYLIB,
+    LC_REEXPORT_DYLIB,
+    LC_LAZY_LOAD_DYLIB,
+    LC_LOAD_UPWARD_DYLIB,
+}
+
+# CPU types
+CPU_ARCH_ABI64 = 0x01000000
+CPU_TYPE_X86 = 7
+CPU_TYPE_ARM = 12
+CPU_TYPE_POWERPC = 18
+CPU_TYPE_X86_64 = CPU_TYPE_X86 | CPU_ARCH_ABI64
+CPU_TYPE_ARM64 = CPU_TYPE_ARM | CPU_ARCH_ABI64
+
+CPU_TYPE_NAMES = {
+    CPU_TYPE_X86: "i386",
+    CPU_TYPE_X86_64: "x86_64",
+    CPU_TYPE_ARM: "arm",
+    CPU_TYPE_ARM64: "arm64",
+    CPU_TYPE_POWERPC: "ppc",
+}
+
+# Section types without file contents (zero offset)
+_ZEROFILL_SECTION_TYPES = {0x1, 0xc, 0x12}
+
+# Java class files share FAT_MAGIC; real fat files never have this many slices
+_MAX_FAT_ARCHS = 32
+
+
+class LoadCommand:
+    """
+    A single load command of a Mach-O slice.
+
+    `offset` is absolute within the file (not the slice) so that callers can
+    patch it in place. For commands carrying a string (dylib name or rpath)
+    `string` holds the decoded value and `string_offset` its offset relative
+    to the start of the command.
+    """
+
+    __slots__ = ("cmd", "offset", "cmdsize", "string", "string_offset")
+
+    def __init__(self, cmd, offset, cmdsize, string=None, string_offset=None):
+        self.cmd = cmd
+        self.offset = offset
+        self.cmdsize = cmdsize
+        self.string = string
+        self.string_offset = string_offset
+
+    def __repr__(self):
+        return f"LoadCommand(cmd=0x{self.cmd:x}, offset={self.offset}, cmdsize={self.cmdsize}, string={self.string!r})"
+
+
+class MachOSlice:
+    """
+    One architecture of a Mach-O file (the whole file for thin binaries).
+    """
+
+    def __init__(self, offset, size, cputype, cpusubtype, is_64, byteorder,
+                 filetype, flags, ncmds, sizeofcmds, load_commands, header_limit):
+        self.offset = offset
+        self.size = size
+        self.cputype = cputype
+        self.cpusubtype = cpusubtype
+        self.is_64 = is_64
+        self.byteorder = byteorder
+        self.filetype = filetype
+        self.flags = flags
+        self.ncmds = ncmds
+        self.sizeofcmds = sizeofcmds
+        self.load_commands = load_commands
+        # Offset (relative to the slice) of the first byte of segment data
+        self.header_limit = header_limit
+
+    @property
+    def arch(self):
+        return CPU_TYPE_NAMES.get(self.cputype, f"cputype_{self.cputype}")
+
+    @property
+    def header_size(self):
+        return 32 if self.is_64 else 28
+
+    @property
+    def header_padding(self):
+        # Free bytes between the end of the load commands and the first section
+        return self.header_limit - (self.header_size + self.sizeofcmds)
+
+    @property
+    def dependencies(self):
+        return [lc.string for lc in self.load_commands if lc.cmd in DYLIB_LOAD_COMMANDS]
+
+    @property
+    def install_name(self):
+        for lc in self.load_commands:
+            if lc.cmd == LC_ID_DYLIB:
+                return lc.string
+        return None
+
+    @property
+    def rpaths(self):
+        return [lc.string for lc in self.load_commands if lc.cmd == LC_RPATH]
+
+    @property
+    def code_signature(self):
+        for lc in self.load_commands:
+            if lc.cmd == LC_CODE_SIGNATURE:
+                return lc
+        return None
+
+
+class MachOFile:
+    """
+    Parsed view of a thin or fat Mach-O file.
+
+    Properties that describe the whole file (dependencies, rpaths) merge all
+    slices in load-command order with duplicates removed, which matches what
+    `otool -L` reports for the slice that actually gets loaded in practice.
+    """
+
+    def __init__(self, path, is_fat, slices):
+        self.path = path
+        self.is_fat = is_fat
+        self.slices = slices
+
+    @property
+    def filetype(self):
+        return self.slices[0].filetype if self.slices else None
+
+    @property
+    def filetype_name(self):
+        return FILE_TYPE_NAMES.get(self.filetype, "unknown")
+
+    @property
+    def is_executable(self):
+        return self.filetype == MH_EXECUTE
+
+    @property
+    def is_library(self):
+        return self.filetype in (MH_DYLIB, MH_BUNDLE, MH_DYLIB_STUB)
+
+    @property
+    def archs(self):
+        return [s.arch for s in self.slices]
+
+    @property
+    def dependencies(self):
+        return _merge(s.dependencies for s in self.slices)
+
+    @property
+    def rpaths(self):
+        return _merge(s.rpaths for s in self.slices)
+
+    @property
+    def install_name(self):
+        for s in self.slices:
+            if s.install_name:
+                return s.install_name
+        return None
+
+    def slice_for_arch(self, arch):
+        for s in self.slices:
+            if s.arch == arch:
+                return s
+        return None
+
+
+def _merge(lists):
+    seen = set()
+    merged = []
+    for items in lists:
+        for item in items:
+            if item not in seen:
+                seen.add(item)
+                merged.append(item)
+    return merged
+
+
+def _read_cstring(buf, start, end):
+    nul = buf.find(b"\0", start, end)
+    if nul == -1:
+        nul = end
+    return bytes(buf[start:nul]).decode("utf-8", errors="surrogateescape")
+
+
+def _parse_slice(buf, offset, size):
+    # Parse the mach_header and load commands of the slice at `offset`
+    if size < 28 or offset + 28 > len(buf):
+        raise ValueError("truncated Mach-O header")
+
+    magic = struct.unpack_from("<I", buf, offset)[0]
+    if magic == MH_MAGIC:
+        byteorder, is_64 = "<", False
+    elif magic == MH_MAGIC_64:
+        byteorder, is_64 = "<", True
+    elif magic == MH_CIGAM:
+        byteorder, is_64 = ">", False
+    elif magic == MH_CIGAM_64:
+        byteorder, is_64 = ">", True
+    else:
+        raise ValueError(f"bad Mach-O magic 0x{magic:08x} at offset {offset}")
+
+    cputype, cpusubtype, filetype, ncmds, sizeofcmds, flags = struct.unpack_from(
+        byteorder + "iIIIII", buf, offset + 4)
+    header_size = 32 if is_64 else 28
+    end_of_cmds = offset + header_size + sizeofcmds
+    if end_of_cmds > len(buf) or end_of_cmds > offset + size:
+        raise ValueError("load commands extend past end of file")
+
+    load_commands = []
+    header_limit = size
+    pos = offset + header_size
+    for _ in range(ncmds):
+        if pos + 8 > end_of_cmds:
+            raise ValueError("truncated load command")
+        cmd, cmdsize = struct.unpack_from(byteorder + "II", buf, pos)
+        if cmdsize < 8 or pos + cmdsize > end_of_cmds:
+            raise ValueError(f"bad load command size {cmdsize}")
+
+        string = string_offset = None
+        if cmd in DYLIB_LOAD_COMMANDS or cmd == LC_ID_DYLIB or cmd == LC_RPATH:
+            string_offset = struct.unpack_from(byteorder + "I", buf, pos + 8)[0]
+            if string_offset < 12 or string_offset >= cmdsize:
+                raise ValueError("bad string offset in load command")
+            string = _read_cstring(buf, pos + string_offset, pos + cmdsize)
+        elif cmd == LC_SEGMENT_64 or cmd == LC_SEGMENT:
+            header_limit = min(header_limit, _segment_data_start(buf, pos, byteorder, cmd == LC_SEGMENT_64))
+
+        load_commands.append(LoadCommand(cmd, pos, cmdsize, string, string_offset))
+        pos += cmdsize
+
+    return MachOSlice(offset, size, cputype, cpusubtype, is_64, byteorder, filetype,
+                      flags, ncmds, sizeofcmds, load_commands, header_limit)
+
+
+def _segment_data_start(buf, pos, byteorder, is_64):
+    # Lowest file offset (relative to the slice) used by a segment's contents
+    if is_64:
+        fileoff, filesize = struct.unpack_from(byteorder + "QQ", buf, pos + 40)
+        nsects = struct.unpack_from(byteorder + "I", buf, pos + 64)[0]
+        sect_start, sect_size, sect_offset_at, flags_at = pos + 72, 80, 48, 64
+    else:
+        fileoff, filesize = struct.unpack_from(byteorder + "II", buf, pos + 32)
+        nsects = struct.unpack_from(byteorder + "I", buf, pos + 48)[0]
+        sect_start, sect_size, sect_offset_at, flags_at = pos + 56, 68, 40, 56
+
+    start = fileoff if fileoff and filesize else float("inf")
+    for i in range(nsects):
+        sect = sect_start + i * sect_size
+        sect_offset = struct.unpack_from(byteorder + "I", buf, sect + sect_offset_at)[0]
+        sect_flags = struct.unpack_from(byteorder + "I", buf, sect + flags_at)[0]
+        if sect_offset and (sect_flags & 0xff) not in _ZEROFILL_SECTION_TYPES:
+            start = min(start, sect_offset)
+    return start
+
+
+def _parse_fat(buf, is_64):
+    nfat_arch = struct.unpack_from(">I", buf, 4)[0]
+    if nfat_arch == 0 or nfat_arch > _MAX_FAT_ARCHS:
+        return None  # Most likely a Java class file
+
+    slices = []
+    arch_size = 32 if is_64 else 20
+    for i in range(nfat_arch):
+        pos = 8 + i * arch_size
+        if pos + arch_size > len(buf):
+            raise ValueError("truncated fat header")
+        if is_64:
+            _, _, offset, size, _ = struct.unpack_from(">iIQQI", buf, pos)
+        else:
+            _, _, offset, size, _ = struct.unpack_from(">iIIII", buf, pos)
+        if offset + size > len(buf):
+            raise ValueError("fat slice extends past end of file")
+        slices.append(_parse_slice(buf, offset, size))
+    return slices
+
+
+def parse_macho(buf, path=None):
+    """
+    Parse a Mach-O image from a bytes-like object (bytes, bytearray or mmap).
+
+    Args:
+        buf: The whole file contents
+        path (str, optional): Path recorded on the result
+
+    Returns:
+        MachOFile: Parsed file, or None if `buf` is not a Mach-O file
+
+    Raises:
+        ValueError: If the file has a Mach-O magic but is malformed
+    """
+    if len(buf) < 8:
+        return None
+    magic_be = struct.unpack_from(">I", buf, 0)[0]
+    if magic_be in (FAT_MAGIC, FAT_MAGIC_64):
+        slices = _parse_fat(buf, magic_be == FAT_MAGIC_64)
+        if slices is None:
+            return None
+        return MachOFile(path, True, slices)
+    if magic_be in (MH_MAGIC, MH_MAGIC_64, MH_CIGAM, MH_CIGAM_64):
+        return MachOFile(path, False, [_parse_slice(buf, 0, len(buf))])
+    return None
+
+
+def sniff_magic(path):
+    """
+    Classify a file by its first four bytes without mapping the whole file.
+
+    Returns:
+        str: "macho", "fat", "script" or "data"
+    """
+    try:
+        with open(path, "rb") as f:
+            head = f.read(8)
+    except OSError:
+        return "data"
+    return classify_header(head)
+
+
+def classify_header(head):
+    if len(head) < 4:
+        return "data"
+    magic_be = struct.unpack_from(">I", head, 0)[0]
+    if magic_be in (MH_MAGIC, MH_MAGIC_64, MH_CIGAM, MH_CIGAM_64):
+        return "macho"
+    if magic_be in (FAT_MAGIC, FAT_MAGIC_64):
+        if len(head) >= 8 and 0 < struct.unpack_from(">I", head, 4)[0] <= _MAX_FAT_ARCHS:
+            return "fat"
+        return "data"
+    if head.startswith(b"#!"):
+        return "script"
+    return "data"
+
+
+def is_macho(path):
+    # Cheap check used in place of `file -b ... | grep Mach-O`
+    return sniff_magic(path) in ("macho", "fat")
+
+
+# Parsed files keyed by real path; entries are dropped when the file's
+# size/mtime change or when a writer calls invalidate().
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _stat_key(st):
+    return (st.st_size, st.st_mtime_ns, st.st_ino)
+
+
+def read_macho(path):
+    """
+    Memory-map a file once and parse it as Mach-O.
+
+    Results are cached per real path, so repeated questions about the same
+    file (type, dependencies, rpaths) cost a single stat.
+
+    Args:
+        path (str): Path to the file
+
+    Returns:
+        MachOFile: Parsed file, or None if the file is not a (valid) Mach-O file
+    """
+    real_path = os.path.realpath(path)
+    try:
+        st = os.stat(real_path)
+    except OSError:
+        return None
+
+    key = _stat_key(st)
+    with _cache_lock:
+        cached = _cache.get(real_path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    profiling.count("macho.parse")
+    result = None
+    if st.st_size >= 8 and is_macho(real_path):
+        try:
+            with open(real_path, "rb") as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                    result = parse_macho(buf, real_path)
+        except (OSError, ValueError, struct.error) as e:
+            logging.warning(f"Could not parse Mach-O file {path}: {e}")
+            result = None
+
+    with _cache_lock:
+        _cache[real_path] = (key, result)
+    return result
+
+
+def invalidate(path):
+    # Forget any cached parse of `path`; call after rewriting a file in place
+    with _cache_lock:
+        _cache.pop(os.path.realpath(path), None)
+
+
+def get_file_type(path):
+    macho = read_macho(path)
+    return macho.filetype if macho else None
+
+
+def get_dependencies(path):
+    macho = read_macho(path)
+    return macho.dependencies if macho else []
+
+
+def get_rpaths(path):
+    macho = read_macho(path)
+    return macho.rpaths if macho else []
+
+
+def get_install_name(path):
+    macho = read_macho(path)
+    return macho.install_name if macho else None
+
+
+def expand_load_path(path, loader_path, executable_path):
+    """
+    Expand @loader_path / @executable_path the way dyld does.
+
+    Args:
+        path (str): Load-command string or rpath
+        loader_path (str): Path of the binary containing the load command
+        executable_path (str): Path of the main executable (or None)
+
+    Returns:
+        str: Expanded, normalized path, or None if it cannot be expanded
+    """
+    if path.startswith("@loader_path"):
+        return os.path.normpath(os.path.dirname(loader_path) + path[len("@loader_path"):])
+    if path.startswith("@executable_path"):
+        if not executable_path:
+            return None
+        return os.path.normpath(os.path.dirname(executable_path) + path[len("@executable_path"):])
+    if path.startswith("@"):
+        return None
+    return path
+
+
+def resolve_load_path(reference, loader_path, executable_path, rpaths=None):
+    """
+    Find the file a load command refers to on this file system.
+
+    @rpath references are tried against every LC_RPATH of the loader
+    (`rpaths` defaults to the loader's own).
+
+    Returns:
+        str: Real path of the referenced file, or None if it does not exist
+    """
+    if reference.startswith("@rpath/"):
+        if rpaths is None:
+            rpaths = get_rpaths(loader_path)
+        for rpath in rpaths:
+            base = expand_load_path(rpath, loader_path, executable_path)
+            if base:
+                candidate = os.path.join(base, reference[len("@rpath/"):])
+                if os.path.exists(candidate):
+                    return os.path.realpath(candidate)
+        return None
+
+    expanded = expand_load_path(reference, loader_path, executable_path)
+    if expanded and os.path.exists(expanded):
+        return os.path.realpath(expanded)
+    return None
+
+
+if __name__ == "__main__":
+    import sys
+
+    # Minimal `otool -L` / `otool -l` style dump for debugging
+    for file_path in sys.argv[1:]:
+        macho = read_macho(file_path)
+        if macho is None:
+            print(f"{file_path}: not a Mach-O file")
+            continue
+        print(f"{file_path}: Mach-O {macho.filetype_name} ({', '.join(macho.archs)})")
+        if macho.install_name:
+            print(f"\tid {macho.install_name}")
+        for dep in macho.dependencies:
+            print(f"\t{dep}")
+        for rpath in macho.rpaths:
+            print(f"\trpath {rpath}")
@@ -38,6 +38,9 @@
 #include <unistd.h>
 #include <dirent.h>
 #include <sys/stat.h>
+#include <fstream>
+#include <map>
+#include <sstream>
 #endif
 
 #include <glibmm/convert.h>
@@ -61,6 +64,49 @@ using namespace studio;
 
 /* === P R O C E D U R E S ================================================= */
 
+#ifdef __APPLE__
+// KEY=value lines of Resources/launch.cfg, written at bundle time by launcher_cache.py
+static std::map<std::string, std::string> read_launch_config(const std::string& path)
+{
+    std::map<std::string, std::string> config;
+    std::ifstream in(path);
+    std::string line;
+    while (std::getline(in, line)) {
+        size_t eq = line.find('=');
+        if (line.empty() || line[0] == '#' || eq == std::string::npos)
+            continue;
+        config[line.substr(0, eq)] = line.substr(eq + 1);
+    }
+    return config;
+}
+
+// Write the bundled loaders.cache with its placeholder replaced by the Resources path,
+// leaving the target alone if it already has that content
+static bool install_loaders_cache(const std::string& source, const std::string& resources, const std::string& target)
+{
+    std::ifstream in(source);
+    if (!in)
+        return false;
+    std::stringstream buffer;
+    buffer << in.rdbuf();
+    std::string cache = buffer.str();
+    const std::string placeholder = "@SYNFIG_RESOURCES@";
+    for (size_t pos = cache.find(placeholder); pos != std::string::npos; pos = cache.find(placeholder, pos + resources.size()))
+        cache.replace(pos, placeholder.size(), resources);
+
+    std::ifstream existing(target);
+    if (existing) {
+        std::stringstream current;
+        current << existing.rdbuf();
+        if (current.str() == cache)
+            return true;
+    }
+    std::ofstream out(target, std::ios::trunc);
+    out << cache;
+    return static_cast<bool>(out);
+}
+#endif
+
 /* === M E T H O D S ======================================================= */
 
 /* === E N T R Y P O I N T ================================================= */
@@ -83,13 +129,17 @@ int main(int argc, char **argv)
         return 1;
     }
 
+    // Lookups done at bundle time, see launcher_cache.py; missing entries fall back to scanning
+    std::map<std::string, std::string> launchConfig = read_launch_config(cwd + "/launch.cfg");
+
     // Static environment variables
     setenv("GTK_EXE_PREFIX", cwd.c_str(), 1);
     setenv("GTK_DATA_PREFIX", (cwd + "/share").c_str(), 1);
     setenv("GSETTINGS_SCHEMA_DIR", (cwd + "/share/glib-2.0/schemas/").c_str(), 1);
     setenv("FONTCONFIG_PATH", (cwd + "/etc/fonts").c_str(), 1);
     setenv("MLT_DATA", (cwd + "/share/mlt/").c_str(), 1);
-    setenv("MLT_REPOSITORY", (cwd + "/lib/mlt/").c_str(), 1);
+    std::string mltRepository = launchConfig.count("MLT_REPOSITORY") ? launchConfig["MLT_REPOSITORY"] : "lib/mlt";
+    setenv("MLT_REPOSITORY", (cwd + "/" + mltRepository + "/").c_str(), 1);
     std::string currentPath = getenv("PATH") ? getenv("PATH") : "";
     setenv("PATH", (cwd + "/bin:" + cwd + "/synfig-production/bin:" + currentPath).c_str(), 1);
     setenv("SYNFIG_ROOT", cwd.c_str(), 1);
@@ -101,21 +151,24 @@ int main(int argc, char **argv)
     // GDK Pixbuf module file
     std::string home = getenv("HOME");
     std::string moduleFile = home + "/.synfig-gdk-loaders";
-    if (access(moduleFile.c_str(), F_OK) == 0) {
-        remove(moduleFile.c_str());
-    }
-    std::string cmd = cwd + "/bin/gdk-pixbuf-query-loaders > " + moduleFile;
-    if (system(cmd.c_str()) != 0) {
-        std::cerr << "Failed to generate GDK pixbuf module file at " << moduleFile << std::endl;
-        return 1;
+    if (launchConfig.count("GDK_PIXBUF_LOADERS_CACHE") == 0
+        || !install_loaders_cache(cwd + "/" + launchConfig["GDK_PIXBUF_LOADERS_CACHE"], cwd, moduleFile)) {
+        if (access(moduleFile.c_str(), F_OK) == 0) {
+            remove(moduleFile.c_str());
+        }
+        std::string cmd = cwd + "/bin/gdk-pixbuf-query-loaders > " + moduleFile;
+        if (system(cmd.c_str()) != 0) {
+            std::cerr << "Failed to generate GDK pixbuf module file at " << moduleFile << std::endl;
+            return 1;
+        }
     }
     setenv("GDK_PIXBUF_MODULE_FILE", moduleFile.c_str(), 1);
 
     // Python setup
     std::string versionsDir = cwd + "/Frameworks/Python.framework/Versions/";
-    DIR* dir = opendir(versionsDir.c_str());
-    std::string pythonVersion;
-    if (dir) {
+    DIR* dir = nullptr;
+    std::string pythonVersion = launchConfig["PYTHON_VERSION"];
+    if (pythonVersion.empty() && (dir = opendir(versionsDir.c_str()))) {
         struct dirent* entry;
         while ((entry = readdir(dir)) != nullptr) {
             if (entry->d_type == DT_DIR && entry->d_name[0] != '.') {
@@ -134,45 +187,51 @@ int main(int argc, char **argv)
 
     // ImageMagick setup
     std::string libDir = cwd + "/lib/";
-    std::string magickDir;
-    dir = opendir(libDir.c_str());
-    if (dir) {
-        struct dirent* entry;
-        while ((entry = readdir(dir)) != nullptr) {
-            if (entry->d_type == DT_DIR && strncmp(entry->d_name, "ImageMagick", 11) == 0) {
-                magickDir = entry->d_name;
-                break;
-            }
-        }
-        closedir(dir);
-    }
-    if (!magickDir.empty()) {
-        std::string magickLibDir = libDir + magickDir + "/";
-        std::string configDir;
-        std::string modulesDir;
-        dir = opendir(magickLibDir.c_str());
+    if (launchConfig.count("MAGICK_CONFIGURE_PATH") && launchConfig.count("MAGICK_MODULES_DIR")) {
+        setenv("MAGICK_CONFIGURE_PATH", (cwd + "/" + launchConfig["MAGICK_CONFIGURE_PATH"] + "/").c_str(), 1);
+        setenv("MAGICK_CODER_MODULE_PATH", (cwd + "/" + launchConfig["MAGICK_MODULES_DIR"] + "/coders/").c_str(), 1);
+        setenv("MAGICK_CODER_FILTER_PATH", (cwd + "/" + launchConfig["MAGICK_MODULES_DIR"] + "/filters/").c_str(), 1);
+    } else {
+        std::string magickDir;
+        dir = opendir(libDir.c_str());
         if (dir) {
             struct dirent* entry;
             while ((entry = readdir(dir)) != nullptr) {
-                if (entry->d_type == DT_DIR && entry->d_name[0] != '.') {
-                    if (strncmp(entry->d_name, "config-", 7) == 0) {
-                        configDir = entry->d_name;
-                    } else if (strncmp(entry->d_name, "modules-", 8) == 0) {
-                        modulesDir = entry->d_name;
-                    }
+                if (entry->d_type == DT_DIR && strncmp(entry->d_name, "ImageMagick", 11) == 0) {
+                    magickDir = entry->d_name;
+                    break;
                 }
             }
             closedir(dir);
         }
-        if (!configDir.empty() && !modulesDir.empty()) {
-            setenv("MAGICK_CONFIGURE_PATH", (magickLibDir + configDir + "/").c_str(), 1);
-            setenv("MAGICK_CODER_MODULE_PATH", (magickLibDir + modulesDir + "/coders/").c_str(), 1);
-            setenv("MAGICK_CODER_FILTER_PATH", (magickLibDir + modulesDir + "/filters/").c_str(), 1);
+        if (!magickDir.empty()) {
+            std::string magickLibDir = libDir + magickDir + "/";
+            std::string configDir;
+            std::string modulesDir;
+            dir = opendir(magickLibDir.c_str());
+            if (dir) {
+                struct dirent* entry;
+                while ((entry = readdir(dir)) != nullptr) {
+                    if (entry->d_type == DT_DIR && entry->d_name[0] != '.') {
+                        if (strncmp(entry->d_name, "config-", 7) == 0) {
+                            configDir = entry->d_name;
+                        } else if (strncmp(entry->d_name, "modules-", 8) == 0) {
+                            modulesDir = entry->d_name;
+                        }
+                    }
+                }
+                closedir(dir);
+            }
+            if (!configDir.empty() && !modulesDir.empty()) {
+                setenv("MAGICK_CONFIGURE_PATH", (magickLibDir + configDir + "/").c_str(), 1);
+                setenv("MAGICK_CODER_MODULE_PATH", (magickLibDir + modulesDir + "/coders/").c_str(), 1);
+                setenv("MAGICK_CODER_FILTER_PATH", (magickLibDir + modulesDir + "/filters/").c_str(), 1);
+            } else {
+                std::cerr << "Warning: Failed to find ImageMagick config or modules directories in " << magickLibDir << std::endl;
+            }
         } else {
-            std::cerr << "Warning: Failed to find ImageMagick config or modules directories in " << magickLibDir << std::endl;
+            std::cerr << "Warning: Failed to find ImageMagick directory in " << libDir << std::endl;
         }
-    } else {
-        std::cerr << "Warning: Failed to find ImageMagick directory in " << libDir << std::endl;
     }
 #else
     // Non-macOS setup
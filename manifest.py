@@ -0,0 +1,320 @@
+"""
+Persistent record of what the collector did to an app bundle, so that a later
+run only redoes what changed.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+
+MANIFEST_VERSION = 1
+
+
+def default_manifest_path(app_bundle_path):
+    app_bundle_path = os.path.normpath(os.path.abspath(app_bundle_path))
+    return os.path.join(os.path.dirname(app_bundle_path), f".{os.path.basename(app_bundle_path)}.manifest.json")
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def refresh_manifest(app_bundle_path, paths, manifest_path=None):
+    """
+    Record the current state of `paths` in the bundle's manifest, if it has one.
+
+    Signing rewrites files without changing what they are, so the manifest
+    is updated whatever architecture it was written for.
+
+    Returns:
+        bool: True if a manifest was found and saved
+    """
+    bundle_manifest = BundleManifest(app_bundle_path, manifest_path)
+    try:
+        with open(bundle_manifest.path) as f:
+            bundle_manifest.arch = json.load(f).get("arch")
+    except (OSError, ValueError):
+        return False
+    if not bundle_manifest.load():
+        return False
+    bundle_manifest.refresh(paths)
+    bundle_manifest.save()
+    return True
+
+
+class DigestCache:
+    """
+    SHA-256 of input files, keyed by real path and stat data.
+
+    Shared by the bundles of a batch (see batch.py), so a Homebrew library
+    that several bundles copy is read once. checkpoint() starts a new
+    bundle; `reused`/`bytes_reused` count the files of earlier bundles that
+    were not hashed again since the last checkpoint. Thread-safe.
+    """
+
+    def __init__(self):
+        self._digests = {}
+        self._previous = frozenset()
+        self._reused = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_reused = 0
+
+    def digest(self, path):
+        real_path = os.path.realpath(path)
+        st = os.stat(real_path)
+        key = (real_path, st.st_size, st.st_mtime_ns, st.st_ino)
+        with self._lock:
+            cached = self._digests.get(key)
+            if cached is not None:
+                self.hits += 1
+                if key in self._previous and key not in self._reused:
+                    self._reused.add(key)
+                    self.bytes_reused += st.st_size
+                return cached
+            self.misses += 1
+        digest = hash_file(real_path)
+        with self._lock:
+            self._digests[key] = digest
+        return digest
+
+    def checkpoint(self):
+        with self._lock:
+            self._previous = frozenset(self._digests)
+            self._reused = set()
+            self.bytes_reused = 0
+
+    @property
+    def reused(self):
+        return len(self._reused)
+
+
+def file_signature(path, with_hash=True):
+    """
+    Args:
+        path (str): File to describe
+        with_hash (bool): Also hash the contents (reads the whole file)
+
+    Returns:
+        dict: {"size", "mtime_ns"[, "sha256"]}, or None if the file is missing
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    signature = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    if with_hash:
+        signature["sha256"] = hash_file(path)
+    return signature
+
+
+class BundleManifest:
+    """
+    Per-file state of one app bundle, keyed by path relative to the bundle.
+
+    Args:
+        app_bundle_path (str): Path to the .app bundle
+        path (str, optional): Manifest file, defaults to default_manifest_path()
+        arch (str, optional): Architecture the bundle is thinned to; a manifest
+            written for another architecture (or none) is ignored
+    """
+
+    def __init__(self, app_bundle_path, path=None, arch=None):
+        self.app_bundle_path = app_bundle_path
+        self.arch = arch
+        self.bundle_root = os.path.realpath(app_bundle_path)
+        self.path = path or default_manifest_path(app_bundle_path)
+        self.files = {}
+        self._recorded = set()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable manifest {self.path}: {e}")
+            return False
+        if data.get("version") != MANIFEST_VERSION:
+            logging.info(f"Ignoring manifest {self.path} with version {data.get('version')}")
+            return False
+        if data.get("arch") != self.arch:
+            logging.info(f"Ignoring manifest {self.path} written for architecture {data.get('arch') or 'all'}")
+            return False
+        self.files = data.get("files", {})
+        return True
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({
+                "version": MANIFEST_VERSION,
+                "arch": self.arch,
+                "files": self.files,
+                "dependents": {target: sorted(paths) for target, paths in self.dependents().items()},
+            }, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def rel(self, path):
+        # Bundle-relative key for files inside the bundle, absolute path otherwise
+        real_path = os.path.realpath(path)
+        if real_path.startswith(self.bundle_root + os.sep):
+            return os.path.relpath(real_path, self.bundle_root)
+        return real_path
+
+    def abs(self, rel_path):
+        if os.path.isabs(rel_path):
+            return rel_path
+        return os.path.join(self.bundle_root, rel_path)
+
+    def _unchanged(self, path, recorded):
+        # Cheap stat comparison first; only hash when the stat data moved
+        current = file_signature(path, with_hash=False)
+        if current is None or recorded is None:
+            return False
+        if current["size"] != recorded.get("size"):
+            return False
+        if current["mtime_ns"] == recorded.get("mtime_ns"):
+            return True
+        if recorded.get("sha256") and hash_file(path) == recorded["sha256"]:
+            recorded["mtime_ns"] = current["mtime_ns"]  # touched, not modified
+            return True
+        return False
+
+    def dependents(self):
+        # Reverse edges between recorded bundle files
+        reverse = {}
+        for rel_path, record in self.files.items():
+            for target in record.get("references", {}).values():
+                if target:
+                    reverse.setdefault(target, set()).add(rel_path)
+        return reverse
+
+    def sources(self):
+        # Input path -> bundle-relative path of the copy made from it (deduplicated inputs included)
+        sources = {}
+        for rel_path, record in self.files.items():
+            for source in [record.get("source")] + record.get("also_from", []):
+                if source and not source.startswith(self.bundle_root + os.sep):
+                    sources[source] = rel_path
+        return sources
+
+    def refresh(self, paths):
+        """
+        Record the current state of files changed after collection, e.g. by signing,
+        so the next run does not take them for modified.
+        """
+        for path in paths:
+            record = self.files.get(self.rel(path))
+            if record is not None:
+                record["signature"] = file_signature(path)
+
+    def find_stale(self, binaries):
+        """
+        Work out which files have to be processed again.
+
+        A file is stale when it is new, when it or its recorded source changed,
+        or when it was deleted. Files that directly reference a stale file
+        are redone as well.
+
+        Args:
+            binaries (list): Mach-O files currently found in the bundle
+
+        Returns:
+            tuple: (stale, dirty, outdated) where `stale` lists the
+                bundle-relative paths that changed, `dirty` the paths to
+                reprocess (stale plus dependents) and `outdated` the bundle
+                copies whose source changed and that must be copied again
+        """
+        stale = set()
+        outdated = []
+        for rel_path, record in self.files.items():
+            path = self.abs(rel_path)
+            if not self._unchanged(path, record.get("signature")):
+                stale.add(rel_path)
+                continue
+            source = record.get("source")
+            if source and not self._unchanged(source, record.get("source_signature")):
+                stale.add(rel_path)
+                outdated.append(rel_path)
+
+        for binary in binaries:
+            rel_path = self.rel(binary)
+            if rel_path not in self.files:
+                stale.add(rel_path)
+
+        dirty = set(stale)
+        reverse = self.dependents()
+        for rel_path in stale:
+            dirty.update(reverse.get(rel_path, ()))
+        return sorted(stale), sorted(dirty), sorted(outdated)
+
+    def known_files(self, dirty):
+        """
+        Map every clean, already relocated file to its place in the bundle.
+
+        Both the bundle copy and the source it came from map to the bundle
+        copy, so discovery can stop at either.
+
+        Returns:
+            dict: real path -> bundle path
+        """
+        dirty = set(dirty)
+        known = {}
+        for rel_path, record in self.files.items():
+            if rel_path in dirty:
+                continue
+            dest = self.abs(rel_path)
+            known[dest] = dest
+            for source in [record.get("source")] + record.get("also_from", []):
+                if source:
+                    known[source] = dest
+        return known
+
+    def forget_missing(self):
+        for rel_path in [r for r in self.files if not os.path.exists(self.abs(r))]:
+            del self.files[rel_path]
+
+    def record(self, node, graph, plan=None):
+        """
+        Store the state of a processed graph node whose file is in the bundle.
+        """
+        if not node.dest or not os.path.isfile(node.dest):
+            return
+        rel_path = self.rel(node.dest)
+        if rel_path in self._recorded:
+            # Another input with the same content, deduplicated into this file
+            record = self.files[rel_path]
+            if not node.in_bundle and node.path != record.get("source"):
+                also_from = record.setdefault("also_from", [])
+                if node.path not in also_from:
+                    also_from.append(node.path)
+            return
+        self._recorded.add(rel_path)
+
+        references = {}
+        for reference, key in node.children.items():
+            child = graph.get(key) if key else None
+            target = child.dest if child is not None and child.dest else key
+            references[reference] = self.rel(target) if target else None
+
+        record = {
+            "signature": file_signature(node.dest),
+            "references": references,
+        }
+        source = node.path if not node.in_bundle else self.files.get(rel_path, {}).get("source")
+        if source:
+            # Bundle copies reprocessed in place keep pointing at where they came from
+            record["source"] = source
+            record["source_signature"] = file_signature(source, with_hash=False)
+        if plan is not None:
+            record["relink"] = plan.to_dict()
+        self.files[rel_path] = record
@@ -0,0 +1,467 @@
+"""
+Pack a finished app bundle into a zip, tar.xz or tar.zst archive, with a
+.contents.json listing, on any OS.
+"""
+
+import argparse
+import collections
+import hashlib
+import json
+import logging
+import lzma
+import os
+import stat
+import struct
+import subprocess
+import sys
+import tarfile
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import profiling
+import tool_runner
+
+FORMATS = ("zip", "tar.xz", "tar.zst")
+DEFAULT_LEVELS = {"zip": 6, "tar.xz": 6, "tar.zst": 10}
+
+# Uncompressed bytes per compression task. Chunks are compressed on `jobs` threads and written back
+# in order: deflate chunks of one member are joined with sync flushes (as pigz does), xz/zstd readers
+# accept concatenated streams/frames. Symlinks are stored as links and owners reset to 0.
+ZIP_CHUNK_SIZE = 1024 * 1024
+TAR_CHUNK_SIZE = 16 * 1024 * 1024
+
+# Sizes and offsets from _ZIP64_LIMIT on go to the Zip64 extra field; the classic field then holds _ZIP64_MARKER
+_ZIP64_LIMIT = 0xFFFFFFFF
+_ZIP64_MARKER = 0xFFFFFFFF
+_ZIP64_COUNT_LIMIT = 0xFFFF
+_ZIP_STORED = 0
+_ZIP_DEFLATED = 8
+_ZIP_UTF8 = 0x800
+
+
+class PackageError(Exception):
+    """
+    The bundle cannot be packed, e.g. a file changed while it was read.
+    """
+
+
+class _OrderedPipeline:
+    """
+    Run compression tasks on a thread pool and hand the results to the
+    writer in submission order, holding at most `window` of them.
+
+    With jobs <= 1 every task runs inline, so the serial and parallel modes
+    execute the same code.
+    """
+
+    def __init__(self, jobs, window=None):
+        self._executor = ThreadPoolExecutor(max_workers=jobs) if jobs > 1 else None
+        self._window = window or 2 * jobs
+        self._pending = collections.deque()
+
+    def submit(self, func, arg, then):
+        # then(func(arg)) on the writer thread, after everything submitted before
+        if self._executor is None:
+            then(func(arg))
+            return
+        self._pending.append((self._executor.submit(func, arg), then))
+        while len(self._pending) > self._window:
+            self._drain_one()
+
+    def after(self, then):
+        # then(None) on the writer thread, after everything submitted before
+        if self._executor is None or not self._pending:
+            then(None)
+        else:
+            self._pending.append((None, then))
+
+    def _drain_one(self):
+        future, then = self._pending.popleft()
+        then(future.result() if future is not None else None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        try:
+            while exc_type is None and self._pending:
+                self._drain_one()
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown(cancel_futures=True)
+
+
+def _walk(app_bundle_path):
+    # (archive name, path, lstat) of the bundle directory and everything in it, sorted, links not followed
+    root = os.path.abspath(app_bundle_path)
+    base = os.path.dirname(root)
+    stack = [root]
+    while stack:
+        path = stack.pop()
+        st = os.lstat(path)
+        yield os.path.relpath(path, base).replace(os.sep, "/"), path, st
+        if stat.S_ISDIR(st.st_mode):
+            with os.scandir(path) as it:
+                children = sorted(entry.path for entry in it)
+            stack.extend(reversed(children))
+
+
+def _entry(name, st, sha256=None, target=None):
+    # One line of the contents manifest
+    kind = "dir" if stat.S_ISDIR(st.st_mode) else "symlink" if stat.S_ISLNK(st.st_mode) else "file"
+    entry = {"path": name, "type": kind, "mode": f"{stat.S_IMODE(st.st_mode):04o}"}
+    if kind == "file":
+        entry["size"] = st.st_size
+        entry["sha256"] = sha256
+    elif kind == "symlink":
+        entry["target"] = target
+    return entry
+
+
+def _dos_time(mtime):
+    t = time.localtime(mtime)
+    year = min(max(t.tm_year, 1980), 2107)
+    if year != t.tm_year:
+        return 0, ((year - 1980) << 9) | (1 << 5) | 1
+    return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), ((year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+
+class _ZipMember:
+    # Local header position and running checksums of the member being written
+
+    def __init__(self, name, st, method, zip64):
+        self.name = name.encode()
+        self.st = st
+        self.method = method
+        self.zip64 = zip64
+        self.offset = 0
+        self.crc = 0
+        self.compressed = 0
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+
+
+class _ZipWriter:
+    """
+    Zip writer taking already-compressed data, with Zip64 where needed.
+
+    zipfile can only compress members itself, on the calling thread.
+    """
+
+    def __init__(self, fileobj):
+        self._f = fileobj
+        self._members = []
+
+    def _extended_time(self, st):
+        # 0x5455: mtime in UTC seconds, restored by unzip
+        return struct.pack("<HHBI", 0x5455, 5, 1, int(st.st_mtime) & 0xFFFFFFFF)
+
+    def begin(self, member):
+        member.offset = self._f.tell()
+        dos_time, dos_date = _dos_time(member.st.st_mtime)
+        extra = self._extended_time(member.st)
+        sizes = (0, 0)
+        if member.zip64:
+            extra += struct.pack("<HHQQ", 0x0001, 16, 0, 0)
+            sizes = (_ZIP64_MARKER, _ZIP64_MARKER)
+        self._f.write(struct.pack(
+            "<IHHHHHIIIHH", 0x04034b50, 45 if member.zip64 else 20, _ZIP_UTF8, member.method,
+            dos_time, dos_date, 0, sizes[0], sizes[1], len(member.name), len(extra),
+        ))
+        self._f.write(member.name)
+        self._f.write(extra)
+
+    def write(self, member, raw, compressed):
+        member.crc = zlib.crc32(raw, member.crc)
+        member.sha256.update(raw)
+        member.size += len(raw)
+        member.compressed += len(compressed)
+        self._f.write(compressed)
+
+    def end(self, member):
+        if not member.zip64 and (member.compressed >= _ZIP64_LIMIT or member.size >= _ZIP64_LIMIT):
+            raise PackageError(f"{member.name.decode()} grew past 4 GiB while it was packed")
+        end = self._f.tell()
+        self._f.seek(member.offset + 14)
+        if member.zip64:
+            self._f.write(struct.pack("<I", member.crc))
+            self._f.seek(member.offset + 30 + len(member.name) + 9 + 4)
+            self._f.write(struct.pack("<QQ", member.size, member.compressed))
+        else:
+            self._f.write(struct.pack("<III", member.crc, member.compressed, member.size))
+        self._f.seek(end)
+        self._members.append(member)
+
+    def close(self):
+        start = self._f.tell()
+        for member in self._members:
+            dos_time, dos_date = _dos_time(member.st.st_mtime)
+            zip64_fields = []
+            size, compressed, offset = member.size, member.compressed, member.offset
+            if size >= _ZIP64_LIMIT:
+                zip64_fields.append(size)
+                size = _ZIP64_MARKER
+            if compressed >= _ZIP64_LIMIT:
+                zip64_fields.append(compressed)
+                compressed = _ZIP64_MARKER
+            if offset >= _ZIP64_LIMIT:
+                zip64_fields.append(offset)
+                offset = _ZIP64_MARKER
+            extra = self._extended_time(member.st)
+            if zip64_fields:
+                extra += struct.pack(f"<HH{len(zip64_fields)}Q", 0x0001, 8 * len(zip64_fields), *zip64_fields)
+            needed = 45 if member.zip64 or zip64_fields else 20
+            external = (member.st.st_mode & 0xFFFF) << 16
+            if stat.S_ISDIR(member.st.st_mode):
+                external |= 0x10
+            self._f.write(struct.pack(
+                "<IHHHHHHIIIHHHHHII", 0x02014b50, (3 << 8) | 45, needed, _ZIP_UTF8, member.method,
+                dos_time, dos_date, member.crc, compressed, size, len(member.name), len(extra), 0, 0, 0,
+                external, offset,
+            ))
+            self._f.write(member.name)
+            self._f.write(extra)
+        end = self._f.tell()
+        count = len(self._members)
+        if count >= _ZIP64_COUNT_LIMIT or start >= _ZIP64_LIMIT or end - start >= _ZIP64_LIMIT:
+            self._f.write(struct.pack("<IQHHIIQQQQ", 0x06064b50, 44, (3 << 8) | 45, 45, 0, 0, count, count, end - start, start))
+            self._f.write(struct.pack("<IIQI", 0x07064b50, 0, end, 1))
+            self._f.write(struct.pack("<IHHHHIIH", 0x06054b50, 0, 0, 0xFFFF, 0xFFFF, _ZIP64_MARKER, _ZIP64_MARKER, 0))
+        else:
+            self._f.write(struct.pack("<IHHHHIIH", 0x06054b50, 0, 0, count, count, end - start, start, 0))
+
+
+def _deflate_chunk(level):
+    def compress(task):
+        data, last = task
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+    return compress
+
+
+def _pack_zip(app_bundle_path, out, level, jobs, entries):
+    writer = _ZipWriter(out)
+    compress = _deflate_chunk(level)
+    with _OrderedPipeline(jobs) as pipeline:
+        for name, path, st in _walk(app_bundle_path):
+            if stat.S_ISDIR(st.st_mode) or stat.S_ISLNK(st.st_mode):
+                target = os.readlink(path) if stat.S_ISLNK(st.st_mode) else None
+                member = _ZipMember(name + "/" if target is None else name, st, _ZIP_STORED, False)
+                data = target.encode() if target is not None else b""
+
+                def stored(_, member=member, data=data):
+                    writer.begin(member)
+                    writer.write(member, data, data)
+                    writer.end(member)
+                pipeline.after(stored)
+                entries.append(_entry(name, st, target=target))
+                continue
+            if not stat.S_ISREG(st.st_mode):
+                logging.warning(f"Skipping {path}: not a regular file, directory or symlink")
+                continue
+
+            member = _ZipMember(name, st, _ZIP_DEFLATED if st.st_size else _ZIP_STORED, st.st_size * 1.05 > _ZIP64_LIMIT)
+            entry = _entry(name, st)
+            entries.append(entry)
+            pipeline.after(lambda _, member=member: writer.begin(member))
+            chunks = -(-st.st_size // ZIP_CHUNK_SIZE)
+            with open(path, "rb") as f:
+                for i in range(chunks):
+                    data = f.read(ZIP_CHUNK_SIZE)
+                    last = i == chunks - 1
+                    if len(data) != (st.st_size - i * ZIP_CHUNK_SIZE if last else ZIP_CHUNK_SIZE):
+                        raise PackageError(f"{path} changed while it was packed")
+                    pipeline.submit(compress, (data, last), lambda out_, member=member, data=data: writer.write(member, data, out_))
+
+            def finish(_, member=member, entry=entry):
+                writer.end(member)
+                entry["sha256"] = member.sha256.hexdigest()
+            pipeline.after(finish)
+    writer.close()
+
+
+def _xz_chunk(level):
+    def compress(data):
+        return lzma.compress(data, format=lzma.FORMAT_XZ, preset=level)
+    return compress
+
+
+def _zstd_chunk(level):
+    # The zstandard module if installed, else the zstd tool
+    try:
+        import zstandard
+    except ImportError:
+        zstandard = None
+    if zstandard is not None:
+        local = threading.local()
+
+        def compress(data):
+            if not hasattr(local, "compressor"):
+                local.compressor = zstandard.ZstdCompressor(level=level)
+            return local.compressor.compress(data)
+        return compress
+
+    zstd = tool_runner.get_runner().find_tool("zstd")
+
+    def compress_with_tool(data):
+        try:
+            result = subprocess.run([zstd, "-q", "-c", f"-{level}"], input=data, capture_output=True)
+        except OSError as e:
+            raise PackageError(f"tar.zst needs the zstandard module or the zstd tool: {e}")
+        if result.returncode != 0:
+            raise PackageError(f"zstd failed: {result.stderr.decode(errors='replace').strip()}")
+        profiling.count("tool.zstd")
+        return result.stdout
+    return compress_with_tool
+
+
+class _ChunkedSink:
+    # File object for tarfile that compresses what it is given in chunks, in order
+
+    def __init__(self, pipeline, compress, out):
+        self._pipeline = pipeline
+        self._compress = compress
+        self._out = out
+        self._buffer = bytearray()
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= TAR_CHUNK_SIZE:
+            chunk = bytes(self._buffer[:TAR_CHUNK_SIZE])
+            del self._buffer[:TAR_CHUNK_SIZE]
+            self._pipeline.submit(self._compress, chunk, self._out.write)
+        return len(data)
+
+    def flush(self):
+        if self._buffer:
+            self._pipeline.submit(self._compress, bytes(self._buffer), self._out.write)
+            self._buffer = bytearray()
+
+
+class _HashingReader:
+    # Hands a member's bytes to tarfile and hashes them on the way
+
+    def __init__(self, f, path, size):
+        self._f = f
+        self._path = path
+        self._remaining = size
+        self.sha256 = hashlib.sha256()
+
+    def read(self, n=-1):
+        data = self._f.read(n)
+        self._remaining -= len(data)
+        if self._remaining < 0 or (not data and self._remaining):
+            raise PackageError(f"{self._path} changed while it was packed")
+        self.sha256.update(data)
+        return data
+
+
+def _pack_tar(app_bundle_path, out, compress, jobs, entries):
+    with _OrderedPipeline(jobs) as pipeline:
+        sink = _ChunkedSink(pipeline, compress, out)
+        with tarfile.open(fileobj=sink, mode="w|", format=tarfile.PAX_FORMAT) as tar:
+            for name, path, st in _walk(app_bundle_path):
+                info = tar.gettarinfo(path, name)
+                if info is None:
+                    logging.warning(f"Skipping {path}: not a regular file, directory or symlink")
+                    continue
+                info.uid = info.gid = 0
+                info.uname = info.gname = ""
+                if info.isreg():
+                    with open(path, "rb") as f:
+                        reader = _HashingReader(f, path, info.size)
+                        tar.addfile(info, reader)
+                    entries.append(_entry(name, st, reader.sha256.hexdigest()))
+                else:
+                    tar.addfile(info)
+                    entries.append(_entry(name, st, target=info.linkname if info.issym() else None))
+        sink.flush()
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def default_output(app_bundle_path, fmt):
+    app = os.path.abspath(app_bundle_path)
+    return os.path.join(os.path.dirname(app), f"{os.path.splitext(os.path.basename(app))[0]}.{fmt}")
+
+
+def package_bundle(app_bundle_path, output=None, fmt="zip", level=None, jobs=1, contents_path=None):
+    """
+    Pack the bundle into a compressed archive and write its contents manifest.
+
+    Args:
+        app_bundle_path (str): Path to the .app bundle
+        output (str, optional): Archive path (default: <App>.<fmt> next to the bundle)
+        fmt (str): One of FORMATS
+        level (int, optional): Compression level (default: DEFAULT_LEVELS[fmt])
+        jobs (int): Number of chunks compressed at the same time
+        contents_path (str, optional): Manifest path (default: <output>.contents.json)
+
+    Returns:
+        dict: The contents manifest
+    """
+    if fmt not in FORMATS:
+        raise PackageError(f"Unknown archive format {fmt} (expected one of {', '.join(FORMATS)})")
+    output = output or default_output(app_bundle_path, fmt)
+    contents_path = contents_path or output + ".contents.json"
+    level = DEFAULT_LEVELS[fmt] if level is None else level
+    entries = []
+    partial = output + ".part"
+    with profiling.phase("package", format=fmt):
+        try:
+            with open(partial, "wb") as out:
+                if fmt == "zip":
+                    _pack_zip(app_bundle_path, out, level, jobs, entries)
+                else:
+                    compress = _xz_chunk(level) if fmt == "tar.xz" else _zstd_chunk(level)
+                    _pack_tar(app_bundle_path, out, compress, jobs, entries)
+            os.replace(partial, output)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+
+    contents = {
+        "bundle": os.path.basename(os.path.abspath(app_bundle_path)),
+        "archive": os.path.basename(output),
+        "format": fmt,
+        "archive_size": os.path.getsize(output),
+        "archive_sha256": _file_sha256(output),
+        "entries": entries,
+    }
+    with open(contents_path, "w") as f:
+        json.dump(contents, f, indent=1)
+    size = sum(e.get("size", 0) for e in entries)
+    profiling.count("package.entries", len(entries))
+    profiling.count("package.bytes_in", size)
+    profiling.count("package.bytes_out", contents["archive_size"])
+    logging.info(f"Packed {len(entries)} entries ({size} bytes) into {output} ({contents['archive_size']} bytes)")
+    return contents
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Pack an app bundle into a zip, tar.xz or tar.zst archive with a contents manifest")
+    parser.add_argument("--app", required=True, help="Path to the .app bundle")
+    parser.add_argument("--format", choices=FORMATS, default="zip", help="Archive format (default: zip)")
+    parser.add_argument("--output", "-o", help="Archive path (default: <App>.<format> next to the bundle)")
+    parser.add_argument("--level", type=int, help="Compression level (default: zip 6, tar.xz 6, tar.zst 10)")
+    parser.add_argument("--jobs", "-j", type=int, default=1, help="Number of chunks compressed in parallel (default: 1)")
+    parser.add_argument("--contents", help="Contents manifest path (default: <archive>.contents.json)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.app):
+        logging.error(f"App bundle not found at {args.app}")
+        sys.exit(1)
+    try:
+        package_bundle(args.app, args.output, args.format, args.level, args.jobs, args.contents)
+    except (OSError, PackageError) as e:
+        logging.error(f"Packaging failed: {e}")
+        sys.exit(1)
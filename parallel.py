@@ -0,0 +1,86 @@
+"""Worker-pool helpers shared by the collection and signing stages."""
+
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class PathLocks:
+    """
+    One lock per path, created on demand.
+
+    Used to serialize writes to the same destination in the bundle
+    (e.g. two libraries copied to the same name in Contents/Resources/lib,
+    or two binaries inside the same framework).
+    """
+
+    def __init__(self):
+        self._locks = {}
+        self._guard = threading.Lock()
+
+    def get(self, path):
+        with self._guard:
+            lock = self._locks.get(path)
+            if lock is None:
+                lock = self._locks[path] = threading.RLock()
+            return lock
+
+
+def map_in_order(func, items, jobs=1):
+    """
+    Apply `func` to every item, up to `jobs` at a time.
+
+    Returns:
+        list: Results in the order of `items`, regardless of completion order
+    """
+    items = list(items)
+    if jobs <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(func, items))
+
+
+def run_in_dependency_order(graph, func, jobs=1):
+    """
+    Call `func(node)` for every node of a DependencyGraph, leaves first.
+
+    A node is only started once all of its dependencies have finished, so
+    independent libraries run concurrently while dependency order is kept.
+    Cycles are broken the same way as in DependencyGraph.post_order().
+    The first exception raised by `func` is re-raised after running tasks
+    have finished.
+    """
+    order = graph.post_order()
+    if jobs <= 1:
+        for node in order:
+            func(node)
+        return
+
+    rank = {node.path: i for i, node in enumerate(order)}
+    pending = {}
+    dependents = {node.path: [] for node in order}
+    for node in order:
+        # Only edges to nodes ranked earlier count; the others are cycle back edges
+        children = {c.path for c in graph.child_nodes(node) if rank[c.path] < rank[node.path]}
+        pending[node.path] = children
+        for child in children:
+            dependents[child].append(node.path)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        running = {}
+
+        def submit(key):
+            running[executor.submit(func, graph.get(key))] = key
+
+        for node in order:
+            if not pending[node.path]:
+                submit(node.path)
+
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in sorted(done, key=lambda f: rank[running[f]]):
+                key = running.pop(future)
+                future.result()
+                for parent in dependents[key]:
+                    pending[parent].discard(key)
+                    if not pending[parent]:
+                        submit(parent)
@@ -0,0 +1,211 @@
+"""Optional timing of phases and external tool calls (the scripts' --profile flag)."""
+
+import json
+import logging
+import os
+import subprocess
+import threading
+import time
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+_profiler = None
+
+
+class _Span:
+    def __init__(self, profiler, name, category, args):
+        self.profiler = profiler
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        end = time.perf_counter()
+        if exc_type is not None:
+            self.args = dict(self.args or {}, error=exc_type.__name__)
+        self.profiler.add_span(self.name, self.category, self.start, end, self.args)
+        return False
+
+
+class Profiler:
+    """
+    Collects spans (timed phases and tool calls) and counters for one run.
+    """
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.spans = []
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def span(self, name, category, args=None):
+        return _Span(self, name, category, args)
+
+    def add_span(self, name, category, start, end, args=None):
+        thread = threading.current_thread()
+        span = {
+            "name": name,
+            "category": category,
+            "start": start - self.origin,
+            "duration": end - start,
+            "thread": thread.ident,
+            "thread_name": thread.name,
+        }
+        if args:
+            span["args"] = args
+        with self._lock:
+            self.spans.append(span)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def summary(self):
+        """
+        Aggregate spans per (category, name).
+
+        Returns:
+            list: Dicts with category, name, calls, total, mean and max
+                seconds, slowest total first
+        """
+        groups = {}
+        for span in self.spans:
+            key = (span["category"], span["name"])
+            group = groups.setdefault(key, {"category": key[0], "name": key[1], "calls": 0, "total": 0.0, "max": 0.0})
+            group["calls"] += 1
+            group["total"] += span["duration"]
+            group["max"] = max(group["max"], span["duration"])
+        for group in groups.values():
+            group["mean"] = group["total"] / group["calls"]
+        return sorted(groups.values(), key=lambda g: (g["category"] != "phase", -g["total"]))
+
+    def format_table(self):
+        lines = [f"{'category':<10}{'name':<28}{'calls':>8}{'total s':>11}{'mean ms':>11}{'max ms':>11}"]
+        for g in self.summary():
+            lines.append(
+                f"{g['category']:<10}{g['name'][:27]:<28}{g['calls']:>8}{g['total']:>11.3f}"
+                f"{g['mean'] * 1000:>11.2f}{g['max'] * 1000:>11.2f}"
+            )
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"{'counter':<10}{name[:27]:<28}{value:>8}")
+        return "\n".join(lines)
+
+    def to_dict(self):
+        return {
+            "wall_seconds": time.perf_counter() - self.origin,
+            "summary": self.summary(),
+            "counters": dict(self.counters),
+            "spans": list(self.spans),
+        }
+
+    def chrome_trace(self):
+        # Trace Event Format: complete ("X") events in microseconds, one track per thread
+        pid = os.getpid()
+        events = []
+        threads = {}
+        for span in self.spans:
+            threads.setdefault(span["thread"], span["thread_name"])
+            event = {
+                "name": span["name"],
+                "cat": span["category"],
+                "ph": "X",
+                "ts": round(span["start"] * 1e6, 3),
+                "dur": round(span["duration"] * 1e6, 3),
+                "pid": pid,
+                "tid": span["thread"],
+            }
+            if "args" in span:
+                event["args"] = span["args"]
+            events.append(event)
+        for tid, name in threads.items():
+            events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}})
+        if self.counters:
+            end = (time.perf_counter() - self.origin) * 1e6
+            events.append({"name": "counters", "ph": "C", "ts": round(end, 3), "pid": pid, "args": dict(self.counters)})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write(self, prefix):
+        """
+        Write <prefix>.json (summary, counters and spans) and <prefix>.trace.json (Chrome trace).
+
+        Returns:
+            tuple: The two paths
+        """
+        json_path = f"{prefix}.json"
+        trace_path = f"{prefix}.trace.json"
+        with open(json_path, "w") as f:
+            json.dump(self.to_dict(), f, indent=1)
+        with open(trace_path, "w") as f:
+            json.dump(self.chrome_trace(), f)
+        return json_path, trace_path
+
+
+def enable():
+    """
+    Start recording. Returns the active Profiler.
+    """
+    global _profiler
+    if _profiler is None:
+        _profiler = Profiler()
+    return _profiler
+
+
+def disable():
+    global _profiler
+    _profiler = None
+
+
+def get_profiler():
+    return _profiler
+
+
+def phase(name, **args):
+    """
+    Context manager timing one phase of a run (no-op unless enabled).
+    """
+    if _profiler is None:
+        return _NULL_SPAN
+    return _profiler.span(name, "phase", args or None)
+
+
+def count(name, n=1):
+    if _profiler is not None:
+        _profiler.count(name, n)
+
+
+def run_tool(cmd, **kwargs):
+    """
+    subprocess.run() for external tools, timed and counted when profiling.
+
+    The span is named after the tool (basename of cmd[0]).
+    """
+    if _profiler is None:
+        return subprocess.run(cmd, **kwargs)
+    tool = os.path.basename(cmd[0])
+    _profiler.count(f"tool.{tool}")
+    with _profiler.span(tool, "tool", {"argc": len(cmd)}):
+        return subprocess.run(cmd, **kwargs)
+
+
+def report(prefix):
+    """
+    Log the summary table and write the JSON and trace files, if profiling is on.
+    """
+    if _profiler is None:
+        return None
+    logging.info("Profile:\n" + _profiler.format_table())
+    paths = _profiler.write(prefix)
+    logging.info(f"Profile written to {paths[0]} and {paths[1]}")
+    return paths
@@ -0,0 +1,294 @@
+"""Remove what a collected bundle never loads, and report what the rest costs."""
+
+import argparse
+import fnmatch
+import json
+import logging
+import os
+import shutil
+import sys
+
+import audit
+import bundle_scanner
+import macho
+import manifest
+import thinning
+
+# Bundle-relative directories (fnmatch patterns) whose Mach-O files are dlopen()ed at run time
+PLUGIN_DIRS = (
+    "Contents/Resources/lib/mlt",
+    "Contents/Resources/lib/gdk-pixbuf-2.0",
+    "Contents/Resources/lib/gtk-3.0",
+    "Contents/Resources/lib/gio/modules",
+    "Contents/Resources/lib/synfig",
+    "Contents/Resources/lib/python3*",
+    "Contents/Frameworks/Python.framework",
+    "Contents/Resources/Frameworks/Python.framework",
+)
+EXECUTABLE_DIRS = ("Contents/MacOS", "Contents/Resources/bin")
+
+# Directories where unreachable Mach-O files are removed
+PRUNABLE_DIRS = ("Contents/Resources/lib", "Contents/Frameworks")
+
+# Framework content only needed to build against the framework
+FRAMEWORK_DEV_DIRS = {"Headers", "PrivateHeaders", "Modules"}
+
+
+class PruneReport:
+    """
+    What prune_bundle() removed (or would remove) and the size attribution.
+
+    Attributes:
+        removed (list): Bundle-relative paths of removed files and directories
+        bytes_removed (int): Their total size
+        roots (dict): Root rel path -> {"files", "bytes", "exclusive_bytes"}
+        shared_bytes (int): Bytes reachable from more than one root
+        reachable_bytes (int): Bytes of all reachable Mach-O files (and framework payloads)
+    """
+
+    def __init__(self):
+        self.removed = []
+        self.bytes_removed = 0
+        self.roots = {}
+        self.shared_bytes = 0
+        self.reachable_bytes = 0
+
+    def to_dict(self):
+        return {
+            "removed": self.removed,
+            "bytes_removed": self.bytes_removed,
+            "reachable_bytes": self.reachable_bytes,
+            "shared_bytes": self.shared_bytes,
+            "roots": self.roots,
+        }
+
+    def format_table(self, limit=20):
+        mib = 1024 * 1024
+        lines = [f"{'root':<60}{'files':>7}{'MiB':>10}{'only MiB':>10}"]
+        ranked = sorted(self.roots.items(), key=lambda item: -item[1]["exclusive_bytes"])
+        for rel_path, entry in ranked[:limit]:
+            lines.append(f"{rel_path[-59:]:<60}{entry['files']:>7}{entry['bytes'] / mib:>10.2f}{entry['exclusive_bytes'] / mib:>10.2f}")
+        if len(ranked) > limit:
+            rest = sum(entry["exclusive_bytes"] for _, entry in ranked[limit:])
+            lines.append(f"{f'({len(ranked) - limit} more roots)':<60}{'':>7}{'':>10}{rest / mib:>10.2f}")
+        lines.append(f"{'shared by several roots':<60}{'':>7}{'':>10}{self.shared_bytes / mib:>10.2f}")
+        lines.append(f"{'reachable in total':<60}{'':>7}{'':>10}{self.reachable_bytes / mib:>10.2f}")
+        lines.append(f"{'pruned':<60}{len(self.removed):>7}{'':>10}{self.bytes_removed / mib:>10.2f}")
+        return "\n".join(lines)
+
+
+def _under(rel_path, directories):
+    # True if rel_path is one of the directories (fnmatch patterns) or inside one
+    parts = rel_path.split("/")
+    return any(fnmatch.fnmatchcase("/".join(parts[:d.count("/") + 1]), d) for d in directories)
+
+
+def _framework_root(rel_path):
+    # "Contents/Frameworks/X.framework" for any path inside a framework, else None
+    if ".framework/" not in rel_path and not rel_path.endswith(".framework"):
+        return None
+    return rel_path.split(".framework", 1)[0] + ".framework"
+
+
+def _tree_size(path):
+    if os.path.islink(path) or not os.path.isdir(path):
+        return os.lstat(path).st_size
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files:
+            full = os.path.join(root, name)
+            if os.path.islink(full) or not os.path.isdir(full):
+                total += os.lstat(full).st_size
+    return total
+
+
+def find_roots(files, extra_roots=()):
+    """
+    Mach-O files the app starts from: executables and dlopen()ed plugins.
+
+    Args:
+        files (list): bundle_scanner.BundleFile records of the bundle
+        extra_roots (iterable): More bundle-relative paths or directories
+
+    Returns:
+        list: BundleFile records of the roots
+    """
+    extra = tuple(r.rstrip("/") for r in extra_roots)
+    roots = []
+    for f in files:
+        if not f.is_macho:
+            continue
+        if (_under(f.rel_path, EXECUTABLE_DIRS) and f.is_executable) or _under(f.rel_path, PLUGIN_DIRS + extra) \
+                or macho.get_file_type(f.path) == macho.MH_BUNDLE:
+            roots.append(f)
+    return roots
+
+
+def reachable_from(roots, edges):
+    """
+    Every file reachable from each root.
+
+    Returns:
+        dict: Root real path -> set of real paths (including the root)
+    """
+    closures = {}
+    for root in roots:
+        seen = {root}
+        stack = [root]
+        while stack:
+            for target in edges.get(stack.pop(), ()):
+                if target not in seen:
+                    seen.add(target)
+                    stack.append(target)
+        closures[root] = seen
+    return closures
+
+
+def _unused_framework_content(app_bundle_path, framework, reachable):
+    # Build-time directories and versions of one framework that nothing loads
+    unused = []
+    framework_path = os.path.join(app_bundle_path, framework)
+    version_dirs = [framework_path]
+    versions = os.path.join(framework_path, "Versions")
+    if os.path.isdir(versions) and not os.path.islink(versions):
+        current = os.path.realpath(os.path.join(versions, "Current"))
+        for name in sorted(os.listdir(versions)):
+            path = os.path.join(versions, name)
+            if name == "Current" or os.path.islink(path):
+                continue
+            real = os.path.realpath(path)
+            if real != current and not any(r.startswith(real + os.sep) for r in reachable):
+                unused.append(path)
+            else:
+                version_dirs.append(path)
+    for directory in version_dirs:
+        for name in sorted(FRAMEWORK_DEV_DIRS):
+            path = os.path.join(directory, name)
+            if os.path.lexists(path):
+                unused.append(path)
+    return unused
+
+
+def prune_bundle(app_bundle_path, jobs=1, files=None, extra_roots=(), dry_run=False, manifest_path=None, arch=None):
+    """
+    Remove unreachable libraries, frameworks and build-time framework content.
+
+    Args:
+        app_bundle_path (str): Path to the .app bundle
+        jobs (int): Number of files parsed at the same time
+        files (list, optional): bundle_scanner.BundleFile records of an earlier scan
+        extra_roots (iterable): Bundle-relative paths or directories that are also roots
+        dry_run (bool): Only report what would be removed
+        manifest_path, arch: Collector manifest to drop removed files from
+
+    Returns:
+        PruneReport
+    """
+    if files is None:
+        files = list(bundle_scanner.scan_bundle(app_bundle_path))
+    bundle_root = os.path.realpath(app_bundle_path)
+    edges = audit.load_graph(app_bundle_path, jobs, files)
+    roots = find_roots(files, extra_roots)
+    closures = reachable_from(sorted({os.path.realpath(r.path) for r in roots}), edges)
+    reachable = set().union(*closures.values()) if closures else set()
+    report = PruneReport()
+
+    # Unreachable Mach-O files and frameworks
+    doomed = set()
+    frameworks = {}
+    for f in files:
+        framework = _framework_root(f.rel_path)
+        real_path = os.path.realpath(f.path)
+        if framework:
+            frameworks.setdefault(framework, set())
+            if f.is_macho and real_path in reachable:
+                frameworks[framework].add(real_path)
+        elif f.is_macho and _under(f.rel_path, PRUNABLE_DIRS) and real_path not in reachable \
+                and not _under(f.rel_path, PLUGIN_DIRS):
+            doomed.add(f.path)
+    for framework, used in frameworks.items():
+        if not _under(framework, PRUNABLE_DIRS):
+            continue
+        if used or _under(framework, PLUGIN_DIRS):
+            doomed.update(_unused_framework_content(app_bundle_path, framework, used))
+        else:
+            doomed.add(os.path.join(app_bundle_path, framework))
+
+    # Aliases whose target goes away
+    doomed_real = {os.path.realpath(p) for p in doomed}
+    for f in files:
+        if f.is_symlink and _under(f.rel_path, PRUNABLE_DIRS):
+            target = os.path.realpath(f.path)
+            if target in doomed_real or any(target.startswith(d + os.sep) for d in doomed_real):
+                doomed.add(f.path)
+
+    # Size attribution, frameworks counted with their payload
+    sizes = {}
+    for real_path in reachable:
+        sizes[real_path] = os.path.getsize(real_path)
+    for framework, used in frameworks.items():
+        if used:
+            framework_path = os.path.join(app_bundle_path, framework)
+            payload = _tree_size(framework_path) - sum(_tree_size(p) for p in doomed if p.startswith(framework_path + os.sep))
+            payload -= sum(sizes[r] for r in used)
+            first = min(used)
+            sizes[first] += max(0, payload)
+    owners = {}
+    for root, closure in closures.items():
+        for real_path in closure:
+            owners.setdefault(real_path, []).append(root)
+    for root, closure in closures.items():
+        report.roots[os.path.relpath(root, bundle_root)] = {
+            "files": len(closure),
+            "bytes": sum(sizes[p] for p in closure),
+            "exclusive_bytes": sum(sizes[p] for p in closure if len(owners[p]) == 1),
+        }
+    report.shared_bytes = sum(sizes[p] for p, o in owners.items() if len(o) > 1)
+    report.reachable_bytes = sum(sizes.values())
+
+    # Parents before children, so nothing is removed twice
+    for path in sorted(doomed):
+        if any(path.startswith(other + os.sep) for other in doomed):
+            continue
+        size = _tree_size(path)
+        report.removed.append(os.path.relpath(path, app_bundle_path))
+        report.bytes_removed += size
+        if dry_run:
+            logging.info(f"Would remove {path} ({size} bytes)")
+            continue
+        logging.info(f"Removing {path} ({size} bytes)")
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.unlink(path)
+
+    if report.removed and not dry_run:
+        bundle_manifest = manifest.BundleManifest(app_bundle_path, manifest_path, arch)
+        if bundle_manifest.load():
+            bundle_manifest.forget_missing()
+            bundle_manifest.save()
+    return report
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Remove what an app bundle never loads and report what the rest costs")
+    parser.add_argument("--app", required=True, help="Path to the .app bundle")
+    parser.add_argument("--jobs", "-j", type=int, default=1, help="Number of files parsed in parallel (default: 1)")
+    parser.add_argument("--root", action="append", default=[], help="Bundle-relative file or directory that is also loaded at run time (repeatable)")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be removed")
+    parser.add_argument("--report", metavar="FILE", help="Also write the report as JSON")
+    parser.add_argument("--arch", choices=thinning.ARCHS, help="Architecture the bundle was collected for (selects the manifest)")
+    parser.add_argument("--manifest", help="Collector manifest to update (default: .<app name>.manifest.json next to the bundle)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.app):
+        logging.error(f"App bundle not found at {args.app}")
+        sys.exit(1)
+
+    result = prune_bundle(args.app, args.jobs, extra_roots=args.root, dry_run=args.dry_run,
+                          manifest_path=args.manifest, arch=args.arch)
+    logging.info("Size by root:\n" + result.format_table())
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(result.to_dict(), f, indent=1)
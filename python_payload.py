@@ -0,0 +1,349 @@
+"""
+Make the embedded Python.framework self-contained and fast to start: remove
+tests and caches, relocate its Mach-O files and precompile its modules.
+"""
+
+import argparse
+import compileall
+import logging
+import os
+import py_compile
+import re
+import shutil
+import sys
+import time
+
+import bundle_scanner
+import copy_store
+import dependency_collection_4
+import dependency_graph
+import macho
+import parallel
+import profiling
+import relink
+import thinning
+import tool_runner
+
+# Where the launcher (main.cpp) and Homebrew-style layouts keep the framework
+FRAMEWORK_DIRS = (
+    "Contents/Resources/Frameworks/Python.framework",
+    "Contents/Frameworks/Python.framework",
+)
+
+# Directories never needed at run time
+CLUTTER_DIRS = {"__pycache__"}
+TEST_DIRS = {"test", "tests", "idle_test"}
+CLUTTER_SUFFIXES = (".pyc", ".pyo")
+
+_VERSION_DIR = re.compile(r"^\d+\.\d+$")
+
+
+class Payload:
+    """
+    One embedded Python installation.
+
+    Attributes:
+        framework (str): The Python.framework directory
+        version (str): e.g. "3.11"
+        lib_dir (str): Versions/<version>/lib/python<version>, the standard
+            library with lib-dynload and site-packages
+    """
+
+    def __init__(self, framework, version):
+        self.framework = framework
+        self.version = version
+        self.home = os.path.join(framework, "Versions", version)
+        self.lib_dir = os.path.join(self.home, "lib", f"python{version}")
+
+    def interpreter(self):
+        for name in (f"python{self.version}", "python3"):
+            path = os.path.join(self.home, "bin", name)
+            if os.access(path, os.X_OK):
+                return path
+        return None
+
+    def __repr__(self):
+        return f"Payload({self.framework!r}, {self.version!r})"
+
+
+def find_payloads(app_bundle_path):
+    """
+    Embedded Python installations of the bundle, one per version directory
+    that has a standard library.
+
+    Returns:
+        list: Payload objects
+    """
+    payloads = []
+    for rel_path in FRAMEWORK_DIRS:
+        framework = os.path.join(app_bundle_path, rel_path)
+        versions = os.path.join(framework, "Versions")
+        try:
+            names = sorted(e.name for e in os.scandir(versions) if e.is_dir(follow_symlinks=False))
+        except OSError:
+            continue
+        for name in names:
+            payload = Payload(framework, name)
+            if _VERSION_DIR.match(name) and os.path.isdir(payload.lib_dir):
+                payloads.append(payload)
+    return payloads
+
+
+def remove_clutter(lib_dir, keep_tests=False):
+    """
+    Delete __pycache__ directories, stray .pyc/.pyo files and (unless
+    `keep_tests`) test packages below `lib_dir`.
+
+    Returns:
+        tuple: (paths removed, bytes removed)
+    """
+    names = CLUTTER_DIRS if keep_tests else CLUTTER_DIRS | TEST_DIRS
+    removed = []
+    size = 0
+    for root, dirs, files in os.walk(lib_dir):
+        for name in sorted(d for d in dirs if d in names):
+            path = os.path.join(root, name)
+            size += _tree_size(path)
+            shutil.rmtree(path)
+            removed.append(path)
+        dirs[:] = [d for d in dirs if d not in names]
+        for name in files:
+            if name.endswith(CLUTTER_SUFFIXES):
+                path = os.path.join(root, name)
+                size += os.lstat(path).st_size
+                os.remove(path)
+                removed.append(path)
+    return removed, size
+
+
+def _tree_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def _resolver(framework):
+    # find_dependency, except that any Python.framework resolves to the bundled one
+    def resolve(reference, binary_path):
+        if "Python.framework/" in reference:
+            bundled = os.path.join(framework, reference.split("Python.framework/", 1)[1])
+            if os.path.exists(bundled):
+                return os.path.realpath(bundled)
+        return dependency_collection_4.find_dependency(reference, binary_path)
+    return resolve
+
+
+def _placed_files(app_bundle_path):
+    # Libraries and frameworks already in the bundle, by real path
+    placed = set()
+    for rel_path in ("Contents/Resources/lib", "Contents/Frameworks"):
+        directory = os.path.join(app_bundle_path, rel_path)
+        try:
+            with os.scandir(directory) as it:
+                placed.update(os.path.realpath(entry.path) for entry in it)
+        except OSError:
+            pass
+    return placed
+
+
+def loader_reference(target, binary_path):
+    # Reference to `target` that holds wherever the bundle is and whichever executable loads `binary_path`
+    relative = os.path.relpath(os.path.realpath(target), os.path.dirname(os.path.realpath(binary_path)))
+    return "@loader_path/" + relative
+
+
+def plan_payload_relink(node, app_bundle_path, graph):
+    """
+    Load-command edits of one payload file: every resolved reference
+    relative to @loader_path, absolute rpaths outside the bundle removed,
+    and the bundle ID for libraries this stage copied.
+    """
+    plan = relink.RelinkPlan(node.dest)
+    for reference, key in node.children.items():
+        child = graph.get(key) if key else None
+        if child is not None and child.dest:
+            plan.change(reference, loader_reference(child.dest, node.dest))
+    dependency_collection_4.update_rpaths(node.dest, app_bundle_path, plan)
+    if not node.in_bundle and macho.get_file_type(node.dest) == macho.MH_DYLIB:
+        dependency_collection_4.update_library_id(node.dest, plan)
+    return plan
+
+
+def relocate_payload(payload, app_bundle_path, jobs=1, arch=None):
+    """
+    Copy the missing dependencies of the payload's Mach-O files and
+    rewrite their references, on `jobs` workers.
+
+    Returns:
+        dict: {"modules", "copied", "relinked", "graph"}
+    """
+    rel_root = os.path.relpath(os.path.realpath(payload.framework), os.path.realpath(app_bundle_path))
+    roots = [
+        os.path.realpath(f.path) for f in bundle_scanner.scan_bundle(payload.framework, rel_root=rel_root)
+        if f.is_macho
+    ]
+    if arch:
+        with profiling.phase("thin"):
+            parallel.map_in_order(lambda path: thinning.thin_in_place(path, arch), roots, jobs)
+
+    bundle_root = os.path.realpath(app_bundle_path) + os.sep
+    with profiling.phase("resolve"):
+        graph = dependency_graph.build_dependency_graph(
+            roots,
+            list_references=dependency_collection_4.get_bundled_dependencies,
+            resolve_reference=_resolver(payload.framework),
+            in_bundle=lambda path: path.startswith(bundle_root),
+            jobs=jobs,
+        )
+
+    placed = _placed_files(app_bundle_path)
+    # The collector's relocation cache holds @executable_path relinks, which do not fit here
+    relocation = dependency_collection_4.get_relocation_cache()
+    dependency_collection_4.reset_copy_store(copy_store.CopyStore(arch))
+    dependency_collection_4.reset_relocation_cache()
+    try:
+        dependency_collection_4.copy_pass(graph, app_bundle_path, jobs)
+    finally:
+        dependency_collection_4.reset_relocation_cache(relocation)
+
+    def is_new(node):
+        if node.in_bundle or not node.dest:
+            return False
+        placed_as = node.dest.split(".framework/", 1)[0] + ".framework" if ".framework/" in node.dest else node.dest
+        return os.path.realpath(placed_as) not in placed
+
+    framework = os.path.realpath(payload.framework) + os.sep
+    relinked = []
+
+    def relink_node(node):
+        if not node.dest or not (node.dest.startswith(framework) or is_new(node)):
+            return
+        if not dependency_collection_4.is_binary_file(node.dest):
+            return
+        plan = plan_payload_relink(node, app_bundle_path, graph)
+        if not plan.is_empty() and relink.apply_plan(plan):
+            relinked.append(node.dest)
+
+    with profiling.phase("relink"):
+        parallel.run_in_dependency_order(graph, relink_node, jobs)
+    copied = sum(1 for node in graph if is_new(node))
+    return {"modules": len(roots), "copied": copied, "relinked": len(relinked), "graph": graph}
+
+
+def compile_payload(payload, app_bundle_path, jobs=1, runner=None):
+    """
+    Write checked-hash .pyc files for every module below the payload's lib_dir.
+
+    Returns:
+        str: "bundled" or "host" for the interpreter used, None if none could
+    """
+    strip_dir = os.path.dirname(os.path.realpath(app_bundle_path))
+    lib_dir = os.path.realpath(payload.lib_dir)
+    interpreter = payload.interpreter()
+    if interpreter:
+        result = (runner or tool_runner.get_runner()).run([
+            interpreter, "-E", "-s", "-m", "compileall", "-q", "-j", str(max(1, jobs)),
+            "--invalidation-mode", "checked-hash", "-s", strip_dir, lib_dir,
+        ])
+        if result.ok:
+            return "bundled"
+        logging.info(f"Could not run {interpreter} ({result.error or result.stderr.strip() or result.returncode})")
+
+    if f"{sys.version_info[0]}.{sys.version_info[1]}" != payload.version:
+        logging.warning(f"Not precompiling Python {payload.version}: the bundled interpreter does not run here "
+                        f"and this is Python {sys.version_info[0]}.{sys.version_info[1]}")
+        return None
+    ok = compileall.compile_dir(
+        lib_dir, quiet=1, workers=max(1, jobs), stripdir=strip_dir,
+        invalidation_mode=py_compile.PycInvalidationMode.CHECKED_HASH,
+    )
+    if not ok:
+        # Templates and test data with deliberate syntax errors are expected, the rest was compiled
+        logging.warning(f"Some modules below {lib_dir} did not compile")
+    return "host"
+
+
+def count_pycs(lib_dir):
+    return sum(
+        1 for root, _, files in os.walk(lib_dir) if os.path.basename(root) == "__pycache__"
+        for name in files if name.endswith(".pyc")
+    )
+
+
+def process_python_payload(app_bundle_path, jobs=1, arch=None, keep_tests=False, compile=True, runner=None, payloads=None):
+    """
+    Run the whole stage on every embedded Python of the bundle.
+
+    Args:
+        payloads (list, optional): Payload objects to process instead of find_payloads()
+
+    Returns:
+        list: One dict per payload with what was removed, relocated and compiled,
+            and the payload's dependency graph ("graph")
+    """
+    reports = []
+    for payload in find_payloads(app_bundle_path) if payloads is None else payloads:
+        start = time.perf_counter()
+        logging.info(f"Python {payload.version} payload: {payload.lib_dir}")
+        with profiling.phase("python clutter"):
+            removed, bytes_removed = remove_clutter(payload.lib_dir, keep_tests)
+        with profiling.phase("python relocate"):
+            relocation = relocate_payload(payload, app_bundle_path, jobs, arch)
+        compiled_by = None
+        if compile:
+            with profiling.phase("python compile"):
+                compiled_by = compile_payload(payload, app_bundle_path, jobs, runner)
+        report = {
+            "framework": payload.framework,
+            "version": payload.version,
+            "removed": len(removed),
+            "bytes_removed": bytes_removed,
+            "modules": relocation["modules"],
+            "copied": relocation["copied"],
+            "relinked": relocation["relinked"],
+            "compiled_by": compiled_by,
+            "pycs": count_pycs(payload.lib_dir),
+            "seconds": round(time.perf_counter() - start, 3),
+            "graph": relocation["graph"],
+        }
+        logging.info(
+            f"Python {payload.version}: removed {report['removed']} test/cache entries "
+            f"({bytes_removed / (1024 * 1024):.1f} MiB), {report['modules']} Mach-O files in the framework, "
+            f"{report['copied']} dependencies copied, {report['relinked']} files relinked, {report['pycs']} .pyc files "
+            f"({compiled_by or 'not compiled'}) in {report['seconds']:.2f}s"
+        )
+        profiling.count("python.relinked", report["relinked"])
+        profiling.count("python.pycs", report["pycs"])
+        reports.append(report)
+    return reports
+
+
+if __name__ == "__main__":
+    dependency_collection_4.setup_logging()
+    parser = argparse.ArgumentParser(description="Relocate and precompile the bundle's embedded Python")
+    parser.add_argument("--app", required=True, help="Path to the .app bundle")
+    parser.add_argument("--jobs", "-j", type=int, default=1, help="Number of parallel workers (default: 1, serial)")
+    parser.add_argument("--arch", choices=thinning.ARCHS, help="Keep only this architecture of universal binaries (default: keep all)")
+    parser.add_argument("--keep-tests", action="store_true", help="Keep test packages (test, tests, idle_test)")
+    parser.add_argument("--no-compile", action="store_true", help="Do not write .pyc files")
+    parser.add_argument("--profile", nargs="?", const="python_payload.profile", metavar="PREFIX",
+                        help="Time phases and tool calls, write PREFIX.json and PREFIX.trace.json (default prefix: python_payload.profile)")
+    args = parser.parse_args()
+    if args.profile:
+        profiling.enable()
+
+    if not os.path.exists(args.app):
+        logging.error(f"App bundle not found at {args.app}")
+        sys.exit(1)
+
+    try:
+        if not process_python_payload(args.app, args.jobs, args.arch, args.keep_tests, not args.no_compile):
+            logging.info(f"No embedded Python found in {args.app}")
+    finally:
+        if args.profile:
+            profiling.report(args.profile)
@@ -0,0 +1,185 @@
+"""Batched load-command edits, applied in place or with one install_name_tool call."""
+
+import logging
+import mmap
+import struct
+import subprocess
+
+import copy_store
+import macho
+import profiling
+
+
+class RelinkPlan:
+    """
+    All load-command edits for a single binary.
+
+    Args:
+        path (str): Path of the binary to edit
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.changes = {}
+        self.new_id = None
+        self.add_rpaths = []
+        self.delete_rpaths = []
+
+    def change(self, old_path, new_path):
+        if old_path != new_path:
+            self.changes[old_path] = new_path
+
+    def set_id(self, new_id):
+        self.new_id = new_id
+
+    def add_rpath(self, rpath):
+        if rpath not in self.add_rpaths:
+            self.add_rpaths.append(rpath)
+
+    def delete_rpath(self, rpath):
+        if rpath not in self.delete_rpaths:
+            self.delete_rpaths.append(rpath)
+
+    def to_dict(self):
+        return {
+            "changes": dict(self.changes),
+            "id": self.new_id,
+            "add_rpaths": list(self.add_rpaths),
+            "delete_rpaths": list(self.delete_rpaths),
+        }
+
+    def is_empty(self):
+        return not (self.changes or self.new_id or self.add_rpaths or self.delete_rpaths)
+
+    def install_name_tool_command(self):
+        # The equivalent single install_name_tool invocation
+        cmd = ["install_name_tool"]
+        for old_path, new_path in self.changes.items():
+            cmd.extend(["-change", old_path, new_path])
+        if self.new_id:
+            cmd.extend(["-id", self.new_id])
+        for rpath in self.delete_rpaths:
+            cmd.extend(["-delete_rpath", rpath])
+        for rpath in self.add_rpaths:
+            cmd.extend(["-add_rpath", rpath])
+        cmd.append(self.path)
+        return cmd
+
+    def __repr__(self):
+        return f"RelinkPlan({self.path!r}, changes={len(self.changes)}, id={self.new_id!r}, " \
+               f"add_rpaths={self.add_rpaths}, delete_rpaths={self.delete_rpaths})"
+
+
+def _string_command(buf, lc, new_string, slice_):
+    # Rebuild a dylib/rpath command around a new string, keeping its fixed fields
+    align = 8 if slice_.is_64 else 4
+    fixed = bytes(buf[lc.offset:lc.offset + lc.string_offset])
+    data = new_string.encode("utf-8", errors="surrogateescape") + b"\0"
+    data += b"\0" * (-(len(fixed) + len(data)) % align)
+    cmdsize = len(fixed) + len(data)
+    return struct.pack(slice_.byteorder + "II", lc.cmd, cmdsize) + fixed[8:] + data
+
+
+def _rpath_command(rpath, slice_):
+    align = 8 if slice_.is_64 else 4
+    data = rpath.encode("utf-8", errors="surrogateescape") + b"\0"
+    data += b"\0" * (-(12 + len(data)) % align)
+    return struct.pack(slice_.byteorder + "III", macho.LC_RPATH, 12 + len(data), 12) + data
+
+
+def _rewrite_commands(buf, slice_, plan):
+    # Build the new load-command area of one slice; returns (ncmds, bytes)
+    commands = []
+    existing_rpaths = set()
+    for lc in slice_.load_commands:
+        if lc.cmd == macho.LC_RPATH:
+            if lc.string in plan.delete_rpaths:
+                continue
+            existing_rpaths.add(lc.string)
+            commands.append(bytes(buf[lc.offset:lc.offset + lc.cmdsize]))
+        elif lc.cmd in macho.DYLIB_LOAD_COMMANDS and lc.string in plan.changes:
+            commands.append(_string_command(buf, lc, plan.changes[lc.string], slice_))
+        elif lc.cmd == macho.LC_ID_DYLIB and plan.new_id:
+            commands.append(_string_command(buf, lc, plan.new_id, slice_))
+        else:
+            commands.append(bytes(buf[lc.offset:lc.offset + lc.cmdsize]))
+
+    for rpath in plan.add_rpaths:
+        if rpath not in existing_rpaths:
+            commands.append(_rpath_command(rpath, slice_))
+    return len(commands), b"".join(commands)
+
+
+def rewrite_in_place(plan):
+    """
+    Apply a plan by patching the load commands of the mapped file directly.
+
+    Every slice is checked before anything is written, so a file is either
+    fully rewritten or left untouched.
+
+    Returns:
+        bool: True if the plan was applied, False if a slice's header padding
+            is too small (or the file is not a Mach-O file we can edit)
+    """
+    parsed = macho.read_macho(plan.path)
+    if parsed is None:
+        return False
+
+    try:
+        with open(plan.path, "r+b") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_WRITE) as buf:
+                edits = []
+                for slice_ in parsed.slices:
+                    if plan.new_id and slice_.install_name is None:
+                        logging.warning(f"{plan.path} has no LC_ID_DYLIB, ignoring -id {plan.new_id}")
+                    ncmds, commands = _rewrite_commands(buf, slice_, plan)
+                    if slice_.header_size + len(commands) > slice_.header_limit:
+                        logging.info(f"Not enough header padding in {plan.path} ({slice_.arch}), "
+                                     f"need {len(commands) - slice_.sizeofcmds} more bytes")
+                        return False
+                    edits.append((slice_, ncmds, commands))
+
+                for slice_, ncmds, commands in edits:
+                    start = slice_.offset + slice_.header_size
+                    old_end = start + slice_.sizeofcmds
+                    buf[start:start + len(commands)] = commands
+                    if start + len(commands) < old_end:
+                        buf[start + len(commands):old_end] = b"\0" * (old_end - start - len(commands))
+                    struct.pack_into(slice_.byteorder + "II", buf, slice_.offset + 16, ncmds, len(commands))
+                buf.flush()
+    except OSError as e:
+        logging.warning(f"Could not rewrite {plan.path} in place: {e}")
+        return False
+    finally:
+        macho.invalidate(plan.path)
+    return True
+
+
+def apply_plan(plan):
+    """
+    Apply every edit of a plan in a single pass over the binary.
+
+    Returns:
+        bool: True on success
+    """
+    if plan.is_empty():
+        return True
+    copy_store.unshare(plan.path)
+
+    logging.info(f"Relinking {plan.path}: {len(plan.changes)} changes"
+                 f"{', new id' if plan.new_id else ''}"
+                 f"{f', +{len(plan.add_rpaths)} rpaths' if plan.add_rpaths else ''}"
+                 f"{f', -{len(plan.delete_rpaths)} rpaths' if plan.delete_rpaths else ''}")
+    if rewrite_in_place(plan):
+        profiling.count("relink.in_place")
+        return True
+
+    # Header too small: let install_name_tool grow it, still in one invocation
+    try:
+        profiling.run_tool(plan.install_name_tool_command(), check=True)
+        return True
+    except (subprocess.CalledProcessError, OSError) as e:
+        logging.error(f"Error relinking {plan.path}: {e}")
+        return False
+    finally:
+        macho.invalidate(plan.path)
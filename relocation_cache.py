@@ -0,0 +1,177 @@
+"""On-disk cache of relinked libraries, shared across runs and bundles."""
+
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from copy_store import fast_copy
+
+CACHE_VERSION = 1
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024
+
+
+def default_cache_dir():
+    # $SYNFIG_BUNDLE_CACHE, so CI runners can point it at a directory they keep between runs
+    return os.environ.get("SYNFIG_BUNDLE_CACHE")
+
+
+class RelocationCache:
+    """
+    Relinked libraries keyed by (input hash, relocation plan hash).
+
+    Plans only contain bundle-relative paths, so a hit can be copied into any
+    bundle as is. The directory holds:
+
+        objects/<key[:2]>/<key>   relinked files
+        tmp/                      entries being written
+        lock                      held while evicting
+
+    Entries are written to tmp/ and renamed into place, so readers never see
+    a partial file and parallel jobs or concurrent builds can share the
+    directory. The modification time of an entry is its last use.
+
+    Args:
+        directory (str): Cache directory, created if missing
+        max_bytes (int): Size evict() trims the cache to
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._objects = os.path.join(directory, "objects")
+        self._tmp = os.path.join(directory, "tmp")
+        os.makedirs(self._objects, exist_ok=True)
+        os.makedirs(self._tmp, exist_ok=True)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.bytes_stored = 0
+        self.evictions = 0
+        self.bytes_evicted = 0
+        # Keys stored by this process; hits on them are relinks an earlier bundle of a batch did
+        self._stored = set()
+        self.reused = 0
+
+    def key(self, digest, plan, arch=None):
+        """
+        Cache key of an input file relinked with `plan`.
+
+        Args:
+            digest (str): SHA-256 of the input file
+            plan (relink.RelinkPlan): Edits applied to it
+            arch (str, optional): Architecture the input was thinned to
+        """
+        description = {"version": CACHE_VERSION, "input": digest, "arch": arch, "plan": plan.to_dict()}
+        return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self._objects, key[:2], key)
+
+    def fetch(self, key, place):
+        """
+        Hand the cached file for `key` to `place(path)`, e.g. a copy into the bundle.
+
+        Returns:
+            bool: True on a hit, False if there is no entry (or it was evicted meanwhile)
+        """
+        path = self._path(key)
+        try:
+            os.utime(path)
+            place(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return False
+        with self._lock:
+            self.hits += 1
+            if key in self._stored:
+                self.reused += 1
+        return True
+
+    def store(self, key, path):
+        # Add the relinked `path` under `key`; an existing entry is replaced by identical content
+        target = self._path(key)
+        tmp_path = os.path.join(self._tmp, f"{key}.{os.getpid()}.{threading.get_ident()}")
+        try:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            fast_copy(path, tmp_path)
+            os.utime(tmp_path)
+            os.replace(tmp_path, target)
+        except OSError as e:
+            logging.warning(f"Could not add {path} to the relocation cache: {e}")
+            return
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        with self._lock:
+            self._stored.add(key)
+            self.stores += 1
+            self.bytes_stored += os.path.getsize(target)
+
+    def _entries(self):
+        entries = []
+        for root, _, files in os.walk(self._objects):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache is at most max_bytes.
+
+        Returns:
+            int: Bytes removed
+        """
+        with open(os.path.join(self.directory, "lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                entries = sorted(self._entries())
+                total = sum(size for _, size, _ in entries)
+                removed = 0
+                for _, size, path in entries:
+                    if total - removed <= self.max_bytes:
+                        break
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        continue
+                    removed += size
+                    self.evictions += 1
+                # Leftovers of writers that were killed
+                cutoff = time.time() - 24 * 3600
+                for name in os.listdir(self._tmp):
+                    path = os.path.join(self._tmp, name)
+                    try:
+                        if os.stat(path).st_mtime < cutoff:
+                            os.remove(path)
+                    except FileNotFoundError:
+                        pass
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        self.bytes_evicted += removed
+        return removed
+
+    def report(self):
+        lookups = self.hits + self.misses
+        logging.info(
+            f"Relocation cache {self.directory}: {self.hits}/{lookups} hits, {self.stores} stored "
+            f"({self.bytes_stored} bytes), {self.evictions} evicted ({self.bytes_evicted} bytes)"
+        )
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "bytes_stored": self.bytes_stored,
+            "evictions": self.evictions,
+            "bytes_evicted": self.bytes_evicted,
+        }
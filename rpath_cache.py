@@ -0,0 +1,112 @@
+"""Memoized @rpath resolution."""
+
+import logging
+import os
+import threading
+
+import profiling
+
+
+class RpathCache:
+    """
+    Per-run cache of expanded rpath lists and @rpath lookups.
+
+    Both caches are keyed by values, not by the referencing binary, so two
+    binaries with the same rpaths share their lookups. All methods are
+    thread-safe; a value computed twice by concurrent callers is the same.
+
+    A batch (see batch.py) keeps one cache for several bundles and calls
+    checkpoint() before each; `reused` then counts the lookups of earlier
+    bundles that did not probe the file system again.
+    """
+
+    def __init__(self):
+        self._rpaths = {}
+        self._lookups = {}
+        self._lock = threading.Lock()
+        self.rpath_hits = 0
+        self.rpath_misses = 0
+        self.lookup_hits = 0
+        self.lookup_misses = 0
+        self._previous = frozenset()
+        self._reused = set()
+
+    def rpaths(self, binary_path, expand):
+        """
+        Expanded rpath list of a binary.
+
+        Args:
+            binary_path (str): The referencing binary
+            expand (callable): binary_path -> list of directories, called once per binary
+
+        Returns:
+            tuple: Directories to search, in order
+        """
+        key = os.path.realpath(binary_path)
+        with self._lock:
+            cached = self._rpaths.get(key)
+            if cached is not None:
+                self.rpath_hits += 1
+                return cached
+            self.rpath_misses += 1
+        rpaths = tuple(expand(binary_path))
+        with self._lock:
+            self._rpaths[key] = rpaths
+        return rpaths
+
+    def resolve(self, rpaths, lib_name, search):
+        """
+        Resolve `lib_name` against an expanded rpath list.
+
+        Args:
+            rpaths (tuple): As returned by rpaths()
+            lib_name (str): Path after "@rpath/"
+            search (callable): (rpaths, lib_name) -> real path or None, called once per key
+
+        Returns:
+            str: Real path of the library, or None (also cached)
+        """
+        key = (rpaths, lib_name)
+        with self._lock:
+            if key in self._lookups:
+                self.lookup_hits += 1
+                if key in self._previous:
+                    self._reused.add(key)
+                return self._lookups[key]
+            self.lookup_misses += 1
+        found = search(rpaths, lib_name)
+        with self._lock:
+            self._lookups[key] = found
+        return found
+
+    def checkpoint(self):
+        with self._lock:
+            self._previous = frozenset(self._lookups)
+            self._reused = set()
+
+    @property
+    def reused(self):
+        return len(self._reused)
+
+    def stats(self):
+        lookups = self.lookup_hits + self.lookup_misses
+        return {
+            "rpath_lists": len(self._rpaths),
+            "rpath_hits": self.rpath_hits,
+            "rpath_misses": self.rpath_misses,
+            "lookup_hits": self.lookup_hits,
+            "lookup_misses": self.lookup_misses,
+            "lookup_hit_rate": self.lookup_hits / lookups if lookups else 0.0,
+        }
+
+    def report(self):
+        stats = self.stats()
+        lookups = stats["lookup_hits"] + stats["lookup_misses"]
+        if lookups:
+            logging.info(
+                f"Rpath cache: {stats['lookup_hits']}/{lookups} @rpath lookups served from cache "
+                f"({stats['lookup_hit_rate']:.0%}), {stats['rpath_lists']} rpath lists read"
+            )
+        profiling.count("rpath.lookup_hits", stats["lookup_hits"])
+        profiling.count("rpath.lookup_misses", stats["lookup_misses"])
+        return stats
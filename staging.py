@@ -0,0 +1,366 @@
+"""
+Build a bundle in a staging copy, resume interrupted runs, and publish it with
+one atomic rename.
+"""
+
+import ctypes
+import errno
+import fcntl
+import json
+import logging
+import os
+import shutil
+import sys
+import threading
+
+import copy_store
+import manifest
+import parallel
+
+JOURNAL_VERSION = 1
+JOURNAL = "journal.json"
+LOCK = "lock"
+
+# ioctl number of FICLONE on Linux (fcntl.FICLONE from Python 3.12)
+_FICLONE = getattr(fcntl, "FICLONE", 0x40049409)
+_RENAME_EXCHANGE = 2  # Linux renameat2() flag
+_RENAME_SWAP = 2      # macOS renamex_np() flag
+_AT_FDCWD = -100
+
+try:
+    _libc = ctypes.CDLL(None, use_errno=True)
+except OSError:
+    _libc = None
+
+
+def _libc_function(name):
+    return getattr(_libc, name, None) if _libc is not None else None
+
+
+def reflink(src, dst):
+    """
+    Clone a file's data without copying it, on file systems that can.
+
+    Returns:
+        bool: True if `dst` was created as a copy-on-write clone of `src`
+    """
+    clonefile = _libc_function("clonefile") if sys.platform == "darwin" else None
+    if clonefile is not None:
+        return clonefile(os.fsencode(src), os.fsencode(dst), 0) == 0
+    if not sys.platform.startswith("linux"):
+        return False
+    try:
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+    except OSError:
+        if os.path.exists(dst):
+            os.remove(dst)
+        return False
+    shutil.copystat(src, dst)
+    return True
+
+
+def exchange(a, b):
+    """
+    Swap two paths in one atomic rename.
+
+    Returns:
+        bool: False if the system or file system cannot do it
+    """
+    if sys.platform == "darwin":
+        renamex_np = _libc_function("renamex_np")
+        if renamex_np is not None:
+            return renamex_np(os.fsencode(a), os.fsencode(b), _RENAME_SWAP) == 0
+    renameat2 = _libc_function("renameat2")
+    if renameat2 is not None and sys.platform.startswith("linux"):
+        return renameat2(_AT_FDCWD, os.fsencode(a), _AT_FDCWD, os.fsencode(b), _RENAME_EXCHANGE) == 0
+    return False
+
+
+class Cloner:
+    """
+    Clone files with the cheapest method that works, remembering what failed.
+
+    Attributes:
+        counts (dict): Files cloned by "reflink", "hardlink" and "copy"
+    """
+
+    def __init__(self):
+        self.use_reflink = True
+        self.use_hardlink = True
+        self.counts = {"reflink": 0, "hardlink": 0, "copy": 0}
+        self._lock = threading.Lock()
+
+    def clone(self, src, dst):
+        method = "copy"
+        if self.use_reflink:
+            if reflink(src, dst):
+                method = "reflink"
+            else:
+                self.use_reflink = False
+        if method == "copy" and self.use_hardlink:
+            try:
+                os.link(src, dst)
+                method = "hardlink"
+            except OSError as e:
+                if e.errno in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+                    self.use_hardlink = False
+                else:
+                    raise
+        if method == "copy":
+            copy_store.fast_copy(src, dst)
+        with self._lock:
+            self.counts[method] += 1
+
+
+def clone_tree(src, dst, jobs=1):
+    """
+    Clone a bundle directory: directories and symlinks are recreated, files
+    cloned on `jobs` threads (see Cloner).
+
+    Returns:
+        dict: Files cloned per method
+    """
+    cloner = Cloner()
+    files = []
+    directories = []
+    for root, dirs, names in os.walk(src):
+        rel_root = os.path.relpath(root, src)
+        target_root = os.path.normpath(os.path.join(dst, rel_root))
+        os.makedirs(target_root, exist_ok=True)
+        directories.append((root, target_root))
+        for name in sorted(dirs + names):
+            path = os.path.join(root, name)
+            target = os.path.join(target_root, name)
+            if os.path.islink(path):
+                os.symlink(os.readlink(path), target)
+            elif name in names:
+                files.append((path, target))
+        dirs[:] = [d for d in dirs if not os.path.islink(os.path.join(root, d))]
+    parallel.map_in_order(lambda pair: cloner.clone(*pair), files, jobs)
+    for root, target_root in directories:
+        shutil.copystat(root, target_root)
+    return cloner.counts
+
+
+def source_fingerprint(app_bundle_path):
+    # Stat data of the files a rebuilt bundle changes first: Info.plist and the executables
+    entries = []
+    contents = os.path.join(app_bundle_path, "Contents")
+    paths = [os.path.join(contents, "Info.plist")]
+    macos = os.path.join(contents, "MacOS")
+    if os.path.isdir(macos):
+        paths.extend(os.path.join(macos, name) for name in sorted(os.listdir(macos)))
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        entries.append([os.path.relpath(path, app_bundle_path), st.st_size, st.st_mtime_ns])
+    return entries
+
+
+class Stage:
+    """
+    Staged copy of a bundle, its journal and the publish step.
+
+    The work directory is next to the published bundle, on the same file
+    system:
+
+        .<App>.staging/<App>                   the staged bundle
+        .<App>.staging/.<App>.manifest.json    its collector manifest
+        .<App>.staging/journal.json            completed stages
+        .<App>.staging/lock                    held while a run uses the directory
+
+    Files are cloned as reflinks, else hardlinks, else copies; hardlinked
+    files get their own copy before anything writes to them in place
+    (copy_store.unshare()), so the source bundle never changes. A run that
+    finds a journal written with the same options for an unchanged source
+    resumes after the last completed stage. An interrupted stage is run
+    again, unless it cannot pick up half-done work, in which case the
+    bundle is cloned again.
+
+    Args:
+        app_bundle_path (str): Bundle to clone
+        output (str, optional): Bundle to publish to, defaults to `app_bundle_path`
+        options (dict): Settings the result depends on; a journal written
+            with other options is not resumed
+        work_dir (str, optional): Defaults to .<output name>.staging next to `output`
+        manifest_path (str, optional): Collector manifest of `output`, see manifest.py
+        source_manifest (str, optional): Collector manifest of `app_bundle_path`,
+            copied along with the bundle; defaults to `manifest_path` when the
+            bundle is published in place
+    """
+
+    def __init__(self, app_bundle_path, output=None, options=None, work_dir=None, manifest_path=None, source_manifest=None):
+        self.source = os.path.normpath(os.path.abspath(app_bundle_path))
+        self.output = os.path.normpath(os.path.abspath(output or app_bundle_path))
+        name = os.path.basename(self.output)
+        self.work_dir = work_dir or os.path.join(os.path.dirname(self.output), f".{name}.staging")
+        self.path = os.path.join(self.work_dir, name)
+        self.output_manifest = manifest_path or manifest.default_manifest_path(self.output)
+        self.manifest_path = os.path.join(self.work_dir, os.path.basename(self.output_manifest))
+        if source_manifest is None:
+            source_manifest = self.output_manifest if self.source == self.output else manifest.default_manifest_path(self.source)
+        self.source_manifest = source_manifest
+        self.options = options or {}
+        self.journal = None
+        self._lock = None
+
+    def _journal_path(self):
+        return os.path.join(self.work_dir, JOURNAL)
+
+    def _load_journal(self):
+        try:
+            with open(self._journal_path()) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable staging journal {self._journal_path()}: {e}")
+            return None
+
+    def _save_journal(self):
+        # Written and synced before it replaces the old journal, so a crash leaves one or the other
+        tmp_path = self._journal_path() + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.journal, f, indent=1, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._journal_path())
+
+    def _resumable(self, journal):
+        return (
+            journal is not None
+            and journal.get("version") == JOURNAL_VERSION
+            and journal.get("source") == self.source
+            and journal.get("options") == json.loads(json.dumps(self.options))
+            and journal.get("fingerprint") == source_fingerprint(self.source)
+            and "clone" in journal.get("stages", [])
+            and journal.get("rerunnable", True)
+            and os.path.isdir(self.path)
+        )
+
+    def open(self, jobs=1):
+        """
+        Take the work directory and resume from its journal, or clone the bundle afresh.
+
+        Raises:
+            RuntimeError: If another run holds the work directory
+
+        Returns:
+            list: Stages already completed
+        """
+        os.makedirs(self.work_dir, exist_ok=True)
+        self._lock = open(os.path.join(self.work_dir, LOCK), "a")
+        try:
+            fcntl.flock(self._lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._lock.close()
+            self._lock = None
+            raise RuntimeError(f"{self.work_dir} is in use by another run") from None
+
+        journal = self._load_journal()
+        if journal is not None and journal.get("publishing") and self._published(journal):
+            # The last run was interrupted after the swap: finish its clean-up, which removes
+            # the work directory, and start anew
+            logging.info(f"Finishing the interrupted publish of {self.output}")
+            self._finish_publish()
+            return self.open(jobs)
+        if self._resumable(journal):
+            self.journal = journal
+            logging.info(f"Resuming {self.output} from {self.work_dir} after stage {journal['stages'][-1]}")
+            return list(journal["stages"])
+
+        if journal is not None and not journal.get("rerunnable", True):
+            logging.info(f"Discarding staged work in {self.work_dir}: stage {journal.get('running')} was interrupted")
+        elif journal is not None:
+            logging.info(f"Discarding staged work in {self.work_dir}: options or source bundle changed")
+        for path in (self.path, self.manifest_path):
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            elif os.path.lexists(path):
+                os.remove(path)
+        self.journal = {
+            "version": JOURNAL_VERSION,
+            "source": self.source,
+            "output": self.output,
+            "options": self.options,
+            "fingerprint": source_fingerprint(self.source),
+            "stages": [],
+        }
+        self._save_journal()
+        counts = clone_tree(self.source, self.path, jobs)
+        if os.path.exists(self.source_manifest):
+            shutil.copy2(self.source_manifest, self.manifest_path)
+        logging.info(f"Staged {self.source} in {self.path}: {counts['reflink']} files reflinked, "
+                     f"{counts['hardlink']} hardlinked, {counts['copy']} copied")
+        self.complete("clone")
+        return list(self.journal["stages"])
+
+    def done(self, name):
+        return name in self.journal["stages"]
+
+    def start(self, name, rerunnable=True):
+        # `rerunnable` False: an interrupted run of this stage leaves the staged bundle unusable
+        self.journal["running"] = name
+        self.journal["rerunnable"] = rerunnable
+        self._save_journal()
+
+    def complete(self, name):
+        self.journal["stages"].append(name)
+        self.journal.pop("running", None)
+        self.journal.pop("rerunnable", None)
+        self._save_journal()
+
+    def run(self, name, func, rerunnable=True):
+        """
+        Run one stage on the staged bundle unless the journal has it as completed.
+
+        Returns:
+            The result of `func`, or None if the stage was skipped
+        """
+        if self.done(name):
+            logging.info(f"Stage {name} already completed, skipping it")
+            return None
+        self.start(name, rerunnable)
+        result = func()
+        self.complete(name)
+        return result
+
+    def _published(self, journal):
+        try:
+            return os.stat(self.output).st_ino == journal.get("staged_ino")
+        except OSError:
+            return False
+
+    def publish(self):
+        """
+        Replace the output bundle with the staged one in a single rename,
+        then remove the work directory.
+        """
+        self.journal["publishing"] = True
+        self.journal["staged_ino"] = os.stat(self.path).st_ino
+        self._save_journal()
+        if not os.path.exists(self.output):
+            os.rename(self.path, self.output)
+        elif not exchange(self.path, self.output):
+            # No atomic exchange here: keep the old bundle until the new one is in place
+            logging.info("Atomic exchange not supported, publishing with two renames")
+            previous = os.path.join(self.work_dir, os.path.basename(self.output) + ".previous")
+            os.rename(self.output, previous)
+            os.rename(self.path, self.output)
+        logging.info(f"Published {self.output}")
+        self._finish_publish()
+
+    def _finish_publish(self):
+        if os.path.exists(self.manifest_path):
+            os.replace(self.manifest_path, self.output_manifest)
+        self.close()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def close(self):
+        if self._lock is not None:
+            fcntl.flock(self._lock, fcntl.LOCK_UN)
+            self._lock.close()
+            self._lock = None
@@ -0,0 +1,37 @@
+#!/bin/sh
+# Rebuild the fixtures of tests/test_adhoc_signature.py: small thin arm64
+# and x86_64 executables and dylibs, twice:
+#
+#   unsigned/NAME   linked with -no_adhoc_codesign
+#   lld/NAME        ad-hoc signed by the linker (-adhoc_codesign)
+#
+# Needs an assembler and a Mach-O linker, which do not depend on macOS:
+#
+#   LLVM_MC   llvm-mc                       (default: llvm-mc)
+#   LD64      ld64.lld, or ld on macOS      (default: ld64.lld)
+set -eu
+
+LLVM_MC=${LLVM_MC:-llvm-mc}
+LD64=${LD64:-ld64.lld}
+
+cd "$(dirname "$0")"
+work=$(mktemp -d)
+trap 'rm -rf "$work"' EXIT
+
+# A few pages of __TEXT, so the signatures hash more than the header page
+printf '.globl _main\n_main:\n  mov w0, #0\n  ret\n.globl _f\n_f:\n  ret\n.fill 10000, 1, 0xa5\n' > "$work/arm64.s"
+printf '.globl _main\n_main:\n  xorl %%eax, %%eax\n  retq\n.globl _f\n_f:\n  retq\n.fill 10000, 1, 0xa5\n' > "$work/x86_64.s"
+for arch in arm64 x86_64; do
+    "$LLVM_MC" -triple "$arch-apple-macos11" -filetype=obj "$work/$arch.s" -o "$work/$arch.o"
+done
+
+mkdir -p unsigned lld
+for arch in arm64 x86_64; do
+    for sign in no_adhoc_codesign adhoc_codesign; do
+        if [ "$sign" = adhoc_codesign ]; then dir=lld; else dir=unsigned; fi
+        "$LD64" -arch "$arch" -platform_version macos 11.0 11.0 "$work/$arch.o" -headerpad 0x100 -"$sign" \
+            -execute -o "$dir/hello-$arch"
+        "$LD64" -arch "$arch" -platform_version macos 11.0 11.0 "$work/$arch.o" -headerpad 0x100 -"$sign" \
+            -dylib -install_name "@rpath/libhello-$arch.dylib" -o "$dir/libhello-$arch.dylib"
+    done
+done
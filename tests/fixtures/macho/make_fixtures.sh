@@ -0,0 +1,139 @@
+#!/bin/sh
+# Rebuild the Mach-O fixtures of tests/test_macho.py and record what otool
+# reports for them. Needs an assembler and a Mach-O linker, which do not
+# depend on macOS:
+#
+#   LLVM_MC   llvm-mc                       (default: llvm-mc)
+#   LD64      ld64.lld, or ld on macOS      (default: ld64.lld)
+#   LIPO      llvm-lipo, or lipo            (default: llvm-lipo)
+#   OTOOL     otool, or llvm-otool          (default: otool)
+#   OBJ2YAML, YAML2OBJ                      (default: obj2yaml, yaml2obj)
+#   INSTALL_NAME_TOOL  install_name_tool, or llvm-install-name-tool
+#                                           (default: install_name_tool)
+#
+# ld64.lld cannot write upward or lazy loads, so libloads.dylib gets those
+# by editing the linked file with obj2yaml/yaml2obj (ld64.lld also writes a
+# plain load next to the reexport of libreexport.dylib; it is kept, the
+# parser has to report both). Run from anywhere; the fixtures and the
+# NAME.ARCH.otool-L.txt / NAME.ARCH.otool-l.txt recordings are written next
+# to this script.
+#
+# relinked/CASES lists install_name_tool edits (NAME FIXTURE ARGS...) for
+# tests/test_relink.py; what otool -l prints after each is recorded as
+# relinked/NAME.ARCH.otool-l.txt.
+set -eu
+
+LLVM_MC=${LLVM_MC:-llvm-mc}
+LD64=${LD64:-ld64.lld}
+LIPO=${LIPO:-llvm-lipo}
+OTOOL=${OTOOL:-otool}
+OBJ2YAML=${OBJ2YAML:-obj2yaml}
+YAML2OBJ=${YAML2OBJ:-yaml2obj}
+INSTALL_NAME_TOOL=${INSTALL_NAME_TOOL:-install_name_tool}
+
+cd "$(dirname "$0")"
+work=$(mktemp -d)
+trap 'rm -rf "$work"' EXIT
+
+printf '.globl _f\n_f:\n  ret\n' > "$work/arm64.s"
+printf '.globl _f\n_f:\n  retq\n' > "$work/x86_64.s"
+for arch in arm64 x86_64; do
+    "$LLVM_MC" -triple "$arch-apple-macos11" -filetype=obj "$work/$arch.s" -o "$work/$arch.o"
+done
+
+# link ARCH OUTPUT ARGS...: link one slice of a dylib (or bundle, with -bundle in ARGS)
+link() {
+    arch=$1 output=$2
+    shift 2
+    "$LD64" -arch "$arch" -platform_version macos 11.0 11.0 "$work/$arch.o" -o "$output" "$@"
+}
+
+# fat OUTPUT ARGS...: a fat arm64 + x86_64 dylib
+fat() {
+    fat_output=$1
+    shift
+    link arm64 "$work/arm64.dylib" -dylib "$@"
+    link x86_64 "$work/x86_64.dylib" -dylib "$@"
+    "$LIPO" -create "$work/arm64.dylib" "$work/x86_64.dylib" -output "$fat_output"
+}
+
+# Libraries the others link against, fat so both slices of libfat.dylib can use them
+fat libbase.dylib -install_name /opt/homebrew/opt/base/lib/libbase.1.dylib \
+    -compatibility_version 1.0.0 -current_version 1.4.2
+fat libweak.dylib -install_name /opt/homebrew/lib/libweak.dylib
+fat libreexport.dylib -install_name @rpath/libreexport.dylib
+fat libupward.dylib -install_name @loader_path/libupward.dylib
+fat liblazy.dylib -install_name /opt/homebrew/lib/liblazy.dylib
+
+# Thin arm64 dylib with an @rpath install name
+link arm64 libthin.dylib -dylib -install_name @rpath/libthin.1.dylib \
+    -compatibility_version 1.0.0 -current_version 1.2.3 libbase.dylib
+
+# Fat arm64/x86_64 dylib
+fat libfat.dylib -install_name /opt/homebrew/lib/libfat.dylib libbase.dylib
+
+# Loadable bundle (MH_BUNDLE, like a plug-in or Python extension) with two LC_RPATHs
+link arm64 plugin.bundle -bundle -rpath @loader_path/../lib -rpath /opt/homebrew/lib \
+    libthin.dylib libbase.dylib
+
+# Every kind of load: normal, weak, reexport, then upward and lazy patched in
+link arm64 "$work/libloads.dylib" -dylib -no_adhoc_codesign -install_name @rpath/libloads.dylib \
+    libbase.dylib -weak_library libweak.dylib -reexport_library libreexport.dylib \
+    libupward.dylib liblazy.dylib
+"$OBJ2YAML" "$work/libloads.dylib" | awk '
+    /cmd: *LC_LOAD_DYLIB/ { pending = $0; next }
+    pending != "" {
+        if ($0 ~ /cmdsize/) { held = $0; next }
+        if ($0 ~ /Content: .*libupward/) sub(/LC_LOAD_DYLIB/, "LC_LOAD_UPWARD_DYLIB", pending)
+        if ($0 ~ /Content: .*liblazy/) sub(/LC_LOAD_DYLIB/, "LC_LAZY_LOAD_DYLIB", pending)
+        if ($0 ~ /Content:/) {
+            print pending; print held; print buffered $0
+            pending = ""; held = ""; buffered = ""
+            next
+        }
+        buffered = buffered $0 "\n"
+        next
+    }
+    { print }
+' > "$work/libloads.yaml"
+"$YAML2OBJ" "$work/libloads.yaml" -o libloads.dylib
+
+# No header padding at all: relinking to a longer path cannot be done in place
+link arm64 libnopad.dylib -dylib -headerpad 0 -install_name /opt/homebrew/lib/libnopad.dylib libbase.dylib
+
+# Fat file whose arm64 slice has no header padding and whose x86_64 slice has some
+"$LIPO" libfat.dylib -thin x86_64 -output "$work/fat.x86_64.dylib"
+"$LIPO" -create libnopad.dylib "$work/fat.x86_64.dylib" -output libmixedpad.dylib
+
+# record FILE NAME KINDS...: otool -KIND of every slice of FILE into NAME.ARCH.otool-KIND.txt,
+# from a thinned copy so every otool prints the same
+mkdir "$work/slice"
+record() {
+    file=$1 name=$2
+    shift 2
+    archs=$("$LIPO" -archs "$file")
+    for arch in $archs; do
+        if [ "$(echo $archs | wc -w)" -eq 1 ]; then
+            cp "$file" "$work/slice/$(basename "$name")"
+        else
+            "$LIPO" "$file" -thin "$arch" -output "$work/slice/$(basename "$name")"
+        fi
+        for kind; do
+            (cd "$work/slice" && "$OTOOL" -"$kind" "$(basename "$name")") > "$name.$arch.otool-$kind.txt"
+        done
+    done
+}
+rm -f ./*.otool-L.txt ./*.otool-l.txt relinked/*.otool-l.txt
+for fixture in libbase.dylib libthin.dylib libfat.dylib plugin.bundle libloads.dylib libnopad.dylib libmixedpad.dylib; do
+    record "$fixture" "$fixture" L l
+done
+
+# The load commands install_name_tool writes for each edit of relinked/CASES
+while read -r name fixture args; do
+    case "$name" in ""|"#"*) continue ;; esac
+    cp "$fixture" "$work/$name"
+    eval "set -- $args"
+    "$INSTALL_NAME_TOOL" "$@" "$work/$name"
+    record "$work/$name" "relinked/$name" l
+done < relinked/CASES
+rm -f libweak.dylib libreexport.dylib libupward.dylib liblazy.dylib
@@ -0,0 +1,228 @@
+"""
+adhoc_signature.py against the ld64.lld-signed fixtures of fixtures/codesign
+(see make_fixtures.sh there), and on a small .app.
+"""
+
+import hashlib
+import os
+import plistlib
+import shutil
+import struct
+
+import pytest
+
+import adhoc_signature
+import macho
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "codesign")
+NAMES = sorted(os.listdir(os.path.join(FIXTURES, "unsigned")))
+
+
+def fixture(kind, name):
+    return os.path.join(FIXTURES, kind, name)
+
+
+def identifier(name):
+    return f"org.synfig.fixture.{name}"
+
+
+def read_code_directory(path):
+    """
+    The embedded CodeDirectory of a thin file, parsed independently of adhoc_signature.py.
+
+    Returns:
+        dict: dataoff of LC_CODE_SIGNATURE, the CodeDirectory header fields
+            and "hashes", the list of code page hashes
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    slice_ = macho.parse_macho(data, path).slices[0]
+    dataoff = struct.unpack_from("<I", data, slice_.code_signature.offset + 8)[0]
+    magic, _, count = struct.unpack_from(">III", data, dataoff)
+    assert magic == adhoc_signature.CSMAGIC_EMBEDDED_SIGNATURE
+    for i in range(count):
+        slot, offset = struct.unpack_from(">II", data, dataoff + 12 + 8 * i)
+        if slot == adhoc_signature.CSSLOT_CODEDIRECTORY:
+            start = dataoff + offset
+    names = ("magic", "length", "version", "flags", "hashOffset", "identOffset", "nSpecialSlots", "nCodeSlots",
+             "codeLimit", "hashSize", "hashType", "platform", "pageSize", "spare2", "scatterOffset",
+             "teamOffset", "spare3", "codeLimit64", "execSegBase", "execSegLimit", "execSegFlags")
+    cd = dict(zip(names, struct.unpack_from(">IIIIIIIIIBBBBIIIIQQQQ", data, start)))
+    hashes = data[start + cd["hashOffset"]:start + cd["hashOffset"] + cd["nCodeSlots"] * cd["hashSize"]]
+    cd["hashes"] = [hashes[i:i + cd["hashSize"]] for i in range(0, len(hashes), cd["hashSize"])]
+    cd["dataoff"] = dataoff
+    cd["identifier"] = data[start + cd["identOffset"]:data.index(b"\0", start + cd["identOffset"])].decode()
+    return cd
+
+
+def signed_copy(tmp_path, kind, name, **kwargs):
+    path = str(tmp_path / name)
+    shutil.copy(fixture(kind, name), path)
+    adhoc_signature.sign_file(path, **kwargs)
+    return path
+
+
+@pytest.mark.parametrize("name", NAMES)
+def test_page_hashes_match_linker(name):
+    # Hashing the linker-signed file up to its signature gives the linker's hashes, header page included
+    lld = read_code_directory(fixture("lld", name))
+    with open(fixture("lld", name), "rb") as f:
+        data = f.read()
+    hashes = adhoc_signature.hash_pages(data, lld["codeLimit"])
+    assert [hashes[i:i + 32] for i in range(0, len(hashes), 32)] == lld["hashes"]
+    assert lld["codeLimit"] == lld["dataoff"]
+
+
+@pytest.mark.parametrize("name", NAMES)
+def test_resigning_matches_linker(tmp_path, name):
+    lld = read_code_directory(fixture("lld", name))
+    ours = read_code_directory(signed_copy(tmp_path, "lld", name, identifier=identifier(name), runtime=False))
+    # The existing LC_CODE_SIGNATURE is reused; only the header page changes (its datasize)
+    assert ours["dataoff"] == ours["codeLimit"] == lld["codeLimit"]
+    assert ours["hashes"][1:] == lld["hashes"][1:]
+    for field in ("version", "nCodeSlots", "hashSize", "hashType", "pageSize",
+                  "execSegBase", "execSegLimit", "execSegFlags"):
+        assert ours[field] == lld[field], field
+    assert ours["flags"] == adhoc_signature.CS_ADHOC
+    assert ours["identifier"] == identifier(name)
+
+
+@pytest.mark.parametrize("name", NAMES)
+def test_signing_unsigned_matches_linker_layout(tmp_path, name):
+    lld = read_code_directory(fixture("lld", name))
+    ours = read_code_directory(signed_copy(tmp_path, "unsigned", name))
+    # LC_CODE_SIGNATURE is added in the header padding, the signature goes where the linker puts it
+    assert ours["codeLimit"] == lld["codeLimit"]
+    for field in ("nCodeSlots", "execSegBase", "execSegLimit", "execSegFlags"):
+        assert ours[field] == lld[field], field
+    assert ours["flags"] == adhoc_signature.CS_ADHOC | adhoc_signature.CS_RUNTIME
+    assert ours["identifier"] == adhoc_signature.default_identifier(name)
+    expected_flags = adhoc_signature.CS_EXECSEG_MAIN_BINARY if name.startswith("hello") else 0
+    assert ours["execSegFlags"] == expected_flags
+
+
+@pytest.mark.parametrize("name", NAMES)
+def test_verify_detects_changes(tmp_path, name):
+    path = signed_copy(tmp_path, "unsigned", name)
+    assert adhoc_signature.verify_file(path) == []
+    assert adhoc_signature.verify_file(fixture("unsigned", name))[0].endswith("not signed")
+
+    # A byte changed past the header page: that page's hash no longer matches
+    with open(path, "r+b") as f:
+        f.seek(adhoc_signature.PAGE_SIZE + 100)
+        byte = f.read(1)
+        f.seek(-1, os.SEEK_CUR)
+        f.write(bytes([byte[0] ^ 0xff]))
+    assert adhoc_signature.verify_file(path) == [f"{path} ({macho.read_macho(path).archs[0]}): "
+                                                 "signature does not match the file contents"]
+
+
+@pytest.fixture
+def app(tmp_path):
+    # A small .app: main executable, a signed library with an alias, resources, and files the seal leaves out
+    app = tmp_path / "Test.app"
+    contents = app / "Contents"
+    for directory in ("MacOS", "Frameworks", "Resources/en.lproj"):
+        (contents / directory).mkdir(parents=True)
+    with open(contents / "Info.plist", "wb") as f:
+        plistlib.dump({"CFBundleExecutable": "hello", "CFBundleIdentifier": "org.synfig.test"}, f)
+    (contents / "PkgInfo").write_text("APPL????")
+    shutil.copy(fixture("unsigned", "hello-arm64"), contents / "MacOS" / "hello")
+    shutil.copy(fixture("unsigned", "libhello-arm64.dylib"), contents / "Frameworks" / "libhello.1.dylib")
+    adhoc_signature.sign_file(str(contents / "Frameworks" / "libhello.1.dylib"))
+    os.symlink("libhello.1.dylib", contents / "Frameworks" / "libhello.dylib")
+    (contents / "Resources" / "data.txt").write_text("data\n")
+    (contents / "Resources" / "en.lproj" / "Localizable.strings").write_text('"a" = "b";\n')
+    (contents / "Resources" / ".DS_Store").write_bytes(b"\0")
+    return str(app)
+
+
+def read_seal(app):
+    with open(os.path.join(app, "Contents", "_CodeSignature", "CodeResources"), "rb") as f:
+        raw = f.read()
+    return raw, plistlib.loads(raw)
+
+
+def test_seal_resources(app):
+    adhoc_signature.sign_bundle(app)
+    _, seal = read_seal(app)
+    contents = os.path.join(app, "Contents")
+    data = b"data\n"
+
+    assert sorted(seal["files2"]) == [
+        "Frameworks/libhello.1.dylib",
+        "Frameworks/libhello.dylib",
+        "Resources/data.txt",
+        "Resources/en.lproj/Localizable.strings",
+    ]
+    assert seal["files2"]["Resources/data.txt"] == {
+        "hash": hashlib.sha1(data).digest(),
+        "hash2": hashlib.sha256(data).digest(),
+    }
+    assert seal["files2"]["Resources/en.lproj/Localizable.strings"]["optional"] is True
+    assert seal["files2"]["Frameworks/libhello.dylib"] == {"symlink": "libhello.1.dylib"}
+    cdhash = adhoc_signature.code_directory_hash(os.path.join(contents, "Frameworks", "libhello.1.dylib"))
+    assert seal["files2"]["Frameworks/libhello.1.dylib"] == {
+        "cdhash": cdhash, "requirement": f'cdhash H"{cdhash.hex()}"',
+    }
+    # The legacy "files" dictionary only lists resources, by SHA-1
+    assert seal["files"] == {
+        "Resources/data.txt": hashlib.sha1(data).digest(),
+        "Resources/en.lproj/Localizable.strings": {
+            "hash": seal["files2"]["Resources/en.lproj/Localizable.strings"]["hash"], "optional": True,
+        },
+    }
+    assert "rules" in seal and "rules2" in seal
+
+
+def test_sign_bundle_binds_info_plist_and_seal(app):
+    adhoc_signature.sign_bundle(app)
+    raw_seal, _ = read_seal(app)
+    with open(os.path.join(app, "Contents", "Info.plist"), "rb") as f:
+        info = f.read()
+    main = read_code_directory(os.path.join(app, "Contents", "MacOS", "hello"))
+    assert main["identifier"] == "org.synfig.test"
+    assert main["execSegFlags"] == adhoc_signature.CS_EXECSEG_MAIN_BINARY
+
+    # Special slots are stored right before the code hashes, slot 1 closest
+    with open(os.path.join(app, "Contents", "MacOS", "hello"), "rb") as f:
+        data = f.read()
+    blobs = adhoc_signature._blobs(adhoc_signature._embedded_signature(
+        data, macho.parse_macho(data).slices[0])[1])
+    code_directory = blobs[adhoc_signature.CSSLOT_CODEDIRECTORY]
+
+    def special(slot):
+        end = main["hashOffset"] - (slot - 1) * 32
+        return code_directory[end - 32:end]
+
+    assert special(adhoc_signature.CSSLOT_INFOSLOT) == hashlib.sha256(info).digest()
+    assert special(adhoc_signature.CSSLOT_RESOURCEDIR) == hashlib.sha256(raw_seal).digest()
+    assert special(adhoc_signature.CSSLOT_REQUIREMENTS) == hashlib.sha256(
+        blobs[adhoc_signature.CSSLOT_REQUIREMENTS]).digest()
+    assert adhoc_signature.verify_bundle(app) == []
+
+
+def test_verify_bundle_detects_changes(app):
+    adhoc_signature.sign_bundle(app)
+    contents = os.path.join(app, "Contents")
+    with open(os.path.join(contents, "Resources", "data.txt"), "a") as f:
+        f.write("more\n")
+    assert adhoc_signature.verify_bundle(app) == [f"{app}: resources were modified after signing"]
+
+    adhoc_signature.sign_bundle(app)
+    # Re-signing nested code changes its cdhash, which the seal records
+    adhoc_signature.sign_file(os.path.join(contents, "Frameworks", "libhello.1.dylib"), identifier="other")
+    assert adhoc_signature.verify_bundle(app) == [f"{app}: resources were modified after signing"]
+
+    adhoc_signature.sign_bundle(app)
+    with open(os.path.join(contents, "Info.plist"), "ab") as f:
+        f.write(b"\n")
+    assert adhoc_signature.verify_bundle(app) == [
+        f"{os.path.join(contents, 'MacOS', 'hello')} (arm64): Info.plist was modified after signing",
+    ]
+
+
+def test_sign_bundle_needs_nested_code_signed(app):
+    shutil.copy(fixture("unsigned", "libhello-x86_64.dylib"), os.path.join(app, "Contents", "Frameworks", "libx.dylib"))
+    with pytest.raises(adhoc_signature.SignatureError, match="is not signed"):
+        adhoc_signature.sign_bundle(app)
@@ -0,0 +1,83 @@
+"""BatchSession: reuse between the bundles of a batch, and the same result as separate runs."""
+
+import os
+import shutil
+
+import pytest
+
+import batch
+import dependency_collection_4
+from benchmarks import synthetic_bundle
+from test_parallel_collect import TOOLS_DIR, snapshot
+
+LIBRARIES = 30
+
+
+def generate(root):
+    # Synth.app and a copy of it, linking the same prefix libraries
+    shutil.rmtree(root, ignore_errors=True)
+    app = synthetic_bundle.generate_bundle(root, libraries=LIBRARIES, frameworks=2, data_files=3, fat_every=5)["app"]
+    other = os.path.join(root, "Other.app")
+    shutil.copytree(app, other, symlinks=True)
+    return [app, other]
+
+
+@pytest.fixture
+def tools_path(monkeypatch):
+    monkeypatch.setenv("PATH", TOOLS_DIR + os.pathsep + os.environ.get("PATH", ""))
+
+
+def test_batch_matches_separate_runs(tmp_path, tools_path):
+    root = str(tmp_path / "synth")
+    separate = []
+    for app in generate(root):
+        dependency_collection_4.process_app_bundle(app, 2)
+        separate.append(snapshot(app))
+
+    apps = generate(root)
+    report = batch.process_app_bundles(apps, jobs=2)
+    assert [snapshot(app) for app in apps] == separate
+    assert report["failed"] == []
+
+    first, second = report["bundles"]
+    assert first["inputs"] == second["inputs"] == LIBRARIES + 2
+    # Nothing to reuse for the first bundle
+    assert (first["inputs_reused"], first["hashes_reused"], first["relinks_reused"]) == (0, 0, 0)
+    # Every input of the second was parsed for the first, every library hashed and relinked for it
+    # (frameworks are copied as directory trees, not hashed or cached)
+    assert second["inputs_reused"] == second["inputs"]
+    assert second["hashes_reused"] == second["relinks_reused"] == LIBRARIES
+    assert second["rpath_lookups_reused"] > 0
+    assert report["saved"]["relinks_reused"] == second["relinks_reused"]
+
+
+def test_session_keeps_a_given_cache(tmp_path, tools_path):
+    apps = generate(str(tmp_path / "synth"))
+    cache_dir = str(tmp_path / "cache")
+    session = batch.BatchSession(cache_dir=cache_dir)
+    try:
+        for app in apps:
+            session.process(app, 2)
+    finally:
+        session.close()
+    assert session.relocation_cache.stores == LIBRARIES
+    assert os.listdir(os.path.join(cache_dir, "objects"))
+    # close() leaves the module without the session's caches
+    assert dependency_collection_4.get_relocation_cache() is None
+
+
+def test_failed_bundle_does_not_stop_the_batch(tmp_path, tools_path, monkeypatch):
+    apps = generate(str(tmp_path / "synth"))
+    process = dependency_collection_4.process_app_bundle
+
+    def fail_first(app_bundle_path, *args, **kwargs):
+        if app_bundle_path == apps[0]:
+            raise RuntimeError("broken bundle")
+        return process(app_bundle_path, *args, **kwargs)
+    monkeypatch.setattr(dependency_collection_4, "process_app_bundle", fail_first)
+
+    report = batch.process_app_bundles(apps)
+    assert report["failed"] == [apps[0]]
+    assert report["bundles"][0]["error"] == "broken bundle"
+    assert report["bundles"][1]["inputs"] == LIBRARIES + 2
+    assert dependency_collection_4.check_app_bundle(apps[1]) == ([], [])
@@ -0,0 +1,210 @@
+"""
+macho.py against Mach-O files built by ld64.lld and what otool prints for them
+(fixtures/macho, see make_fixtures.sh there).
+"""
+
+import glob
+import os
+import re
+import shutil
+
+import pytest
+
+import macho
+import relink
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "macho")
+
+# Load command names otool prints; macho.py only defines the ones it acts on
+LC_NAMES = {name: value for name, value in vars(macho).items() if name.startswith("LC_") and isinstance(value, int)}
+LC_NAMES.update({
+    "LC_SYMTAB": 0x2,
+    "LC_DYSYMTAB": 0xb,
+    "LC_UUID": 0x1b,
+    "LC_FUNCTION_STARTS": 0x26,
+    "LC_DATA_IN_CODE": 0x29,
+    "LC_BUILD_VERSION": 0x32,
+    "LC_DYLD_INFO_ONLY": 0x22 | macho.LC_REQ_DYLD,
+})
+
+LOAD_KINDS = {
+    "weak": macho.LC_LOAD_WEAK_DYLIB,
+    "reexport": macho.LC_REEXPORT_DYLIB,
+    "upward": macho.LC_LOAD_UPWARD_DYLIB,
+    "lazy": macho.LC_LAZY_LOAD_DYLIB,
+}
+
+
+def recordings(kind):
+    # (fixture, arch) for every recorded NAME.ARCH.otool-<kind>.txt
+    pairs = []
+    for path in sorted(glob.glob(os.path.join(FIXTURES, f"*.otool-{kind}.txt"))):
+        fixture, arch = os.path.basename(path)[:-len(f".otool-{kind}.txt")].rsplit(".", 1)
+        pairs.append((fixture, arch))
+    return pairs
+
+
+def otool_L(fixture, arch):
+    # [(name, kind)] as printed by otool -L; kind is "" for LC_LOAD_DYLIB and LC_ID_DYLIB
+    entries = []
+    with open(os.path.join(FIXTURES, f"{fixture}.{arch}.otool-L.txt")) as f:
+        for line in f:
+            match = re.match(r"\t(.*) \(compatibility version [^,]*, current version [^,)]*(?:, (\w+))?\)$", line)
+            if match:
+                entries.append((match.group(1), match.group(2) or ""))
+    return entries
+
+
+def otool_l(fixture, arch):
+    """
+    Parse otool -l output.
+
+    Returns:
+        tuple: (header, commands) where `header` maps the mach header
+            columns to ints (empty if otool did not print it) and each
+            command is a dict of its fields plus "sections", the fields of
+            its sections
+    """
+    header = {}
+    commands = []
+    target = None
+    with open(os.path.join(FIXTURES, f"{fixture}.{arch}.otool-l.txt")) as f:
+        lines = f.read().splitlines()
+    for i, line in enumerate(lines):
+        fields = line.split()
+        if line == "Mach header":
+            names = lines[i + 1].split()
+            header = dict(zip(names, (int(v, 0) for v in lines[i + 2].split())))
+        elif line.startswith("Load command"):
+            commands.append({"sections": []})
+            target = commands[-1]
+        elif line == "Section":
+            commands[-1]["sections"].append({})
+            target = commands[-1]["sections"][-1]
+        elif target is not None and len(fields) >= 2 and fields[0] not in target:
+            target[fields[0]] = line.split(None, 1)[1]
+    return header, commands
+
+
+def parsed_slice(fixture, arch):
+    parsed = macho.read_macho(os.path.join(FIXTURES, fixture))
+    assert parsed is not None
+    slice_ = parsed.slice_for_arch(arch)
+    assert slice_ is not None, f"{fixture} has no {arch} slice"
+    return slice_
+
+
+def strip_offset(value):
+    # "name @rpath/libx.dylib (offset 24)" -> ("@rpath/libx.dylib", 24)
+    match = re.match(r"(.*) \(offset (\d+)\)$", value)
+    return match.group(1), int(match.group(2))
+
+
+@pytest.mark.parametrize("fixture,arch", recordings("l"))
+def test_load_commands_match_otool_l(fixture, arch):
+    slice_ = parsed_slice(fixture, arch)
+    _, commands = otool_l(fixture, arch)
+    assert [lc.cmd for lc in slice_.load_commands] == [LC_NAMES[c["cmd"]] for c in commands]
+    assert [lc.cmdsize for lc in slice_.load_commands] == [int(c["cmdsize"]) for c in commands]
+    for lc, command in zip(slice_.load_commands, commands):
+        value = command.get("name") or command.get("path")
+        if lc.cmd in macho.DYLIB_LOAD_COMMANDS or lc.cmd in (macho.LC_ID_DYLIB, macho.LC_RPATH):
+            assert (lc.string, lc.string_offset) == strip_offset(value)
+        else:
+            assert lc.string is None
+
+
+@pytest.mark.parametrize("fixture,arch", recordings("l"))
+def test_header_matches_otool_l(fixture, arch):
+    slice_ = parsed_slice(fixture, arch)
+    header, commands = otool_l(fixture, arch)
+    if header:
+        assert slice_.cputype == header["cputype"]
+        assert slice_.filetype == header["filetype"]
+        assert slice_.ncmds == header["ncmds"]
+        assert slice_.sizeofcmds == header["sizeofcmds"]
+        assert slice_.flags == header["flags"]
+    assert slice_.sizeofcmds == sum(int(c["cmdsize"]) for c in commands)
+
+    # Header padding: first byte of segment or section contents minus the load commands
+    starts = []
+    for command in commands:
+        if command["cmd"] in ("LC_SEGMENT", "LC_SEGMENT_64"):
+            if int(command["fileoff"]) and int(command["filesize"]):
+                starts.append(int(command["fileoff"]))
+            starts += [int(s["offset"]) for s in command["sections"] if int(s["offset"])]
+    assert slice_.header_padding == min(starts) - slice_.header_size - slice_.sizeofcmds
+
+
+@pytest.mark.parametrize("fixture,arch", recordings("L"))
+def test_dependencies_match_otool_L(fixture, arch):
+    slice_ = parsed_slice(fixture, arch)
+    entries = otool_L(fixture, arch)
+    if slice_.filetype == macho.MH_DYLIB:
+        # otool -L lists the install name first
+        assert slice_.install_name == entries[0][0]
+        entries = entries[1:]
+    else:
+        assert slice_.install_name is None
+    assert slice_.dependencies == [name for name, _ in entries]
+    loads = [lc for lc in slice_.load_commands if lc.cmd in macho.DYLIB_LOAD_COMMANDS]
+    assert [lc.cmd for lc in loads] == [LOAD_KINDS.get(kind, macho.LC_LOAD_DYLIB) for _, kind in entries]
+
+
+def test_fat_file():
+    parsed = macho.read_macho(os.path.join(FIXTURES, "libfat.dylib"))
+    assert parsed.is_fat
+    assert sorted(parsed.archs) == ["arm64", "x86_64"]
+    assert parsed.is_library
+    assert parsed.install_name == "/opt/homebrew/lib/libfat.dylib"
+    assert parsed.dependencies == ["/opt/homebrew/opt/base/lib/libbase.1.dylib"]
+    # Slice offsets are absolute, so both slices' load commands are where the fat header says
+    assert len({s.offset for s in parsed.slices}) == 2
+    assert all(lc.offset > s.offset for s in parsed.slices for lc in s.load_commands)
+
+
+def test_thin_file():
+    parsed = macho.read_macho(os.path.join(FIXTURES, "libthin.dylib"))
+    assert not parsed.is_fat
+    assert parsed.archs == ["arm64"]
+    assert macho.get_file_type(parsed.path) == macho.MH_DYLIB
+
+
+def test_rpaths():
+    parsed = macho.read_macho(os.path.join(FIXTURES, "plugin.bundle"))
+    assert parsed.filetype == macho.MH_BUNDLE
+    assert parsed.rpaths == ["@loader_path/../lib", "/opt/homebrew/lib"]
+    assert parsed.install_name is None
+
+
+def test_dependencies_are_merged_without_duplicates():
+    # ld64.lld writes libreexport.dylib both as a plain load and as a reexport
+    slice_ = parsed_slice("libloads.dylib", "arm64")
+    assert slice_.dependencies.count("@rpath/libreexport.dylib") == 2
+    assert macho.get_dependencies(os.path.join(FIXTURES, "libloads.dylib")) == [
+        "/opt/homebrew/opt/base/lib/libbase.1.dylib",
+        "/opt/homebrew/lib/libweak.dylib",
+        "@rpath/libreexport.dylib",
+        "@loader_path/libupward.dylib",
+        "/opt/homebrew/lib/liblazy.dylib",
+    ]
+
+
+def test_no_header_padding_is_not_rewritten_in_place(tmp_path):
+    path = str(tmp_path / "libnopad.dylib")
+    shutil.copy(os.path.join(FIXTURES, "libnopad.dylib"), path)
+    assert macho.read_macho(path).slices[0].header_padding == 0
+    with open(path, "rb") as f:
+        before = f.read()
+
+    plan = relink.RelinkPlan(path)
+    plan.change("/opt/homebrew/opt/base/lib/libbase.1.dylib", "@executable_path/../Frameworks/base/lib/libbase.1.dylib")
+    assert not relink.rewrite_in_place(plan)
+    with open(path, "rb") as f:
+        assert f.read() == before
+
+    # A shorter path frees space instead of needing it
+    plan = relink.RelinkPlan(path)
+    plan.change("/opt/homebrew/opt/base/lib/libbase.1.dylib", "@rpath/libbase.1.dylib")
+    assert relink.rewrite_in_place(plan)
+    assert macho.get_dependencies(path) == ["@rpath/libbase.1.dylib"]
@@ -0,0 +1,206 @@
+"""package.py's zip, Zip64 and chunked tar writers, read back with zipfile and tarfile."""
+
+import hashlib
+import io
+import json
+import os
+import random
+import shutil
+import stat
+import struct
+import subprocess
+import tarfile
+import zipfile
+
+import pytest
+
+import package
+
+BIG_SIZE = 3 * package.ZIP_CHUNK_SIZE + 12345
+
+
+@pytest.fixture
+def app(tmp_path):
+    # Framework with Versions/Current, library aliases, executables, an empty file and a multi-chunk file
+    app = tmp_path / "Test.app"
+    contents = app / "Contents"
+    framework = contents / "Frameworks" / "Foo.framework"
+    (framework / "Versions" / "A").mkdir(parents=True)
+    (contents / "MacOS").mkdir()
+    (contents / "Resources" / "lib").mkdir(parents=True)
+    (contents / "Info.plist").write_text("<plist/>\n")
+    (contents / "MacOS" / "Test").write_bytes(b"\xcf\xfa\xed\xfe" + b"main" * 1000)
+    (framework / "Versions" / "A" / "Foo").write_bytes(b"\xcf\xfa\xed\xfe" + b"foo" * 1000)
+    os.symlink("A", framework / "Versions" / "Current")
+    os.symlink("Versions/Current/Foo", framework / "Foo")
+    (contents / "Resources" / "lib" / "libbar.1.dylib").write_bytes(b"bar" * 5000)
+    os.symlink("libbar.1.dylib", contents / "Resources" / "lib" / "libbar.dylib")
+    (contents / "Resources" / "empty").write_bytes(b"")
+    # Compressible and incompressible parts, across chunk boundaries
+    big = (b"synfig " * BIG_SIZE)[:BIG_SIZE // 2] + random.Random(0).randbytes(BIG_SIZE - BIG_SIZE // 2)
+    (contents / "Resources" / "big.bin").write_bytes(big)
+    for path in (contents / "MacOS" / "Test", framework / "Versions" / "A" / "Foo"):
+        path.chmod(0o755)
+    (contents / "Resources" / "empty").chmod(0o600)
+    return str(app)
+
+
+def expected_tree(app):
+    # Archive name -> ("dir", mode) / ("link", target) / ("file", mode, bytes)
+    base = os.path.dirname(app)
+    tree = {}
+    for dirpath, dirnames, filenames in os.walk(app):
+        for path in [dirpath] + [os.path.join(dirpath, name) for name in dirnames + filenames]:
+            name = os.path.relpath(path, base)
+            st = os.lstat(path)
+            if stat.S_ISLNK(st.st_mode):
+                tree[name] = ("link", os.readlink(path))
+            elif stat.S_ISDIR(st.st_mode):
+                tree[name] = ("dir", stat.S_IMODE(st.st_mode))
+            else:
+                with open(path, "rb") as f:
+                    tree[name] = ("file", stat.S_IMODE(st.st_mode), f.read())
+    return tree
+
+
+def zip_tree(path):
+    tree = {}
+    with zipfile.ZipFile(path) as archive:
+        assert archive.testzip() is None
+        for info in archive.infolist():
+            mode = info.external_attr >> 16
+            data = archive.read(info)
+            if stat.S_ISLNK(mode):
+                tree[info.filename] = ("link", data.decode())
+            elif info.is_dir():
+                tree[info.filename.rstrip("/")] = ("dir", stat.S_IMODE(mode))
+            else:
+                tree[info.filename] = ("file", stat.S_IMODE(mode), data)
+    return tree
+
+
+def tar_tree(archive):
+    tree = {}
+    for info in archive:
+        assert (info.uid, info.gid, info.uname, info.gname) == (0, 0, "", "")
+        if info.issym():
+            tree[info.name] = ("link", info.linkname)
+        elif info.isdir():
+            tree[info.name] = ("dir", info.mode)
+        else:
+            tree[info.name] = ("file", info.mode, archive.extractfile(info).read())
+    return tree
+
+
+def check_contents(contents, output, tree):
+    with open(output + ".contents.json") as f:
+        assert json.load(f) == contents
+    with open(output, "rb") as f:
+        assert contents["archive_sha256"] == hashlib.sha256(f.read()).hexdigest()
+    assert contents["archive_size"] == os.path.getsize(output)
+    # Sorted, every entry once, each with the type, mode, size and hash of what is in the bundle
+    assert [e["path"] for e in contents["entries"]] == sorted(tree)
+    for entry in contents["entries"]:
+        expected = tree[entry["path"]]
+        if expected[0] == "link":
+            assert (entry["type"], entry["target"]) == ("symlink", expected[1])
+        elif expected[0] == "dir":
+            assert (entry["type"], entry["mode"]) == ("dir", f"{expected[1]:04o}")
+        else:
+            assert entry == {
+                "path": entry["path"], "type": "file", "mode": f"{expected[1]:04o}",
+                "size": len(expected[2]), "sha256": hashlib.sha256(expected[2]).hexdigest(),
+            }
+
+
+@pytest.mark.parametrize("jobs", [1, 4])
+def test_zip(app, tmp_path, jobs):
+    output = str(tmp_path / f"Test.{jobs}.zip")
+    contents = package.package_bundle(app, output, "zip", jobs=jobs)
+    tree = expected_tree(app)
+    assert zip_tree(output) == tree
+    check_contents(contents, output, tree)
+    with zipfile.ZipFile(output) as archive:
+        # The empty file is stored, the big one deflated in several sync-flushed chunks
+        assert archive.getinfo("Test.app/Contents/Resources/empty").compress_type == zipfile.ZIP_STORED
+        big = archive.getinfo("Test.app/Contents/Resources/big.bin")
+        assert big.compress_type == zipfile.ZIP_DEFLATED and big.file_size == BIG_SIZE
+    if shutil.which("unzip"):
+        assert subprocess.run(["unzip", "-tq", output], capture_output=True).returncode == 0
+
+
+def test_zip_is_the_same_with_any_number_of_jobs(app, tmp_path):
+    archives = []
+    for jobs in (1, 3):
+        output = str(tmp_path / f"Test.{jobs}.zip")
+        package.package_bundle(app, output, "zip", jobs=jobs)
+        with open(output, "rb") as f:
+            archives.append(f.read())
+    assert archives[0] == archives[1]
+
+
+def test_zip64(app, tmp_path, monkeypatch):
+    # Lower the threshold so the big file, and everything written after it, takes the Zip64 paths
+    monkeypatch.setattr(package, "_ZIP64_LIMIT", package.ZIP_CHUNK_SIZE)
+    output = str(tmp_path / "Test.zip")
+    contents = package.package_bundle(app, output, "zip", jobs=2)
+    tree = expected_tree(app)
+    assert zip_tree(output) == tree
+    check_contents(contents, output, tree)
+
+    with open(output, "rb") as f:
+        data = f.read()
+    assert b"PK\x06\x06" in data and b"PK\x06\x07" in data  # Zip64 end of central directory and locator
+    with zipfile.ZipFile(output) as archive:
+        big = archive.getinfo("Test.app/Contents/Resources/big.bin")
+        # The local header carries a Zip64 extra field with the real sizes
+        name_length, extra_length = struct.unpack_from("<HH", data, big.header_offset + 26)
+        extra = big.header_offset + 30 + name_length
+        # After the 9-byte extended timestamp: Zip64 header id, length, size and compressed size
+        assert struct.unpack_from("<HHQQ", data, extra + 9) == (0x0001, 16, BIG_SIZE, big.compress_size)
+        assert extra_length == 9 + 20
+        assert max(info.header_offset for info in archive.infolist()) >= package.ZIP_CHUNK_SIZE
+    if shutil.which("unzip"):
+        assert subprocess.run(["unzip", "-tq", output], capture_output=True).returncode == 0
+
+
+@pytest.mark.parametrize("jobs", [1, 4])
+def test_tar_xz(app, tmp_path, monkeypatch, jobs):
+    # Small chunks: the archive is several concatenated xz streams
+    monkeypatch.setattr(package, "TAR_CHUNK_SIZE", 256 * 1024)
+    output = str(tmp_path / "Test.tar.xz")
+    contents = package.package_bundle(app, output, "tar.xz", jobs=jobs)
+    tree = expected_tree(app)
+    with tarfile.open(output, "r:xz") as archive:
+        assert tar_tree(archive) == tree
+    check_contents(contents, output, tree)
+
+
+def test_tar_zst(app, tmp_path, monkeypatch):
+    zstd = shutil.which("zstd")
+    if zstd is None:
+        pytest.skip("zstd is not installed")
+    monkeypatch.setattr(package, "TAR_CHUNK_SIZE", 256 * 1024)
+    output = str(tmp_path / "Test.tar.zst")
+    contents = package.package_bundle(app, output, "tar.zst", jobs=2)
+    tree = expected_tree(app)
+    stream = subprocess.run([zstd, "-d", "-c", output], capture_output=True, check=True).stdout
+    with tarfile.open(fileobj=io.BytesIO(stream), mode="r:") as archive:
+        assert tar_tree(archive) == tree
+    check_contents(contents, output, tree)
+
+
+def test_file_changing_while_packed(app, tmp_path, monkeypatch):
+    big = os.path.join(app, "Contents", "Resources", "big.bin")
+    read = package._walk
+
+    def walk_then_truncate(app_bundle_path):
+        for name, path, st in read(app_bundle_path):
+            if path == big:
+                os.truncate(big, 10)
+            yield name, path, st
+    monkeypatch.setattr(package, "_walk", walk_then_truncate)
+    output = str(tmp_path / "Test.zip")
+    with pytest.raises(package.PackageError, match="changed while it was packed"):
+        package.package_bundle(app, output, "zip")
+    assert not os.path.exists(output) and not os.path.exists(output + ".part")
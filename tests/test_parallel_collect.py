@@ -0,0 +1,52 @@
+"""The parallel collector must build the same bundle as the serial one."""
+
+import os
+import shutil
+import stat
+
+import pytest
+
+import dependency_collection_4
+from benchmarks import synthetic_bundle
+
+TOOLS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "tools")
+
+
+def snapshot(root):
+    # Bundle-relative path -> ("link", target) or ("file", mode, bytes), directories with their mode
+    tree = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in dirnames + filenames:
+            path = os.path.join(dirpath, name)
+            rel_path = os.path.relpath(path, root)
+            st = os.lstat(path)
+            if stat.S_ISLNK(st.st_mode):
+                tree[rel_path] = ("link", os.readlink(path))
+            elif stat.S_ISDIR(st.st_mode):
+                tree[rel_path] = ("dir", stat.S_IMODE(st.st_mode))
+            else:
+                with open(path, "rb") as f:
+                    tree[rel_path] = ("file", stat.S_IMODE(st.st_mode), f.read())
+    return tree
+
+
+def collect(root, jobs):
+    info = synthetic_bundle.generate_bundle(root, libraries=60, frameworks=3, data_files=10, fat_every=5)
+    dependency_collection_4.process_app_bundle(info["app"], jobs)
+    return snapshot(info["app"])
+
+
+@pytest.mark.parametrize("jobs", [4, 8])
+def test_parallel_collect_matches_serial(tmp_path, monkeypatch, jobs):
+    monkeypatch.setenv("PATH", TOOLS_DIR + os.pathsep + os.environ.get("PATH", ""))
+    root = str(tmp_path / "synth")
+    serial = collect(root, 1)
+    shutil.rmtree(root)
+    parallel = collect(root, jobs)
+
+    assert sorted(parallel) == sorted(serial)
+    for rel_path, entry in serial.items():
+        assert parallel[rel_path] == entry, f"{rel_path} differs between jobs=1 and jobs={jobs}"
+    # The run did collect something: libraries copied in, and their aliases as symlinks
+    assert any(entry[0] == "link" for entry in serial.values())
+    assert sum(rel_path.endswith(".dylib") for rel_path in serial) > 60
@@ -0,0 +1,168 @@
+"""python_payload.py on a small fake Python.framework."""
+
+import importlib.util
+import logging
+import marshal
+import os
+import sys
+
+import pytest
+
+import macho
+import python_payload
+from benchmarks import machogen
+
+VERSION = f"{sys.version_info[0]}.{sys.version_info[1]}"
+CACHE_TAG = sys.implementation.cache_tag
+
+
+def write(path, data=b"", mode=0o644):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+    os.chmod(path, mode)
+
+
+@pytest.fixture
+def app(tmp_path):
+    # Test.app with a Python.framework linking openssl from a fake Homebrew prefix (tmp_path/homebrew),
+    # and the libcrypto the collector already placed in Contents/Resources/lib
+    prefix = str(tmp_path / "homebrew")
+    ssl = f"{prefix}/opt/openssl/lib/libssl.3.dylib"
+    crypto = f"{prefix}/opt/openssl/lib/libcrypto.3.dylib"
+    homebrew_python = f"{prefix}/opt/python/Frameworks/Python.framework/Versions/{VERSION}/Python"
+    write(crypto, machogen.build_macho(install_name=crypto))
+    write(ssl, machogen.build_macho(install_name=ssl, dependencies=[crypto]))
+
+    app = str(tmp_path / "Test.app")
+    write(os.path.join(app, "Contents", "Resources", "lib", "libcrypto.3.dylib"),
+          machogen.build_macho(install_name="@executable_path/../Resources/lib/libcrypto.3.dylib", seed="collected"))
+    framework = os.path.join(app, "Contents", "Resources", "Frameworks", "Python.framework")
+    home = os.path.join(framework, "Versions", VERSION)
+    write(os.path.join(home, "Python"), machogen.build_macho(install_name=homebrew_python, dependencies=[crypto]), 0o755)
+    write(os.path.join(home, "bin", f"python{VERSION}"),
+          machogen.build_macho(macho.MH_EXECUTE, dependencies=[homebrew_python], seed="python"), 0o755)
+    write(os.path.join(home, "lib", f"python{VERSION}", "lib-dynload", "_ssl.so"),
+          machogen.build_macho(macho.MH_BUNDLE, dependencies=[ssl, homebrew_python], rpaths=[f"{prefix}/lib"],
+                               seed="_ssl"), 0o755)
+    os.symlink(VERSION, os.path.join(framework, "Versions", "Current"))
+    os.symlink("Versions/Current/Python", os.path.join(framework, "Python"))
+    return app
+
+
+@pytest.fixture
+def payload(app):
+    payloads = python_payload.find_payloads(app)
+    assert [(p.framework, p.version) for p in payloads] == [
+        (os.path.join(app, "Contents", "Resources", "Frameworks", "Python.framework"), VERSION),
+    ]
+    return payloads[0]
+
+
+def tree(root):
+    return sorted(os.path.relpath(os.path.join(dirpath, name), root)
+                  for dirpath, dirnames, filenames in os.walk(root) for name in dirnames + filenames)
+
+
+@pytest.mark.parametrize("keep_tests", [False, True])
+def test_remove_clutter(payload, keep_tests):
+    lib = payload.lib_dir
+    for rel_path in ("os.py", "json/__init__.py", "json/tests/test_json.py", "test/test_os.py",
+                     "idlelib/idle_test/test_run.py", "site-packages/pkg/testing.py", "site-packages/pkg/tests.py",
+                     f"__pycache__/os.{CACHE_TAG}.pyc", f"json/tests/__pycache__/test_json.{CACHE_TAG}.pyc",
+                     "site-packages/pkg/stray.pyc", "site-packages/pkg/stray.pyo"):
+        write(os.path.join(lib, rel_path), b"x" * 10)
+
+    removed, size = python_payload.remove_clutter(lib, keep_tests)
+
+    # Whole directories go, the walk does not descend into them
+    expected = ["__pycache__", "site-packages/pkg/stray.pyc", "site-packages/pkg/stray.pyo"]
+    if keep_tests:
+        expected.append("json/tests/__pycache__")
+    else:
+        expected += ["json/tests", "test", "idlelib/idle_test"]
+    assert sorted(os.path.relpath(path, lib) for path in removed) == sorted(expected)
+    assert size == 10 * (4 if keep_tests else 7)
+    # Modules merely named like tests are kept
+    remaining = tree(lib)
+    assert "site-packages/pkg/testing.py" in remaining and "site-packages/pkg/tests.py" in remaining
+    assert ("json/tests/test_json.py" in remaining) == keep_tests
+    assert not any(path.endswith((".pyc", ".pyo")) for path in remaining)
+
+
+def test_relocate_payload(app, payload):
+    home = payload.home
+    lib = os.path.join(app, "Contents", "Resources", "lib")
+    ssl_so = os.path.join(payload.lib_dir, "lib-dynload", "_ssl.so")
+    with open(os.path.join(lib, "libcrypto.3.dylib"), "rb") as f:
+        collected = f.read()
+
+    report = python_payload.relocate_payload(payload, app)
+
+    def loader_path(target, binary):
+        return "@loader_path/" + os.path.relpath(target, os.path.dirname(binary))
+
+    # libssl was missing and is copied; the collected libcrypto is reused as it is
+    assert (report["modules"], report["copied"], report["relinked"]) == (3, 1, 4)
+    assert sorted(os.listdir(lib)) == ["libcrypto.3.dylib", "libssl.3.dylib"]
+    with open(os.path.join(lib, "libcrypto.3.dylib"), "rb") as f:
+        assert f.read() == collected
+
+    # Every reference is relative to the file holding it, whichever executable loads it
+    assert macho.get_dependencies(os.path.join(home, "bin", f"python{VERSION}")) == ["@loader_path/../Python"]
+    assert macho.get_dependencies(os.path.join(home, "Python")) == [
+        loader_path(os.path.join(lib, "libcrypto.3.dylib"), os.path.join(home, "Python")),
+    ]
+    assert macho.get_dependencies(ssl_so) == [
+        loader_path(os.path.join(lib, "libssl.3.dylib"), ssl_so),
+        loader_path(os.path.join(home, "Python"), ssl_so),
+    ]
+    assert macho.get_dependencies(os.path.join(lib, "libssl.3.dylib")) == ["@loader_path/libcrypto.3.dylib"]
+    # Rpaths outside the bundle are dropped
+    assert macho.get_rpaths(ssl_so) == []
+    assert os.readlink(os.path.join(payload.framework, "Python")) == "Versions/Current/Python"
+
+
+def test_compile_payload_writes_checked_hash_pycs(app, payload, caplog):
+    sources = {
+        "os.py": b"import sys\n",
+        "json/__init__.py": b"from .decoder import loads\n",
+        "json/decoder.py": b"def loads(s):\n    return s\n",
+        "site-packages/lxml/__init__.py": b"",
+        # Templates with deliberate syntax errors are skipped, not fatal
+        "site-packages/pkg/template.py": b"def (\n",
+    }
+    for rel_path, data in sources.items():
+        write(os.path.join(payload.lib_dir, rel_path), data)
+
+    with caplog.at_level(logging.INFO):
+        # The framework's interpreter is not a program that runs here, the host compiles instead
+        assert python_payload.compile_payload(payload, app, jobs=2) == "host"
+    assert "did not compile" in caplog.text
+
+    for rel_path, data in sources.items():
+        directory, name = os.path.split(os.path.join(payload.lib_dir, rel_path))
+        pyc = os.path.join(directory, "__pycache__", f"{name[:-3]}.{CACHE_TAG}.pyc")
+        if name == "template.py":
+            assert not os.path.exists(pyc)
+            continue
+        with open(pyc, "rb") as f:
+            pyc_data = f.read()
+        assert pyc_data[:4] == importlib.util.MAGIC_NUMBER
+        # Flags: hash-based, checked against the source
+        assert int.from_bytes(pyc_data[4:8], "little") == 0b11
+        assert pyc_data[8:16] == importlib.util.source_hash(data)
+        # The recorded path starts at the bundle, not at where it was built
+        code = marshal.loads(pyc_data[16:])
+        assert code.co_filename == os.path.relpath(os.path.join(directory, name), os.path.dirname(app))
+    assert python_payload.count_pycs(payload.lib_dir) == len(sources) - 1
+
+
+def test_compile_payload_needs_the_same_python(tmp_path, caplog):
+    other = python_payload.Payload(str(tmp_path / "Python.framework"), "2.7")
+    os.makedirs(other.lib_dir)
+    write(os.path.join(other.lib_dir, "os.py"), b"import sys\n")
+    with caplog.at_level(logging.WARNING):
+        assert python_payload.compile_payload(other, str(tmp_path / "Test.app")) is None
+    assert "Not precompiling Python 2.7" in caplog.text
+    assert python_payload.count_pycs(other.lib_dir) == 0
@@ -0,0 +1,162 @@
+"""
+relink.rewrite_in_place() against what install_name_tool makes of the same
+edits (fixtures/macho/relinked, see make_fixtures.sh).
+"""
+
+import logging
+import os
+import shlex
+import shutil
+
+import pytest
+
+import macho
+import profiling
+import relink
+from test_macho import FIXTURES, LC_NAMES, otool_l, strip_offset
+
+BASE = "/opt/homebrew/opt/base/lib/libbase.1.dylib"
+
+
+def cases():
+    # [(name, fixture, args)] from relinked/CASES
+    entries = []
+    with open(os.path.join(FIXTURES, "relinked", "CASES")) as f:
+        for line in f:
+            if line.strip() and not line.startswith("#"):
+                name, fixture, args = line.split(None, 2)
+                entries.append((name, fixture, shlex.split(args)))
+    return entries
+
+
+def plan_from_args(path, args):
+    # The RelinkPlan for install_name_tool arguments
+    plan = relink.RelinkPlan(path)
+    i = 0
+    while i < len(args):
+        if args[i] == "-change":
+            plan.change(args[i + 1], args[i + 2])
+            i += 3
+        else:
+            {"-id": plan.set_id, "-add_rpath": plan.add_rpath, "-delete_rpath": plan.delete_rpath}[args[i]](args[i + 1])
+            i += 2
+    return plan
+
+
+def copy_fixture(tmp_path, fixture):
+    path = str(tmp_path / fixture)
+    shutil.copy(os.path.join(FIXTURES, fixture), path)
+    with open(path, "rb") as f:
+        return path, f.read()
+
+
+@pytest.mark.parametrize("name,fixture,args", cases(), ids=[case[0] for case in cases()])
+def test_rewrite_matches_install_name_tool(tmp_path, name, fixture, args):
+    path, before = copy_fixture(tmp_path, fixture)
+    old_slices = macho.read_macho(path).slices
+    plan = plan_from_args(path, args)
+    assert plan.install_name_tool_command() == ["install_name_tool"] + args + [path]
+
+    assert relink.rewrite_in_place(plan)
+    with open(path, "rb") as f:
+        after = f.read()
+    for old, slice_ in zip(old_slices, macho.read_macho(path).slices):
+        header, commands = otool_l(f"relinked/{name}", slice_.arch)
+        assert (slice_.ncmds, slice_.sizeofcmds) == (header["ncmds"], header["sizeofcmds"])
+        assert [(lc.cmd, lc.cmdsize) for lc in slice_.load_commands] == \
+            [(LC_NAMES[c["cmd"]], int(c["cmdsize"])) for c in commands]
+        for lc, command in zip(slice_.load_commands, commands):
+            value = command.get("name") or command.get("path")
+            if lc.string is not None:
+                assert (lc.string, lc.string_offset) == strip_offset(value)
+
+        # Only the load commands changed; space they no longer use is zeroed
+        start = slice_.offset + slice_.header_size
+        end = max(start + old.sizeofcmds, start + slice_.sizeofcmds)
+        assert after[start + slice_.sizeofcmds:end] == bytes(end - start - slice_.sizeofcmds)
+        assert after[end:old.offset + old.size] == before[end:old.offset + old.size]
+
+
+def test_shrinking_commands_zeroes_the_leftover_space(tmp_path):
+    path, before = copy_fixture(tmp_path, "libnopad.dylib")
+    old = macho.read_macho(path).slices[0]
+    assert old.header_padding == 0
+    plan = relink.RelinkPlan(path)
+    plan.change(BASE, "@rpath/b.dylib")
+    plan.set_id("@rpath/n.dylib")
+    assert relink.rewrite_in_place(plan)
+
+    with open(path, "rb") as f:
+        after = f.read()
+    slice_ = macho.read_macho(path).slices[0]
+    assert slice_.sizeofcmds < old.sizeofcmds
+    assert slice_.header_padding == old.sizeofcmds - slice_.sizeofcmds
+    start = slice_.header_size
+    assert after[start + slice_.sizeofcmds:start + old.sizeofcmds] == bytes(old.sizeofcmds - slice_.sizeofcmds)
+    assert after[start + old.sizeofcmds:] == before[start + old.sizeofcmds:]
+    assert (slice_.install_name, slice_.dependencies) == ("@rpath/n.dylib", ["@rpath/b.dylib"])
+
+
+def test_fat_file_is_rewritten_in_every_slice_or_none(tmp_path):
+    # libmixedpad.dylib: an arm64 slice without header padding and an x86_64 slice with some
+    path, before = copy_fixture(tmp_path, "libmixedpad.dylib")
+    padding = {s.arch: s.header_padding for s in macho.read_macho(path).slices}
+    assert padding["arm64"] == 0 and padding["x86_64"] >= 8
+
+    # 8 more bytes fit in the x86_64 slice only: neither is written
+    plan = relink.RelinkPlan(path)
+    plan.change(BASE, "@executable_path/../Frameworks/base/libbase.1.dylib")
+    assert not relink.rewrite_in_place(plan)
+    with open(path, "rb") as f:
+        assert f.read() == before
+
+    plan = relink.RelinkPlan(path)
+    plan.change(BASE, "@rpath/libbase.1.dylib")
+    assert relink.rewrite_in_place(plan)
+    assert [s.dependencies for s in macho.read_macho(path).slices] == [["@rpath/libbase.1.dylib"]] * 2
+
+
+def test_id_of_a_bundle_is_ignored(tmp_path, caplog):
+    path, _ = copy_fixture(tmp_path, "plugin.bundle")
+    plan = relink.RelinkPlan(path)
+    plan.set_id("@rpath/plugin.bundle")
+    plan.add_rpath("@loader_path")
+    with caplog.at_level(logging.WARNING):
+        assert relink.rewrite_in_place(plan)
+    assert "has no LC_ID_DYLIB, ignoring -id @rpath/plugin.bundle" in caplog.text
+    parsed = macho.read_macho(path)
+    assert parsed.install_name is None
+    assert parsed.rpaths == ["@loader_path/../lib", "/opt/homebrew/lib", "@loader_path"]
+
+
+def test_existing_rpath_is_not_added_twice(tmp_path):
+    path, before = copy_fixture(tmp_path, "plugin.bundle")
+    plan = relink.RelinkPlan(path)
+    plan.add_rpath("/opt/homebrew/lib")
+    assert relink.rewrite_in_place(plan)
+    with open(path, "rb") as f:
+        assert f.read() == before
+
+
+def test_apply_plan_falls_back_to_install_name_tool(tmp_path, monkeypatch):
+    path, before = copy_fixture(tmp_path, "libnopad.dylib")
+    calls = []
+    monkeypatch.setattr(profiling, "run_tool", lambda cmd, **kwargs: calls.append(cmd))
+    plan = relink.RelinkPlan(path)
+    plan.change(BASE, "@executable_path/../Frameworks/base/lib/libbase.1.dylib")
+    plan.set_id("@rpath/libnopad.dylib")
+    plan.delete_rpath("/nowhere")
+    plan.add_rpath("@loader_path")
+
+    assert relink.apply_plan(plan)
+    # Every edit in one invocation, on the untouched file
+    assert calls == [[
+        "install_name_tool",
+        "-change", BASE, "@executable_path/../Frameworks/base/lib/libbase.1.dylib",
+        "-id", "@rpath/libnopad.dylib",
+        "-delete_rpath", "/nowhere",
+        "-add_rpath", "@loader_path",
+        path,
+    ]]
+    with open(path, "rb") as f:
+        assert f.read() == before
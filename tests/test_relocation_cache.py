@@ -0,0 +1,155 @@
+"""RelocationCache keys, eviction and concurrent writers, and bundles collected from cache hits."""
+
+import multiprocessing
+import os
+import shutil
+import threading
+
+import pytest
+
+import dependency_collection_4
+import relink
+import relocation_cache
+from benchmarks import synthetic_bundle
+from test_parallel_collect import TOOLS_DIR, snapshot
+
+
+def make_plan(new_id="@rpath/libx.dylib"):
+    plan = relink.RelinkPlan("/Test.app/Contents/Frameworks/libx.dylib")
+    plan.change("/opt/homebrew/lib/liby.dylib", "@rpath/liby.dylib")
+    plan.set_id(new_id)
+    return plan
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_key(tmp_path):
+    cache = relocation_cache.RelocationCache(str(tmp_path / "cache"))
+    key = cache.key("a" * 64, make_plan(), "arm64")
+    assert key == cache.key("a" * 64, make_plan(), "arm64")
+    # The input, the architecture and every edit of the plan are part of the key
+    assert key != cache.key("b" * 64, make_plan(), "arm64")
+    assert key != cache.key("a" * 64, make_plan(), None)
+    assert key != cache.key("a" * 64, make_plan("@rpath/libz.dylib"), "arm64")
+    plan = make_plan()
+    plan.add_rpath("@loader_path")
+    assert key != cache.key("a" * 64, plan, "arm64")
+
+
+def test_fetch_and_store(tmp_path):
+    cache = relocation_cache.RelocationCache(str(tmp_path / "cache"))
+    key = cache.key("a" * 64, make_plan())
+    fetched = []
+    assert not cache.fetch(key, fetched.append)
+
+    (tmp_path / "libx.dylib").write_bytes(b"relinked")
+    cache.store(key, str(tmp_path / "libx.dylib"))
+    # The entry is a copy: later writes to the bundle file do not reach it
+    (tmp_path / "libx.dylib").write_bytes(b"signed")
+    assert cache.fetch(key, fetched.append)
+    assert [read(path) for path in fetched] == [b"relinked"]
+    assert (cache.hits, cache.misses, cache.stores, cache.reused) == (1, 1, 1, 1)
+    assert os.listdir(tmp_path / "cache" / "tmp") == []
+
+    cache.store(key, str(tmp_path / "missing.dylib"))
+    assert cache.stores == 1
+
+
+def test_evict_removes_least_recently_used(tmp_path):
+    cache = relocation_cache.RelocationCache(str(tmp_path / "cache"), max_bytes=250)
+    keys = [cache.key(str(i) * 64, make_plan()) for i in range(4)]
+    for i, key in enumerate(keys):
+        (tmp_path / "lib").write_bytes(bytes([i]) * 100)
+        cache.store(key, str(tmp_path / "lib"))
+        # Stored an hour apart, oldest first
+        os.utime(cache._path(key), (1000 + 3600 * i, 1000 + 3600 * i))
+    # Using the oldest entry makes it the most recent
+    assert cache.fetch(keys[0], lambda path: None)
+    # A killed writer's leftover is removed after a day, a current one is kept
+    (tmp_path / "cache" / "tmp" / "killed").write_bytes(b"x")
+    os.utime(tmp_path / "cache" / "tmp" / "killed", (1000, 1000))
+    (tmp_path / "cache" / "tmp" / "writing").write_bytes(b"x")
+
+    assert cache.evict() == 200
+    assert [cache.fetch(key, lambda path: None) for key in keys] == [True, False, False, True]
+    assert (cache.evictions, cache.bytes_evicted) == (2, 200)
+    assert os.listdir(tmp_path / "cache" / "tmp") == ["writing"]
+    assert cache.evict() == 0
+
+
+def store_many(directory, key, source, count, barrier):
+    cache = relocation_cache.RelocationCache(directory)
+    barrier.wait()
+    for _ in range(count):
+        cache.store(key, source)
+
+
+def test_concurrent_stores_of_one_key(tmp_path):
+    directory = str(tmp_path / "cache")
+    cache = relocation_cache.RelocationCache(directory)
+    key = cache.key("a" * 64, make_plan())
+    data = os.urandom(4 * 1024 * 1024)
+    sources = []
+    for i in range(4):
+        sources.append(str(tmp_path / f"lib{i}"))
+        with open(sources[-1], "wb") as f:
+            f.write(data)
+
+    # Two processes and two threads store the same entry while readers fetch it
+    context = multiprocessing.get_context("fork")
+    barrier = context.Barrier(4)
+    processes = [context.Process(target=store_many, args=(directory, key, sources[i], 5, barrier)) for i in range(2)]
+    threads = [threading.Thread(target=store_many, args=(directory, key, sources[i], 5, barrier)) for i in (2, 3)]
+    seen = []
+    done = threading.Event()
+
+    def reader():
+        while not done.is_set():
+            cache.fetch(key, lambda path: seen.append(read(path)))
+
+    readers = [threading.Thread(target=reader) for _ in range(2)]
+    for worker in processes + threads + readers:
+        worker.start()
+    for worker in processes + threads:
+        worker.join()
+    done.set()
+    for worker in readers:
+        worker.join()
+
+    assert all(process.exitcode == 0 for process in processes)
+    # Readers only ever saw the whole file, and no partial write is left behind
+    assert all(content == data for content in seen)
+    assert read(cache._path(key)) == data
+    assert os.listdir(os.path.join(directory, "tmp")) == []
+
+
+@pytest.fixture
+def collect(tmp_path, monkeypatch):
+    monkeypatch.setenv("PATH", TOOLS_DIR + os.pathsep + os.environ.get("PATH", ""))
+    root = str(tmp_path / "synth")
+
+    def collect(cache_dir=None):
+        # A fresh copy of the same bundle at the same path each time
+        shutil.rmtree(root, ignore_errors=True)
+        app = synthetic_bundle.generate_bundle(root, libraries=30, frameworks=2, data_files=3, fat_every=5)["app"]
+        dependency_collection_4.process_app_bundle(app, 2, cache_dir=cache_dir)
+        return snapshot(app)
+    yield collect
+    dependency_collection_4.reset_relocation_cache()
+
+
+def test_cache_hits_give_the_same_bundle(tmp_path, collect):
+    cache_dir = str(tmp_path / "cache")
+    uncached = collect()
+
+    assert collect(cache_dir) == uncached
+    first = dependency_collection_4.get_relocation_cache()
+    assert first.hits == 0 and first.stores >= 30
+
+    assert collect(cache_dir) == uncached
+    second = dependency_collection_4.get_relocation_cache()
+    # Every library came from the cache
+    assert (second.hits, second.misses, second.stores) == (first.stores, 0, 0)
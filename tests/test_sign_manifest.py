@@ -0,0 +1,73 @@
+"""Signing keeps the collector's manifest in step with the bundle, whichever entry point signs."""
+
+import os
+import subprocess
+import sys
+
+import code_signing_1
+import dependency_collection_4
+import manifest
+from benchmarks import synthetic_bundle
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOOLS_DIR = os.path.join(REPO_ROOT, "benchmarks", "tools")
+
+
+def rewriting_codesign(tmp_path):
+    path = tmp_path / "codesign"
+    path.write_text(
+        "#!/bin/sh\n"
+        'for arg; do [ -f "$arg" ] && printf signed >> "$arg"; done\n'
+        "exit 0\n"
+    )
+    path.chmod(0o755)
+    return str(path)
+
+
+def script(cwd, name, *args):
+    # Run in `cwd`: the standalone scripts write their log file to the working directory
+    env = dict(os.environ, PATH=TOOLS_DIR + os.pathsep + os.environ.get("PATH", ""))
+    return subprocess.run([sys.executable, os.path.join(REPO_ROOT, name)] + list(args),
+                          env=env, cwd=cwd, capture_output=True, text=True)
+
+
+def test_two_script_workflow_leaves_manifest_clean(tmp_path):
+    app = synthetic_bundle.generate_bundle(str(tmp_path / "synth"), libraries=20, frameworks=2, data_files=3)["app"]
+    codesign = rewriting_codesign(tmp_path)
+
+    assert script(tmp_path, "dependency_collection_4.py", "--app", app).returncode == 0
+    signed = script(tmp_path, "code_signing_1.py", "--app", app, "--identity", "Test Identity", "--backend", "codesign",
+                    "--codesign", codesign, "--spctl", os.path.join(TOOLS_DIR, "spctl"))
+    assert signed.returncode == 0, signed.stderr
+    check = script(tmp_path, "dependency_collection_4.py", "--app", app, "--check")
+    assert check.returncode == 0, check.stderr
+
+
+def test_sign_app_bundle_refreshes_the_manifest(tmp_path, monkeypatch):
+    monkeypatch.setenv("PATH", TOOLS_DIR + os.pathsep + os.environ.get("PATH", ""))
+    app = synthetic_bundle.generate_bundle(str(tmp_path / "synth"), libraries=20, frameworks=2, data_files=3)["app"]
+    manifest_path = str(tmp_path / "collect.json")
+    dependency_collection_4.process_app_bundle(app, 2, manifest_path)
+    backend = code_signing_1.make_backend("codesign", "Test Identity", codesign=rewriting_codesign(tmp_path))
+    code_signing_1.sign_app_bundle(app, "Test Identity", jobs=2, backend=backend, verify=False,
+                                   manifest_path=manifest_path)
+
+    stale, dirty = dependency_collection_4.check_app_bundle(app, manifest_path)
+    assert (stale, dirty) == ([], [])
+    # The files were rewritten, and the manifest has their new hashes
+    bundle_manifest = manifest.BundleManifest(app, manifest_path)
+    assert bundle_manifest.load()
+    main_executable = bundle_manifest.rel(code_signing_1.find_main_executable(app))
+    with open(code_signing_1.find_main_executable(app), "rb") as f:
+        assert f.read().endswith(b"signed")
+    assert bundle_manifest.files[main_executable]["signature"]["sha256"] == manifest.hash_file(
+        code_signing_1.find_main_executable(app))
+
+
+def test_signing_without_a_manifest_does_not_create_one(tmp_path, monkeypatch):
+    monkeypatch.setenv("PATH", TOOLS_DIR + os.pathsep + os.environ.get("PATH", ""))
+    app = synthetic_bundle.generate_bundle(str(tmp_path / "synth"), libraries=5, frameworks=1, data_files=1)["app"]
+    dependency_collection_4.process_app_bundle(app, 1, str(tmp_path / "elsewhere.json"))
+    backend = code_signing_1.make_backend("codesign", "Test Identity", codesign=rewriting_codesign(tmp_path))
+    code_signing_1.sign_app_bundle(app, "Test Identity", backend=backend, verify=False)
+    assert not os.path.exists(manifest.default_manifest_path(app))
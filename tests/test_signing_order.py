@@ -0,0 +1,151 @@
+"""The signing scheduler against the stand-in codesign of benchmarks/tools."""
+
+import math
+import os
+import time
+
+import pytest
+
+import code_signing_1
+import dependency_collection_4
+import macho
+import tool_runner
+from benchmarks import synthetic_bundle
+
+TOOLS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "tools")
+BATCH_SIZE = 32
+
+
+def signing_env(tmp_path, monkeypatch, fanout, libraries):
+    # A collected synthetic bundle, the logging codesign wrapper and its log
+    monkeypatch.setenv("PATH", TOOLS_DIR + os.pathsep + os.environ.get("PATH", ""))
+    info = synthetic_bundle.generate_bundle(str(tmp_path / "synth"), libraries=libraries, fanout=fanout,
+                                            frameworks=3, data_files=5)
+    dependency_collection_4.process_app_bundle(info["app"], 4)
+
+    # The stand-in logs "codesign <args>" when it starts, the wrapper adds "done <args>" when it returns
+    log = tmp_path / "tools.log"
+    wrapper = tmp_path / "codesign"
+    wrapper.write_text(
+        "#!/bin/sh\n"
+        f'"{os.path.join(TOOLS_DIR, "codesign")}" "$@"\n'
+        "status=$?\n"
+        'echo "done $*" >> "$BENCH_TOOL_LOG"\n'
+        "exit $status\n"
+    )
+    wrapper.chmod(0o755)
+    monkeypatch.setenv("BENCH_TOOL_LOG", str(log))
+    monkeypatch.setenv("BENCH_TOOL_DELAY", "0")
+    monkeypatch.setattr(tool_runner, "_default_runner", tool_runner.ToolRunner(8))
+    return info["app"], str(wrapper), log
+
+
+@pytest.fixture
+def deep_bundle(tmp_path, monkeypatch):
+    # Libraries loading each other: many small waves
+    return signing_env(tmp_path, monkeypatch, fanout=2, libraries=150)
+
+
+@pytest.fixture
+def wide_bundle(tmp_path, monkeypatch):
+    # Independent libraries: one wave too large for a single call
+    return signing_env(tmp_path, monkeypatch, fanout=0, libraries=250)
+
+
+def sign(app, wrapper, log, jobs, delay):
+    os.environ["BENCH_TOOL_DELAY"] = str(delay)
+    if log.exists():
+        log.unlink()
+    backend = code_signing_1.make_backend("codesign", "Test Identity", codesign=wrapper,
+                                          spctl=os.path.join(TOOLS_DIR, "spctl"))
+    start = time.perf_counter()
+    code_signing_1.sign_app_bundle(app, "Test Identity", jobs=jobs, backend=backend, verify=False)
+    return time.perf_counter() - start
+
+
+def signing_calls(log):
+    """
+    The signing calls in the log, in start order.
+
+    Returns:
+        list: (paths, calls that had finished when this one started) per call
+    """
+    calls = []
+    finished = set()
+    for line in log.read_text().splitlines():
+        kind, args = line.split(" ", 1)
+        if "-s" not in args.split():
+            continue
+        # The paths follow the identity: codesign --force ... -s "Test Identity" path...
+        paths = tuple(args.split("Test Identity ", 1)[1].split(" "))
+        if kind == "codesign":
+            calls.append((paths, frozenset(finished)))
+        else:
+            finished.add(paths)
+    return calls
+
+
+def loaded_or_contained(path, signable, executable_path):
+    # The signable files `path` loads, plus the ones inside it if it is a directory
+    deps = set()
+    for reference in macho.get_dependencies(path):
+        target = macho.resolve_load_path(reference, path, executable_path)
+        if target in signable and target != path:
+            deps.add(target)
+    if os.path.isdir(path):
+        deps.update(p for p in signable if p.startswith(path + os.sep))
+    return deps
+
+
+@pytest.mark.parametrize("jobs", [1, 4])
+def test_files_are_signed_after_what_they_load(deep_bundle, jobs):
+    app, wrapper, log = deep_bundle
+    sign(app, wrapper, log, jobs, 0)
+    calls = signing_calls(log)
+    signable = {os.path.realpath(p) for p in code_signing_1.find_signable_files(app)}
+    executable_path = code_signing_1.find_main_executable(app)
+
+    signed_by = {}
+    for paths, _ in calls:
+        for path in paths:
+            signed_by[os.path.realpath(path)] = paths
+    assert set(signed_by) == signable | {os.path.realpath(app)}
+
+    for paths, finished in calls:
+        for path in paths:
+            if os.path.realpath(path) == os.path.realpath(app):
+                deps = signable  # the bundle itself comes last
+            else:
+                deps = loaded_or_contained(os.path.realpath(path), signable, executable_path)
+            for dep in deps:
+                assert signed_by[dep] in finished, f"{path} was signed before {dep} had been"
+
+
+@pytest.mark.parametrize("jobs", [1, 4])
+def test_waves_are_batched(wide_bundle, jobs):
+    app, wrapper, log = wide_bundle
+    sign(app, wrapper, log, jobs, 0)
+    files = code_signing_1.find_signable_files(app)
+    waves = code_signing_1.compute_signing_waves(files, app)
+    wave_of = {path: i for i, wave in enumerate(waves) for path in wave}
+    calls = [paths for paths, _ in signing_calls(log)][:-1]  # without the bundle itself
+
+    calls_per_wave = [0] * len(waves)
+    for paths in calls:
+        assert len(paths) <= BATCH_SIZE
+        assert len({wave_of[p] for p in paths}) == 1, "a call mixes files of two waves"
+        calls_per_wave[wave_of[paths[0]]] += 1
+    for wave, n_calls in zip(waves, calls_per_wave):
+        if jobs == 1:
+            # One multi-path call per wave, split only beyond BATCH_SIZE files
+            assert n_calls == math.ceil(len(wave) / BATCH_SIZE)
+        else:
+            assert n_calls <= max(jobs, math.ceil(len(wave) / BATCH_SIZE))
+    assert any(len(wave) > BATCH_SIZE for wave in waves), "no wave large enough to batch"
+
+
+def test_parallel_signing_is_faster(wide_bundle):
+    app, wrapper, log = wide_bundle
+    serial = sign(app, wrapper, log, 1, 0.1)
+    parallel = sign(app, wrapper, log, 4, 0.1)
+    assert parallel < serial * 0.7, f"jobs=4 took {parallel:.2f}s, jobs=1 {serial:.2f}s"
@@ -0,0 +1,263 @@
+"""Staged builds: clone, journal, resume and discard rules, publish and its recovery."""
+
+import json
+import logging
+import os
+import stat
+
+import pytest
+
+import bundle
+import code_signing_1
+import copy_store
+import dependency_collection_4
+import staging
+import tool_runner
+from benchmarks import synthetic_bundle
+
+TOOLS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "tools")
+
+
+def snapshot(root):
+    # Relative path -> ("link", target) / ("dir",) / ("file", inode, mode, bytes)
+    tree = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in dirnames + filenames:
+            path = os.path.join(dirpath, name)
+            st = os.lstat(path)
+            if stat.S_ISLNK(st.st_mode):
+                tree[os.path.relpath(path, root)] = ("link", os.readlink(path))
+            elif stat.S_ISDIR(st.st_mode):
+                tree[os.path.relpath(path, root)] = ("dir",)
+            else:
+                with open(path, "rb") as f:
+                    tree[os.path.relpath(path, root)] = ("file", st.st_ino, stat.S_IMODE(st.st_mode), f.read())
+    return tree
+
+
+@pytest.fixture
+def hardlinks(monkeypatch):
+    # Clone with hardlinks whatever the file system, the case where writes could reach the source
+    monkeypatch.setattr(staging, "reflink", lambda src, dst: False)
+
+
+@pytest.fixture
+def tools_path(monkeypatch):
+    monkeypatch.setenv("PATH", TOOLS_DIR + os.pathsep + os.environ.get("PATH", ""))
+
+
+def rewriting_codesign(tmp_path):
+    # Appends to every file it signs, like codesign rewrites them; fails while tmp_path/fail exists
+    path = tmp_path / "codesign"
+    path.write_text(
+        "#!/bin/sh\n"
+        f'[ -e "{tmp_path / "fail"}" ] && exit 1\n'
+        'for arg; do [ -f "$arg" ] && printf signed >> "$arg"; done\n'
+        "exit 0\n"
+    )
+    path.chmod(0o755)
+    return str(path)
+
+
+@pytest.fixture
+def app(tmp_path):
+    # A minimal bundle for the journal and publish tests
+    app = tmp_path / "Test.app"
+    (app / "Contents" / "MacOS").mkdir(parents=True)
+    (app / "Contents" / "Info.plist").write_text("<plist/>\n")
+    (app / "Contents" / "MacOS" / "Test").write_bytes(b"test")
+    os.symlink("MacOS/Test", app / "Contents" / "alias")
+    return str(app)
+
+
+def test_interrupted_run_resumes_after_the_last_stage(tmp_path, monkeypatch, tools_path, hardlinks, caplog):
+    monkeypatch.setattr(tool_runner, "_default_runner", tool_runner.get_runner())  # bundle.main replaces it
+    app = synthetic_bundle.generate_bundle(str(tmp_path / "synth"), libraries=20, frameworks=2, data_files=3)["app"]
+    codesign = rewriting_codesign(tmp_path)
+    argv = ["all", "--app", app, "--stage", "--identity", "Test Identity", "--backend", "codesign",
+            "--codesign", codesign, "--spctl", os.path.join(TOOLS_DIR, "spctl")]
+    before = snapshot(app)
+
+    (tmp_path / "fail").touch()
+    assert bundle.main(argv) == 1
+    stage = staging.Stage(app)
+    with open(os.path.join(stage.work_dir, staging.JOURNAL)) as f:
+        journal = json.load(f)
+    assert journal["stages"] == ["clone", "collect", "python", "audit"]
+    assert journal["running"] == "sign"
+    # Collected and relinked on hardlinks, yet the bundle is as it was: same inodes, same bytes
+    assert snapshot(app) == before
+
+    os.remove(tmp_path / "fail")
+    caplog.clear()
+    with caplog.at_level(logging.INFO):
+        assert bundle.main(argv) == 0
+    assert "after stage audit" in caplog.text
+    assert "Stage collect already completed" in caplog.text
+    assert "Finished processing app bundle" not in caplog.text
+    assert not os.path.exists(stage.work_dir)
+    assert os.path.exists(stage.output_manifest)
+    with open(code_signing_1.find_main_executable(app), "rb") as f:
+        assert f.read().endswith(b"signed")
+    assert dependency_collection_4.check_app_bundle(app) == ([], [])
+
+
+def test_hardlinked_clone_leaves_source_untouched(tmp_path, tools_path, hardlinks):
+    app = synthetic_bundle.generate_bundle(str(tmp_path / "synth"), libraries=20, frameworks=2, data_files=3)["app"]
+    before = snapshot(app)
+    stage = staging.Stage(app)
+    stage.open()
+    try:
+        staged = snapshot(stage.path)
+        # Every file shares its inode with the source
+        assert {p: e[1] for p, e in staged.items() if e[0] == "file"} == {p: e[1] for p, e in before.items() if e[0] == "file"}
+
+        dependency_collection_4.process_app_bundle(stage.path, 2, stage.manifest_path)
+        backend = code_signing_1.make_backend("codesign", "Test Identity", codesign=rewriting_codesign(tmp_path))
+        code_signing_1.sign_app_bundle(stage.path, "Test Identity", jobs=2, backend=backend, verify=False,
+                                       manifest_path=stage.manifest_path)
+    finally:
+        stage.close()
+
+    assert snapshot(app) == before
+    after = snapshot(stage.path)
+    main_executable = os.path.relpath(code_signing_1.find_main_executable(stage.path), stage.path)
+    assert after[main_executable][3].endswith(b"signed")
+    assert after[main_executable][1] != before[main_executable][1]
+    # Files nothing wrote to are still shared
+    assert any(after[p][1] == e[1] for p, e in before.items() if e[0] == "file")
+
+
+def test_clone_tree(tmp_path, app):
+    counts = staging.clone_tree(app, str(tmp_path / "clone"))
+    assert sum(counts.values()) == 2
+    clone = snapshot(str(tmp_path / "clone"))
+    assert {p: e[:1] + e[2:] for p, e in clone.items() if e[0] == "file"} == \
+        {p: e[:1] + e[2:] for p, e in snapshot(app).items() if e[0] == "file"}
+    assert clone["Contents/alias"] == ("link", "MacOS/Test")
+
+
+def test_rerunnable_stage_resumes(app):
+    stage = staging.Stage(app, options={"identity": "-"})
+    stage.open()
+    stage.run("collect", lambda: None, rerunnable=False)
+    stage.start("sign")
+    staged_executable = os.path.join(stage.path, "Contents", "MacOS", "Test")
+    copy_store.unshare(staged_executable)  # as every stage does before writing in place
+    with open(staged_executable, "ab") as f:
+        f.write(b" half signed")
+    stage.close()
+
+    stage = staging.Stage(app, options={"identity": "-"})
+    assert stage.open() == ["clone", "collect"]
+    assert stage.run("collect", lambda: pytest.fail("collect ran again")) is None
+    assert stage.run("sign", lambda: "signed") == "signed"
+    with open(os.path.join(stage.path, "Contents", "MacOS", "Test"), "rb") as f:
+        assert f.read() == b"test half signed"
+    stage.close()
+
+
+def test_interrupted_non_rerunnable_stage_is_discarded(app, caplog):
+    stage = staging.Stage(app)
+    stage.open()
+    stage.start("collect", rerunnable=False)
+    staged_executable = os.path.join(stage.path, "Contents", "MacOS", "Test")
+    copy_store.unshare(staged_executable)  # as every stage does before writing in place
+    with open(staged_executable, "ab") as f:
+        f.write(b" half relinked")
+    stage.close()
+
+    stage = staging.Stage(app)
+    with caplog.at_level(logging.INFO):
+        assert stage.open() == ["clone"]
+    assert "stage collect was interrupted" in caplog.text
+    with open(os.path.join(stage.path, "Contents", "MacOS", "Test"), "rb") as f:
+        assert f.read() == b"test"
+    stage.close()
+
+
+@pytest.mark.parametrize("change", ["options", "source"])
+def test_changed_options_or_source_are_discarded(app, change, caplog):
+    stage = staging.Stage(app, options={"arch": None})
+    stage.open()
+    stage.run("collect", lambda: None, rerunnable=False)
+    stage.close()
+
+    options = {"arch": None}
+    if change == "options":
+        options = {"arch": "arm64"}
+    else:
+        with open(os.path.join(app, "Contents", "Info.plist"), "a") as f:
+            f.write("<!-- rebuilt -->\n")
+    stage = staging.Stage(app, options=options)
+    with caplog.at_level(logging.INFO):
+        assert stage.open() == ["clone"]
+    assert "options or source bundle changed" in caplog.text
+    stage.close()
+
+
+def test_work_directory_is_locked(app):
+    stage = staging.Stage(app)
+    stage.open()
+    with pytest.raises(RuntimeError, match="in use by another run"):
+        staging.Stage(app).open()
+    stage.close()
+
+
+def publish_changed(app, **kwargs):
+    stage = staging.Stage(app, **kwargs)
+    stage.open()
+    staged_executable = os.path.join(stage.path, "Contents", "MacOS", "Test")
+    os.remove(staged_executable)
+    with open(staged_executable, "wb") as f:
+        f.write(b"new")
+    with open(stage.manifest_path, "w") as f:
+        f.write("{}")
+    return stage
+
+
+@pytest.mark.parametrize("atomic", [True, False])
+def test_publish(app, monkeypatch, atomic, caplog):
+    if not atomic:
+        monkeypatch.setattr(staging, "exchange", lambda a, b: False)
+    stage = publish_changed(app)
+    with caplog.at_level(logging.INFO):
+        stage.publish()
+    with open(os.path.join(app, "Contents", "MacOS", "Test"), "rb") as f:
+        assert f.read() == b"new"
+    assert os.path.islink(os.path.join(app, "Contents", "alias"))
+    assert not os.path.exists(stage.work_dir)
+    with open(stage.output_manifest) as f:
+        assert f.read() == "{}"
+    if not atomic:
+        assert "publishing with two renames" in caplog.text
+
+
+def test_publish_to_another_bundle(tmp_path, app):
+    output = str(tmp_path / "dist" / "Test.app")
+    os.makedirs(os.path.dirname(output))
+    stage = publish_changed(app, output=output)
+    stage.publish()
+    with open(os.path.join(output, "Contents", "MacOS", "Test"), "rb") as f:
+        assert f.read() == b"new"
+    with open(os.path.join(app, "Contents", "MacOS", "Test"), "rb") as f:
+        assert f.read() == b"test"
+
+
+def test_interrupted_publish_is_finished(tmp_path, app, monkeypatch):
+    # The swap happened, the run died before moving the manifest and removing the work directory
+    monkeypatch.setattr(staging, "exchange", lambda a, b: False)
+    stage = publish_changed(app)
+    monkeypatch.setattr(stage, "_finish_publish", lambda: None)
+    stage.publish()
+    stage.close()
+    assert os.path.exists(stage.work_dir)
+
+    stage = staging.Stage(app)
+    assert stage.open() == ["clone"]
+    with open(stage.output_manifest) as f:
+        assert f.read() == "{}"
+    assert not os.path.exists(os.path.join(stage.work_dir, "Test.app.previous"))
+    with open(os.path.join(stage.path, "Contents", "MacOS", "Test"), "rb") as f:
+        assert f.read() == b"new"  # cloned again, from the published bundle
+    stage.close()
@@ -0,0 +1,55 @@
+"""The ToolRunner process limit holds for the whole runner, across threads and event loops."""
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import tool_runner
+
+DELAY = 0.2
+
+
+def timed(calls, threads=8):
+    # Wall time of running every call of `calls` on its own thread
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        results = list(executor.map(lambda call: call(), calls))
+    return time.perf_counter() - start, results
+
+
+@pytest.mark.parametrize("concurrency", [1, 2])
+def test_limit_holds_across_threads(concurrency):
+    runner = tool_runner.ToolRunner(concurrency)
+    elapsed, results = timed([lambda: runner.run(["sleep", str(DELAY)])] * 8)
+    assert all(result.ok for result in results)
+    assert elapsed >= 8 / concurrency * DELAY * 0.95, f"8 calls took {elapsed:.2f}s with concurrency={concurrency}"
+
+
+def test_limit_holds_for_run_many_and_async_callers():
+    runner = tool_runner.ToolRunner(2)
+    calls = [lambda: runner.run_many([["sleep", str(DELAY)]] * 2)] * 2
+    calls += [lambda: asyncio.run(runner.run_many_async([["sleep", str(DELAY)]] * 2))] * 2
+    elapsed, results = timed(calls, threads=4)
+    assert all(result.ok for batch in results for result in batch)
+    assert elapsed >= 4 * DELAY * 0.95
+
+
+def test_calls_run_concurrently_up_to_the_limit():
+    runner = tool_runner.ToolRunner(8)
+    elapsed, _ = timed([lambda: runner.run(["sleep", str(DELAY)])] * 8)
+    assert elapsed < 4 * DELAY
+    elapsed = time.perf_counter()
+    runner.run_many([["sleep", str(DELAY)]] * 8)
+    assert time.perf_counter() - elapsed < 4 * DELAY
+
+
+def test_results_and_errors():
+    runner = tool_runner.ToolRunner(2, timeout=5)
+    results = runner.run_many([["sh", "-c", "echo out; echo err >&2; exit 3"], ["cat"], ["/nonexistent/tool"]])
+    assert (results[0].returncode, results[0].stdout, results[0].stderr) == (3, "out\n", "err\n")
+    assert results[1].ok and results[1].stdout == ""
+    assert results[2].returncode is None and results[2].error
+    assert runner.run(["cat"], input="piped").stdout == "piped"
+    assert runner.run(["sleep", "5"], timeout=0.1).timed_out
@@ -0,0 +1,134 @@
+"""Watch mode redoes, and signs again, only what a changed source affects."""
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+import code_signing_1
+import copy_store
+import dependency_collection_4
+import manifest
+import relink
+import watch
+from benchmarks import synthetic_bundle
+from test_parallel_collect import TOOLS_DIR
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def logging_codesign(tmp_path):
+    # Appends to every file it signs, as codesign rewrites them, and logs its path arguments
+    path = tmp_path / "codesign"
+    path.write_text(
+        "#!/bin/sh\n"
+        'for arg; do\n'
+        f'    [ -e "$arg" ] && echo "$arg" >> "{tmp_path / "signed.txt"}"\n'
+        '    [ -f "$arg" ] && printf signed >> "$arg"\n'
+        'done\n'
+        "exit 0\n"
+    )
+    path.chmod(0o755)
+    return str(path)
+
+
+def signed_paths(tmp_path):
+    log = tmp_path / "signed.txt"
+    paths = log.read_text().split() if log.exists() else []
+    if log.exists():
+        log.unlink()
+    return paths
+
+
+@pytest.fixture
+def signed_app(tmp_path, monkeypatch):
+    # A collected bundle, signed, and a source library that other bundle files reference
+    monkeypatch.setenv("PATH", TOOLS_DIR + os.pathsep + os.environ.get("PATH", ""))
+    app = synthetic_bundle.generate_bundle(str(tmp_path / "synth"), libraries=30, frameworks=2, data_files=3)["app"]
+    dependency_collection_4.process_app_bundle(app, 2)
+    backend = code_signing_1.make_backend("codesign", "Test Identity", codesign=logging_codesign(tmp_path))
+    code_signing_1.sign_app_bundle(app, "Test Identity", jobs=2, backend=backend, verify=False)
+    signed_paths(tmp_path)
+    assert dependency_collection_4.check_app_bundle(app) == ([], [])
+
+    bundle_manifest = manifest.BundleManifest(app)
+    assert bundle_manifest.load()
+    reverse = bundle_manifest.dependents()
+    source, rel_path = next((source, rel_path) for source, rel_path in sorted(bundle_manifest.sources().items())
+                            if source.endswith(".dylib") and len(reverse.get(rel_path, ())) > 1)
+    dependents = {bundle_manifest.abs(r) for r in reverse[rel_path]}
+    return app, backend, source, bundle_manifest.abs(rel_path), dependents
+
+
+@pytest.fixture
+def processed(monkeypatch):
+    # Bundle paths copied and relinked by the collector
+    seen = {"copied": [], "relinked": []}
+    copy, apply_plan = copy_store.CopyStore.copy, relink.apply_plan
+
+    def spy_copy(self, src, dest, *args, **kwargs):
+        seen["copied"].append(dest)
+        return copy(self, src, dest, *args, **kwargs)
+
+    def spy_apply_plan(plan):
+        seen["relinked"].append(plan.path)
+        return apply_plan(plan)
+    monkeypatch.setattr(copy_store.CopyStore, "copy", spy_copy)
+    monkeypatch.setattr(relink, "apply_plan", spy_apply_plan)
+    return seen
+
+
+def test_watch_redoes_only_the_changed_file(tmp_path, monkeypatch, signed_app, processed):
+    app, backend, source, dest, dependents = signed_app
+    polls = []
+
+    def poll(seconds):
+        # The source changes before the first poll, the second sees it has settled
+        if not polls:
+            with open(source, "ab") as f:
+                f.write(b"\0" * 16)
+        polls.append(seconds)
+    monkeypatch.setattr(watch.time, "sleep", poll)
+
+    assert watch.watch(app, jobs=2, interval=0, signing_identity="Test Identity", backend=backend, rounds=1) == 1
+    assert len(polls) == 2
+    assert processed["copied"] == [dest]
+    assert sorted(processed["relinked"]) == sorted({dest} | dependents)
+    # The dependents were relinked to the same bytes, so only the new copy and the bundle are signed
+    assert signed_paths(tmp_path) == [dest, app]
+    with open(dest, "rb") as f:
+        assert f.read().endswith(b"\0" * 16 + b"signed")
+
+    assert dependency_collection_4.check_app_bundle(app) == ([], [])
+    check = subprocess.run([sys.executable, os.path.join(REPO_ROOT, "dependency_collection_4.py"), "--app", app, "--check"],
+                           cwd=tmp_path, capture_output=True, text=True)
+    assert check.returncode == 0, check.stderr
+
+
+def test_rebundle_with_nothing_changed(tmp_path, signed_app, processed):
+    app, backend, _, _, _ = signed_app
+    assert watch.rebundle(app, jobs=2, signing_identity="Test Identity", backend=backend) == []
+    assert processed == {"copied": [], "relinked": []}
+    assert signed_paths(tmp_path) == []
+
+
+def test_overlay_from_a_watched_directory(tmp_path, signed_app, processed):
+    app, backend, source, dest, dependents = signed_app
+    build = tmp_path / "build"
+    build.mkdir()
+    with open(source, "rb") as f:
+        (build / os.path.basename(dest)).write_bytes(f.read() + b"rebuilt")
+
+    bundle_manifest = manifest.BundleManifest(app)
+    bundle_manifest.load()
+    targets = watch.watch_targets(bundle_manifest, [str(build)])
+    overlay = str(build / os.path.basename(dest))
+    assert targets[overlay] == (bundle_manifest.rel(dest), True)
+    assert targets[source] == (bundle_manifest.rel(dest), False)
+
+    changed = watch.rebundle(app, [(overlay, dest)], jobs=2, signing_identity="Test Identity", backend=backend)
+    assert changed == [dest]
+    assert sorted(processed["relinked"]) == sorted({dest} | dependents)
+    assert signed_paths(tmp_path) == [dest, app]
+    assert dependency_collection_4.check_app_bundle(app) == ([], [])
@@ -0,0 +1,93 @@
+"""Universal (fat) binary thinning without `lipo`."""
+
+import logging
+import os
+import shutil
+
+import macho
+
+ARCHS = ("arm64", "x86_64")
+
+
+def slice_range(path, arch):
+    """
+    Byte range of `arch` in a fat file.
+
+    Returns:
+        tuple: (offset, size), or None if the file is not fat or has no such slice
+    """
+    parsed = macho.read_macho(path)
+    if parsed is None or not parsed.is_fat:
+        return None
+    slice_ = parsed.slice_for_arch(arch)
+    if slice_ is None:
+        logging.warning(f"{path} has no {arch} slice ({', '.join(parsed.archs)}), keeping all slices")
+        return None
+    return slice_.offset, slice_.size
+
+
+def _copy_range(src, dst, offset, size):
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        remaining = size
+        if hasattr(os, "copy_file_range"):
+            try:
+                position = offset
+                while remaining > 0:
+                    copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining, position)
+                    if copied == 0:
+                        break
+                    position += copied
+                    remaining -= copied
+            except OSError:
+                fdst.seek(0)
+                fdst.truncate()
+                remaining = size
+        if remaining > 0:
+            fsrc.seek(offset + size - remaining)
+            while remaining > 0:
+                chunk = fsrc.read(min(remaining, 1024 * 1024))
+                if not chunk:
+                    raise OSError(f"{src} is shorter than its fat header says")
+                fdst.write(chunk)
+                remaining -= len(chunk)
+    shutil.copystat(src, dst)
+
+
+def thin_copy(src, dst, arch, copy_function=shutil.copy2):
+    """
+    Copy `src` to `dst`, keeping only the `arch` slice if `src` is a fat file.
+
+    Returns:
+        int: Bytes left out of the copy (0 if it was copied whole)
+    """
+    found = slice_range(src, arch)
+    if found is None:
+        copy_function(src, dst)
+        return 0
+    offset, size = found
+    _copy_range(src, dst, offset, size)
+    return os.path.getsize(src) - size
+
+
+def thin_in_place(path, arch):
+    """
+    Replace a fat file with its `arch` slice.
+
+    Returns:
+        int: Bytes removed
+    """
+    found = slice_range(path, arch)
+    if found is None:
+        return 0
+    offset, size = found
+    tmp_path = path + ".thin"
+    removed = os.path.getsize(path) - size
+    try:
+        _copy_range(path, tmp_path, offset, size)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        macho.invalidate(path)
+    logging.info(f"Thinned {path} to {arch} ({removed} bytes removed)")
+    return removed
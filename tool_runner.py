@@ -0,0 +1,247 @@
+"""
+Run external tools (otool, install_name_tool, codesign, spctl, ...) with a
+bounded number of processes in flight.
+"""
+
+import asyncio
+import logging
+import os
+import shutil
+import subprocess
+import threading
+import time
+
+import profiling
+
+DEFAULT_CONCURRENCY = os.cpu_count() or 4
+
+
+class ToolResult:
+    """
+    Outcome of one tool call.
+
+    Attributes:
+        args (list): Command line, with the tool path resolved
+        returncode (int): Exit status, None if the call timed out or could not start
+        stdout (str): Captured standard output
+        stderr (str): Captured standard error
+        duration (float): Wall time in seconds
+        timed_out (bool): True if the call was killed after its timeout
+        error (str): Why the tool could not be started, if it could not
+    """
+
+    def __init__(self, args, returncode=None, stdout="", stderr="", duration=0.0, timed_out=False, error=None):
+        self.args = args
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.duration = duration
+        self.timed_out = timed_out
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.returncode == 0
+
+    def check(self, timeout=None):
+        """
+        Raise like subprocess.run(check=True) would if the call failed.
+
+        Raises:
+            subprocess.TimeoutExpired: If the call timed out
+            subprocess.CalledProcessError: If it exited with a non-zero status
+            OSError: If the tool could not be started
+        """
+        if self.timed_out:
+            raise subprocess.TimeoutExpired(self.args, timeout, self.stdout, self.stderr)
+        if self.error is not None:
+            raise FileNotFoundError(self.error)
+        if self.returncode != 0:
+            raise subprocess.CalledProcessError(self.returncode, self.args, self.stdout, self.stderr)
+        return self
+
+    def to_dict(self):
+        return {
+            "args": self.args,
+            "returncode": self.returncode,
+            "stdout": self.stdout,
+            "stderr": self.stderr,
+            "duration": self.duration,
+            "timed_out": self.timed_out,
+            "error": self.error,
+        }
+
+    def __repr__(self):
+        status = "timed out" if self.timed_out else self.error or f"exit {self.returncode}"
+        return f"ToolResult({os.path.basename(self.args[0])}, {status}, {self.duration:.3f}s)"
+
+
+class ToolRunner:
+    """
+    Runs external commands with at most `concurrency` processes at a time.
+
+    Every call, from any thread or event loop, runs on the runner's own event
+    loop thread, so the limit holds for the whole process. The synchronous
+    methods (run, run_many) return ToolResult objects instead of raising,
+    unless check=True.
+
+    Args:
+        concurrency (int): Maximum number of processes running at once
+        timeout (float, optional): Default per-call timeout in seconds
+        tools (dict, optional): Tool name -> path overrides
+        search_path (list, optional): Directories searched before $PATH
+    """
+
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, timeout=None, tools=None, search_path=None):
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        self.tools = dict(tools or {})
+        self.search_path = list(search_path or [])
+        self._loop = None
+        self._semaphore = None
+        self._loop_lock = threading.Lock()
+
+    def find_tool(self, name):
+        """
+        Path of a tool: an explicit override, then the environment variable
+        named after the tool (CODESIGN, INSTALL_NAME_TOOL, ...), then the
+        runner's extra search directories, then $PATH. Pointing overrides or
+        search directories at stand-in scripts lets the pipeline run on Linux.
+
+        Names containing a path separator are returned unchanged.
+        """
+        if os.sep in name:
+            return name
+        if name in self.tools:
+            return self.tools[name]
+        from_env = os.environ.get(name.upper().replace("-", "_"))
+        if from_env:
+            return from_env
+        if self.search_path:
+            found = shutil.which(name, path=os.pathsep.join(self.search_path))
+            if found:
+                return found
+        return shutil.which(name) or name
+
+    def _event_loop(self):
+        # The loop every call of this runner goes through, started on first use
+        with self._loop_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                self._semaphore = asyncio.Semaphore(self.concurrency)
+                threading.Thread(target=loop.run_forever, name="tool-runner", daemon=True).start()
+                self._loop = loop
+        return self._loop
+
+    def _submit(self, commands, timeout, input):
+        # concurrent.futures.Future of the results of `commands`, run on the runner's loop
+        async def gather():
+            return await asyncio.gather(*(self._run(cmd, timeout, input) for cmd in commands))
+        return asyncio.run_coroutine_threadsafe(gather(), self._event_loop())
+
+    async def _run(self, args, timeout, input):
+        args = [self.find_tool(args[0])] + list(args[1:])
+        timeout = self.timeout if timeout is None else timeout
+        async with self._semaphore:
+            start = time.perf_counter()
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    *args,
+                    stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                )
+            except OSError as e:
+                return ToolResult(args, error=str(e), duration=time.perf_counter() - start)
+
+            timed_out = False
+            try:
+                stdout, stderr = await asyncio.wait_for(
+                    process.communicate(input.encode() if input is not None else None), timeout,
+                )
+            except asyncio.TimeoutError:
+                timed_out = True
+                process.kill()
+                stdout, stderr = await process.communicate()
+            end = time.perf_counter()
+
+        profiler = profiling.get_profiler()
+        if profiler is not None:
+            tool = os.path.basename(args[0])
+            profiler.count(f"tool.{tool}")
+            profiler.add_span(tool, "tool", start, end, {"argc": len(args), "returncode": process.returncode})
+        if timed_out:
+            logging.warning(f"{os.path.basename(args[0])} timed out after {timeout}s: {' '.join(args)}")
+        return ToolResult(
+            args,
+            None if timed_out else process.returncode,
+            stdout.decode(errors="replace"),
+            stderr.decode(errors="replace"),
+            end - start,
+            timed_out,
+        )
+
+    async def run_many_async(self, commands, timeout=None, input=None):
+        """
+        Run every command, at most `concurrency` at a time across all callers of this runner.
+
+        Returns:
+            list: ToolResult per command, in the order of `commands`
+        """
+        return await asyncio.wrap_future(self._submit(list(commands), timeout, input))
+
+    async def run_async(self, args, timeout=None, input=None):
+        return (await self.run_many_async([args], timeout, input))[0]
+
+    def run_many(self, commands, timeout=None, check=False):
+        """
+        Blocking version of run_many_async().
+
+        Args:
+            commands (list): Argument lists
+            timeout (float, optional): Per-call timeout, defaults to the runner's
+            check (bool): Raise for the first failed call, like subprocess.run(check=True)
+
+        Returns:
+            list: ToolResult per command, in order
+        """
+        commands = list(commands)
+        if not commands:
+            return []
+        results = self._submit(commands, timeout, None).result()
+        if check:
+            for result in results:
+                result.check(timeout if timeout is not None else self.timeout)
+        return results
+
+    def run(self, args, timeout=None, check=False, input=None):
+        """
+        Blocking single call, a drop-in for subprocess.run(args, capture_output=True, text=True).
+        """
+        result = self._submit([args], timeout, input).result()[0]
+        if check:
+            result.check(timeout if timeout is not None else self.timeout)
+        return result
+
+
+_default_runner = ToolRunner()
+
+
+def get_runner():
+    return _default_runner
+
+
+def set_runner(runner):
+    """
+    Replace the runner used by the scripts (e.g. with stand-in tools or another limit).
+    """
+    global _default_runner
+    _default_runner = runner
+
+
+def run(args, timeout=None, check=False):
+    return _default_runner.run(args, timeout, check)
+
+
+def run_many(commands, timeout=None, check=False):
+    return _default_runner.run_many(commands, timeout, check)
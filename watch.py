@@ -0,0 +1,211 @@
+"""Rebundle while developing: watch what a bundle was collected from and redo only what changed."""
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+import code_signing_1
+import copy_store
+import dependency_collection_4
+import manifest
+import profiling
+import relocation_cache
+import thinning
+
+DEFAULT_INTERVAL = 0.5
+
+
+def watch_targets(bundle_manifest, watch_dirs=()):
+    """
+    Files to poll.
+
+    Args:
+        bundle_manifest (manifest.BundleManifest): Loaded collector manifest
+        watch_dirs (iterable): Build output directories whose files replace
+            the bundle file of the same name
+
+    Returns:
+        dict: path -> (bundle-relative path, overlay) where `overlay` is True
+            for files that are copied over the bundle file before collecting
+    """
+    targets = {source: (rel_path, False) for source, rel_path in bundle_manifest.sources().items()}
+    by_name = {}
+    for source, rel_path in bundle_manifest.sources().items():
+        by_name.setdefault(os.path.basename(source), rel_path)
+    for rel_path in bundle_manifest.files:
+        if not os.path.isabs(rel_path):
+            by_name.setdefault(os.path.basename(rel_path), rel_path)
+    for directory in watch_dirs:
+        try:
+            with os.scandir(directory) as it:
+                names = sorted(entry.name for entry in it if entry.is_file())
+        except OSError as e:
+            logging.warning(f"Cannot watch {directory}: {e}")
+            continue
+        for name in names:
+            if name in by_name:
+                targets[os.path.realpath(os.path.join(directory, name))] = (by_name[name], True)
+    return targets
+
+
+def snapshot(paths):
+    # (size, mtime_ns) of every path, None for missing ones
+    state = {}
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            state[path] = None
+            continue
+        state[path] = (st.st_size, st.st_mtime_ns)
+    return state
+
+
+def overlay(path, dest, arch=None):
+    # Put a build output in place of its bundle copy, keeping the bundle file's mode
+    mode = os.stat(dest).st_mode if os.path.exists(dest) else 0o644
+    tmp_path = dest + ".watch"
+    copy_store.CopyStore(arch).write(path, tmp_path)
+    os.chmod(tmp_path, mode)
+    os.replace(tmp_path, dest)
+    logging.info(f"Copied {path} over {dest}")
+
+
+def _content(bundle_manifest):
+    return {rel_path: (record.get("signature") or {}).get("sha256") for rel_path, record in bundle_manifest.files.items()}
+
+
+def rebundle(app_bundle_path, overlays=(), jobs=1, manifest_path=None, arch=None, roots=None,
+             signing_identity=None, entitlements=None, backend=None, cache_dir=None):
+    """
+    Run the incremental collection and sign what it changed.
+
+    Args:
+        overlays (iterable): (build output, bundle path) pairs copied first
+        roots (list, optional): Executables of the bundle, instead of scanning it
+        signing_identity (str, optional): Sign changed files and the bundle with this identity
+
+    Returns:
+        list: Bundle paths whose content changed
+    """
+    before = manifest.BundleManifest(app_bundle_path, manifest_path, arch)
+    before.load()
+    before_content = _content(before)
+    for path, dest in overlays:
+        overlay(path, dest, arch)
+
+    graph = dependency_collection_4.process_app_bundle(
+        app_bundle_path, jobs, manifest_path, binaries=roots, arch=arch, cache_dir=cache_dir,
+    )
+    after = manifest.BundleManifest(app_bundle_path, manifest_path, arch)
+    after.load()
+    changed = sorted(
+        after.abs(rel_path) for rel_path, digest in _content(after).items()
+        if digest != before_content.get(rel_path) and os.path.exists(after.abs(rel_path))
+    )
+
+    if signing_identity and changed:
+        signable = [path for path in changed if dependency_collection_4.is_binary_file(path)]
+        code_signing_1.sign_app_bundle(
+            app_bundle_path, signing_identity, entitlements, jobs, backend,
+            signable_files=signable, graph=graph, verify=False, manifest_path=manifest_path,
+        )
+    return changed
+
+
+def watch(app_bundle_path, watch_dirs=(), jobs=1, manifest_path=None, arch=None, interval=DEFAULT_INTERVAL,
+          signing_identity=None, entitlements=None, backend=None, cache_dir=None, rounds=None):
+    """
+    Poll the bundle's inputs and rebundle after every change, until interrupted.
+
+    Args:
+        rounds (int, optional): Stop after this many rebundles
+
+    Returns:
+        int: Number of rebundles done
+    """
+    bundle_manifest = manifest.BundleManifest(app_bundle_path, manifest_path, arch)
+    if not bundle_manifest.load():
+        raise FileNotFoundError(f"No collector manifest at {bundle_manifest.path}, collect the bundle first")
+    roots = dependency_collection_4.find_bundle_binaries(app_bundle_path)
+    targets = watch_targets(bundle_manifest, watch_dirs)
+    baseline = snapshot(targets)
+    pending = {}
+    logging.info(f"Watching {len(targets)} files of {app_bundle_path}, every {interval}s")
+
+    done = 0
+    while rounds is None or done < rounds:
+        time.sleep(interval)
+        current = snapshot(targets)
+        # A file is picked up once it has stopped changing for one interval
+        ready = [path for path, state in current.items()
+                 if state != baseline[path] and pending.get(path) == state and state is not None]
+        pending = {path: state for path, state in current.items() if state != baseline[path]}
+        if not ready:
+            continue
+
+        start = time.perf_counter()
+        overlays = []
+        for path in ready:
+            rel_path, is_overlay = targets[path]
+            logging.info(f"Changed: {path}")
+            if is_overlay:
+                overlays.append((path, bundle_manifest.abs(rel_path)))
+            baseline[path] = current[path]
+            del pending[path]
+        roots = [r for r in roots if os.path.exists(r)]
+        changed = rebundle(
+            app_bundle_path, overlays, jobs, manifest_path, arch, roots,
+            signing_identity, entitlements, backend, cache_dir,
+        )
+        done += 1
+        logging.info(f"Rebundled in {time.perf_counter() - start:.2f}s: {len(changed)} files changed"
+                      + (" and signed" if signing_identity and changed else ""))
+
+        # Newly copied files have sources of their own now
+        bundle_manifest.load()
+        for path, target in watch_targets(bundle_manifest, watch_dirs).items():
+            if path not in targets:
+                targets[path] = target
+                baseline[path] = snapshot([path])[path]
+    return done
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Watch a collected bundle's inputs and rebundle only what changes")
+    parser.add_argument("--app", required=True, help="Path to the .app bundle")
+    parser.add_argument("--watch", action="append", default=[], metavar="DIR",
+                        help="Build output directory whose libraries replace the bundled ones of the same name (repeatable)")
+    parser.add_argument("--jobs", "-j", type=int, default=1, help="Number of parallel workers (default: 1, serial)")
+    parser.add_argument("--manifest", help="Manifest file (default: .<app name>.manifest.json next to the bundle)")
+    parser.add_argument("--arch", choices=thinning.ARCHS, help="Architecture the bundle was collected for")
+    parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL, help="Seconds between polls (default: 0.5)")
+    parser.add_argument("--identity", help="Sign changed files and the bundle with this identity (e.g. - for ad-hoc)")
+    parser.add_argument("--entitlements", help="Path to entitlements.plist")
+    parser.add_argument("--cache", default=relocation_cache.default_cache_dir(), metavar="DIR",
+                        help="Relocation cache directory (default: $SYNFIG_BUNDLE_CACHE)")
+    parser.add_argument("--profile", nargs="?", const="watch.profile", metavar="PREFIX",
+                        help="Time phases and tool calls, write PREFIX.json and PREFIX.trace.json (default prefix: watch.profile)")
+    args = parser.parse_args()
+    if args.profile:
+        profiling.enable()
+
+    if not os.path.exists(args.app):
+        logging.error(f"App bundle not found at {args.app}")
+        sys.exit(1)
+
+    backend = code_signing_1.make_backend("auto", args.identity, jobs=args.jobs) if args.identity else None
+    try:
+        watch(args.app, args.watch, args.jobs, args.manifest, args.arch, args.interval,
+              args.identity, args.entitlements, backend, args.cache)
+    except KeyboardInterrupt:
+        pass
+    except FileNotFoundError as e:
+        logging.error(str(e))
+        sys.exit(1)
+    finally:
+        if args.profile:
+            profiling.report(args.profile)